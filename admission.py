@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Контроль допуска генераций: ограничение одновременных генераций, очередь и справедливость между клиентами
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import deadline
+from metrics import Counter, Gauge, Histogram
+
+# Оценка длительности генерации до первых замеров (секунды)
+DEFAULT_ESTIMATE = 120.0
+# Вес нового замера в скользящем среднем длительности генерации
+ESTIMATE_WEIGHT = 0.2
+
+ADMISSION_REJECTIONS = Counter(
+    "quest_admission_rejections",
+    "Запросы генерации, отклонённые с 429: очередь заполнена или превышен лимит клиента",
+    ["reason"],
+)
+ADMISSION_QUEUE_SECONDS = Histogram(
+    "quest_admission_queue_seconds",
+    "Время ожидания генерации в очереди",
+    ["outcome"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1200),
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "quest_admission_in_flight",
+    "Выполняющиеся генерации",
+)
+ADMISSION_QUEUED = Gauge(
+    "quest_admission_queued",
+    "Генерации, ожидающие в очереди",
+)
+ADMISSION_ESTIMATE = Gauge(
+    "quest_admission_estimated_generation_seconds",
+    "Скользящая средняя длительности генерации, по которой вычисляется Retry-After",
+)
+
+
+class Rejected(Exception):
+    """
+    Генерация не принята: очередь заполнена ("queue_full") или у клиента
+    слишком много генераций ("client_limit").
+    """
+
+    def __init__(self, reason: str, retry_after: int):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__("Очередь генераций заполнена" if reason == "queue_full"
+                         else "Слишком много генераций от одного клиента")
+
+
+class Ticket:
+    """Место запроса в контроллере: в очереди или среди выполняющихся генераций."""
+
+    def __init__(self, client: str):
+        self.client = client
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.admitted: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.released = False
+
+    def start(self) -> None:
+        self.started_at = time.monotonic()
+        if not self.admitted.done():
+            self.admitted.set_result(None)
+
+
+class AdmissionController:
+    """
+    Ограничивает число одновременных генераций.
+
+    Запрос получает место сразу, если выполняется меньше max_in_flight
+    генераций, иначе ждёт в очереди длиной не больше max_queue. Очередь
+    разбита по клиентам, и освободившееся место получает клиент, которого
+    дольше всех не обслуживали, поэтому клиент с пачкой запросов не задерживает
+    остальных (справедливая очередь по кругу); max_per_client
+    ограничивает число выполняющихся и ожидающих генераций одного клиента.
+    Отклонённый запрос получает Retry-After: оценку времени до освобождения
+    места по скользящей средней длительности генераций.
+
+    Методы вызываются из цикла событий asyncio (не потокобезопасны).
+    """
+
+    def __init__(self, max_in_flight: int = 4, max_queue: int = 32, max_per_client: int = 0,
+                 initial_estimate: float = DEFAULT_ESTIMATE):
+        """
+        Args:
+            max_in_flight: Максимум одновременных генераций (0 - без ограничения)
+            max_queue: Максимальная длина очереди
+            max_per_client: Максимум генераций одного клиента, включая ожидающие (0 - без ограничения)
+            initial_estimate: Оценка длительности генерации до первых замеров
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_per_client = max_per_client
+        self.estimate = initial_estimate
+        self._running: List[Ticket] = []
+        # клиент -> его ожидающие запросы (в порядке поступления клиентов в очередь)
+        self._queues: Dict[str, Deque[Ticket]] = {}
+        self._per_client: Dict[str, int] = {}
+        # клиент -> номер последнего обслуживания (для очереди по кругу)
+        self._served: Dict[str, int] = {}
+        self._turn = 0
+        ADMISSION_ESTIMATE.set(round(self.estimate, 3))
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._running)
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def enter(self, client: str) -> Ticket:
+        """
+        Принимает запрос генерации: сразу или в очередь.
+
+        Args:
+            client: Идентификатор клиента
+
+        Returns:
+            Ticket: Место запроса; дождаться очереди - wait, освободить - leave
+
+        Raises:
+            Rejected: Если очередь заполнена или превышен лимит клиента
+        """
+        ticket = Ticket(client)
+        if self.max_per_client and self._per_client.get(client, 0) >= self.max_per_client:
+            self._reject("client_limit", client)
+        if not self.max_in_flight or (self.in_flight < self.max_in_flight and not self._queues):
+            self._start(ticket)
+        elif self.queued >= self.max_queue:
+            self._reject("queue_full")
+        else:
+            self._queues.setdefault(client, deque()).append(ticket)
+            ADMISSION_QUEUED.set(self.queued)
+        self._per_client[client] = self._per_client.get(client, 0) + 1
+        return ticket
+
+    async def wait(self, ticket: Ticket, cancel: Optional[deadline.Deadline] = None) -> None:
+        """
+        Ждёт, пока запрос получит место.
+
+        Args:
+            ticket: Место запроса
+            cancel: Срок запроса: ожидание в очереди прерывается по его
+                истечении или отмене
+
+        Raises:
+            deadline.Cancelled: Если срок истёк или запрос отменён в очереди
+        """
+        while not ticket.admitted.done():
+            step = deadline.POLL_SECONDS
+            if cancel is not None:
+                cancel.check()
+                remaining = cancel.remaining()
+                if remaining is not None:
+                    step = min(step, remaining)
+            await asyncio.wait({ticket.admitted}, timeout=step)
+
+    def leave(self, ticket: Ticket) -> None:
+        """Освобождает место (или очередь), запоминает длительность генерации и пускает следующих."""
+        if ticket.released:
+            return
+        ticket.released = True
+        count = self._per_client.get(ticket.client, 0) - 1
+        if count > 0:
+            self._per_client[ticket.client] = count
+        else:
+            self._per_client.pop(ticket.client, None)
+            self._served.pop(ticket.client, None)
+
+        if ticket.started_at is None:
+            # Запрос ушёл из очереди, не дождавшись места
+            queue = self._queues.get(ticket.client)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self._queues[ticket.client]
+            ADMISSION_QUEUED.set(self.queued)
+            ADMISSION_QUEUE_SECONDS.observe(time.monotonic() - ticket.enqueued_at, outcome="abandoned")
+            return
+
+        self._running.remove(ticket)
+        duration = time.monotonic() - ticket.started_at
+        self.estimate += ESTIMATE_WEIGHT * (duration - self.estimate)
+        ADMISSION_ESTIMATE.set(round(self.estimate, 3))
+        self._dispatch()
+
+    def position(self, ticket: Ticket) -> int:
+        """Позиция запроса в очереди с учётом очерёдности клиентов (0 - место получено)."""
+        if ticket.started_at is not None:
+            return 0
+        queues = {client: deque(queue) for client, queue in self._queues.items()}
+        served = dict(self._served)
+        turn = self._turn
+        position = 0
+        while queues:
+            client = self._next_client(queues, served)
+            position += 1
+            if queues[client].popleft() is ticket:
+                return position
+            if not queues[client]:
+                del queues[client]
+            turn += 1
+            served[client] = turn
+        return 0
+
+    def expected_wait(self, ticket: Ticket) -> float:
+        """Оценка ожидания в очереди (секунды)."""
+        position = self.position(ticket)
+        if not position:
+            return 0.0
+        return self._next_free() + self.estimate * (position - 1) / max(self.max_in_flight, 1)
+
+    def retry_after(self, client: Optional[str] = None) -> int:
+        """
+        Через сколько секунд имеет смысл повторить запрос.
+
+        Args:
+            client: Клиент, упёршийся в свой лимит: учитываются его генерации
+
+        Returns:
+            int: Оценка времени до завершения ближайшей генерации (не меньше 1)
+        """
+        return max(1, math.ceil(self._next_free(client)))
+
+    def _next_free(self, client: Optional[str] = None) -> float:
+        now = time.monotonic()
+        running = [ticket for ticket in self._running if ticket.client == client] or self._running
+        if not running:
+            return self.estimate
+        return min(max(self.estimate - (now - ticket.started_at), 0.0) for ticket in running)
+
+    def _reject(self, reason: str, client: Optional[str] = None) -> None:
+        ADMISSION_REJECTIONS.inc(reason=reason)
+        raise Rejected(reason, self.retry_after(client))
+
+    @staticmethod
+    def _next_client(queues: Dict[str, Deque[Ticket]], served: Dict[str, int]) -> str:
+        # Следующее место - клиенту, которого дольше всех не обслуживали
+        return min(queues, key=lambda client: served.get(client, -1))
+
+    def _start(self, ticket: Ticket) -> None:
+        ticket.start()
+        self._running.append(ticket)
+        self._turn += 1
+        self._served[ticket.client] = self._turn
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+
+    def _dispatch(self) -> None:
+        while self._queues and (not self.max_in_flight or self.in_flight < self.max_in_flight):
+            client = self._next_client(self._queues, self._served)
+            queue = self._queues[client]
+            ticket = queue.popleft()
+            if not queue:
+                del self._queues[client]
+            ADMISSION_QUEUE_SECONDS.observe(time.monotonic() - ticket.enqueued_at, outcome="admitted")
+            self._start(ticket)
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+        ADMISSION_QUEUED.set(self.queued)
+
+
+def get_admission_controller() -> AdmissionController:
+    """
+    Создаёт контроллер допуска генераций.
+
+    QUEST_MAX_GENERATIONS: одновременных генераций (по умолчанию 4, 0 - без ограничения).
+    QUEST_GENERATION_QUEUE: длина очереди (по умолчанию 32).
+    QUEST_GENERATIONS_PER_CLIENT: генераций одного клиента, включая ожидающие
+    (по умолчанию 0 - без ограничения).
+    """
+    return AdmissionController(
+        max_in_flight=int(os.getenv("QUEST_MAX_GENERATIONS", "4")),
+        max_queue=int(os.getenv("QUEST_GENERATION_QUEUE", "32")),
+        max_per_client=int(os.getenv("QUEST_GENERATIONS_PER_CLIENT", "0")),
+    )
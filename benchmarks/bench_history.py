@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# История версий квестов: рост хранилища при правках и скорость чтения последней версии
+
+import argparse
+import copy
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from bench_storage import make_quest
+import serialization
+from storage import FileQuestStorage, SQLiteQuestStorage
+
+
+def history_bytes(storage, quest_name: str) -> int:
+    """Размер истории версий квеста: объекты и манифесты."""
+    if isinstance(storage, FileQuestStorage):
+        directory = storage._history_dir(quest_name)
+        return sum(os.path.getsize(path) for path in directory.iterdir())
+    return storage._connect().execute(
+        "SELECT (SELECT COALESCE(SUM(LENGTH(body)), 0) FROM history_objects WHERE quest_name = ?) + "
+        "(SELECT COALESCE(SUM(LENGTH(manifest)), 0) FROM quest_versions WHERE quest_name = ?)",
+        (quest_name, quest_name),
+    ).fetchone()[0]
+
+
+def read_ms(storage, quest_name: str, runs: int = 20) -> float:
+    """Медиана времени чтения последней версии квеста."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        storage.load_quest(quest_name)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def run(storage, scene_count: int, edits: int) -> dict:
+    """Сохраняет квест и серию правок одной сцены или позиции узла."""
+    rng = random.Random(0)
+    quest, positions = make_quest(scene_count)
+    version = storage.save_quest("quest", quest, positions)
+    read_before = read_ms(storage, "quest")
+    full_copies = len(serialization.dumps_bytes(quest)) + len(serialization.dumps_bytes(positions))
+    timings = {"update": [], "patch_text": [], "patch_move": []}
+
+    for i in range(edits):
+        kind = ("update", "patch_text", "patch_move")[i % 3]
+        index = rng.randrange(scene_count)
+        start = time.perf_counter()
+        if kind == "update":
+            # Редактор отправляет весь квест, изменён текст одной сцены
+            quest = copy.deepcopy(quest)
+            quest["scenes"][index]["text"] += f" Правка {i}."
+            version = storage.save_quest("quest", quest, positions, expected_version=version)
+        elif kind == "patch_text":
+            scene = dict(quest["scenes"][index], text=quest["scenes"][index]["text"] + f" Правка {i}.")
+            quest["scenes"][index] = scene
+            version = storage.patch_quest("quest", version, {scene["scene_id"]: scene}, {})
+        else:
+            item = {"scene_id": positions[index]["scene_id"], "position": {"x": i, "y": index}}
+            positions[index] = item
+            version = storage.patch_quest("quest", version, {}, {item["scene_id"]: item})
+        timings[kind].append(time.perf_counter() - start)
+        full_copies += len(serialization.dumps_bytes(quest)) + len(serialization.dumps_bytes(positions))
+
+    start = time.perf_counter()
+    diff = storage.diff_versions("quest", 1, version)
+    diff_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    storage.load_version("quest", 1)
+    load_version_ms = (time.perf_counter() - start) * 1000
+    return {
+        "history": history_bytes(storage, "quest"),
+        "full_copies": full_copies,
+        "versions": version,
+        "read_before_ms": read_before,
+        "read_after_ms": read_ms(storage, "quest"),
+        "save_ms": {kind: statistics.median(values) * 1000 for kind, values in timings.items() if values},
+        "diff_ms": diff_ms,
+        "diff_changed": len(diff["changed"]),
+        "load_version_ms": load_version_ms,
+    }
+
+
+def main():
+    """Главная функция программы."""
+    parser = argparse.ArgumentParser(description='Бенчмарк истории версий квестов')
+    parser.add_argument('--scenes', type=int, default=500, help='Сцен в квесте')
+    parser.add_argument('--edits', type=int, default=300, help='Количество правок')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storages = {
+            "file": FileQuestStorage(Path(tmp_dir) / "quests", Path(tmp_dir) / "positions"),
+            "sqlite": SQLiteQuestStorage(Path(tmp_dir) / "quests.db"),
+        }
+        for name, storage in storages.items():
+            result = run(storage, args.scenes, args.edits)
+            storage.close()
+            print(f"\n{name}: {args.scenes} сцен, {result['versions']} версий")
+            print(f"  история:          {result['history'] / 1e6:8.2f} МБ "
+                  f"(полные копии: {result['full_copies'] / 1e6:.1f} МБ, "
+                  f"в {result['full_copies'] / result['history']:.0f} раз меньше)")
+            print(f"  на версию:        {result['history'] / result['versions'] / 1e3:8.1f} КБ")
+            print("  сохранение:       " + ", ".join(
+                f"{kind} {ms:.1f} мс" for kind, ms in result["save_ms"].items()))
+            print(f"  чтение квеста:    {result['read_before_ms']:8.2f} мс до правок, "
+                  f"{result['read_after_ms']:.2f} мс после")
+            print(f"  diff 1..{result['versions']}:       {result['diff_ms']:8.1f} мс "
+                  f"({result['diff_changed']} изменённых сцен), версия 1: {result['load_version_ms']:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
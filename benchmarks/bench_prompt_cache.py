@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Кэш похожих промптов: время поиска в зависимости от размера истории и точность LSH
+
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from prompt_cache import PromptCache, jaccard, shingles
+
+GENRES = ["тёмное фэнтези", "киберпанк", "хоррор", "детектив", "космоопера", "стимпанк",
+          "постапокалипсис", "вестерн", "нуар", "сказка", "мифология", "пиратские приключения"]
+SYLLABLES = ["ка", "ро", "ми", "ла", "тар", "вен", "ос", "гри", "дум", "ше", "ля", "зор",
+             "фа", "ни", "бел", "кр", "ант", "ус", "мор", "эль", "вий", "сто", "на", "рек"]
+
+
+def make_vocabulary(rng: random.Random, size: int = 3000) -> list:
+    """Словарь псевдослов: промпты пользователей - свободный текст, а не выбор из списков."""
+    return ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(size)]
+
+
+def make_prompt(rng: random.Random, words: list) -> str:
+    """Промпт в формате input_example.txt: жанр из списка, герой и цель - случайные слова."""
+    return (f"Жанр - {rng.choice(GENRES)}\n"
+            f"Главный герой - {' '.join(rng.choices(words, k=2))}\n"
+            f"Цель - {' '.join(rng.choices(words, k=8))}")
+
+
+def rephrase(prompt: str) -> str:
+    """Тот же промпт другими словами: подписи полей, регистр и пунктуация."""
+    return (prompt.replace("Жанр - ", "Жанр: ").replace("Главный герой - ", "Главный герой: ")
+            .replace("Цель - ", "Цель квеста: ").upper() + "!")
+
+
+def main():
+    """Главная функция программы."""
+    parser = argparse.ArgumentParser(description='Бенчмарк кэша похожих промптов')
+    parser.add_argument('--sizes', default='1000,10000,50000', help='Размеры истории промптов')
+    parser.add_argument('--queries', type=int, default=200, help='Запросов на каждый размер')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    words = make_vocabulary(rng)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = PromptCache(Path(tmp_dir) / "prompt_cache.db")
+        prompts = []
+        for size in map(int, args.sizes.split(",")):
+            start = time.perf_counter()
+            while len(prompts) < size:
+                prompt = make_prompt(rng, words)
+                cache.add(prompt, f"quest_{len(prompts)}", 1)
+                prompts.append(prompt)
+            add_ms = (time.perf_counter() - start) / max(size, 1) * 1000
+
+            lookup, hits, scan = [], 0, []
+            for _ in range(args.queries):
+                index = rng.randrange(len(prompts))
+                query = rephrase(prompts[index])
+                start = time.perf_counter()
+                results = cache.find_similar(query)
+                lookup.append(time.perf_counter() - start)
+                hits += bool(results) and results[0]["quest_name"] == f"quest_{index}"
+            # Полный перебор для сравнения: точное сходство со всеми промптами
+            query_items = shingles(rephrase(prompts[0]))
+            for _ in range(3):
+                start = time.perf_counter()
+                max(jaccard(query_items, shingles(prompt)) for prompt in prompts)
+                scan.append(time.perf_counter() - start)
+
+            print(f"{size:7d} промптов: добавление {add_ms:.2f} мс, поиск {statistics.median(lookup) * 1000:6.2f} мс "
+                  f"(перебор {statistics.median(scan) * 1000:7.1f} мс), найдено {hits / args.queries:.0%}")
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
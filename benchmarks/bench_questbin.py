@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Загрузка больших квестов: json.load против скомпилированного формата .qbin (время и память)
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from bench_storage import make_quest
+from questbin import compile_file
+
+# Каждый способ загрузки замеряется в отдельном интерпретаторе, чтобы память не накапливалась
+CHILD_SCRIPT = r"""
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+from engine import CompiledQuest
+import questbin
+
+def rss_mb():
+    # Пик памяти процесса; ru_maxrss в Linux наследуется от родителя через fork, поэтому VmHWM
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("VmHWM")) / 1024
+    except OSError:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / 1024 if sys.platform != "darwin" else rss / 1024 / 1024
+
+path, mode = {path!r}, {mode!r}
+before = rss_mb()
+start = time.perf_counter()
+if mode == "json_game":
+    with open(path, encoding="utf-8") as f:
+        quest = CompiledQuest(json.load(f))
+    quest.scene("start")
+elif mode == "json_dict":
+    with open(path, encoding="utf-8") as f:
+        json.load(f)
+elif mode == "qbin_game":
+    quest = questbin.load_compiled_quest(path)
+    quest.scene("start")
+elif mode == "qbin_dict":
+    questbin.load_quest_data(path)
+elif mode == "qbin_skeleton":
+    questbin.load_skeleton(path)
+elapsed = time.perf_counter() - start
+print(json.dumps({{"ms": elapsed * 1000, "rss_mb": rss_mb() - before}}))
+"""
+
+MODES = (
+    ("json_game", "json.load + CompiledQuest (игра)"),
+    ("qbin_game", ".qbin mmap + CompiledQuest (игра)"),
+    ("json_dict", "json.load (валидатор)"),
+    ("qbin_dict", ".qbin to_dict (валидатор)"),
+    ("qbin_skeleton", ".qbin skeleton (раскладка графа)"),
+)
+
+
+def measure(path: Path, mode: str) -> dict:
+    """Загружает квест выбранным способом в новом процессе и возвращает время и прирост памяти."""
+    script = CHILD_SCRIPT.format(root=str(PROJECT_ROOT), path=str(path), mode=mode)
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Замер {mode} завершился ошибкой:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    """Главная функция программы."""
+    parser = argparse.ArgumentParser(description='Бенчмарк загрузки квестов: JSON против .qbin')
+    parser.add_argument('--scenes', default='1000,10000,50000', help='Размеры квестов через запятую')
+    parser.add_argument('--runs', type=int, default=3, help='Повторов каждого замера')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scene_count in map(int, args.scenes.split(',')):
+            quest, _ = make_quest(scene_count)
+            path = Path(tmp_dir) / f"quest_{scene_count}.json"
+            # Квесты из генератора сохраняются с отступами
+            path.write_text(json.dumps(quest, ensure_ascii=False, indent=2), encoding="utf-8")
+            binary = compile_file(path)
+
+            print(f"\nСцен: {scene_count}, JSON {os.path.getsize(path) / 1e6:.1f} МБ, "
+                  f".qbin {os.path.getsize(binary) / 1e6:.1f} МБ")
+            print(f"  {'способ':<36} {'время, мс':>10} {'пик памяти, МБ':>15}")
+            for mode, title in MODES:
+                runs = [measure(path, mode) for _ in range(args.runs)]
+                print(f"  {title:<36} {statistics.median(run['ms'] for run in runs):>10.1f} "
+                      f"{statistics.median(run['rss_mb'] for run in runs):>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Память и скорость игровых сессий: тысячи игроков в одном процессе
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from bench_storage import make_quest
+from engine import SessionManager
+from storage import SQLiteQuestStorage
+
+
+def main():
+    """Главная функция программы."""
+    parser = argparse.ArgumentParser(description='Бенчмарк игровых сессий')
+    parser.add_argument('--sessions', type=int, default=10000, help='Количество сессий')
+    parser.add_argument('--scenes', type=int, default=50, help='Сцен в квесте')
+    parser.add_argument('--moves', type=int, default=20, help='Ходов в каждой сессии')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = SQLiteQuestStorage(Path(tmp_dir) / "sessions.db")
+        quest, _ = make_quest(args.scenes)
+        storage.save_quest("bench", quest)
+        manager = SessionManager(storage, max_sessions=args.sessions + 1)
+        manager.load_quest("bench")
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        session_ids = [manager.create("bench")[0] for _ in range(args.sessions)]
+        create_s = time.perf_counter() - start
+
+        rng = random.Random(0)
+        moves = 0
+        start = time.perf_counter()
+        for _ in range(args.moves):
+            for session_id in session_ids:
+                session = manager.get(session_id)
+                choices = session.scene()["choices"]
+                if choices:
+                    session.choose(rng.randrange(len(choices)))
+                    moves += 1
+        move_s = time.perf_counter() - start
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        saved = [manager.get(session_id).save() for session_id in session_ids[:1000]]
+        restored = [manager.restore(state) for state in saved]
+        restore_s = time.perf_counter() - start
+        storage.close()
+
+    print(f"Сессий: {args.sessions}, сцен в квесте: {args.scenes}, ходов: {moves}")
+    print(f"  создание сессии:     {create_s / args.sessions * 1e6:8.1f} мкс")
+    print(f"  ход (get + choose):  {move_s / max(moves, 1) * 1e6:8.1f} мкс")
+    print(f"  сохранение+восст.:   {restore_s / len(restored) * 1e6:8.1f} мкс")
+    print(f"  память на сессию:    {(after - before) / args.sessions:8.0f} байт "
+          f"(включая историю из {moves // args.sessions + 1} сцен)")
+
+
+if __name__ == "__main__":
+    main()
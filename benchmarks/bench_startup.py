@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Холодный старт backend: время импорта, первый ответ, память и бюджет
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+
+# Модули, которые не должны загружаться при старте (только при первом использовании)
+DEFAULT_FORBIDDEN = "langchain_community,langchain_core,gigachat,networkx,numpy,pygraphviz"
+
+# Выполняется в отдельном интерпретаторе, чтобы замер был холодным
+CHILD_SCRIPT = r"""
+import asyncio, json, resource, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+sys.path.insert(0, {backend_dir!r})
+import backend
+imported = time.perf_counter()
+
+async def first_request():
+    scope = {{
+        "type": "http", "asgi": {{"version": "3.0"}}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": "/list_quests", "raw_path": b"/list_quests",
+        "query_string": b"", "root_path": "", "headers": [],
+        "server": ("bench", 80), "client": ("bench", 1),
+    }}
+    status = []
+    async def receive():
+        return {{"type": "http.request", "body": b"", "more_body": False}}
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+    await backend.app(scope, receive, send)
+    return status[0]
+
+status = asyncio.run(first_request())
+ready = time.perf_counter()
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform != "darwin":
+    rss *= 1024
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "first_response_ms": (ready - start) * 1000,
+    "status": status,
+    "max_rss_mb": rss / 1024 / 1024,
+    "loaded": sorted({{name.split(".")[0] for name in sys.modules}}),
+}}))
+"""
+
+
+def isolated_env(tmp_dir: str) -> dict:
+    """
+    Окружение backend, в котором все его данные лежат во временной папке:
+    замер не трогает хранилище проекта и не создаёт файлов в репозитории.
+    """
+    return dict(
+        os.environ,
+        QUEST_PRELOAD="0",
+        QUEST_STORAGE="sqlite",
+        QUEST_DB_PATH=os.path.join(tmp_dir, "quests.db"),
+        QUEST_SEARCH_DB=os.path.join(tmp_dir, "search.db"),
+        QUEST_TELEMETRY_DIR=os.path.join(tmp_dir, "telemetry"),
+        QUEST_TRACE_DIR=os.path.join(tmp_dir, "traces"),
+        QUEST_PROMPT_CACHE_DB=os.path.join(tmp_dir, "prompt_cache.db"),
+        QUEST_CHECKPOINT_DIR=os.path.join(tmp_dir, "checkpoints"),
+    )
+
+
+def measure(env_python: str, env: dict) -> dict:
+    """Запускает холодный старт backend в новом процессе и возвращает замеры."""
+    script = CHILD_SCRIPT.format(root=str(PROJECT_ROOT), backend_dir=str(PROJECT_ROOT / "ui-backend"))
+    result = subprocess.run(
+        [env_python, "-c", script],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, env=env,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Не удалось запустить backend:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def top_imports(env_python: str, env: dict, limit: int) -> list:
+    """Самые медленные импорты по данным python -X importtime."""
+    script = f"import sys; sys.path[:0] = [{str(PROJECT_ROOT)!r}, {str(PROJECT_ROOT / 'ui-backend')!r}]; import backend"
+    result = subprocess.run([env_python, "-X", "importtime", "-c", script],
+                            cwd=PROJECT_ROOT, capture_output=True, text=True, env=env)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    """Главная функция программы."""
+    parser = argparse.ArgumentParser(description='Бенчмарк холодного старта backend')
+    parser.add_argument('--runs', type=int, default=5, help='Количество холодных запусков')
+    parser.add_argument('--budget-ms', type=float, default=1500,
+                        help='Бюджет времени до первого ответа (медиана), мс')
+    parser.add_argument('--budget-mb', type=float, default=150, help='Бюджет пиковой памяти, МБ')
+    parser.add_argument('--forbid', default=DEFAULT_FORBIDDEN,
+                        help='Модули, которые не должны загружаться при старте (через запятую)')
+    parser.add_argument('--top', type=int, default=0, help='Показать N самых медленных импортов')
+    parser.add_argument('--python', default=sys.executable, help='Интерпретатор для запуска backend')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = isolated_env(tmp_dir)
+        runs = [measure(args.python, env) for _ in range(args.runs)]
+        slowest_imports = top_imports(args.python, env, args.top) if args.top else []
+    import_ms = statistics.median(run["import_ms"] for run in runs)
+    ready_ms = statistics.median(run["first_response_ms"] for run in runs)
+    rss_mb = max(run["max_rss_mb"] for run in runs)
+    forbidden = [name for name in args.forbid.split(",") if name and name in runs[0]["loaded"]]
+
+    print(f"Запусков: {args.runs}")
+    print(f"  импорт backend:      {import_ms:8.1f} мс (медиана)")
+    print(f"  первый ответ:        {ready_ms:8.1f} мс (медиана, бюджет {args.budget_ms:.0f})")
+    print(f"  пиковая память:      {rss_mb:8.1f} МБ (бюджет {args.budget_mb:.0f})")
+    print(f"  статус /list_quests: {runs[0]['status']}")
+
+    if args.top:
+        print(f"\nСамые медленные импорты (cumulative):")
+        for cumulative_us, name in slowest_imports:
+            print(f"  {cumulative_us / 1000:8.1f} мс  {name}")
+
+    failures = []
+    if ready_ms > args.budget_ms:
+        failures.append(f"время до первого ответа {ready_ms:.0f} мс > {args.budget_ms:.0f} мс")
+    if rss_mb > args.budget_mb:
+        failures.append(f"память {rss_mb:.0f} МБ > {args.budget_mb:.0f} МБ")
+    if forbidden:
+        failures.append(f"при старте загружены тяжёлые модули: {', '.join(forbidden)}")
+
+    if failures:
+        print("\n❌ Бюджет превышен:")
+        for failure in failures:
+            print(f"  • {failure}")
+        sys.exit(1)
+    print("\n✅ Бюджет соблюдён")
+
+
+if __name__ == "__main__":
+    main()
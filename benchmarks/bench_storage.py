@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Сравнение файлового хранилища и SQLite: запись, чтение, список квестов
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from storage import FileQuestStorage, SQLiteQuestStorage
+
+
+def make_quest(scene_count: int):
+    """Создаёт синтетический квест и позиции узлов заданного размера."""
+    scenes = []
+    for i in range(scene_count):
+        choices = [
+            {"text": f"Выбор {j} в сцене {i}: " + "действие " * 8, "next_scene": f"scene_{i + j + 1}"}
+            for j in range(2) if i + j + 1 < scene_count
+        ]
+        scenes.append({
+            "scene_id": "start" if i == 0 else f"scene_{i}",
+            "text": f"Сцена {i}. " + "Туман стелется над древним городом. " * 20,
+            "choices": choices,
+        })
+    positions = [
+        {"scene_id": scene["scene_id"], "position": {"x": i * 100, "y": (i % 7) * 80}}
+        for i, scene in enumerate(scenes)
+    ]
+    return {"scenes": scenes}, positions
+
+
+def run(storage, quest_count: int, scene_count: int, readers: int):
+    """Замеряет основные операции хранилища и возвращает результаты в секундах."""
+    quest, positions = make_quest(scene_count)
+    names = [f"quest_{i}" for i in range(quest_count)]
+    results = {}
+
+    start = time.perf_counter()
+    for name in names:
+        storage.save_quest(name, quest, positions)
+    results["write"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for name in names:
+        storage.load_quest(name)
+        storage.load_positions(name)
+    results["read"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=readers) as pool:
+        list(pool.map(lambda name: (storage.load_quest(name), storage.load_positions(name)), names))
+    results[f"read x{readers} threads"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(20):
+        storage.list_quests()
+    results["list x20"] = time.perf_counter() - start
+
+    return results
+
+
+def main():
+    """Главная функция программы."""
+    parser = argparse.ArgumentParser(description='Бенчмарк хранилищ квестов')
+    parser.add_argument('--quests', type=int, default=500, help='Количество квестов')
+    parser.add_argument('--scenes', type=int, default=10, help='Сцен в каждом квесте')
+    parser.add_argument('--readers', type=int, default=8, help='Потоков при параллельном чтении')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = {
+            "file": FileQuestStorage(os.path.join(tmp, "quests"), os.path.join(tmp, "positions")),
+            "sqlite": SQLiteQuestStorage(os.path.join(tmp, "quests.db")),
+        }
+        print(f"Квестов: {args.quests}, сцен в квесте: {args.scenes}")
+        for name, storage in stores.items():
+            results = run(storage, args.quests, args.scenes, args.readers)
+            storage.close()
+            print(f"\n{name}:")
+            for operation, seconds in results.items():
+                print(f"  {operation:<20} {seconds * 1000:9.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Телеметрия прохождений: размер журнала, скорость записи и потоковой агрегации
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from bench_storage import make_quest
+from engine import ABANDONED, FINISHED, CompiledQuest
+from storage import SQLiteQuestStorage
+from telemetry import TelemetryRecorder, telemetry_files
+
+# Агрегация выполняется в отдельном процессе: его пик памяти не включает данные бенчмарка
+CHILD_SCRIPT = r"""
+import json, sys, time
+sys.path.insert(0, {root!r})
+from storage import SQLiteQuestStorage
+from telemetry import TelemetryAggregator, telemetry_files
+
+def peak_mb():
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("VmHWM")) / 1024
+
+storage = SQLiteQuestStorage({db!r})
+before = peak_mb()
+start = time.perf_counter()
+aggregator = TelemetryAggregator(storage)
+for path in telemetry_files({directory!r}):
+    aggregator.add_file(path)
+report = aggregator.report()
+print(json.dumps({{
+    "seconds": time.perf_counter() - start,
+    "peak_mb": peak_mb() - before,
+    "quests": [(q["quest_name"], q["sessions"], q["completion_rate"], q["skipped"]) for q in report["quests"]],
+}}))
+"""
+
+
+def random_playthrough(quest: CompiledQuest, rng: random.Random, drop_rate: float):
+    """Случайное прохождение: номера выборов и итог (игрок уходит с вероятностью drop_rate на ход)."""
+    scene = quest.start
+    choices = []
+    while quest.choices[scene]:
+        if rng.random() < drop_rate:
+            return choices, ABANDONED
+        choice = rng.randrange(len(quest.choices[scene]))
+        choices.append(choice)
+        scene = quest.choices[scene][choice][1]
+    return choices, FINISHED
+
+
+def main():
+    """Главная функция программы."""
+    parser = argparse.ArgumentParser(description='Бенчмарк телеметрии прохождений')
+    parser.add_argument('--sessions', type=int, default=1_000_000, help='Количество прохождений')
+    parser.add_argument('--scenes', type=int, default=30, help='Сцен в квесте')
+    parser.add_argument('--quests', type=int, default=3, help='Количество квестов')
+    parser.add_argument('--drop-rate', type=float, default=0.03, help='Вероятность уйти на каждом ходу')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = SQLiteQuestStorage(Path(tmp_dir) / "quests.db")
+        quests = []
+        for i in range(args.quests):
+            quest_data, _ = make_quest(args.scenes)
+            version = storage.save_quest(f"quest_{i}", quest_data)
+            quests.append(CompiledQuest(quest_data, f"quest_{i}", version))
+
+        playthroughs = [random_playthrough(quests[i % len(quests)], rng, args.drop_rate)
+                        for i in range(min(args.sessions, 100_000))]
+        recorder = TelemetryRecorder(Path(tmp_dir) / "telemetry")
+        now = time.time()
+        moves = 0
+        start = time.perf_counter()
+        for i in range(args.sessions):
+            choices, outcome = playthroughs[i % len(playthroughs)]
+            quest = quests[i % len(quests)]
+            recorder.record_choices(quest.name, quest.version, choices, outcome, now - 60, now)
+            moves += len(choices)
+        recorder.close()
+        record_s = time.perf_counter() - start
+        files = telemetry_files(Path(tmp_dir) / "telemetry")
+        size = sum(os.path.getsize(path) for path in files)
+
+        storage.close()
+
+        script = CHILD_SCRIPT.format(root=str(PROJECT_ROOT), db=str(Path(tmp_dir) / "quests.db"),
+                                     directory=str(Path(tmp_dir) / "telemetry"))
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Агрегация завершилась ошибкой:\n{result.stderr}")
+        aggregated = json.loads(result.stdout.strip().splitlines()[-1])
+
+    print(f"Прохождений: {args.sessions}, квестов: {args.quests} по {args.scenes} сцен, "
+          f"в среднем {moves / args.sessions:.1f} ходов")
+    print(f"  журнал:           {size / 1e6:8.1f} МБ ({size / args.sessions:.1f} байт на прохождение)")
+    print(f"  запись:           {record_s / args.sessions * 1e6:8.2f} мкс на прохождение")
+    print(f"  агрегация:        {args.sessions / aggregated['seconds']:8.0f} прохождений/с "
+          f"({aggregated['seconds']:.1f} с), прирост пика памяти {aggregated['peak_mb']:.1f} МБ")
+    for name, sessions, completion_rate, skipped in aggregated["quests"]:
+        print(f"  {name}: {sessions} прохождений, завершено {completion_rate:.1%}, пропущено {skipped or 0}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Задержка перерисовки по нажатию клавиши: clear + полный вывод против TerminalRenderer
+
+import argparse
+import fcntl
+import io
+import os
+import pty
+import statistics
+import struct
+import sys
+import termios
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from terminal import TerminalRenderer
+
+SENTENCE = "Туман стелется над старым маяком, и где-то вдали слышен скрип ржавых цепей. "
+
+
+class PtyTerminal:
+    """Псевдотерминал заданного размера, вывод которого читается фоновым потоком."""
+
+    def __init__(self, rows: int, columns: int):
+        self.master, self.slave = pty.openpty()
+        fcntl.ioctl(self.slave, termios.TIOCSWINSZ, struct.pack("HHHH", rows, columns, 0, 0))
+        self.received = 0
+        self._reader = threading.Thread(target=self._drain, daemon=True)
+        self._reader.start()
+
+    def _drain(self) -> None:
+        while True:
+            try:
+                data = os.read(self.master, 65536)
+            except OSError:
+                return
+            if not data:
+                return
+            self.received += len(data)
+
+    def close(self) -> None:
+        os.close(self.slave)
+        os.close(self.master)
+
+
+def legacy_redraw(out, text: str, choices: List[str], selected: int) -> None:
+    """Прежняя перерисовка game.py: внешняя команда clear и вывод всей сцены."""
+    os.system("clear")
+    out.write(text + "\n" + "-" * 80 + "\n")
+    out.write("\nДоступные действия (используйте ↑↓ для выбора, Enter для подтверждения):\n")
+    for i, choice in enumerate(choices):
+        marker = "→" if i == selected else " "
+        out.write(f"{marker} {i + 1}. {choice}\n")
+    out.write(f"\nТекущий выбор: {selected + 1}\n")
+    out.write("Управление: ↑/↓ - навигация, Enter - выбор, q - выход, h - история\n")
+    out.flush()
+
+
+def measure(terminal: PtyTerminal, keystroke: Callable[[int], None], presses: int) -> Dict:
+    """Выполняет presses нажатий и возвращает задержки и объём вывода на нажатие."""
+    latencies = []
+    before = terminal.received
+    for i in range(presses):
+        start = time.perf_counter()
+        keystroke(i)
+        latencies.append(time.perf_counter() - start)
+    # Ждём, пока терминал прочитает весь вывод
+    time.sleep(0.2)
+    latencies.sort()
+    return {
+        "median_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "bytes_per_key": (terminal.received - before) / presses,
+    }
+
+
+def main():
+    """Главная функция программы."""
+    parser = argparse.ArgumentParser(description='Бенчмарк перерисовки игры в терминале')
+    parser.add_argument('--presses', type=int, default=200, help='Количество нажатий')
+    parser.add_argument('--text-lines', type=int, default=60, help='Длина текста сцены в строках')
+    parser.add_argument('--choices', type=int, default=4, help='Количество выборов')
+    parser.add_argument('--rows', type=int, default=24, help='Высота терминала')
+    parser.add_argument('--columns', type=int, default=80, help='Ширина терминала')
+    args = parser.parse_args()
+
+    text = "\n".join(SENTENCE for _ in range(args.text_lines))
+    choices = [f"Вариант действия номер {i + 1}" for i in range(args.choices)]
+
+    terminal = PtyTerminal(args.rows, args.columns)
+    saved_stdout = os.dup(1)
+    os.dup2(terminal.slave, 1)
+    out = io.TextIOWrapper(os.fdopen(os.dup(1), "wb"), encoding="utf-8", write_through=True)
+    env_term = os.environ.setdefault("TERM", "xterm")
+    try:
+        legacy = measure(
+            terminal,
+            lambda i: legacy_redraw(out, text, choices, (i + 1) % len(choices)),
+            args.presses
+        )
+
+        renderer = TerminalRenderer(out, os.terminal_size((args.columns, args.rows)))
+        renderer.render_scene(text, choices)
+        selection = measure(
+            terminal,
+            lambda i: renderer.select((i + 1) % len(choices)),
+            args.presses
+        )
+        scrolling = measure(
+            terminal,
+            lambda i: renderer.page(1 if (i // 3) % 2 == 0 else -1),
+            args.presses
+        )
+    finally:
+        out.flush()
+        os.dup2(saved_stdout, 1)
+        os.close(saved_stdout)
+        terminal.close()
+
+    print(f"Терминал {args.columns}x{args.rows} (TERM={env_term}), текст {args.text_lines} строк, "
+          f"{args.choices} выбора, {args.presses} нажатий")
+    print(f"{'способ':<34} {'медиана, мс':>12} {'p95, мс':>9} {'байт/нажатие':>13}")
+    for name, result in (("clear + полный вывод (прежний)", legacy),
+                         ("TerminalRenderer: ↑/↓", selection),
+                         ("TerminalRenderer: PgUp/PgDn", scrolling)):
+        print(f"{name:<34} {result['median_ms']:>12.3f} {result['p95_ms']:>9.3f} "
+              f"{result['bytes_per_key']:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
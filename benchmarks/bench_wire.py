@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Размер квестов на проводе и время сериализации для разных форматов
+
+import argparse
+import gzip
+import json
+import time
+
+from bench_storage import make_quest
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def serializers():
+    """Форматы, которые сравниваются в бенчмарке."""
+    formats = {
+        # Так квесты хранились раньше
+        "json indent=4": lambda data: json.dumps(data, ensure_ascii=False, indent=4).encode("utf-8"),
+        # Стандартный JSONResponse FastAPI
+        "json compact": lambda data: json.dumps(
+            data, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8"),
+    }
+    if orjson is not None:
+        formats["orjson"] = orjson.dumps
+    return formats
+
+
+def timed(fn, data, repeat: int) -> float:
+    """Лучшее время одного вызова из repeat попыток, в миллисекундах."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    """Главная функция программы."""
+    parser = argparse.ArgumentParser(description='Бенчмарк форматов передачи квестов')
+    parser.add_argument('--sizes', default='10,100,1000,10000', help='Размеры квестов (сцен) через запятую')
+    parser.add_argument('--repeat', type=int, default=5, help='Повторов на замер')
+    args = parser.parse_args()
+
+    if orjson is None:
+        print("orjson не установлен: сравнение только со стандартным json")
+    if brotli is None:
+        print("brotli не установлен: колонка br пропущена")
+
+    header = f"{'сцен':>6} {'формат':<14} {'байт':>11} {'gzip':>10} {'br':>10} {'сериализация, мс':>18}"
+    print(header)
+    print("-" * len(header))
+
+    for size in (int(value) for value in args.sizes.split(",")):
+        quest, positions = make_quest(size)
+        payload = {"quest_name": "bench", "quest_data": quest, "node_positions": positions}
+
+        for name, fn in serializers().items():
+            body = fn(payload)
+            gzip_bytes = len(gzip.compress(body, compresslevel=6))
+            br_bytes = str(len(brotli.compress(body, quality=5))) if brotli is not None else "-"
+            elapsed = timed(fn, payload, args.repeat)
+            print(f"{size:>6} {name:<14} {len(body):>11} {gzip_bytes:>10} {br_bytes:>10} {elapsed:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
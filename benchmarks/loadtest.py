@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Нагрузочное тестирование backend: смесь запросов, перцентили задержек, ошибки
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from bench_storage import make_quest
+
+DEFAULT_MIX = "list_quests=5,get_quest_data=10,update_quest=3,generate_quest=1"
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Разбирает смесь запросов вида 'list_quests=5,get_quest_data=10'."""
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    unknown = set(weights) - set(ENDPOINTS)
+    if unknown:
+        raise ValueError(f"Неизвестные запросы в смеси: {', '.join(sorted(unknown))}")
+    return {name: weight for name, weight in weights.items() if weight > 0}
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Перцентиль p (0..100) методом ближайшего ранга."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def load_backend(tmp_dir: str, llm_latency: float, stub_layout: bool):
+    """
+    Загружает приложение backend в этом процессе с изолированным хранилищем
+    и заглушкой LLM вместо GigaChat.
+    """
+    # Данные backend (хранилище, индексы, телеметрия, трассировки, контрольные
+    # точки) задаются до импорта: backend открывает их при загрузке модуля
+    os.environ.update(
+        QUEST_STORAGE="sqlite",
+        QUEST_DB_PATH=os.path.join(tmp_dir, "loadtest.db"),
+        QUEST_SEARCH_DB=os.path.join(tmp_dir, "search.db"),
+        QUEST_TELEMETRY_DIR=os.path.join(tmp_dir, "telemetry"),
+        QUEST_TRACE_DIR=os.path.join(tmp_dir, "traces"),
+        QUEST_PROMPT_CACHE_DB=os.path.join(tmp_dir, "prompt_cache.db"),
+        QUEST_CHECKPOINT_DIR=os.path.join(tmp_dir, "checkpoints"),
+    )
+    spec = importlib.util.spec_from_file_location("backend", PROJECT_ROOT / "ui-backend" / "backend.py")
+    backend = importlib.util.module_from_spec(spec)
+    sys.path.insert(0, str(PROJECT_ROOT / "ui-backend"))
+    spec.loader.exec_module(backend)
+
+    def stub_generate_rpg_quest(user_prompt, system_prompt, credentials, on_event=None, **kwargs):
+        time.sleep(llm_latency)
+        quest, _ = make_quest(8)
+        return quest
+
+    backend.main_module.generate_rpg_quest = stub_generate_rpg_quest
+
+    if stub_layout:
+        def stub_build_node_positions(quest_name):
+            quest = backend.storage.load_quest(quest_name)
+            backend.storage.save_positions(quest_name, [
+                {"scene_id": scene["scene_id"], "position": {"x": i * 100, "y": 0}}
+                for i, scene in enumerate(quest["scenes"])
+            ])
+            return True
+        backend.build_node_positions = stub_build_node_positions
+
+    return backend
+
+
+class LoadTest:
+    """Генератор нагрузки: concurrency воркеров выполняют запросы из смеси."""
+
+    def __init__(self, client: httpx.AsyncClient, mix: Dict[str, float], quest_names: List[str],
+                 scenes: int):
+        self.client = client
+        self.mix = mix
+        self.quest_names = quest_names
+        self.quest, self.positions = make_quest(scenes)
+        self.latencies: Dict[str, List[float]] = {name: [] for name in mix}
+        self.errors: Dict[str, Dict[str, int]] = {name: {} for name in mix}
+        self._generated = 0
+
+    async def request(self, endpoint: str) -> None:
+        start = time.perf_counter()
+        try:
+            response = await ENDPOINTS[endpoint](self)
+            status = str(response.status_code) if response.status_code >= 400 else None
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        if status is not None:
+            self.errors[endpoint][status] = self.errors[endpoint].get(status, 0) + 1
+
+    async def worker(self, deadline: float, remaining: List[int], rng: random.Random) -> None:
+        names, weights = list(self.mix), list(self.mix.values())
+        while time.perf_counter() < deadline:
+            if remaining[0] <= 0:
+                return
+            remaining[0] -= 1
+            await self.request(rng.choices(names, weights)[0])
+
+    def random_quest(self) -> str:
+        return random.choice(self.quest_names)
+
+    async def list_quests(self):
+        return await self.client.get("/list_quests")
+
+    async def get_quest_data(self):
+        return await self.client.get(f"/get_quest_data/{self.random_quest()}")
+
+    async def update_quest(self):
+        return await self.client.put("/update_quest", json={
+            "quest_name": self.random_quest(),
+            "quest_data": self.quest,
+            "node_positions": self.positions,
+        })
+
+    async def generate_quest(self):
+        self._generated += 1
+        return await self.client.post("/generate_quest", json={
+            "quest_name": f"loadtest_generated_{self._generated}",
+            "user_prompt": f"Жанр: нагрузочный тест {self._generated}",
+        })
+
+
+ENDPOINTS = {
+    "list_quests": LoadTest.list_quests,
+    "get_quest_data": LoadTest.get_quest_data,
+    "update_quest": LoadTest.update_quest,
+    "generate_quest": LoadTest.generate_quest,
+}
+
+
+async def run(args) -> Dict:
+    mix = parse_mix(args.mix)
+    quest_names = [f"loadtest_{i}" for i in range(args.quests)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        backend = None
+        if args.url:
+            client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        else:
+            backend = load_backend(tmp_dir, args.llm_latency, args.stub_layout)
+            client = httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=backend.app),
+                base_url="http://loadtest",
+                timeout=args.timeout,
+            )
+
+        async with client:
+            test = LoadTest(client, mix, quest_names, args.scenes)
+            # Заполняем хранилище квестами для чтения и обновления
+            for name in quest_names:
+                await client.put("/update_quest", json={
+                    "quest_name": name, "quest_data": test.quest, "node_positions": test.positions,
+                })
+
+            rng = random.Random(args.seed)
+            remaining = [args.requests if args.requests else float("inf")]
+            start = time.perf_counter()
+            deadline = start + args.duration
+            await asyncio.gather(*(
+                test.worker(deadline, remaining, random.Random(rng.random()))
+                for _ in range(args.concurrency)
+            ))
+            elapsed = time.perf_counter() - start
+
+        if backend is not None:
+            backend.storage.close()
+            backend.search_index.close()
+
+    endpoints = {}
+    for name, latencies in test.latencies.items():
+        errors = sum(test.errors[name].values())
+        endpoints[name] = {
+            "requests": len(latencies),
+            "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "error_rate": errors / len(latencies) if latencies else 0.0,
+            "errors": test.errors[name],
+        }
+
+    total = sum(item["requests"] for item in endpoints.values())
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "mix": mix, "concurrency": args.concurrency, "duration": args.duration,
+            "requests": args.requests, "quests": args.quests, "scenes": args.scenes,
+            "llm_latency": args.llm_latency, "target": args.url or "asgi",
+        },
+        "elapsed_s": elapsed,
+        "total_requests": total,
+        "throughput_rps": total / elapsed if elapsed else 0.0,
+        "endpoints": endpoints,
+    }
+
+
+def print_report(results: Dict, baseline: Optional[Dict] = None) -> None:
+    """Печатает таблицу результатов и (если задано) сравнение с прошлым запуском."""
+    print(f"\nЗапросов: {results['total_requests']} за {results['elapsed_s']:.1f} с "
+          f"({results['throughput_rps']:.1f} rps)")
+    header = f"{'запрос':<16} {'кол-во':>7} {'rps':>8} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'ошибки':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, item in results["endpoints"].items():
+        print(f"{name:<16} {item['requests']:>7} {item['throughput_rps']:>8.1f} {item['p50_ms']:>9.1f} "
+              f"{item['p95_ms']:>9.1f} {item['p99_ms']:>9.1f} {item['error_rate']:>7.1%}")
+        if baseline and name in baseline["endpoints"]:
+            before = baseline["endpoints"][name]
+            print(f"{'  изменение':<16} {'':>7} {item['throughput_rps'] - before['throughput_rps']:>+8.1f} "
+                  f"{item['p50_ms'] - before['p50_ms']:>+9.1f} {item['p95_ms'] - before['p95_ms']:>+9.1f} "
+                  f"{item['p99_ms'] - before['p99_ms']:>+9.1f} "
+                  f"{item['error_rate'] - before['error_rate']:>+7.1%}")
+
+
+def main():
+    """Главная функция программы."""
+    parser = argparse.ArgumentParser(description='Нагрузочное тестирование backend')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Веса запросов (по умолчанию: {DEFAULT_MIX})')
+    parser.add_argument('--concurrency', type=int, default=20, help='Одновременных клиентов')
+    parser.add_argument('--duration', type=float, default=10, help='Длительность теста, с')
+    parser.add_argument('--requests', type=int, default=0, help='Ограничить общее число запросов')
+    parser.add_argument('--quests', type=int, default=50, help='Квестов в хранилище')
+    parser.add_argument('--scenes', type=int, default=10, help='Сцен в каждом квесте')
+    parser.add_argument('--llm-latency', type=float, default=2.0, help='Задержка заглушки LLM, с')
+    parser.add_argument('--stub-layout', action='store_true', help='Не запускать graphviz для раскладки')
+    parser.add_argument('--url', help='Адрес запущенного backend вместо ASGI в этом процессе')
+    parser.add_argument('--timeout', type=float, default=600, help='Таймаут запроса, с')
+    parser.add_argument('--seed', type=int, default=0, help='Зерно генератора смеси запросов')
+    parser.add_argument('-o', '--output', help='Файл для сохранения результатов (JSON)')
+    parser.add_argument('--compare', help='Результаты прошлого запуска для сравнения')
+    args = parser.parse_args()
+
+    if args.url and "generate_quest" in parse_mix(args.mix):
+        print("Внимание: при --url генерация обращается к настоящему LLM backend")
+
+    results = asyncio.run(run(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"loadtest-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Контрольные точки генерации: попытки, ответы модели и готовые сцены для возобновления после сбоя
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from metrics import Counter
+
+SUFFIX = ".ndjson"
+# Контрольные точки старше этого срока удаляются (секунды)
+DEFAULT_TTL = 7 * 24 * 3600
+
+CHECKPOINT_REUSED = Counter(
+    "quest_checkpoint_reused",
+    "Результаты прошлых запусков генерации, взятые из контрольной точки вместо запроса к LLM",
+    ["kind"],
+)
+
+
+def run_id(quest_name: str, user_prompt: str, scene_count: Optional[int] = None) -> str:
+    """
+    Идентификатор запуска генерации. Одинаковый для повторов того же запроса,
+    поэтому повтор после сбоя или перезапуска продолжает прежний запуск.
+    """
+    digest = hashlib.sha256()
+    for part in (quest_name, user_prompt, str(scene_count)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:24]
+
+
+class Run:
+    """
+    Контрольная точка одного запуска генерации.
+
+    Журнал в режиме дозаписи ({run_id}.ndjson), по записи JSON на строку:
+    run (параметры запуска), attempt (ответ модели, разобранный результат и
+    итог валидации), skeleton (скелет, прошедший валидацию) и scene (текст
+    сцены, прошедший проверку). Каждая запись сбрасывается на диск сразу,
+    поэтому после аварийного завершения теряется не больше одной записи;
+    недописанная последняя строка при чтении пропускается. Запись
+    потокобезопасна: тексты сцен пишутся из рабочих потоков.
+    """
+
+    def __init__(self, path: Path, run_id: str):
+        self.path = path
+        self.run_id = run_id
+        self.attempts: List[Dict] = []
+        self.skeleton: Optional[List[Dict]] = None
+        self.scenes: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        if path.exists():
+            self._load()
+
+    def _load(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                kind = record.get("type")
+                if kind == "attempt":
+                    self.attempts.append(record)
+                elif kind == "skeleton":
+                    self.skeleton = record["scenes"]
+                elif kind == "scene":
+                    self.scenes[record["scene"]["scene_id"]] = record["scene"]
+
+    def _append(self, record: Dict) -> None:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    @property
+    def resumed(self) -> bool:
+        """Есть ли результаты прошлых запусков."""
+        return bool(self.attempts or self.skeleton or self.scenes)
+
+    def start(self, **params) -> None:
+        """Записывает параметры запуска (название квеста, размер) для просмотра через CLI."""
+        self._append(dict(type="run", run_id=self.run_id, started_at=time.time(), **params))
+
+    def record_attempt(self, phase: str, response: Optional[str], parsed: Optional[Dict],
+                       valid: bool, message: str) -> None:
+        """
+        Записывает попытку генерации.
+
+        Args:
+            phase: quest (квест целиком) или skeleton (скелет двухфазной генерации)
+            response: Текст ответа модели (None, если ответа нет)
+            parsed: Разобранный ответ
+            valid: Прошёл ли он валидацию
+            message: Сообщение валидатора
+        """
+        record = {"type": "attempt", "phase": phase, "attempt": len(self.attempts) + 1,
+                  "response": response, "parsed": parsed, "valid": valid, "message": message,
+                  "created_at": time.time()}
+        self._append(record)
+        self.attempts.append(record)
+
+    def valid_quest(self) -> Optional[Dict]:
+        """Квест, прошедший валидацию в прошлом запуске, но не сохранённый (например, из-за сбоя)."""
+        for record in reversed(self.attempts):
+            if record["phase"] == "quest" and record["valid"]:
+                return record["parsed"]
+        return None
+
+    def save_skeleton(self, scenes: List[Dict]) -> None:
+        """Сохраняет скелет, прошедший валидацию."""
+        self._append({"type": "skeleton", "scenes": scenes})
+        self.skeleton = scenes
+
+    def save_scene(self, scene: Dict) -> None:
+        """Сохраняет готовую сцену двухфазной генерации."""
+        self._append({"type": "scene", "scene": scene})
+        with self._lock:
+            self.scenes[scene["scene_id"]] = scene
+
+    def finish(self) -> None:
+        """Удаляет контрольную точку: квест сохранён, возобновлять нечего."""
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class CheckpointStore:
+    """Папка контрольных точек генерации: файл на запуск, устаревшие удаляются."""
+
+    def __init__(self, directory, ttl: float = DEFAULT_TTL):
+        self.directory = Path(directory)
+        self.ttl = ttl
+
+    def open(self, quest_name: str, user_prompt: str, scene_count: Optional[int] = None) -> Run:
+        """
+        Открывает контрольную точку запуска: прежнюю, если запуск с теми же
+        параметрами не завершился, иначе новую.
+        """
+        self.purge()
+        key = run_id(quest_name, user_prompt, scene_count)
+        run = Run(self.directory / f"{key}{SUFFIX}", key)
+        if run.resumed:
+            print(f"Возобновляем генерацию {quest_name} из контрольной точки {key}: "
+                  f"попыток {len(run.attempts)}, скелет {'есть' if run.skeleton else 'нет'}, "
+                  f"готовых сцен {len(run.scenes)}")
+        run.start(quest_name=quest_name, scene_count=scene_count)
+        return run
+
+    def runs(self) -> List[Dict]:
+        """Незавершённые запуски: параметры, число попыток и готовых сцен."""
+        result = []
+        for path in sorted(self.directory.glob(f"*{SUFFIX}"), key=lambda p: p.stat().st_mtime):
+            run = Run(path, path.stem)
+            params = {}
+            with open(path, "r", encoding="utf-8") as f:
+                first = f.readline()
+            try:
+                params = json.loads(first)
+            except json.JSONDecodeError:
+                pass
+            result.append({
+                "run_id": run.run_id,
+                "quest_name": params.get("quest_name"),
+                "scene_count": params.get("scene_count"),
+                "attempts": len(run.attempts),
+                "valid_quest": run.valid_quest() is not None,
+                "skeleton_scenes": len(run.skeleton) if run.skeleton else 0,
+                "scenes": len(run.scenes),
+                "updated_at": path.stat().st_mtime,
+            })
+        return result
+
+    def purge(self, ttl: Optional[float] = None) -> int:
+        """Удаляет контрольные точки, которые не обновлялись дольше ttl секунд; возвращает их число."""
+        ttl = self.ttl if ttl is None else ttl
+        if not self.directory.is_dir():
+            return 0
+        removed = 0
+        cutoff = time.time() - ttl
+        for path in self.directory.glob(f"*{SUFFIX}"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+def get_checkpoint_store(project_root=None) -> Optional[CheckpointStore]:
+    """
+    Открывает папку контрольных точек генерации.
+
+    QUEST_CHECKPOINTS: 0 - контрольные точки отключены (по умолчанию включены).
+    QUEST_CHECKPOINT_DIR: папка (по умолчанию checkpoints в корне проекта).
+    QUEST_CHECKPOINT_TTL: через сколько секунд без обновлений контрольная точка
+    удаляется (по умолчанию 7 дней).
+    """
+    if os.getenv("QUEST_CHECKPOINTS", "1") == "0":
+        return None
+    root = Path(project_root) if project_root else Path(__file__).parent
+    return CheckpointStore(
+        os.getenv("QUEST_CHECKPOINT_DIR", str(root / "checkpoints")),
+        ttl=float(os.getenv("QUEST_CHECKPOINT_TTL", str(DEFAULT_TTL))),
+    )
+
+
+def main():
+    """Главная функция программы."""
+    script_dir = Path(__file__).parent
+    parser = argparse.ArgumentParser(description='Незавершённые запуски генерации квестов')
+    parser.add_argument('--dir', default=os.getenv("QUEST_CHECKPOINT_DIR", str(script_dir / "checkpoints")),
+                        help='Папка контрольных точек')
+    parser.add_argument('--purge', type=float, metavar='SECONDS',
+                        help='Удалить контрольные точки старше SECONDS секунд (0 - все)')
+    args = parser.parse_args()
+
+    store = CheckpointStore(args.dir)
+    if args.purge is not None:
+        print(f"Удалено контрольных точек: {store.purge(args.purge)}")
+        return
+
+    runs = store.runs()
+    if not runs:
+        print("Незавершённых запусков нет")
+        return
+    for run in runs:
+        age = (time.time() - run["updated_at"]) / 60
+        size = f", {run['scene_count']} сцен" if run["scene_count"] else ""
+        print(f"{run['run_id']}  {run['quest_name']}{size}: попыток {run['attempts']}, "
+              f"скелет {run['skeleton_scenes']} сцен, готовых сцен {run['scenes']}"
+              f"{', квест прошёл валидацию' if run['valid_quest'] else ''} ({age:.0f} мин назад)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Срок выполнения запроса и его отмена: передаются через контекст во все этапы генерации
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+# Шаг, с которым ожидания проверяют отмену
+POLL_SECONDS = 0.5
+
+_current: contextvars.ContextVar = contextvars.ContextVar("quest_deadline", default=None)
+
+
+class Cancelled(Exception):
+    """
+    Работа отменена: истёк срок запроса ("deadline") или клиент
+    отключился ("disconnected").
+    """
+
+    def __init__(self, reason: str):
+        self.reason = reason
+        super().__init__("Истёк срок выполнения запроса" if reason == "deadline"
+                         else "Клиент отключился, запрос отменён")
+
+
+class Deadline:
+    """
+    Срок выполнения запроса и флаг его отмены.
+
+    Срок задаётся один раз вызывающим (HTTP-запрос, CLI) и действует на
+    все вложенные этапы: тайм-ауты вызовов LLM вычисляются из оставшегося
+    времени, повторные попытки не начинаются, если времени не осталось.
+    Отменить можно из любого потока; выполняющая работа замечает отмену
+    в ближайшей проверке (check, sleep, очередной фрагмент ответа LLM).
+    """
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+        self._cancelled = threading.Event()
+        self._reason: Optional[str] = None
+
+    def cancel(self, reason: str = "disconnected") -> None:
+        """Отменяет работу (вызывается, например, при отключении клиента)."""
+        if not self._cancelled.is_set():
+            self._reason = reason
+            self._cancelled.set()
+
+    def remaining(self) -> Optional[float]:
+        """Оставшееся время в секундах или None, если срок не задан."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def reason(self) -> Optional[str]:
+        """Причина прекращения работы или None, если работу можно продолжать."""
+        if self._cancelled.is_set():
+            return self._reason
+        if self.remaining() == 0:
+            return "deadline"
+        return None
+
+    def check(self, min_remaining: float = 0.0) -> None:
+        """
+        Проверяет, что работу можно продолжать.
+
+        Args:
+            min_remaining: Сколько секунд должно остаться (например, чтобы
+                имело смысл начинать новую попытку)
+
+        Raises:
+            Cancelled: Если работа отменена или времени меньше min_remaining
+        """
+        reason = self.reason()
+        if reason is not None:
+            raise Cancelled(reason)
+        remaining = self.remaining()
+        if remaining is not None and remaining < min_remaining:
+            raise Cancelled("deadline")
+
+    def timeout(self, default: float) -> float:
+        """Тайм-аут очередного вызова: default, но не больше оставшегося времени."""
+        self.check()
+        remaining = self.remaining()
+        return default if remaining is None else min(default, remaining)
+
+    def wait(self, event: threading.Event, seconds: Optional[float] = None) -> bool:
+        """
+        Ждёт событие, прерываясь при отмене.
+
+        Args:
+            event: Событие
+            seconds: Максимальное время ожидания (None - без ограничения)
+
+        Returns:
+            bool: Произошло ли событие
+
+        Raises:
+            Cancelled: Если работа отменена во время ожидания
+        """
+        end = None if seconds is None else time.monotonic() + seconds
+        while True:
+            self.check()
+            step = POLL_SECONDS
+            remaining = self.remaining()
+            if remaining is not None:
+                step = min(step, remaining)
+            if end is not None:
+                step = min(step, end - time.monotonic())
+                if step <= 0:
+                    return event.is_set()
+            if event.wait(max(step, 0.0)):
+                return True
+
+    def sleep(self, seconds: float) -> None:
+        """Пауза, прерываемая отменой (Cancelled)."""
+        self.wait(threading.Event(), seconds)
+        self.check()
+
+
+class SharedDeadline(Deadline):
+    """
+    Срок общей работы нескольких запросов (см. SingleFlight).
+
+    Работа продолжается, пока она нужна хотя бы одному участнику: срок -
+    самый поздний из сроков участников (без срока, если хотя бы у одного
+    его нет), отмена - когда отменены все участники.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._members: List[Optional[Deadline]] = []
+        self._lock = threading.Lock()
+
+    def add(self, deadline: Optional[Deadline]) -> None:
+        """Добавляет участника (None - вызов без срока и без отмены)."""
+        with self._lock:
+            self._members.append(deadline)
+
+    def _snapshot(self) -> List[Optional[Deadline]]:
+        with self._lock:
+            return list(self._members)
+
+    def remaining(self) -> Optional[float]:
+        members = self._snapshot()
+        if not members or any(member is None or member.remaining() is None for member in members):
+            return None
+        return max(member.remaining() for member in members)
+
+    def reason(self) -> Optional[str]:
+        if self._cancelled.is_set():
+            return self._reason
+        members = self._snapshot()
+        if not members or any(member is None for member in members):
+            return None
+        reasons = [member.reason() for member in members]
+        if any(reason is None for reason in reasons):
+            return None
+        return "disconnected" if "disconnected" in reasons else "deadline"
+
+
+def current() -> Optional[Deadline]:
+    """Срок текущего запроса или None."""
+    return _current.get()
+
+
+@contextmanager
+def use(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """Устанавливает срок для кода внутри блока (и потоков, получивших его контекст)."""
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def check(min_remaining: float = 0.0) -> None:
+    """Deadline.check для текущего срока; без срока ничего не делает."""
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check(min_remaining)
+
+
+def timeout(default: float) -> float:
+    """Deadline.timeout для текущего срока; без срока возвращает default."""
+    deadline = _current.get()
+    return default if deadline is None else deadline.timeout(default)
+
+
+def sleep(seconds: float) -> None:
+    """Пауза, прерываемая отменой текущего запроса."""
+    deadline = _current.get()
+    if deadline is None:
+        time.sleep(seconds)
+    else:
+        deadline.sleep(seconds)
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Игровой движок без ввода-вывода: общий неизменяемый квест и лёгкие сессии игроков
+
+import secrets
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from metrics import Counter, Gauge
+
+ACTIVE_SESSIONS = Gauge("game_sessions_active", "Активные игровые сессии")
+EVICTED_SESSIONS = Counter(
+    "game_sessions_evicted",
+    "Сессии, удалённые из памяти",
+    ["reason"],
+)
+
+START_SCENE = "start"
+# Переход в сцену, которой нет в квесте
+MISSING_SCENE = 0xFFFFFFFF
+# Выбор, который не удалось восстановить по истории сцен
+UNKNOWN_CHOICE = 0xFFFF
+
+# Чем закончилось прохождение (для телеметрии)
+FINISHED = "finished"
+ABANDONED = "abandoned"
+RESTARTED = "restarted"
+
+
+class GameError(Exception):
+    """Ошибка игровой логики: некорректный квест, выбор или сохранение."""
+
+
+class CompiledQuest:
+    """
+    Квест в компактном неизменяемом виде, общий для всех сессий.
+
+    Сцены пронумерованы; переходы хранятся номерами сцен, поэтому
+    состояние игрока - это номер текущей сцены и массив номеров.
+    """
+
+    __slots__ = ("name", "version", "scene_ids", "index", "texts", "choices", "start", "__weakref__")
+
+    def __init__(self, quest_data: Dict, name: Optional[str] = None, version: Optional[int] = None):
+        """
+        Args:
+            quest_data: Данные квеста ({"scenes": [...]})
+            name: Название квеста
+            version: Версия квеста в хранилище
+
+        Raises:
+            GameError: Если квест нельзя загрузить
+        """
+        if not isinstance(quest_data, dict) or not isinstance(quest_data.get("scenes"), list):
+            raise GameError("В файле отсутствует поле 'scenes'!")
+
+        scenes = quest_data["scenes"]
+        index: Dict[str, int] = {}
+        for scene in scenes:
+            if not isinstance(scene, dict) or "scene_id" not in scene:
+                raise GameError("Найден сценарий без поля 'scene_id'!")
+            index.setdefault(scene["scene_id"], len(index))
+        if START_SCENE not in index:
+            raise GameError(f"Не найден стартовый сценарий с id '{START_SCENE}'!")
+
+        self.name = name
+        self.version = version
+        self.scene_ids: Tuple[str, ...] = tuple(index)
+        self.index = index
+        texts = {}
+        choices = {}
+        for scene in scenes:
+            texts[scene["scene_id"]] = scene.get("text", "Описание сценария отсутствует.")
+            choices[scene["scene_id"]] = tuple(
+                (choice.get("text", "Неизвестное действие"),
+                 index.get(choice.get("next_scene"), MISSING_SCENE))
+                for choice in scene.get("choices") or [] if isinstance(choice, dict)
+            )
+        # При повторяющихся scene_id побеждает последняя сцена, как в словаре game.py
+        self.texts: Tuple[str, ...] = tuple(texts[scene_id] for scene_id in self.scene_ids)
+        self.choices: Tuple[Tuple[Tuple[str, int], ...], ...] = tuple(
+            choices[scene_id] for scene_id in self.scene_ids
+        )
+        self.start = index[START_SCENE]
+
+    @classmethod
+    def from_tables(cls, scene_ids: Tuple[str, ...], texts: Sequence[str],
+                    choices: Sequence[Tuple[Tuple[str, int], ...]],
+                    name: Optional[str] = None, version: Optional[int] = None) -> "CompiledQuest":
+        """
+        Создаёт квест из готовых таблиц (например, из двоичного формата questbin).
+
+        Args:
+            scene_ids: Уникальные id сцен; номер сцены - позиция в кортеже
+            texts: Тексты сцен по номерам
+            choices: Выборы сцен по номерам: ((текст, номер целевой сцены), ...)
+            name: Название квеста
+            version: Версия квеста в хранилище
+
+        Raises:
+            GameError: Если нет стартовой сцены
+        """
+        index = {scene_id: number for number, scene_id in enumerate(scene_ids)}
+        if START_SCENE not in index:
+            raise GameError(f"Не найден стартовый сценарий с id '{START_SCENE}'!")
+        quest = cls.__new__(cls)
+        quest.name = name
+        quest.version = version
+        quest.scene_ids = scene_ids
+        quest.index = index
+        quest.texts = texts
+        quest.choices = choices
+        quest.start = index[START_SCENE]
+        return quest
+
+    def __len__(self) -> int:
+        return len(self.scene_ids)
+
+    def scene(self, scene_id: str) -> Optional[Dict]:
+        """
+        Возвращает сцену по id в формате квеста.
+
+        Returns:
+            Optional[Dict]: {"scene_id", "text", "choices": [{"text", "next_scene"}]} или None
+        """
+        number = self.index.get(scene_id)
+        return None if number is None else self.scene_at(number)
+
+    def scene_at(self, number: int) -> Dict:
+        return {
+            "scene_id": self.scene_ids[number],
+            "text": self.texts[number],
+            "choices": [
+                {"text": text, "next_scene": self.scene_ids[target] if target != MISSING_SCENE else None}
+                for text, target in self.choices[number]
+            ],
+        }
+
+
+class GameSession:
+    """
+    Состояние одного игрока: текущая сцена и история переходов.
+
+    Квест не копируется: сессия хранит ссылку на общий CompiledQuest,
+    массив номеров посещённых сцен (4 байта на ход) и номера сделанных
+    выборов (2 байта на ход, для телеметрии).
+    """
+
+    __slots__ = ("quest", "history", "choices", "started", "last_access")
+
+    def __init__(self, quest: CompiledQuest, history: Optional[array] = None,
+                 choices: Optional[array] = None):
+        self.quest = quest
+        self.history = history if history is not None else array("I", [quest.start])
+        self.choices = choices if choices is not None else array("H")
+        self.started = time.time()
+        self.last_access = time.monotonic()
+
+    @property
+    def current(self) -> int:
+        return self.history[-1]
+
+    @property
+    def current_scene_id(self) -> str:
+        return self.quest.scene_ids[self.current]
+
+    def is_finished(self) -> bool:
+        """Игра окончена: у текущей сцены нет выборов."""
+        return not self.quest.choices[self.current]
+
+    def scene(self) -> Dict:
+        """Текущая сцена."""
+        return self.quest.scene_at(self.current)
+
+    def choose(self, choice: int) -> Dict:
+        """
+        Делает выбор в текущей сцене.
+
+        Args:
+            choice: Номер выбора (с 0)
+
+        Returns:
+            Dict: Новая текущая сцена
+
+        Raises:
+            GameError: Если игра окончена, выбора нет или он ведёт в несуществующую сцену
+        """
+        choices = self.quest.choices[self.current]
+        if not choices:
+            raise GameError("Игра окончена: в этой сцене нет выборов")
+        if not 0 <= choice < len(choices):
+            raise GameError(f"Выбор должен быть числом от 0 до {len(choices) - 1}")
+        target = choices[choice][1]
+        if target == MISSING_SCENE:
+            raise GameError("Выбор ведёт в несуществующий сценарий")
+        self.history.append(target)
+        self.choices.append(choice)
+        return self.scene()
+
+    def outcome(self) -> str:
+        """Итог прохождения, если оно прерывается сейчас: FINISHED или ABANDONED."""
+        return FINISHED if self.is_finished() else ABANDONED
+
+    def restart(self) -> None:
+        """Начинает игру заново."""
+        self.history = array("I", [self.quest.start])
+        self.choices = array("H")
+        self.started = time.time()
+
+    def history_ids(self) -> List[str]:
+        """История посещённых сцен (включая текущую)."""
+        scene_ids = self.quest.scene_ids
+        return [scene_ids[number] for number in self.history]
+
+    def stats(self) -> Dict:
+        """Статистика игры."""
+        total = len(self.quest)
+        visited = len(set(self.history))
+        return {
+            "total_scenes": total,
+            "visited_scenes": visited,
+            "completion_rate": round(visited / total * 100, 1) if total else 0.0,
+            "moves": len(self.history),
+        }
+
+    def save(self) -> Dict:
+        """
+        Сохраняет состояние сессии.
+
+        Сцены записываются по id, поэтому сохранение можно восстановить
+        и после изменения квеста, если посещённые сцены в нём остались.
+        """
+        return {
+            "quest_name": self.quest.name,
+            "quest_version": self.quest.version,
+            "history": self.history_ids(),
+        }
+
+    @classmethod
+    def restore(cls, quest: CompiledQuest, state: Dict) -> "GameSession":
+        """
+        Восстанавливает сессию из save().
+
+        Raises:
+            GameError: Если сохранение повреждено или не подходит к квесту
+        """
+        scene_ids = state.get("history") if isinstance(state, dict) else None
+        if not isinstance(scene_ids, list) or not scene_ids:
+            raise GameError("В сохранении нет истории сцен")
+        missing = [scene_id for scene_id in scene_ids
+                   if not isinstance(scene_id, str) or scene_id not in quest.index]
+        if missing:
+            raise GameError(f"Сцены из сохранения отсутствуют в квесте: {', '.join(map(str, missing[:5]))}")
+        history = array("I", (quest.index[scene_id] for scene_id in scene_ids))
+        # Номера выборов в сохранении не хранятся: первый выбор, ведущий в следующую сцену
+        choices = array("H")
+        for current, target in zip(history, history[1:]):
+            targets = [choice_target for _, choice_target in quest.choices[current]]
+            choices.append(targets.index(target) if target in targets else UNKNOWN_CHOICE)
+        return cls(quest, history, choices)
+
+
+class SessionManager:
+    """
+    Игровые сессии одного процесса.
+
+    Квесты загружаются из хранилища один раз на версию и разделяются
+    всеми сессиями; сессии, начатые до изменения квеста, доигрывают
+    свою версию. Неактивные дольше ttl сессии и (при превышении
+    max_sessions) самые давно использованные удаляются.
+
+    Каждое прохождение передаётся в телеметрию один раз, когда оно
+    заканчивается: при перезапуске, удалении или вытеснении сессии и
+    при остановке процесса (close).
+    """
+
+    def __init__(self, storage, max_sessions: int = 100_000, ttl: float = 3600, telemetry=None):
+        """
+        Args:
+            storage: Хранилище квестов (QuestStorage)
+            max_sessions: Максимум сессий в памяти
+            ttl: Время жизни неактивной сессии, с
+            telemetry: Запись прохождений (TelemetryRecorder из telemetry.py) или None
+        """
+        self.storage = storage
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.telemetry = telemetry
+        self._sessions: "OrderedDict[str, GameSession]" = OrderedDict()
+        self._quests: Dict[str, CompiledQuest] = {}
+        self._lock = threading.Lock()
+
+    def load_quest(self, quest_name: str) -> Optional[CompiledQuest]:
+        """Возвращает скомпилированную последнюю версию квеста (None, если квеста нет)."""
+        version = self.storage.get_version(quest_name)
+        if version is None:
+            return None
+        quest = self._quests.get(quest_name)
+        if quest is not None and quest.version == version:
+            return quest
+        quest = self.storage.load_compiled(quest_name, version)
+        if quest is None:
+            return None
+        self._quests[quest_name] = quest
+        return quest
+
+    def _evict(self, now: float) -> None:
+        """Удаляет устаревшие сессии и самые старые сверх лимита. Вызывается под блокировкой."""
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_access > self.ttl:
+                reason = "expired"
+            elif len(self._sessions) >= self.max_sessions:
+                reason = "capacity"
+            else:
+                break
+            del self._sessions[session_id]
+            EVICTED_SESSIONS.inc(reason=reason)
+            self._record(session, session.outcome())
+
+    def _record(self, session: GameSession, outcome: str) -> None:
+        if self.telemetry is not None:
+            self.telemetry.record(session, outcome)
+
+    def _add(self, session: GameSession) -> str:
+        session_id = secrets.token_urlsafe(12)
+        with self._lock:
+            self._evict(time.monotonic())
+            self._sessions[session_id] = session
+            ACTIVE_SESSIONS.set(len(self._sessions))
+        return session_id
+
+    def create(self, quest_name: str) -> Tuple[str, GameSession]:
+        """
+        Начинает новую игру.
+
+        Raises:
+            KeyError: Если квеста нет
+            GameError: Если квест нельзя загрузить
+        """
+        quest = self.load_quest(quest_name)
+        if quest is None:
+            raise KeyError(quest_name)
+        session = GameSession(quest)
+        return self._add(session), session
+
+    def restore(self, state: Dict) -> Tuple[str, GameSession]:
+        """
+        Восстанавливает игру из сохранения в новую сессию.
+
+        Raises:
+            KeyError: Если квеста из сохранения нет
+            GameError: Если сохранение не подходит к квесту
+        """
+        quest_name = state.get("quest_name") if isinstance(state, dict) else None
+        quest = self.load_quest(quest_name) if isinstance(quest_name, str) else None
+        if quest is None:
+            raise KeyError(quest_name)
+        session = GameSession.restore(quest, state)
+        return self._add(session), session
+
+    def get(self, session_id: str) -> Optional[GameSession]:
+        """Возвращает сессию и отмечает её использование (None, если сессии нет или она истекла)."""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if now - session.last_access > self.ttl:
+                del self._sessions[session_id]
+                EVICTED_SESSIONS.inc(reason="expired")
+                ACTIVE_SESSIONS.set(len(self._sessions))
+                self._record(session, session.outcome())
+                return None
+            session.last_access = now
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def restart(self, session_id: str) -> Optional[GameSession]:
+        """Начинает игру в сессии заново (None, если сессии нет или она истекла)."""
+        session = self.get(session_id)
+        if session is not None:
+            self._record(session, FINISHED if session.is_finished() else RESTARTED)
+            session.restart()
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        """Завершает сессию."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            ACTIVE_SESSIONS.set(len(self._sessions))
+        if session is None:
+            return False
+        self._record(session, session.outcome())
+        return True
+
+    def close(self) -> None:
+        """Передаёт в телеметрию все незавершённые прохождения (при остановке процесса)."""
+        with self._lock:
+            remaining = list(self._sessions.values())
+            self._sessions.clear()
+            ACTIVE_SESSIONS.set(0)
+        if self.telemetry is not None:
+            for session in remaining:
+                self.telemetry.record(session, session.outcome())
+            self.telemetry.flush()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
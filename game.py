@@ -6,15 +6,19 @@
 import json
 import sys
 import os
-from typing import Dict, List, Optional
+from typing import Optional
 import time
 
+from engine import CompiledQuest, GameError, GameSession
+from questbin import QuestFormatError, load_compiled_quest
+from telemetry import get_telemetry
+from terminal import CLEAR, TerminalRenderer, cbreak_mode, cooked_mode, read_key
+
 # Для работы с клавишами в Unix/Linux/Mac
 INTERACTIVE_MODE = False
 try:
     import termios
     import tty
-    import select
     # Проверяем, что функции доступны
     if hasattr(tty, 'setcbreak') and hasattr(termios, 'tcgetattr'):
         INTERACTIVE_MODE = True
@@ -23,32 +27,41 @@ except ImportError:
 
 
 def clear_screen():
-    """Очищает экран."""
-    os.system('cls' if os.name == 'nt' else 'clear')
+    """Очищает экран (ANSI-последовательностью, без запуска внешней команды)."""
+    if os.name == 'nt':
+        os.system('cls')
+    else:
+        sys.stdout.write(CLEAR)
+        sys.stdout.flush()
 
 
 def get_char():
-    """Получает одиночный символ без нажатия Enter (только для Unix/Linux/Mac)."""
+    """
+    Получает одну клавишу без нажатия Enter (только для Unix/Linux/Mac).
+
+    Returns:
+        "up", "down", "page_up", "page_down", "enter" или введённый символ
+    """
     if not INTERACTIVE_MODE:
         return input()
     
     try:
-        fd = sys.stdin.fileno()
-        old_settings = termios.tcgetattr(fd)
-        try:
-            tty.setcbreak(fd)
-            ch = sys.stdin.read(1)
-        finally:
-            termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-        return ch
+        with cbreak_mode():
+            return read_key()
     except (AttributeError, OSError, termios.error):
         # Если что-то пошло не так, используем обычный ввод
         print("(Переключение в обычный режим)")
-        return input()
+        with cooked_mode():
+            return input()
 
 
 class TextAdventureGame:
-    """Консольная текстовая игра на основе JSON файла со сценариями."""
+    """
+    Консольная текстовая игра на основе JSON файла со сценариями.
+
+    Игровая логика (переходы, история, статистика) выполняется движком
+    engine.GameSession; этот класс отвечает только за ввод и вывод.
+    """
     
     def __init__(self, filename: str):
         """
@@ -58,10 +71,13 @@ class TextAdventureGame:
             filename: Путь к JSON файлу с игровыми сценариями
         """
         self.filename = filename
-        self.scenes: Dict = {}
-        self.current_scene: str = "start"
-        self.game_history: List[str] = []
+        self.quest: Optional[CompiledQuest] = None
+        self.session: Optional[GameSession] = None
         self.selected_choice = 0  # Для интерактивного выбора
+        self.renderer = TerminalRenderer()
+        # Журнал прохождений (QUEST_TELEMETRY=0 отключает)
+        self.telemetry = get_telemetry()
+        self.recorded = False
         
     def load_game_data(self) -> bool:
         """
@@ -75,31 +91,25 @@ class TextAdventureGame:
                 print(f"Ошибка: Файл '{self.filename}' не найден!")
                 return False
                 
-            with open(self.filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-            if 'scenes' not in data:
-                print("Ошибка: В файле отсутствует поле 'scenes'!")
-                return False
-                
-            # Создаём словарь сценариев для быстрого доступа
-            for scene in data['scenes']:
-                if 'scene_id' not in scene:
-                    print("Ошибка: Найден сценарий без поля 'scene_id'!")
-                    return False
-                self.scenes[scene['scene_id']] = scene
-                
-            if 'start' not in self.scenes:
-                print("Ошибка: Не найден стартовый сценарий с id 'start'!")
-                return False
+            # Скомпилированная копия квеста (.qbin) загружается без разбора JSON
+            # Название - как у квеста в хранилище, чтобы телеметрия сопоставлялась с ним
+            quest_name = os.path.splitext(os.path.basename(self.filename))[0].lstrip('.')
+            self.quest = load_compiled_quest(self.filename, name=quest_name)
+            self.session = GameSession(self.quest)
                 
             print(f"Игровые данные загружены из '{self.filename}'")
-            print(f"Загружено сценариев: {len(self.scenes)}")
+            print(f"Загружено сценариев: {len(self.quest)}")
             return True
             
+        except GameError as e:
+            print(f"Ошибка: {e}")
+            return False
         except json.JSONDecodeError as e:
             print(f"Ошибка парсинга JSON: {e}")
             return False
+        except QuestFormatError as e:
+            print(f"Ошибка: {e}")
+            return False
         except Exception as e:
             print(f"Неожиданная ошибка при загрузке: {e}")
             return False
@@ -115,13 +125,23 @@ class TextAdventureGame:
         Returns:
             True если сценарий найден, False иначе
         """
-        if scene_id not in self.scenes:
+        scene = self.quest.scene(scene_id)
+        if scene is None:
             print(f"Ошибка: Сценарий '{scene_id}' не найден!")
             return False
             
-        scene = self.scenes[scene_id]
+        choices = scene.get('choices', [])
+        
+        # В интерактивном режиме сцена рисуется целиком один раз, а навигация
+        # по выборам перерисовывает только изменившиеся строки
+        if interactive and INTERACTIVE_MODE and choices:
+            self.renderer.render_scene(
+                scene.get('text', 'Описание сценария отсутствует.'),
+                [choice.get('text', 'Неизвестное действие') for choice in choices],
+                self.selected_choice
+            )
+            return True
         
-        # Очищаем экран для интерактивного режима
         if interactive and INTERACTIVE_MODE:
             clear_screen()
         else:
@@ -132,23 +152,14 @@ class TextAdventureGame:
         print("-" * 80)
         
         # Отображаем доступные выборы
-        choices = scene.get('choices', [])
-        
         if not choices:
             print("КОНЕЦ ИГРЫ!")
             print("\nСпасибо за игру! Хотите начать заново? (y/n)")
             return False
             
-        if interactive and INTERACTIVE_MODE:
-            print("\nДоступные действия (используйте ↑↓ для выбора, Enter для подтверждения):")
-        else:
-            print("\nДоступные действия:")
-            
+        print("\nДоступные действия:")
         for i, choice in enumerate(choices):
-            if interactive and INTERACTIVE_MODE and i == self.selected_choice:
-                print(f"→ {i+1}. {choice.get('text', 'Неизвестное действие')}")
-            else:
-                print(f"  {i+1}. {choice.get('text', 'Неизвестное действие')}")
+            print(f"  {i+1}. {choice.get('text', 'Неизвестное действие')}")
             
         return True
     
@@ -156,6 +167,9 @@ class TextAdventureGame:
         """
         Получает выбор пользователя в интерактивном режиме.
         
+        Сцена должна быть уже нарисована display_scene: нажатия клавиш
+        перерисовывают только строки выбора и окно текста.
+        
         Args:
             max_choices: Максимальное количество доступных выборов
             
@@ -163,39 +177,31 @@ class TextAdventureGame:
             Номер выбора (1-indexed) или None при выходе
         """
         global INTERACTIVE_MODE
-        self.selected_choice = 0
         
         while True:
             try:
-                # Перерисовываем экран с текущим выбором
-                self.display_scene(self.current_scene, interactive=True)
+                key = get_char()
                 
-                if INTERACTIVE_MODE:
-                    print(f"\nТекущий выбор: {self.selected_choice + 1}")
-                    print("Управление: ↑/↓ - навигация, Enter - выбор, q - выход, h - история")
-                    
-                    char = get_char()
-                    
-                    if char == '\x1b':  # ESC последовательность
-                        char = get_char()
-                        if char == '[':
-                            char = get_char()
-                            if char == 'A':  # Стрелка вверх
-                                self.selected_choice = (self.selected_choice - 1) % max_choices
-                            elif char == 'B':  # Стрелка вниз
-                                self.selected_choice = (self.selected_choice + 1) % max_choices
-                    elif char == '\r' or char == '\n':  # Enter
-                        return self.selected_choice + 1
-                    elif char.lower() == 'q':
-                        return None
-                    elif char.lower() == 'h':
-                        clear_screen()
-                        self.show_history()
-                        print("\nНажмите любую клавишу для продолжения...")
-                        get_char()
-                else:
-                    # Fallback для систем без интерактивного режима
-                    return self.get_user_choice_simple(max_choices)
+                if key == 'up':
+                    self.selected_choice = (self.selected_choice - 1) % max_choices
+                    self.renderer.select(self.selected_choice)
+                elif key == 'down':
+                    self.selected_choice = (self.selected_choice + 1) % max_choices
+                    self.renderer.select(self.selected_choice)
+                elif key == 'page_up':
+                    self.renderer.page(-1)
+                elif key == 'page_down':
+                    self.renderer.page(1)
+                elif key == 'enter':
+                    return self.selected_choice + 1
+                elif key.lower() == 'q':
+                    return None
+                elif key.lower() == 'h':
+                    clear_screen()
+                    self.show_history()
+                    print("\nНажмите любую клавишу для продолжения...")
+                    get_char()
+                    self.display_scene(self.session.current_scene_id, interactive=True)
                         
             except (KeyboardInterrupt, EOFError):
                 return None
@@ -234,7 +240,10 @@ class TextAdventureGame:
         while True:
             try:
                 print(f"\n> ", end="")
-                user_input = input().strip().lower()
+                # Во время игры терминал в посимвольном режиме: для input()
+                # временно возвращаем построчный ввод с эхом
+                with cooked_mode():
+                    user_input = input().strip().lower()
                 
                 if user_input in ['quit', 'exit', 'q']:
                     return None
@@ -258,30 +267,50 @@ class TextAdventureGame:
     
     def show_history(self):
         """Показывает историю посещённых сценариев."""
-        if not self.game_history:
+        history = self.session.history_ids() if self.session else []
+        if not history:
             print("История пуста - вы только начали игру!")
             return
             
         print("\nИстория вашего путешествия:")
-        for i, scene_id in enumerate(self.game_history, 1):
-            scene_name = self.scenes.get(scene_id, {}).get('scene_id', scene_id)
-            print(f"  {i}. {scene_name}")
+        for i, scene_id in enumerate(history, 1):
+            print(f"  {i}. {scene_id}")
         print()
     
+    def record_playthrough(self):
+        """Записывает текущее прохождение в телеметрию (один раз за прохождение)."""
+        if self.telemetry is not None and self.session is not None and not self.recorded:
+            self.telemetry.record(self.session, self.session.outcome())
+            self.telemetry.flush()
+            self.recorded = True
+
     def show_game_stats(self):
         """Показывает статистику игры."""
-        total_scenes = len(self.scenes)
-        visited_scenes = len(set(self.game_history))
-        completion_rate = (visited_scenes / total_scenes * 100) if total_scenes > 0 else 0
+        if self.session is None:
+            return
+        stats = self.session.stats()
         
         print(f"\nСтатистика игры:")
-        print(f"   • Всего сценариев в игре: {total_scenes}")
-        print(f"   • Посещено уникальных сценариев: {visited_scenes}")
-        print(f"   • Процент исследования: {completion_rate:.1f}%")
-        print(f"   • Общее количество ходов: {len(self.game_history)}")
+        print(f"   • Всего сценариев в игре: {stats['total_scenes']}")
+        print(f"   • Посещено уникальных сценариев: {stats['visited_scenes']}")
+        print(f"   • Процент исследования: {stats['completion_rate']:.1f}%")
+        print(f"   • Общее количество ходов: {stats['moves']}")
     
     def play(self):
         """Основной игровой цикл."""
+        global INTERACTIVE_MODE
+        if not sys.stdin.isatty():
+            # Ввод из файла или канала: клавиши стрелок недоступны
+            INTERACTIVE_MODE = False
+        if not INTERACTIVE_MODE:
+            self._play()
+            return
+        # Посимвольный ввод и скрытый курсор на всё время игры: нажатия
+        # не отображаются эхом между перерисовками
+        with cbreak_mode(), self.renderer.session():
+            self._play()
+    
+    def _play(self):
         mode_text = "интерактивном" if INTERACTIVE_MODE else "обычном"
         print(f"Добро пожаловать в текстовую приключенческую игру! (режим: {mode_text})")
         
@@ -295,11 +324,8 @@ class TextAdventureGame:
             return
             
         while True:
-            # Добавляем текущий сценарий в историю
-            self.game_history.append(self.current_scene)
-            
             # Отображаем текущий сценарий
-            if not self.display_scene(self.current_scene, interactive=INTERACTIVE_MODE):
+            if not self.display_scene(self.session.current_scene_id, interactive=INTERACTIVE_MODE):
                 # Игра закончена
                 if INTERACTIVE_MODE:
                     clear_screen()
@@ -309,19 +335,21 @@ class TextAdventureGame:
                 if INTERACTIVE_MODE:
                     while True:
                         char = get_char()
-                        if char == '\r' or char == '\n':
+                        if char == 'enter':
                             restart = True
                             break
                         elif char.lower() == 'q':
                             restart = False
                             break
                 else:
-                    restart_input = input().strip().lower()
+                    with cooked_mode():
+                        restart_input = input().strip().lower()
                     restart = restart_input in ['', 'y', 'yes', 'да']
                 
+                self.record_playthrough()
                 if restart:
-                    self.current_scene = "start"
-                    self.game_history = []
+                    self.session.restart()
+                    self.recorded = False
                     self.selected_choice = 0
                     if INTERACTIVE_MODE:
                         clear_screen()
@@ -332,24 +360,25 @@ class TextAdventureGame:
                     break
             
             # Получаем выбор пользователя
-            scene = self.scenes[self.current_scene]
-            choices = scene.get('choices', [])
+            choices = self.session.scene()['choices']
             
             choice_index = self.get_user_choice(len(choices))
             
             if choice_index is None:
                 # Пользователь хочет выйти
+                self.record_playthrough()
                 break
                 
             # Переходим к следующему сценарию
-            selected_choice = choices[choice_index - 1]
-            next_scene = selected_choice.get('next_scene')
-            
-            if next_scene:
-                self.current_scene = next_scene
+            try:
+                self.session.choose(choice_index - 1)
                 self.selected_choice = 0  # Сбрасываем выбор для нового сценария
-            else:
-                print("Ошибка: Не указан следующий сценарий!")
+            except GameError:
+                next_scene = choices[choice_index - 1].get('next_scene')
+                if next_scene:
+                    print(f"Ошибка: Сценарий '{next_scene}' не найден!")
+                else:
+                    print("Ошибка: Не указан следующий сценарий!")
                 break
         
         if INTERACTIVE_MODE:
@@ -371,6 +400,7 @@ def main():
     try:
         game.play()
     except KeyboardInterrupt:
+        game.record_playthrough()
         print("\n\nИгра прервана пользователем. До свидания!")
     except Exception as e:
         print(f"\nПроизошла неожиданная ошибка: {e}")
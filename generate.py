@@ -1,39 +1,385 @@
-from langchain_community.chat_models.gigachat import GigaChat
-from httpx import ReadTimeout
-
+import contextvars
 import json
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+import deadline
+import tracing
+from metrics import STAGE_SECONDS, LLM_TOKENS
+
+# Тайм-аут запроса к GigaChat; при заданном сроке запроса - не больше оставшегося времени
+LLM_TIMEOUT = 360
+# Тайм-аут запроса текста одной сцены: ответ короткий, зависший запрос лучше повторить
+SCENE_TIMEOUT = 120
+# Сколько раз пробовать написать текст одной сцены
+SCENE_ATTEMPTS = 3
+
+
+class PartialSceneParser:
+    """Извлекает полностью полученные сцены из ответа, который ещё дописывается."""
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = None
+        self.scenes = []
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, chunk):
+        """
+        Добавляет фрагмент ответа и возвращает сцены, завершённые в нём.
+
+        Args:
+            chunk: Новый фрагмент текста ответа
+
+        Returns:
+            List[Dict]: Новые полностью разобранные сцены
+        """
+        self.buffer += chunk
+        if self.position is None:
+            start = self.buffer.find('{"scenes": [')
+            if start < 0:
+                return []
+            self.position = start + len('{"scenes": [')
+
+        new_scenes = []
+        while True:
+            # Пропускаем разделители между сценами
+            while self.position < len(self.buffer) and self.buffer[self.position] in ' \t\r\n,':
+                self.position += 1
+            if self.position >= len(self.buffer) or self.buffer[self.position] != '{':
+                break
+            try:
+                scene, end = self._decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                # Сцена ещё не дописана
+                break
+            self.position = end
+            if isinstance(scene, dict):
+                self.scenes.append(scene)
+                new_scenes.append(scene)
+        return new_scenes
+
+
+def record_token_usage(message):
+    """Учитывает токены из ответа модели, если провайдер их сообщил."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    if usage.get("input_tokens"):
+        LLM_TOKENS.inc(usage["input_tokens"], kind="prompt")
+    if usage.get("output_tokens"):
+        LLM_TOKENS.inc(usage["output_tokens"], kind="completion")
+
+
+class SceneTextError(Exception):
+    """Текст сцены не удалось получить за SCENE_ATTEMPTS попыток."""
+
+    def __init__(self, scene_id, reason):
+        self.scene_id = scene_id
+        self.reason = reason
+        super().__init__(f"Сцена '{scene_id}': {reason}")
+
+
+def make_client(credentials, timeout=LLM_TIMEOUT):
+    """Создаёт клиент GigaChat (langchain загружается при первом вызове)."""
+    from langchain_community.chat_models.gigachat import GigaChat
+
+    return GigaChat(
+        credentials=credentials,
+        verify_ssl_certs=False,
+        timeout=timeout,
+        model="GigaChat-2-Max"
+    )
+
+
+def extract_json_object(text):
+    """Возвращает JSON-объект из ответа модели (от первой '{' до последней '}') или None."""
+    start = text.find('{')
+    end = text.rfind('}')
+    if start < 0 or end < start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def preload():
+    """
+    Импортирует клиент GigaChat заранее (например, в фоне после старта backend),
+    чтобы первая генерация не ждала загрузки langchain.
+    """
+    from langchain_community.chat_models.gigachat import GigaChat  # noqa: F401
+
 
 # функция для генерации квеста
-def generate_rpg_quest(user_prompt, system_prompt, credentials):
+@tracing.span("generate_rpg_quest")
+def generate_rpg_quest(user_prompt, system_prompt, credentials, on_event=None, on_response=None):
+    """
+    Генерирует квест через GigaChat.
+
+    Если передан on_event(event_type, data), ответ модели читается потоково
+    и по мере получения отправляются события "tokens" и "scene_parsed".
+    on_response(text) получает полный текст ответа модели (для контрольной
+    точки, см. checkpoint.py).
+
+    Тайм-аут запроса не превышает остаток срока текущего запроса (deadline.py);
+    при отмене потоковое чтение ответа прекращается на очередном фрагменте.
+
+    Raises:
+        deadline.Cancelled: Если срок истёк или запрос отменён
+    """
+    # Тяжёлые зависимости загружаются при первой генерации, а не при импорте модуля
+    from httpx import ReadTimeout
+
     try:
-        giga = GigaChat(
-            credentials=credentials,
-            verify_ssl_certs=False,
-            timeout=360,
-            model="GigaChat-2-Max"
-        )
+        giga = make_client(credentials, deadline.timeout(LLM_TIMEOUT))
 
         full_prompt = f"""{system_prompt}\n\nВходные данные:\n{user_prompt}\n\nВывод только в JSON!Требования к выводу:
         1. ТОЛЬКО JSON без каких-либо других текстов
         2. Обязательное наличие поля "scenes"
         3. Строго соответствовать шаблону
         """
-        response = giga.invoke(full_prompt)
-
-        response_text = response.content 
+        with STAGE_SECONDS.time(stage="llm_call"):
+            if on_event is None:
+                response = giga.invoke(full_prompt)
+                record_token_usage(response)
+                response_text = response.content
+            else:
+                parser = PartialSceneParser()
+                chunks = 0
+                for chunk in giga.stream(full_prompt):
+                    # Отменённый запрос закрывает поток ответа и не тратит токены дальше
+                    deadline.check()
+                    chunks += 1
+                    record_token_usage(chunk)
+                    for scene in parser.feed(chunk.content):
+                        on_event("scene_parsed", {"scene": scene, "scenes_parsed": len(parser.scenes)})
+                    on_event("tokens", {"chunks": chunks, "chars": len(parser.buffer)})
+                response_text = parser.buffer
+            tracing.annotate(prompt_chars=len(full_prompt), response_chars=len(response_text))
+        if on_response is not None:
+            on_response(response_text)
 
         # Извлекаем чистый JSON
-        start = response_text.find('{"scenes": [')
-        if start < 0:
-            return {}
-        end = response_text.rfind(']}') + 2
-        json_str = response_text[start:end]
-
-        return json.loads(json_str)
-        
+        with STAGE_SECONDS.time(stage="json_extract"):
+            start = response_text.find('{"scenes": [')
+            if start < 0:
+                return {}
+            end = response_text.rfind(']}') + 2
+            json_str = response_text[start:end]
+
+            return json.loads(json_str)
+
+    except deadline.Cancelled:
+        raise
+    except ReadTimeout:
+        # Тайм-аут из-за истёкшего срока запроса - отмена, а не ошибка модели
+        deadline.check()
+        print("Ошибка: превышено время ожидания ответа от GigaChat.")
+        return {"error": "timeout"}
+    except Exception as e:
+        print(f"Критическая ошибка: {str(e)}")
+        return {"error": str(e)}
+
+
+@tracing.span("generate_skeleton")
+def generate_quest_skeleton(user_prompt, skeleton_prompt, credentials, scene_count, on_event=None,
+                            on_response=None):
+    """
+    Первая фаза двухфазной генерации: граф сцен без художественного текста.
+
+    Ответ в десятки раз короче полного квеста, поэтому укладывается в
+    тайм-аут даже для квестов из сотен сцен.
+
+    Args:
+        user_prompt: Пользовательский промпт
+        skeleton_prompt: Системный промпт скелета (skeleton_prompt.txt)
+        credentials: Учетные данные GigaChat
+        scene_count: Желаемое количество сцен
+        on_event: Обработчик событий прогресса (ответ читается потоково, события "tokens")
+        on_response: Получает полный текст ответа модели
+
+    Returns:
+        Dict: {"scenes": [{"scene_id", "beat", "next"}]}, {} если JSON не найден,
+        {"error": ...} при ошибке запроса
+
+    Raises:
+        deadline.Cancelled: Если срок истёк или запрос отменён
+    """
+    from httpx import ReadTimeout
+
+    try:
+        giga = make_client(credentials, deadline.timeout(LLM_TIMEOUT))
+        full_prompt = (f"{skeleton_prompt}\n\nВходные данные:\n{user_prompt}\n\n"
+                       f"Количество сцен: около {scene_count}")
+        with STAGE_SECONDS.time(stage="llm_call"):
+            if on_event is None:
+                response = giga.invoke(full_prompt)
+                record_token_usage(response)
+                response_text = response.content
+            else:
+                parts = []
+                chars = 0
+                for chunks, chunk in enumerate(giga.stream(full_prompt), 1):
+                    deadline.check()
+                    record_token_usage(chunk)
+                    parts.append(chunk.content)
+                    chars += len(chunk.content)
+                    on_event("tokens", {"chunks": chunks, "chars": chars})
+                response_text = "".join(parts)
+            tracing.annotate(prompt_chars=len(full_prompt), response_chars=len(response_text))
+        if on_response is not None:
+            on_response(response_text)
+
+        with STAGE_SECONDS.time(stage="json_extract"):
+            return extract_json_object(response_text) or {}
+
+    except deadline.Cancelled:
+        raise
     except ReadTimeout:
+        # Тайм-аут из-за истёкшего срока запроса - отмена, а не ошибка модели
+        deadline.check()
         print("Ошибка: превышено время ожидания ответа от GigaChat.")
         return {"error": "timeout"}
     except Exception as e:
         print(f"Критическая ошибка: {str(e)}")
         return {"error": str(e)}
+
+
+def scene_neighbours(skeleton):
+    """Для каждой сцены скелета - сцены, из которых в неё ведут выборы."""
+    parents = {scene["scene_id"]: [] for scene in skeleton}
+    for scene in skeleton:
+        for next_scene in dict.fromkeys(scene["next"]):
+            if next_scene in parents:
+                parents[next_scene].append(scene)
+    return parents
+
+
+def scene_text_prompt(scene, parents, children, user_prompt, scene_prompt):
+    """Промпт текста одной сцены: замысел квеста, сцены до неё и после неё."""
+    lines = [scene_prompt, "", "Входные данные квеста:", user_prompt, ""]
+    if parents:
+        lines.append("Сцены, из которых игрок попадает в эту сцену:")
+        lines.extend(f"- {parent['beat']}" for parent in parents)
+    else:
+        lines.append("Это первая сцена квеста: завязка, герой, мир и цель.")
+    lines += ["", f"Эта сцена: {scene['beat']}", ""]
+    if children:
+        lines.append(f"Выборы ({len(children)}) ведут в сцены, по порядку:")
+        lines.extend(f"{i}. {child['beat']}" for i, child in enumerate(children, 1))
+    else:
+        lines.append("Это финальная сцена: choices = [].")
+    return "\n".join(lines)
+
+
+def parse_scene_text(response_text, scene):
+    """
+    Проверяет ответ с текстом сцены и собирает сцену квеста.
+
+    Raises:
+        ValueError: Если ответ не подходит (нет текста или число выборов не совпадает)
+    """
+    data = extract_json_object(response_text)
+    if data is None:
+        raise ValueError("ответ не содержит JSON")
+    text = data.get("text")
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError("нет текста сцены")
+    choices = [
+        choice.get("text") if isinstance(choice, dict) else choice
+        for choice in data.get("choices") or []
+    ]
+    if len(choices) != len(scene["next"]) or not all(isinstance(c, str) and c.strip() for c in choices):
+        raise ValueError(f"ожидалось выборов: {len(scene['next'])}, получено: {len(choices)}")
+    return {
+        "scene_id": scene["scene_id"],
+        "text": text.strip(),
+        "choices": [
+            {"text": choice.strip(), "next_scene": next_scene}
+            for choice, next_scene in zip(choices, scene["next"])
+        ],
+    }
+
+
+def write_scene_texts(skeleton, user_prompt, scene_prompt, credentials, max_workers=8, on_scene=None,
+                      written=None):
+    """
+    Вторая фаза двухфазной генерации: тексты всех сцен параллельно.
+
+    Каждая сцена пишется отдельным запросом, которому известны замыслы
+    соседних сцен, поэтому запросы не зависят друг от друга и время фазы
+    близко ко времени самой долгой сцены. Одновременно выполняется не
+    больше max_workers запросов; неудачная сцена повторяется отдельно.
+    После отмены или ошибки оставшиеся сцены не запрашиваются, а
+    выполняющиеся запросы ограничены остатком срока. Сцены из written
+    (готовые в прошлом запуске) повторно не запрашиваются.
+
+    Args:
+        skeleton: Сцены скелета {"scene_id", "beat", "next"} (прошедшего валидацию)
+        user_prompt: Пользовательский промпт
+        scene_prompt: Системный промпт текста сцены (scene_prompt.txt)
+        credentials: Учетные данные GigaChat
+        max_workers: Сколько запросов выполнять одновременно
+        on_scene: Вызывается с каждой новой готовой сценой (из рабочих потоков)
+        written: Готовые сцены по scene_id (из контрольной точки)
+
+    Returns:
+        List[Dict]: Сцены квеста в порядке скелета
+
+    Raises:
+        SceneTextError: Если текст сцены не удалось получить
+        deadline.Cancelled: Если срок истёк или запрос отменён
+    """
+    by_id = {scene["scene_id"]: scene for scene in skeleton}
+    written = written or {}
+    parents = scene_neighbours(skeleton)
+    clients = threading.local()
+
+    def write(scene):
+        prompt = scene_text_prompt(scene, parents[scene["scene_id"]],
+                                   [by_id[next_scene] for next_scene in scene["next"]],
+                                   user_prompt, scene_prompt)
+        reason = None
+        for attempt in range(1, SCENE_ATTEMPTS + 1):
+            with tracing.span("scene_text", scene_id=scene["scene_id"], attempt=attempt):
+                timeout = deadline.timeout(SCENE_TIMEOUT)
+                if timeout < SCENE_TIMEOUT:
+                    # Срок запроса на исходе: клиент с укороченным тайм-аутом
+                    giga = make_client(credentials, timeout)
+                else:
+                    if getattr(clients, "giga", None) is None:
+                        clients.giga = make_client(credentials, SCENE_TIMEOUT)
+                    giga = clients.giga
+                try:
+                    with STAGE_SECONDS.time(stage="llm_call"):
+                        response = giga.invoke(prompt)
+                    record_token_usage(response)
+                    result = parse_scene_text(response.content, scene)
+                except Exception as e:
+                    deadline.check()
+                    reason = str(e) or type(e).__name__
+                    tracing.annotate(error=reason)
+                    continue
+            if on_scene is not None:
+                on_scene(result)
+            return result
+        raise SceneTextError(scene["scene_id"], reason)
+
+    missing = [scene for scene in skeleton if scene["scene_id"] not in written]
+    with tracing.span("scene_texts", scenes=len(missing), reused=len(skeleton) - len(missing),
+                      workers=max_workers):
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scene-text")
+        try:
+            # Каждый запрос получает контекст вызова: трассировку и срок запроса
+            futures = {scene["scene_id"]: executor.submit(contextvars.copy_context().run, write, scene)
+                       for scene in missing}
+            done, _ = wait(futures.values(), return_when=FIRST_EXCEPTION)
+            for future in done:
+                if future.exception() is not None:
+                    raise future.exception()
+            return [written[scene["scene_id"]] if scene["scene_id"] in written
+                    else futures[scene["scene_id"]].result() for scene in skeleton]
+        finally:
+            # После ошибки оставшиеся сцены не запрашиваются
+            executor.shutdown(wait=True, cancel_futures=True)
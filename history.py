@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# История версий квестов: сцены и позиции хранятся по хешу содержимого, версия - небольшой манифест
+
+import hashlib
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import serialization
+
+# Размер хеша объекта в байтах (blake2b)
+HASH_SIZE = 16
+
+# Заголовок записи в файле объектов: хеш и длина данных
+RECORD = struct.Struct(f"<{HASH_SIZE}sI")
+
+# Списки сцен и позиций делятся на блоки в среднем по CHUNK_ENTRIES записей.
+# Граница блока определяется хешем scene_id, а не номером записи, поэтому
+# правка, вставка или удаление сцены меняет только её блок
+CHUNK_ENTRIES = 32
+MAX_CHUNK_ENTRIES = 4 * CHUNK_ENTRIES
+
+ReadObjects = Callable[[Iterable[str]], Dict[str, bytes]]
+
+
+class HistoryError(Exception):
+    """История версий квеста повреждена: манифест ссылается на отсутствующий объект."""
+
+
+def object_hash(data: bytes) -> str:
+    """Возвращает адрес объекта: шестнадцатеричный хеш его содержимого."""
+    return hashlib.blake2b(data, digest_size=HASH_SIZE).hexdigest()
+
+
+def _put(value, objects: Dict[str, bytes]) -> str:
+    data = serialization.dumps_bytes(value)
+    key = object_hash(data)
+    objects[key] = data
+    return key
+
+
+def _load(objects: Dict[str, bytes], key: str):
+    try:
+        return serialization.loads(objects[key])
+    except KeyError:
+        raise HistoryError(f"Объект {key} не найден в истории версий") from None
+
+
+def _scene_id(item):
+    return item.get("scene_id") if isinstance(item, dict) else None
+
+
+def _put_chunks(items: List, scene_ids: Iterable, objects: Dict[str, bytes]) -> List[str]:
+    """Делит список на блоки по границам scene_id и возвращает хеши блоков."""
+    keys = []
+    chunk = []
+    for item, scene_id in zip(items, scene_ids):
+        chunk.append(item)
+        if (zlib.crc32(str(scene_id).encode("utf-8")) % CHUNK_ENTRIES == 0
+                or len(chunk) >= MAX_CHUNK_ENTRIES):
+            keys.append(_put(chunk, objects))
+            chunk = []
+    if chunk:
+        keys.append(_put(chunk, objects))
+    return keys
+
+
+def _load_chunks(keys: List[str], read_objects: ReadObjects) -> List:
+    objects = read_objects(keys)
+    return [item for key in keys for item in _load(objects, key)]
+
+
+def _manifest(extra: str, entries: List, positions: Optional[List[str]],
+              objects: Dict[str, bytes]) -> Dict:
+    return {
+        "extra": extra,
+        "scene_count": len(entries),
+        "scenes": _put_chunks(entries, (scene_id for scene_id, _ in entries), objects),
+        "positions": positions,
+    }
+
+
+def _put_positions(node_positions: List, objects: Dict[str, bytes]) -> List[str]:
+    return _put_chunks(node_positions, map(_scene_id, node_positions), objects)
+
+
+def snapshot(quest_data: Dict, node_positions: Optional[List]) -> Tuple[Dict, Dict[str, bytes]]:
+    """
+    Раскладывает квест на объекты и составляет манифест версии.
+
+    Каждая сцена - отдельный объект; список пар (scene_id, хеш сцены) и
+    набор позиций узлов делятся на блоки, которые тоже хранятся как объекты.
+    Манифест содержит только хеши полей квеста и блоков, поэтому
+    неизменённые сцены и позиции в новой версии не занимают места.
+
+    Args:
+        quest_data: Данные квеста
+        node_positions: Позиции узлов (None - ещё не построены)
+
+    Returns:
+        Tuple[Dict, Dict[str, bytes]]: Манифест {"extra", "scene_count", "scenes",
+        "positions"} и объекты хеш -> данные
+    """
+    objects: Dict[str, bytes] = {}
+    extra = {key: value for key, value in quest_data.items() if key != "scenes"}
+    scenes = quest_data.get("scenes")
+    entries = [
+        [_scene_id(scene), _put(scene, objects)]
+        for scene in (scenes if isinstance(scenes, list) else [])
+    ]
+    positions = None if node_positions is None else _put_positions(node_positions, objects)
+    return _manifest(_put(extra, objects), entries, positions, objects), objects
+
+
+def patch_snapshot(manifest: Dict, scenes: Dict[str, Optional[Dict]],
+                   node_positions: Optional[List], read_objects: ReadObjects
+                   ) -> Tuple[Dict, Dict[str, bytes]]:
+    """
+    Составляет манифест версии по предыдущему и списку изменённых сцен.
+
+    Порядок сцен совпадает с merge_by_scene_id в storage.py: изменённые
+    остаются на месте, новые добавляются в конец.
+
+    Args:
+        manifest: Манифест предыдущей версии
+        scenes: scene_id -> новая сцена (None - удалить сцену)
+        node_positions: Новый набор позиций (None - позиции не менялись)
+        read_objects: Функция чтения объектов по списку хешей
+
+    Returns:
+        Tuple[Dict, Dict[str, bytes]]: Манифест и объекты (уже сохранённые
+        блоки повторно не записываются)
+    """
+    objects: Dict[str, bytes] = {}
+    changes = {
+        scene_id: None if scene is None else _put(scene, objects)
+        for scene_id, scene in scenes.items()
+    }
+    entries = []
+    seen = set()
+    for scene_id, key in _load_chunks(manifest["scenes"], read_objects):
+        if scene_id in changes:
+            seen.add(scene_id)
+            key = changes[scene_id]
+            if key is None:
+                continue
+        entries.append([scene_id, key])
+    entries.extend(
+        [scene_id, key] for scene_id, key in changes.items()
+        if scene_id not in seen and key is not None
+    )
+    positions = manifest["positions"] if node_positions is None else _put_positions(node_positions, objects)
+    return _manifest(manifest["extra"], entries, positions, objects), objects
+
+
+def materialize(manifest: Dict, read_objects: ReadObjects) -> Tuple[Dict, Optional[List]]:
+    """
+    Собирает квест и позиции узлов версии из объектов.
+
+    Returns:
+        Tuple[Dict, Optional[List]]: Данные квеста и позиции узлов
+
+    Raises:
+        HistoryError: Если объекта нет в истории
+    """
+    entries = _load_chunks(manifest["scenes"], read_objects)
+    objects = read_objects([manifest["extra"]] + [key for _, key in entries])
+    quest_data = _load(objects, manifest["extra"])
+    quest_data["scenes"] = [_load(objects, key) for _, key in entries]
+    positions = manifest["positions"]
+    if positions is not None:
+        positions = _load_chunks(positions, read_objects)
+    return quest_data, positions
+
+
+def _changed_chunks(manifest: Dict, other: Dict, field: str, read_objects: ReadObjects) -> List:
+    """Записи блоков манифеста, которых нет в другой версии (общие блоки совпадают целиком)."""
+    keys = manifest[field] or []
+    shared = set(other[field] or [])
+    return _load_chunks([key for key in keys if key not in shared], read_objects)
+
+
+def diff_manifests(old: Dict, new: Dict, read_objects: ReadObjects) -> Dict:
+    """
+    Сравнивает две версии квеста.
+
+    Читаются только блоки и сцены, хеши которых различаются, поэтому
+    стоимость сравнения пропорциональна размеру изменений.
+
+    Args:
+        old: Манифест исходной версии
+        new: Манифест новой версии
+        read_objects: Функция чтения объектов по списку хешей
+
+    Returns:
+        Dict: {"added", "removed", "changed": сцены до и после изменения,
+        "extra": изменённые поля квеста, "moved_nodes": scene_id узлов с новыми позициями}
+
+    Raises:
+        HistoryError: Если объекта нет в истории
+    """
+    old_scenes = dict(_changed_chunks(old, new, "scenes", read_objects))
+    new_scenes = dict(_changed_chunks(new, old, "scenes", read_objects))
+    added = [scene_id for scene_id in new_scenes if scene_id not in old_scenes]
+    removed = [scene_id for scene_id in old_scenes if scene_id not in new_scenes]
+    changed = [
+        scene_id for scene_id, key in new_scenes.items()
+        if scene_id in old_scenes and old_scenes[scene_id] != key
+    ]
+
+    wanted = {new_scenes[scene_id] for scene_id in added + changed}
+    wanted |= {old_scenes[scene_id] for scene_id in removed + changed}
+    if old["extra"] != new["extra"]:
+        wanted |= {old["extra"], new["extra"]}
+    objects = read_objects(wanted)
+
+    extra = {}
+    if old["extra"] != new["extra"]:
+        before = _load(objects, old["extra"])
+        after = _load(objects, new["extra"])
+        extra = {
+            key: {"before": before.get(key), "after": after.get(key)}
+            for key in sorted(set(before) | set(after), key=str)
+            if before.get(key) != after.get(key)
+        }
+
+    moved_nodes = []
+    if old["positions"] != new["positions"]:
+        before = {_scene_id(item): item for item in _changed_chunks(old, new, "positions", read_objects)}
+        after = {_scene_id(item): item for item in _changed_chunks(new, old, "positions", read_objects)}
+        moved_nodes = [
+            scene_id for scene_id in {**before, **after}
+            if scene_id is not None and before.get(scene_id) != after.get(scene_id)
+        ]
+
+    return {
+        "added": [{"scene_id": scene_id, "scene": _load(objects, new_scenes[scene_id])}
+                  for scene_id in added],
+        "removed": [{"scene_id": scene_id, "scene": _load(objects, old_scenes[scene_id])}
+                    for scene_id in removed],
+        "changed": [{"scene_id": scene_id,
+                     "before": _load(objects, old_scenes[scene_id]),
+                     "after": _load(objects, new_scenes[scene_id])}
+                    for scene_id in changed],
+        "extra": extra,
+        "moved_nodes": moved_nodes,
+    }
+
+
+class ObjectPack:
+    """
+    Файл объектов истории одного квеста.
+
+    Записи [хеш][длина][данные] только дописываются в конец, каждый объект
+    хранится один раз. Смещения записей держатся в памяти и дочитываются
+    с места последнего чтения, когда файл дописан другим процессом.
+    Оборванная при сбое последняя запись игнорируется и затирается
+    следующей записью. Методы вызываются под блокировкой квеста.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self._end = 0
+        self._inode = None
+
+    def _refresh(self, f) -> None:
+        """Читает заголовки записей, добавленных после последнего обращения."""
+        stat = os.fstat(f.fileno())
+        size = stat.st_size
+        if stat.st_ino != self._inode or size < self._end:
+            # Файл пересоздан (квест удалён и сохранён заново)
+            self._index.clear()
+            self._end = 0
+            self._inode = stat.st_ino
+        position = self._end
+        while position + RECORD.size <= size:
+            f.seek(position)
+            digest, length = RECORD.unpack(f.read(RECORD.size))
+            if position + RECORD.size + length > size:
+                break
+            self._index[digest.hex()] = (position + RECORD.size, length)
+            position += RECORD.size + length
+        self._end = position
+
+    def write(self, objects: Dict[str, bytes]) -> int:
+        """
+        Дописывает отсутствующие в файле объекты одной записью.
+
+        Args:
+            objects: Хеш -> данные
+
+        Returns:
+            int: Количество записанных байт
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a+b") as f:
+            self._refresh(f)
+            if os.fstat(f.fileno()).st_size > self._end:
+                f.truncate(self._end)
+            buffer = bytearray()
+            added = {}
+            for key, data in objects.items():
+                if key in self._index or key in added:
+                    continue
+                added[key] = (self._end + len(buffer) + RECORD.size, len(data))
+                buffer += RECORD.pack(bytes.fromhex(key), len(data))
+                buffer += data
+            if buffer:
+                f.write(buffer)
+                f.flush()
+                os.fsync(f.fileno())
+        self._index.update(added)
+        self._end += len(buffer)
+        return len(buffer)
+
+    def read(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        """Читает объекты по хешам; отсутствующих объектов нет в результате."""
+        objects = {}
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return objects
+        with f:
+            self._refresh(f)
+            for key in keys:
+                location = self._index.get(key)
+                if location is not None:
+                    f.seek(location[0])
+                    objects[key] = f.read(location[1])
+        return objects
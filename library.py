@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Потоковый экспорт и импорт библиотеки квестов (NDJSON / tar)
+
+import argparse
+import io
+import json
+import os
+import sys
+import tarfile
+import time
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional
+
+import serialization
+from process import GameValidator
+from search import get_search_index
+from storage import QuestStorage, check_quest_name, get_storage
+
+FORMATS = ("ndjson", "tar", "tar.gz")
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "tar": "application/x-tar",
+    "tar.gz": "application/gzip",
+}
+# Сколько ошибок импорта возвращать в отчёте
+MAX_REPORTED_ERRORS = 100
+
+
+def select_quests(storage: QuestStorage, prefix: Optional[str] = None,
+                  names: Optional[List[str]] = None) -> List[str]:
+    """
+    Возвращает названия квестов для экспорта.
+
+    Args:
+        storage: Хранилище
+        prefix: Экспортировать только квесты с этим префиксом
+        names: Экспортировать только перечисленные квесты
+    """
+    quest_names = storage.list_quests()
+    if names:
+        wanted = set(names)
+        quest_names = [name for name in quest_names if name in wanted]
+    if prefix:
+        quest_names = [name for name in quest_names if name.startswith(prefix)]
+    return quest_names
+
+
+def _records(storage: QuestStorage, quest_names: Iterable[str]) -> Iterator[Dict]:
+    """Читает квесты по одному, не держа в памяти всю библиотеку."""
+    for quest_name in quest_names:
+        quest_data = storage.load_quest(quest_name)
+        if quest_data is None:
+            # Квест удалён во время экспорта
+            continue
+        yield {
+            "quest_name": quest_name,
+            "quest_data": quest_data,
+            "node_positions": storage.load_positions(quest_name),
+        }
+
+
+def iter_export_ndjson(storage: QuestStorage, quest_names: Iterable[str]) -> Iterator[bytes]:
+    """
+    Экспортирует квесты в NDJSON: одна строка на квест.
+    Генератор возвращает число выгруженных квестов (см. write_export).
+    """
+    exported = 0
+    for record in _records(storage, quest_names):
+        yield serialization.dumps_bytes(record) + b"\n"
+        exported += 1
+    return exported
+
+
+class _ChunkWriter(io.RawIOBase):
+    """Файловый объект, накапливающий записанные байты для отдачи потоком."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def iter_export_tar(storage: QuestStorage, quest_names: Iterable[str],
+                    compress: bool = False) -> Iterator[bytes]:
+    """
+    Экспортирует квесты в tar-архив, по файлу {quest_name}.json на квест
+    (содержимое как у строки NDJSON). Генератор возвращает число
+    выгруженных квестов.
+    """
+    exported = 0
+    writer = _ChunkWriter()
+    with tarfile.open(fileobj=writer, mode="w|gz" if compress else "w|") as archive:
+        for record in _records(storage, quest_names):
+            data = serialization.dumps_bytes(record)
+            info = tarfile.TarInfo(f"{record['quest_name']}.json")
+            info.size = len(data)
+            info.mtime = int(time.time())
+            archive.addfile(info, io.BytesIO(data))
+            exported += 1
+            chunk = writer.drain()
+            if chunk:
+                yield chunk
+    chunk = writer.drain()
+    if chunk:
+        yield chunk
+    return exported
+
+
+def iter_export(storage: QuestStorage, quest_names: Iterable[str], fmt: str) -> Iterator[bytes]:
+    """Экспортирует квесты в выбранном формате (см. FORMATS)."""
+    if fmt == "ndjson":
+        return iter_export_ndjson(storage, quest_names)
+    if fmt in ("tar", "tar.gz"):
+        return iter_export_tar(storage, quest_names, compress=fmt == "tar.gz")
+    raise ValueError(f"Неизвестный формат: {fmt}")
+
+
+def write_export(storage: QuestStorage, quest_names: Iterable[str], fmt: str, output: BinaryIO) -> int:
+    """
+    Записывает экспорт в файл.
+
+    Returns:
+        int: Число выгруженных квестов (без удалённых во время экспорта)
+    """
+    chunks = iter_export(storage, quest_names, fmt)
+    while True:
+        try:
+            output.write(next(chunks))
+        except StopIteration as stop:
+            return stop.value
+
+
+class LibraryImporter:
+    """
+    Импортирует квесты по одному с валидацией через GameValidator.
+
+    Уже существующие квесты пропускаются или перезаписываются (overwrite).
+    После сохранения каждого квеста вызывается on_import(quest_name, quest_data).
+    """
+
+    def __init__(self, storage: QuestStorage, overwrite: bool = False,
+                 on_import: Optional[Callable[[str, Dict], None]] = None):
+        self.storage = storage
+        self.overwrite = overwrite
+        self.on_import = on_import
+        self.validator = GameValidator()
+        self.imported = 0
+        self.skipped = 0
+        self.invalid = 0
+        self.errors: List[Dict] = []
+
+    def _error(self, quest_name: Optional[str], message: str) -> None:
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"quest_name": quest_name, "error": message})
+
+    def add_record(self, data: bytes) -> None:
+        """Импортирует одну запись вида {"quest_name", "quest_data", "node_positions"}."""
+        try:
+            record = serialization.loads(data)
+        except json.JSONDecodeError as e:
+            self._error(None, f"Запись не является валидным JSON: {e}")
+            return
+
+        quest_name = record.get("quest_name") if isinstance(record, dict) else None
+        if not isinstance(quest_name, str) or not quest_name:
+            self._error(None, "У записи отсутствует поле 'quest_name'")
+            return
+        try:
+            check_quest_name(quest_name)
+        except ValueError as e:
+            self._error(quest_name, str(e))
+            return
+
+        success, message = self.validator.validate_data(record.get("quest_data"))
+        if not success:
+            self._error(quest_name, message)
+            return
+
+        if not self.overwrite and self.storage.quest_exists(quest_name):
+            self.skipped += 1
+            return
+
+        node_positions = record.get("node_positions")
+        self.storage.save_quest(
+            quest_name,
+            record["quest_data"],
+            node_positions if isinstance(node_positions, list) else None
+        )
+        self.imported += 1
+        if self.on_import is not None:
+            self.on_import(quest_name, record["quest_data"])
+
+    def import_ndjson(self, lines: Iterable[bytes]) -> None:
+        """Импортирует поток строк NDJSON."""
+        for line in lines:
+            if line.strip():
+                self.add_record(line)
+
+    def import_tar(self, fileobj: BinaryIO) -> None:
+        """Импортирует tar или tar.gz архив, читая его последовательно."""
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            for member in archive:
+                if not member.isfile() or not member.name.endswith(".json"):
+                    continue
+                self.add_record(archive.extractfile(member).read())
+
+    def report(self) -> Dict:
+        """Итоги импорта."""
+        return {
+            "imported": self.imported,
+            "skipped_existing": self.skipped,
+            "invalid": self.invalid,
+            "errors": self.errors,
+        }
+
+
+def guess_format(path: str) -> str:
+    """Определяет формат архива по расширению файла."""
+    if path.endswith((".tar.gz", ".tgz")):
+        return "tar.gz"
+    if path.endswith(".tar"):
+        return "tar"
+    return "ndjson"
+
+
+def main():
+    """Главная функция программы."""
+    script_dir = Path(__file__).parent
+    parser = argparse.ArgumentParser(description='Экспорт и импорт библиотеки квестов')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='Выгрузить квесты в архив')
+    export_parser.add_argument('-o', '--output', required=True,
+                               help='Файл архива (.ndjson, .tar, .tar.gz) или - для stdout')
+    export_parser.add_argument('--format', choices=FORMATS, help='Формат (по умолчанию по расширению)')
+    export_parser.add_argument('--prefix', help='Только квесты с этим префиксом')
+    export_parser.add_argument('names', nargs='*', help='Только перечисленные квесты')
+
+    import_parser = subparsers.add_parser('import', help='Загрузить квесты из архива')
+    import_parser.add_argument('input', help='Файл архива или - для stdin')
+    import_parser.add_argument('--format', choices=FORMATS, help='Формат (по умолчанию по расширению)')
+    import_parser.add_argument('--overwrite', action='store_true', help='Перезаписывать существующие квесты')
+
+    args = parser.parse_args()
+    storage = get_storage(script_dir)
+
+    if args.command == 'export':
+        fmt = args.format or guess_format(args.output)
+        quest_names = select_quests(storage, args.prefix, args.names)
+        output = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+        try:
+            exported = write_export(storage, quest_names, fmt, output)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        print(f"Экспортировано квестов: {exported}", file=sys.stderr)
+
+    elif args.command == 'import':
+        if args.input != '-' and not os.path.exists(args.input):
+            print(f"Ошибка: Файл '{args.input}' не найден!")
+            sys.exit(1)
+        fmt = args.format or guess_format(args.input)
+        # Импортированные квесты индексируются для поиска, как при импорте через backend
+        search_index = get_search_index(script_dir)
+        importer = LibraryImporter(storage, overwrite=args.overwrite, on_import=search_index.index_quest)
+        source = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+        try:
+            if fmt == "ndjson":
+                importer.import_ndjson(source)
+            else:
+                importer.import_tar(source)
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+
+        report = importer.report()
+        print(f"Импортировано: {report['imported']}, пропущено существующих: "
+              f"{report['skipped_existing']}, с ошибками: {report['invalid']}")
+        for error in report['errors']:
+            print(f"  • {error['quest_name'] or '?'}: {error['error']}")
+        search_index.close()
+
+    storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,50 @@
+import argparse
 import json
 import subprocess
 import os
-from time import sleep
+import threading
 from dotenv import load_dotenv
 
-from generate import generate_rpg_quest
+from generate import (SceneTextError, generate_quest_skeleton, generate_rpg_quest,
+                      write_scene_texts)
+from checkpoint import CHECKPOINT_REUSED, get_checkpoint_store
 from process import GameValidator
+from storage import get_storage
+from search import get_search_index
+import deadline
+import tracing
+from metrics import (STAGE_SECONDS, GENERATION_ATTEMPTS, GENERATION_RETRIES,
+                     GENERATION_FAILURES)
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 load_dotenv()
-def generate_quest_with_validation(quest_name, user_prompt, system_prompt, credentials, max_retries=3):
+
+# Повторная попытка не начинается, если до срока запроса осталось меньше:
+# ответ модели всё равно не успеет прийти
+MIN_ATTEMPT_SECONDS = 30
+
+def emit(on_event, event_type, **data):
+    """Отправляет событие прогресса, если передан обработчик."""
+    if on_event is not None:
+        on_event(event_type, data)
+
+def failure_reason(quest):
+    """Определяет причину неудачной попытки генерации для метрик."""
+    if not quest:
+        return "no_json"
+    if "error" in quest:
+        return "timeout" if quest["error"] == "timeout" else "llm_error"
+    return "validation"
+
+def record_cancellation(error, attempts):
+    """Учитывает в метриках генерацию, прерванную сроком запроса или отключением клиента."""
+    print(f"❌ Генерация прервана: {error}")
+    GENERATION_FAILURES.inc(reason=error.reason)
+    GENERATION_ATTEMPTS.observe(attempts, outcome="cancelled")
+
+@tracing.span("generate_quest_with_validation")
+def generate_quest_with_validation(quest_name, user_prompt, system_prompt, credentials, max_retries=3, on_event=None,
+                                   checkpoint=None):
     """
     Генерирует и и обрабатывает квест через process.py, который:
     1. Читает text_output/{quest_name}.txt
@@ -18,53 +53,280 @@ def generate_quest_with_validation(quest_name, user_prompt, system_prompt, crede
     4. Выполняет валидацию
 
     При ошибках в stderr перезапускает генерацию квеста (до max_retries раз)
+
+    Если передан on_event(event_type, data), о ходе генерации отправляются
+    события: attempt_started, tokens, scene_parsed, validation, retry.
+
+    Срок текущего запроса (deadline.py) ограничивает тайм-аут каждого вызова
+    LLM; повторная попытка не начинается, если до срока осталось меньше
+    MIN_ATTEMPT_SECONDS.
+
+    Если передана контрольная точка (checkpoint.Run), в неё записываются
+    ответы модели и итоги валидации попыток. Квест, прошедший валидацию в
+    прошлом запуске, но не сохранённый из-за сбоя, возвращается без запроса
+    к LLM (событие resumed).
+
+    Raises:
+        deadline.Cancelled: Если срок истёк или запрос отменён
     """
 
     validator = GameValidator()
     retry_count = 0
 
+    if checkpoint is not None and checkpoint.valid_quest() is not None:
+        print(f"✅ Квест {quest_name} взят из контрольной точки {checkpoint.run_id}")
+        CHECKPOINT_REUSED.inc(kind="quest")
+        emit(on_event, "resumed", run_id=checkpoint.run_id, attempts=len(checkpoint.attempts), quest=True)
+        GENERATION_ATTEMPTS.observe(1, outcome="success")
+        return checkpoint.valid_quest(), ""
+
     while retry_count < max_retries:
+        attempt = tracing.begin("attempt", {"attempt": retry_count + 1})
         try:
+            deadline.check(MIN_ATTEMPT_SECONDS if retry_count else 0)
             print(f"Генерируем квест: {quest_name}")
-            quest = generate_rpg_quest(user_prompt=user_prompt, system_prompt=system_prompt, credentials=credentials)
+            emit(on_event, "attempt_started", attempt=retry_count + 1, max_retries=max_retries)
+            responses = []
+            quest = generate_rpg_quest(
+                user_prompt=user_prompt,
+                system_prompt=system_prompt,
+                credentials=credentials,
+                on_event=on_event,
+                on_response=responses.append
+            )
 
             print(f"Обрабатываем квест: {quest_name} (попытка {retry_count + 1}/{max_retries})")
 
-            success, message = validator.validate_data(quest)
+            with STAGE_SECONDS.time(stage="validate"):
+                success, message = validator.validate_data(quest)
+            if checkpoint is not None:
+                checkpoint.record_attempt("quest", responses[-1] if responses else None, quest, success, message)
+            emit(on_event, "validation", attempt=retry_count + 1, success=success, message=message)
+            tracing.annotate(valid=success)
 
             # Выводим результат
             if success:
                 print(f"✅ Квест {quest_name} успешно обработан и валидирован!")
+                GENERATION_ATTEMPTS.observe(retry_count + 1, outcome="success")
                 return quest, ""
 
             print("Ошибки валидации:")
             print(message)
+            GENERATION_FAILURES.inc(reason=failure_reason(quest))
 
             retry_count += 1
             if retry_count < max_retries:
                 print(f"\n⚠️ Обнаружены ошибки, перегенерируем квест (попытка {retry_count + 1}/{max_retries})")
-
-                quest = generate_rpg_quest(user_prompt=user_prompt, system_prompt=system_prompt, credentials=credentials)
-
-                print("Квест перегенерирован, повторяем обработку...")
-                sleep(1)
+                GENERATION_RETRIES.inc()
+                emit(on_event, "retry", attempt=retry_count + 1, max_retries=max_retries, reason=message)
+                deadline.sleep(1)
                 continue
 
+        except deadline.Cancelled as e:
+            record_cancellation(e, retry_count + 1)
+            raise
         except Exception as e:
             print(f"Критическая ошибка: {e}")
+            GENERATION_FAILURES.inc(reason="exception")
+            GENERATION_ATTEMPTS.observe(retry_count + 1, outcome="error")
             return None, str(e)
+        finally:
+            tracing.end(attempt)
 
     print(f"❌ Достигнуто максимальное количество попыток ({max_retries})")
+    GENERATION_FAILURES.inc(reason="max_retries_exceeded")
+    GENERATION_ATTEMPTS.observe(retry_count, outcome="failure")
     return None, "max_retries_exceeded"
 
+def skeleton_quest(skeleton, scene_count):
+    """
+    Проверяет формат скелета и переводит его в формат квеста для GameValidator:
+    замысел сцены вместо текста, выборы без текста.
+
+    Returns:
+        Tuple[Optional[Dict], str]: (квест для валидации или None, сообщение об ошибке)
+    """
+    scenes = skeleton.get("scenes") if isinstance(skeleton, dict) else None
+    if not isinstance(scenes, list):
+        return None, "Данные не содержат поле 'scenes'"
+    for scene in scenes:
+        if not isinstance(scene, dict) or not isinstance(scene.get("scene_id"), str):
+            return None, "У сцены скелета отсутствует поле 'scene_id'"
+        if not isinstance(scene.get("beat"), str):
+            return None, f"У сцены '{scene['scene_id']}' отсутствует поле 'beat'"
+        if not isinstance(scene.get("next"), list) or not all(isinstance(n, str) for n in scene["next"]):
+            return None, f"У сцены '{scene['scene_id']}' поле 'next' должно быть списком scene_id"
+    if len(scenes) < scene_count // 2:
+        return None, f"Недостаточно сцен. Найдено {len(scenes)}, запрошено {scene_count}"
+    return {"scenes": [
+        {"scene_id": scene["scene_id"], "text": scene["beat"],
+         "choices": [{"text": "", "next_scene": next_scene} for next_scene in scene["next"]]}
+        for scene in scenes
+    ]}, ""
+
+@tracing.span("generate_quest_two_phase")
+def generate_quest_two_phase(quest_name, user_prompt, credentials, scene_count, max_retries=3,
+                             max_workers=8, on_event=None, checkpoint=None):
+    """
+    Генерирует большой квест в две фазы.
+
+    1. Скелет: граф сцен с кратким замыслом каждой (skeleton_prompt.txt);
+       проверяется GameValidator и при ошибках генерируется заново (до max_retries раз).
+    2. Тексты сцен и выборов: отдельный запрос на сцену (scene_prompt.txt),
+       не больше max_workers одновременно; неудачная сцена повторяется отдельно.
+
+    Время генерации - скелет плюс самая долгая сцена, а не весь текст квеста
+    одним ответом, поэтому квесты из 50-200 сцен не упираются в тайм-аут.
+
+    Если передан on_event(event_type, data), отправляются события
+    generate_quest_with_validation, а также skeleton_ready (сцены скелета)
+    и scene_parsed для каждой готовой сцены.
+
+    Если передана контрольная точка (checkpoint.Run), в неё записываются
+    попытки скелета, скелет, прошедший валидацию, и каждая готовая сцена.
+    Повтор после ошибки или сбоя берёт оттуда скелет и готовые сцены и
+    запрашивает у LLM только недостающие сцены (событие resumed). Если
+    собранный квест не прошёл валидацию, контрольная точка удаляется.
+
+    Returns:
+        Tuple[Optional[Dict], str]: (квест, "") или (None, описание ошибки)
+
+    Raises:
+        deadline.Cancelled: Если срок истёк или запрос отменён
+    """
+    with open(os.path.join(script_dir, "skeleton_prompt.txt"), "r", encoding="utf-8") as f:
+        skeleton_prompt = f.read()
+    with open(os.path.join(script_dir, "scene_prompt.txt"), "r", encoding="utf-8") as f:
+        scene_prompt = f.read()
+
+    validator = GameValidator()
+    retry_count = 0
+    skeleton = None
+    written = {}
+    if checkpoint is not None and checkpoint.skeleton is not None:
+        skeleton = checkpoint.skeleton
+        ids = {scene["scene_id"] for scene in skeleton}
+        written = {scene_id: scene for scene_id, scene in checkpoint.scenes.items() if scene_id in ids}
+        print(f"Скелет квеста {quest_name} взят из контрольной точки {checkpoint.run_id}, "
+              f"готовых сцен: {len(written)}/{len(skeleton)}")
+        CHECKPOINT_REUSED.inc(kind="skeleton")
+        CHECKPOINT_REUSED.inc(len(written), kind="scene")
+        emit(on_event, "resumed", run_id=checkpoint.run_id, attempts=len(checkpoint.attempts),
+             scenes=len(written), scenes_total=len(skeleton))
+
+    while skeleton is None and retry_count < max_retries:
+        attempt = tracing.begin("attempt", {"attempt": retry_count + 1})
+        try:
+            deadline.check(MIN_ATTEMPT_SECONDS if retry_count else 0)
+            print(f"Генерируем скелет квеста: {quest_name} (около {scene_count} сцен)")
+            emit(on_event, "attempt_started", attempt=retry_count + 1, max_retries=max_retries)
+            responses = []
+            data = generate_quest_skeleton(user_prompt, skeleton_prompt, credentials, scene_count, on_event,
+                                           on_response=responses.append)
+
+            with STAGE_SECONDS.time(stage="validate"):
+                quest, message = skeleton_quest(data, scene_count)
+                if quest is not None:
+                    success, message = validator.validate_data(quest)
+                else:
+                    success = False
+            if checkpoint is not None:
+                checkpoint.record_attempt("skeleton", responses[-1] if responses else None, data, success, message)
+            emit(on_event, "validation", attempt=retry_count + 1, success=success, message=message)
+            tracing.annotate(valid=success)
+
+            if success:
+                skeleton = data["scenes"]
+                if checkpoint is not None:
+                    checkpoint.save_skeleton(skeleton)
+                break
+
+            print("Ошибки валидации скелета:")
+            print(message)
+            GENERATION_FAILURES.inc(reason=failure_reason(data))
+
+            retry_count += 1
+            if retry_count < max_retries:
+                print(f"\n⚠️ Обнаружены ошибки, перегенерируем скелет (попытка {retry_count + 1}/{max_retries})")
+                GENERATION_RETRIES.inc()
+                emit(on_event, "retry", attempt=retry_count + 1, max_retries=max_retries, reason=message)
+                deadline.sleep(1)
+
+        except deadline.Cancelled as e:
+            record_cancellation(e, retry_count + 1)
+            raise
+        except Exception as e:
+            print(f"Критическая ошибка: {e}")
+            GENERATION_FAILURES.inc(reason="exception")
+            GENERATION_ATTEMPTS.observe(retry_count + 1, outcome="error")
+            return None, str(e)
+        finally:
+            tracing.end(attempt)
+
+    if skeleton is None:
+        print(f"❌ Достигнуто максимальное количество попыток ({max_retries})")
+        GENERATION_FAILURES.inc(reason="max_retries_exceeded")
+        GENERATION_ATTEMPTS.observe(retry_count, outcome="failure")
+        return None, "max_retries_exceeded"
+
+    print(f"Скелет готов ({len(skeleton)} сцен), пишем тексты сцен")
+    emit(on_event, "skeleton_ready", scenes=skeleton)
+    done = [0]
+    done_lock = threading.Lock()
+
+    def on_scene(scene):
+        if checkpoint is not None:
+            checkpoint.save_scene(scene)
+        with done_lock:
+            done[0] += 1
+            scenes_parsed = done[0]
+        emit(on_event, "scene_parsed", scene=scene, scenes_parsed=scenes_parsed, scenes_total=len(skeleton))
+
+    # Готовые сцены прошлого запуска - сразу в предпросмотр
+    for scene in written.values():
+        done[0] += 1
+        emit(on_event, "scene_parsed", scene=scene, scenes_parsed=done[0], scenes_total=len(skeleton))
+
+    try:
+        quest = {"scenes": write_scene_texts(skeleton, user_prompt, scene_prompt, credentials,
+                                             max_workers, on_scene, written)}
+    except deadline.Cancelled as e:
+        record_cancellation(e, retry_count + 1)
+        raise
+    except SceneTextError as e:
+        print(f"❌ {e}")
+        GENERATION_FAILURES.inc(reason="scene_text")
+        GENERATION_ATTEMPTS.observe(retry_count + 1, outcome="failure")
+        return None, str(e)
+
+    with STAGE_SECONDS.time(stage="validate"):
+        success, message = validator.validate_data(quest)
+    emit(on_event, "validation", attempt=retry_count + 1, success=success, message=message)
+    if not success:
+        GENERATION_FAILURES.inc(reason="validation")
+        GENERATION_ATTEMPTS.observe(retry_count + 1, outcome="failure")
+        if checkpoint is not None:
+            # Скелет и сцены дают невалидный квест: повтор начинается заново,
+            # а не собирает тот же квест из контрольной точки
+            checkpoint.finish()
+        return None, message
+
+    print(f"✅ Квест {quest_name} ({len(skeleton)} сцен) успешно сгенерирован и валидирован!")
+    GENERATION_ATTEMPTS.observe(retry_count + 1, outcome="success")
+    return quest, ""
+
 # Обрабатываем example-3
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Генерация квеста example-3')
+    parser.add_argument('--deadline', type=float,
+                        help='Срок генерации в секундах, включая повторные попытки (по умолчанию без срока)')
+    args = parser.parse_args()
+
     quest_name = "example-3"
     max_retries = 3  # Максимальное количество попыток перегенерации
     credentials = os.getenv("GIGACHAT_CREDENTIALS")  # Ваши учетные данные GigaChat
     user_prompt_path = os.path.join(script_dir, "input", "example-3.txt")  # Путь к файлу с промптом
     system_prompt_path = os.path.join(script_dir, "system_prompt.txt")
-    gen_quests_path = os.path.join(script_dir, "generated_quests")
     print(f"Запускаем генерацию квеста: {quest_name}")
     print("=" * 50)
 
@@ -74,20 +336,32 @@ if __name__ == "__main__":
     with open(system_prompt_path, "r", encoding="utf-8") as f:
         system_prompt = f.read()
 
-    quest, errors = generate_quest_with_validation(
-        quest_name=quest_name,
-        max_retries=max_retries,
-        credentials=credentials,
-        user_prompt=user_prompt,
-        system_prompt=system_prompt
-    )
+    # QUEST_TRACE=1 (или profile) сохраняет трассировку генерации в traces/
+    # Повторный запуск после ошибки или сбоя продолжает с контрольной точки (см. checkpoint.py)
+    checkpoints = get_checkpoint_store(script_dir)
+    run = checkpoints.open(quest_name, user_prompt) if checkpoints is not None else None
+    with tracing.trace(f"main.py {quest_name}", tracing.trace_mode(), tracing.trace_dir(script_dir),
+                       tracing.trace_format()), \
+            deadline.use(deadline.Deadline(args.deadline) if args.deadline else None):
+        try:
+            quest, errors = generate_quest_with_validation(
+                quest_name=quest_name,
+                max_retries=max_retries,
+                credentials=credentials,
+                user_prompt=user_prompt,
+                system_prompt=system_prompt,
+                checkpoint=run
+            )
+        except deadline.Cancelled as e:
+            quest, errors = None, str(e)
 
     if errors == "":
         print("\n🎉 Обработка завершена успешно!")
-        output_file = os.path.join(gen_quests_path, f"{quest_name}.json")
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write(json.dumps(quest, ensure_ascii=False, indent=4))
-        print(f"Квест {quest_name} готов к использованию в {output_file}")
+        get_storage(script_dir).save_quest(quest_name, quest)
+        get_search_index(script_dir).index_quest(quest_name, quest)
+        if run is not None:
+            run.finish()
+        print(f"Квест {quest_name} готов к использованию")
     else:
         print("\n❌ Обработка завершилась с ошибками")
         print("Проверьте логи выше для диагностики проблем")
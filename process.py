@@ -5,8 +5,14 @@ import json
 import sys
 import os
 import argparse
+from collections import deque
 from typing import Dict, List, Optional, Tuple, Any
 
+from questbin import QuestFormatError, load_quest_data
+
+# Сколько путей выводит подробный режим (путей бывает экспоненциально много)
+MAX_LISTED_PATHS = 50
+
 
 class GameValidator:
     """Класс для валидации игровых сценариев."""
@@ -42,39 +48,13 @@ class GameValidator:
         self.graph = {}
         
         for scene in scenes:
-            if not isinstance(scene, dict):
-                return False, "Сцена должна быть объектом"
-                
-            # Проверяем обязательные поля сцены
-            if 'scene_id' not in scene:
-                return False, "У сцены отсутствует поле 'scene_id'"
-                
-            if 'text' not in scene:
-                return False, f"У сцены '{scene.get('scene_id', 'unknown')}' отсутствует поле 'text'"
-                
-            if 'choices' not in scene:
-                return False, f"У сцены '{scene['scene_id']}' отсутствует поле 'choices'"
-                
-            choices = scene['choices']
-            if not isinstance(choices, list):
-                return False, f"У сцены '{scene['scene_id']}' поле 'choices' должно быть массивом"
+            success, message = self.validate_scene(scene)
+            if not success:
+                return False, message
                 
             scene_id = scene['scene_id']
             self.scenes[scene_id] = scene
-            self.graph[scene_id] = []
-            
-            # Проверяем обязательные поля каждого выбора
-            for i, choice in enumerate(choices):
-                if not isinstance(choice, dict):
-                    return False, f"У сцены '{scene_id}' выбор #{i+1} должен быть объектом"
-                    
-                if 'text' not in choice:
-                    return False, f"У сцены '{scene_id}' в выборе #{i+1} отсутствует поле 'text'"
-                    
-                if 'next_scene' not in choice:
-                    return False, f"У сцены '{scene_id}' в выборе #{i+1} отсутствует поле 'next_scene'"
-                    
-                self.graph[scene_id].append(choice['next_scene'])
+            self.graph[scene_id] = [choice['next_scene'] for choice in scene['choices']]
                     
         # Этап 3: Проверка корректности ссылок (все next_scene должны существовать)
         invalid_refs = self._check_scene_references()
@@ -100,6 +80,52 @@ class GameValidator:
             
         return True, "Все проверки пройдены успешно"
         
+    def validate_scene(self, scene: Dict, known_scenes: Optional[set] = None) -> Tuple[bool, str]:
+        """
+        Проверяет структуру одной сцены без анализа всего графа.
+        
+        Args:
+            scene: Данные сцены
+            known_scenes: Если задано, множество существующих scene_id для проверки ссылок
+            
+        Returns:
+            Tuple[bool, str]: (успех, сообщение)
+        """
+        if not isinstance(scene, dict):
+            return False, "Сцена должна быть объектом"
+            
+        # Проверяем обязательные поля сцены
+        if 'scene_id' not in scene:
+            return False, "У сцены отсутствует поле 'scene_id'"
+            
+        if 'text' not in scene:
+            return False, f"У сцены '{scene.get('scene_id', 'unknown')}' отсутствует поле 'text'"
+            
+        if 'choices' not in scene:
+            return False, f"У сцены '{scene['scene_id']}' отсутствует поле 'choices'"
+            
+        choices = scene['choices']
+        if not isinstance(choices, list):
+            return False, f"У сцены '{scene['scene_id']}' поле 'choices' должно быть массивом"
+            
+        scene_id = scene['scene_id']
+        
+        # Проверяем обязательные поля каждого выбора
+        for i, choice in enumerate(choices):
+            if not isinstance(choice, dict):
+                return False, f"У сцены '{scene_id}' выбор #{i+1} должен быть объектом"
+                
+            if 'text' not in choice:
+                return False, f"У сцены '{scene_id}' в выборе #{i+1} отсутствует поле 'text'"
+                
+            if 'next_scene' not in choice:
+                return False, f"У сцены '{scene_id}' в выборе #{i+1} отсутствует поле 'next_scene'"
+                
+            if known_scenes is not None and choice['next_scene'] not in known_scenes:
+                return False, f"Найдены ссылки на несуществующие сцены: '{choice['next_scene']}'"
+                
+        return True, "Сцена корректна"
+        
     def validate_file(self, filename: str) -> Tuple[bool, str, Optional[Dict]]:
         """
         Поэтапно проверяет файл с игровыми сценариями.
@@ -110,14 +136,15 @@ class GameValidator:
         Returns:
             Tuple[bool, str, Optional[Dict]]: (успех, сообщение, данные)
         """
-        # Этап 1: Проверка валидности JSON
+        # Этап 1: Проверка валидности JSON (или чтение .qbin файла)
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = load_quest_data(filename)
         except FileNotFoundError:
             return False, "Ошибка: Файл не найден", None
         except json.JSONDecodeError as e:
             return False, f"Файл не является валидным JSON. Ошибка: {e}", None
+        except QuestFormatError as e:
+            return False, f"Ошибка чтения скомпилированного квеста: {e}", None
         except Exception as e:
             return False, f"Ошибка чтения файла: {e}", None
             
@@ -148,84 +175,163 @@ class GameValidator:
                         
         return list(invalid_refs)
         
+    def _start_scene(self, start: str = 'start') -> Optional[str]:
+        """Стартовая сцена: start, а если её нет - первая сцена квеста."""
+        if start in self.scenes:
+            return start
+        return next(iter(self.scenes.keys()), None)
+
+    def _distances(self, start: str, blocked: Optional[str] = None) -> Dict[str, int]:
+        """
+        Обход в ширину: число переходов от start до каждой достижимой сцены.
+
+        Args:
+            start: Начальная сцена
+            blocked: Сцена, через которую нельзя проходить
+        """
+        distances = {start: 0}
+        queue = deque([start])
+        while queue:
+            current = queue.popleft()
+            for next_scene in self.graph.get(current, []):
+                if next_scene in self.scenes and next_scene != blocked and next_scene not in distances:
+                    distances[next_scene] = distances[current] + 1
+                    queue.append(next_scene)
+        return distances
+
     def _check_branch_depth(self) -> bool:
         """
-        Проверяет наличие ветки глубиной минимум 3 сцены.
-        
+        Проверяет наличие ветки глубиной минимум 3 сцены: пути без повторов
+        сцен от старта до конечной сцены (без выборов).
+
+        Перебор путей растёт экспоненциально с размером графа, поэтому
+        используется обход в ширину: конечная сцена на расстоянии 2+ даёт
+        такой путь сразу (кратчайший путь не повторяет сцен); соседней со
+        стартом конечной сцене нужен другой предшественник, достижимый от
+        старта в обход неё самой.
+
         Returns:
             bool: True если найдена подходящая ветка
         """
-        start_scene = 'start'
-        if start_scene not in self.scenes:
-            # Ищем любую стартовую сцену
-            start_scene = next(iter(self.scenes.keys()), None)
-            if not start_scene:
-                return False
-                
-        visited_paths = []
-        
-        def dfs(current: str, path: List[str], visited: set) -> None:
-            """Обход в глубину для поиска всех путей."""
-            if current in visited:
-                return
-                
-            new_path = path + [current]
-            new_visited = visited.copy()
-            new_visited.add(current)
-            
-            next_scenes = self.graph.get(current, [])
-            
-            if not next_scenes:  # Конечная сцена
-                visited_paths.append(new_path)
-            else:
-                for next_scene in next_scenes:
-                    if next_scene in self.scenes:  # Проверяем, что сцена существует
-                        dfs(next_scene, new_path, new_visited)
-                        
-        dfs(start_scene, [], set())
-        
-        # Проверяем, есть ли пути длиной 3+ сцены
-        for path in visited_paths:
-            if len(path) >= 3:
+        start_scene = self._start_scene()
+        if not start_scene:
+            return False
+
+        distances = self._distances(start_scene)
+        for scene_id, distance in distances.items():
+            if self.graph.get(scene_id):
+                continue  # Не конечная сцена
+            if distance >= 2:
                 return True
-                
+            if distance == 1:
+                around = self._distances(start_scene, blocked=scene_id)
+                if any(scene_id in self.graph.get(other, []) for other in around if other != start_scene):
+                    return True
         return False
-        
-    def find_all_paths(self, start: str = 'start') -> List[List[str]]:
+
+    def path_stats(self, start: str = 'start') -> Dict[str, Any]:
+        """
+        Статистика путей от старта до конечных сцен без их перебора.
+
+        Для графа без циклов количество путей и их длины считаются
+        динамическим программированием по сценам (каждая сцена - один раз).
+        Если от старта достижим цикл, путей без повторов сцен может быть
+        экспоненциально много, а самый длинный из них - NP-трудная задача:
+        тогда считается только минимальная длина (обходом в ширину).
+
+        Args:
+            start: Стартовая сцена
+
+        Returns:
+            Dict[str, Any]: {"paths", "min_length", "max_length", "has_cycles"};
+            длины в сценах, None - если путей нет или для графа с циклами
+        """
+        start = self._start_scene(start)
+        if not start:
+            return {"paths": 0, "min_length": None, "max_length": None, "has_cycles": False}
+
+        # Сцены в порядке окончания обхода в глубину (итеративно, без рекурсии)
+        order, state = [], {start: 1}  # 1 - в обходе, 2 - обработана
+        has_cycles = False
+        stack = [(start, iter(self.graph.get(start, [])))]
+        while stack:
+            current, children = stack[-1]
+            for next_scene in children:
+                if next_scene not in self.scenes:
+                    continue
+                if state.get(next_scene) == 1:
+                    has_cycles = True
+                elif next_scene not in state:
+                    state[next_scene] = 1
+                    stack.append((next_scene, iter(self.graph.get(next_scene, []))))
+                    break
+            else:
+                state[current] = 2
+                order.append(current)
+                stack.pop()
+
+        if has_cycles:
+            distances = self._distances(start)
+            endings = [distances[scene_id] + 1 for scene_id in distances if not self.graph.get(scene_id)]
+            return {"paths": None, "min_length": min(endings, default=None),
+                    "max_length": None, "has_cycles": True}
+
+        # Потомки обработаны раньше предков: (количество путей, мин. длина, макс. длина)
+        stats: Dict[str, Tuple[int, int, int]] = {}
+        for scene_id in order:
+            children = [stats[next_scene] for next_scene in self.graph.get(scene_id, [])
+                        if next_scene in self.scenes]
+            if not self.graph.get(scene_id):
+                stats[scene_id] = (1, 1, 1)
+            elif not any(count for count, _, _ in children):
+                stats[scene_id] = (0, 0, 0)
+            else:
+                reachable = [child for child in children if child[0]]
+                stats[scene_id] = (sum(count for count, _, _ in reachable),
+                                   min(low for _, low, _ in reachable) + 1,
+                                   max(high for _, _, high in reachable) + 1)
+        count, low, high = stats[start]
+        return {"paths": count, "min_length": low if count else None,
+                "max_length": high if count else None, "has_cycles": False}
+
+    def find_all_paths(self, start: str = 'start', limit: Optional[int] = None) -> List[List[str]]:
         """
         Находит все возможные пути в игре.
-        
+
+        Количество путей растёт экспоненциально с размером графа: для
+        количества и длин путей используйте path_stats.
+
         Args:
             start: Стартовая сцена
-            
+            limit: Максимальное количество путей (None - все)
+
         Returns:
             List[List[str]]: Список всех путей
         """
-        if start not in self.scenes:
-            start = next(iter(self.scenes.keys()), None)
-            if not start:
-                return []
-                
+        start = self._start_scene(start)
+        if not start:
+            return []
+
         all_paths = []
-        
-        def dfs(current: str, path: List[str], visited: set) -> None:
-            if current in visited:
-                return
-                
-            new_path = path + [current]
-            new_visited = visited.copy()
-            new_visited.add(current)
-            
-            next_scenes = self.graph.get(current, [])
-            
-            if not next_scenes:
-                all_paths.append(new_path)
+        path = [start]
+        on_path = {start}
+        # Итеративный обход в глубину: рекурсия упиралась бы в глубину квеста
+        stack = [iter(self.graph.get(start, []))]
+        if not self.graph.get(start):
+            all_paths.append(list(path))
+        while stack and (limit is None or len(all_paths) < limit):
+            for next_scene in stack[-1]:
+                if next_scene in self.scenes and next_scene not in on_path:
+                    path.append(next_scene)
+                    on_path.add(next_scene)
+                    next_scenes = self.graph.get(next_scene, [])
+                    if not next_scenes:
+                        all_paths.append(list(path))
+                    stack.append(iter(next_scenes))
+                    break
             else:
-                for next_scene in next_scenes:
-                    if next_scene in self.scenes:
-                        dfs(next_scene, new_path, new_visited)
-                        
-        dfs(start, [], set())
+                stack.pop()
+                on_path.discard(path.pop())
         return all_paths
 
 
@@ -326,19 +432,22 @@ def main():
                 
         print(f"• Количество развилок: {branches}")
         
-        # Анализируем пути
-        paths = validator.find_all_paths()
-        if paths:
-            max_depth = max(len(path) for path in paths)
-            min_depth = min(len(path) for path in paths)
-            print(f"• Максимальная глубина пути: {max_depth} сцен")
-            print(f"• Минимальная глубина пути: {min_depth} сцен")
-            print(f"• Общее количество возможных путей: {len(paths)}")
+        # Анализируем пути (количество и длины - без перебора путей)
+        stats = validator.path_stats()
+        if stats["min_length"] is not None:
+            if stats["has_cycles"]:
+                print("• В квесте есть циклы: количество путей и максимальная глубина не считаются")
+            else:
+                print(f"• Максимальная глубина пути: {stats['max_length']} сцен")
+            print(f"• Минимальная глубина пути: {stats['min_length']} сцен")
+            if stats["paths"] is not None:
+                print(f"• Общее количество возможных путей: {stats['paths']}")
             
-            if args.verbose:
-                print(f"\nВсе возможные пути:")
-                for i, path in enumerate(paths, 1):
-                    print(f"  {i}. {' → '.join(path)} ({len(path)} сцен)")
+            paths = validator.find_all_paths(limit=MAX_LISTED_PATHS)
+            print(f"\nВсе возможные пути:" if len(paths) < MAX_LISTED_PATHS
+                  else f"\nПервые {MAX_LISTED_PATHS} путей:")
+            for i, path in enumerate(paths, 1):
+                print(f"  {i}. {' → '.join(path)} ({len(path)} сцен)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Кэш похожих промптов: MinHash-сигнатуры символьных n-грамм и поиск кандидатов через LSH
+
+import argparse
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set
+
+from metrics import STAGE_SECONDS, Counter
+
+# Длина символьной n-граммы (шингла)
+SHINGLE_SIZE = 5
+# Сигнатура из NUM_PERM минимальных хешей делится на BANDS полос по ROWS значений.
+# Промпты попадают в кандидаты, если совпала хотя бы одна полоса: при сходстве
+# по Жаккару s вероятность этого 1 - (1 - s^ROWS)^BANDS: 0.06 при s = 0.5, 0.5 при s ~ 0.7,
+# 0.95 при s = 0.8, 0.99 при s = 0.85
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# Порог сходства по умолчанию (коэффициент Жаккара множеств n-грамм)
+DEFAULT_THRESHOLD = 0.8
+# Кандидаты с оценкой по сигнатуре ниже порога на эту величину не проверяются точно
+ESTIMATE_MARGIN = 0.1
+
+MODES = ("generate", "offer", "reuse")
+
+# Хеш-функции (a * x + b) mod P; коэффициенты фиксированы, чтобы сигнатуры
+# совпадали между запусками
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_SIGNATURE = struct.Struct(f"<{NUM_PERM}Q")
+
+# Подписи полей шаблона промпта ("Жанр - ...", "Главный герой: ...") одинаковы
+# у всех промптов и не должны влиять на сходство
+FIELD_LABEL_RE = re.compile(
+    r"^\s*(жанр|главный герой|герой|цель( квеста)?|сеттинг|genre|hero|goal|setting)\s*[:\-—–]\s*",
+    re.IGNORECASE | re.MULTILINE,
+)
+NON_WORD_RE = re.compile(r"[^0-9a-zа-я]+")
+
+PROMPT_CACHE_LOOKUPS = Counter(
+    "prompt_cache_lookups",
+    "Поиск похожих промптов перед генерацией",
+    ["result"],
+)
+
+
+def normalize(prompt: str) -> str:
+    """Приводит промпт к виду для сравнения: без подписей полей, регистра и пунктуации."""
+    text = FIELD_LABEL_RE.sub(" ", prompt).lower().replace("ё", "е")
+    return " ".join(NON_WORD_RE.sub(" ", text).split())
+
+
+def shingles(prompt: str) -> Set[int]:
+    """Множество хешей символьных n-грамм нормализованного промпта."""
+    text = normalize(prompt)
+    if len(text) <= SHINGLE_SIZE:
+        return {zlib.crc32(text.encode("utf-8"))} if text else set()
+    return {
+        zlib.crc32(text[i:i + SHINGLE_SIZE].encode("utf-8"))
+        for i in range(len(text) - SHINGLE_SIZE + 1)
+    }
+
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    """Коэффициент Жаккара двух множеств."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def signature(items: Set[int]) -> List[int]:
+    """
+    MinHash-сигнатура множества: минимум каждой из NUM_PERM хеш-функций.
+
+    Доля совпадающих позиций двух сигнатур - несмещённая оценка
+    коэффициента Жаккара исходных множеств.
+    """
+    if not items:
+        return [_PRIME] * NUM_PERM
+    return [min((a * x + b) % _PRIME for x in items) for a, b in _PERMUTATIONS]
+
+
+def estimate(sig_a: List[int], sig_b: List[int]) -> float:
+    """Оценка сходства по Жаккару по двум сигнатурам."""
+    return sum(x == y for x, y in zip(sig_a, sig_b)) / NUM_PERM
+
+
+def band_keys(sig: List[int]) -> List[int]:
+    """Ключи корзин LSH: хеш каждой полосы сигнатуры (знаковое 64-битное число для SQLite)."""
+    packed = _SIGNATURE.pack(*sig)
+    keys = []
+    for band in range(BANDS):
+        data = packed[band * ROWS * 8:(band + 1) * ROWS * 8]
+        digest = hashlib.blake2b(data, digest_size=8, person=band.to_bytes(2, "little")).digest()
+        keys.append(int.from_bytes(digest, "little", signed=True))
+    return keys
+
+
+class PromptCache:
+    """
+    Индекс промптов уже сгенерированных квестов.
+
+    Для каждого промпта хранятся MinHash-сигнатура и ключи корзин LSH.
+    Поиск читает только промпты, у которых совпала хотя бы одна полоса
+    сигнатуры, поэтому его стоимость не растёт линейно с историей. Кандидаты
+    с близкой оценкой проверяются точным сравнением n-грамм. Записи
+    ссылаются на квест и версию, в которой он был сгенерирован и прошёл
+    валидацию; каждый поток получает собственное соединение.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS prompts (
+            id INTEGER PRIMARY KEY,
+            quest_name TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            prompt TEXT NOT NULL,
+            signature BLOB NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS prompts_quest ON prompts (quest_name);
+        CREATE TABLE IF NOT EXISTS prompt_buckets (
+            band INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            prompt_id INTEGER NOT NULL REFERENCES prompts (id) ON DELETE CASCADE,
+            PRIMARY KEY (band, bucket, prompt_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS prompt_buckets_prompt ON prompt_buckets (prompt_id);
+    """
+
+    def __init__(self, db_path, threshold: float = DEFAULT_THRESHOLD):
+        self.db_path = str(db_path)
+        self.threshold = threshold
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_guard = threading.Lock()
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Возвращает соединение текущего потока, создавая его при необходимости."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+            with self._connections_guard:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def add(self, prompt: str, quest_name: str, version: int) -> None:
+        """
+        Запоминает промпт сгенерированного квеста.
+
+        Args:
+            prompt: Пользовательский промпт
+            quest_name: Название квеста
+            version: Версия квеста сразу после генерации
+        """
+        items = shingles(prompt)
+        if not items:
+            return
+        sig = signature(items)
+        with self._transaction() as conn:
+            prompt_id = conn.execute(
+                "INSERT INTO prompts (quest_name, version, prompt, signature, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (quest_name, version, prompt, _SIGNATURE.pack(*sig), time.time()),
+            ).lastrowid
+            conn.executemany(
+                "INSERT OR IGNORE INTO prompt_buckets (band, bucket, prompt_id) VALUES (?, ?, ?)",
+                [(band, key, prompt_id) for band, key in enumerate(band_keys(sig))],
+            )
+
+    @STAGE_SECONDS.time(stage="prompt_cache")
+    def find_similar(self, prompt: str, limit: int = 5,
+                     threshold: Optional[float] = None) -> List[Dict]:
+        """
+        Ищет ранее сгенерированные квесты с похожим промптом.
+
+        Args:
+            prompt: Пользовательский промпт
+            limit: Сколько результатов вернуть
+            threshold: Минимальное сходство (по умолчанию порог кэша)
+
+        Returns:
+            List[Dict]: По убыванию сходства: id, quest_name, version, prompt,
+            similarity (коэффициент Жаккара n-грамм); для каждого квеста -
+            лучшая запись
+        """
+        threshold = self.threshold if threshold is None else threshold
+        items = shingles(prompt)
+        if not items:
+            return []
+        sig = signature(items)
+        keys = band_keys(sig)
+        conn = self._connect()
+        # Условия через OR: каждое ищется по первичному ключу, а (band, bucket) IN (VALUES ...)
+        # SQLite выполняет полным просмотром таблицы корзин
+        rows = conn.execute(
+            "SELECT id, quest_name, version, prompt, signature FROM prompts WHERE id IN ("
+            "SELECT prompt_id FROM prompt_buckets WHERE "
+            + " OR ".join("(band = ? AND bucket = ?)" for _ in keys) + ")",
+            [value for band, key in enumerate(keys) for value in (band, key)],
+        ).fetchall()
+
+        best: Dict[str, Dict] = {}
+        for prompt_id, quest_name, version, text, blob in rows:
+            if estimate(sig, _SIGNATURE.unpack(blob)) < threshold - ESTIMATE_MARGIN:
+                continue
+            similarity = jaccard(items, shingles(text))
+            if similarity < threshold:
+                continue
+            current = best.get(quest_name)
+            # Из нескольких промптов одного квеста берём самый похожий, при равенстве - новый
+            if current is None or (similarity, prompt_id) > (current["similarity"], current["id"]):
+                best[quest_name] = {
+                    "id": prompt_id,
+                    "quest_name": quest_name,
+                    "version": version,
+                    "prompt": text,
+                    "similarity": round(similarity, 4),
+                }
+        results = sorted(best.values(), key=lambda item: (-item["similarity"], -item["id"]))[:limit]
+        PROMPT_CACHE_LOOKUPS.inc(result="hit" if results else "miss")
+        return results
+
+    def discard(self, prompt_id: int) -> None:
+        """Удаляет запись, квест которой больше недоступен."""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM prompts WHERE id = ?", (prompt_id,))
+
+    def remove_quest(self, quest_name: str) -> None:
+        """Удаляет все промпты квеста."""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM prompts WHERE quest_name = ?", (quest_name,))
+
+    def count(self) -> int:
+        """Количество запомненных промптов."""
+        return self._connect().execute("SELECT COUNT(*) FROM prompts").fetchone()[0]
+
+    def close(self) -> None:
+        with self._connections_guard:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def cache_mode(value: Optional[str] = None) -> str:
+    """
+    Режим кэша для запроса генерации.
+
+    Args:
+        value: Режим из запроса; None - режим по умолчанию из QUEST_PROMPT_CACHE
+
+    Returns:
+        str: "generate" (всегда генерировать), "offer" (вернуть похожие квесты
+        вместо генерации) или "reuse" (сохранить самый похожий квест под новым названием)
+
+    Raises:
+        ValueError: Если режим неизвестен
+    """
+    if value is None:
+        value = os.getenv("QUEST_PROMPT_CACHE", "0")
+        if value in ("0", ""):
+            return "generate"
+    if value not in MODES:
+        raise ValueError(f"Неизвестный режим кэша промптов: {value} (допустимо: {', '.join(MODES)})")
+    return value
+
+
+def get_prompt_cache(project_root=None) -> Optional[PromptCache]:
+    """
+    Открывает кэш похожих промптов.
+
+    QUEST_PROMPT_CACHE: offer или reuse - кэш включён и задаёт режим по
+    умолчанию (по умолчанию 0 - отключён).
+    QUEST_PROMPT_CACHE_DB: путь к базе (по умолчанию prompt_cache.db в корне проекта).
+    QUEST_PROMPT_CACHE_THRESHOLD: минимальное сходство промптов (по умолчанию 0.8).
+    """
+    if os.getenv("QUEST_PROMPT_CACHE", "0") in ("0", ""):
+        return None
+    root = Path(project_root) if project_root else Path(__file__).parent
+    return PromptCache(
+        os.getenv("QUEST_PROMPT_CACHE_DB", str(root / "prompt_cache.db")),
+        threshold=float(os.getenv("QUEST_PROMPT_CACHE_THRESHOLD", str(DEFAULT_THRESHOLD))),
+    )
+
+
+def main():
+    """Главная функция программы."""
+    script_dir = Path(__file__).parent
+    parser = argparse.ArgumentParser(description='Поиск квестов с похожим промптом')
+    parser.add_argument('prompt', nargs='?', help='Промпт (по умолчанию input_example.txt)')
+    parser.add_argument('--db', default=os.getenv("QUEST_PROMPT_CACHE_DB", str(script_dir / "prompt_cache.db")),
+                        help='Путь к базе кэша')
+    parser.add_argument('-t', '--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Минимальное сходство')
+    parser.add_argument('-n', '--limit', type=int, default=5, help='Количество результатов')
+    args = parser.parse_args()
+
+    prompt = args.prompt
+    if prompt is None:
+        with open(script_dir / "input_example.txt", "r", encoding="utf-8") as f:
+            prompt = f.read()
+
+    cache = PromptCache(args.db, threshold=args.threshold)
+    results = cache.find_similar(prompt, limit=args.limit)
+    print(f"Промптов в кэше: {cache.count()}")
+    if not results:
+        print("Похожих промптов не найдено")
+    for result in results:
+        print(f"{result['quest_name']} (версия {result['version']}, сходство {result['similarity']:.2f})")
+        print(f"  {' '.join(result['prompt'].split())}")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Точечные изменения квеста: операции редактора графа
+
+import copy
+from typing import Dict, List, Optional, Tuple
+
+from process import GameValidator
+from storage import merge_by_scene_id
+
+# Операции, меняющие структуру графа (после них нужна полная валидация)
+GRAPH_OPERATIONS = {"add_choice", "remove_choice", "set_choice_target", "add_scene", "remove_scene"}
+
+
+class PatchError(ValueError):
+    """Операцию нельзя применить к квесту."""
+
+
+class QuestPatch:
+    """
+    Применяет список операций к квесту, копируя только затронутые сцены.
+
+    Поддерживаемые операции:
+        {"op": "move_node", "scene_id": ..., "x": ..., "y": ...}
+        {"op": "set_scene_text", "scene_id": ..., "text": ...}
+        {"op": "set_choice_text", "scene_id": ..., "index": ..., "text": ...}
+        {"op": "set_choice_target", "scene_id": ..., "index": ..., "next_scene": ...}
+        {"op": "add_choice", "scene_id": ..., "text": ..., "next_scene": ..., "index": ...}
+        {"op": "remove_choice", "scene_id": ..., "index": ...}
+        {"op": "add_scene", "scene": {...}, "x": ..., "y": ...}
+        {"op": "remove_scene", "scene_id": ...}
+    """
+
+    def __init__(self, quest_data: Dict, node_positions: Optional[List]):
+        self.quest_data = quest_data
+        self.node_positions = node_positions
+        self._scenes = {
+            scene['scene_id']: scene for scene in quest_data.get('scenes', [])
+            if isinstance(scene, dict) and 'scene_id' in scene
+        }
+        self._positions = {
+            item['scene_id']: item for item in (node_positions or [])
+            if isinstance(item, dict) and 'scene_id' in item
+        }
+        self.scene_changes: Dict[str, Optional[Dict]] = {}
+        self.position_changes: Dict[str, Optional[Dict]] = {}
+        self.graph_changed = False
+
+    def _scene_exists(self, scene_id: str) -> bool:
+        if scene_id in self.scene_changes:
+            return self.scene_changes[scene_id] is not None
+        return scene_id in self._scenes
+
+    def _scene(self, scene_id: str) -> Dict:
+        """Возвращает изменяемую копию сцены."""
+        if not self._scene_exists(scene_id):
+            raise PatchError(f"Сцена '{scene_id}' не найдена")
+        if scene_id not in self.scene_changes:
+            self.scene_changes[scene_id] = copy.deepcopy(self._scenes[scene_id])
+        return self.scene_changes[scene_id]
+
+    @staticmethod
+    def _choice_index(scene: Dict, op: Dict, allow_end: bool = False) -> int:
+        index = op.get('index')
+        limit = len(scene['choices']) + (1 if allow_end else 0)
+        if not isinstance(index, int) or not 0 <= index < limit:
+            raise PatchError(f"У сцены '{scene['scene_id']}' нет выбора с индексом {index}")
+        return index
+
+    @staticmethod
+    def _text(op: Dict, field: str = 'text') -> str:
+        value = op.get(field)
+        if not isinstance(value, str):
+            raise PatchError(f"Поле '{field}' должно быть строкой")
+        return value
+
+    def _set_position(self, scene_id: str, op: Dict) -> None:
+        x, y = op.get('x'), op.get('y')
+        if not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
+            raise PatchError("Координаты 'x' и 'y' должны быть числами")
+        if self.node_positions is None:
+            raise PatchError("Позиции узлов ещё не построены")
+        self.position_changes[scene_id] = {
+            'scene_id': scene_id,
+            'position': {'x': int(x), 'y': int(y)}
+        }
+
+    def apply(self, operation: Dict) -> None:
+        """
+        Применяет одну операцию.
+
+        Args:
+            operation: Описание операции
+
+        Raises:
+            PatchError: Если операция некорректна
+        """
+        if not isinstance(operation, dict):
+            raise PatchError("Операция должна быть объектом")
+        op = operation.get('op')
+        scene_id = operation.get('scene_id')
+
+        if op == 'move_node':
+            if not self._scene_exists(scene_id):
+                raise PatchError(f"Сцена '{scene_id}' не найдена")
+            self._set_position(scene_id, operation)
+        elif op == 'set_scene_text':
+            self._scene(scene_id)['text'] = self._text(operation)
+        elif op == 'set_choice_text':
+            scene = self._scene(scene_id)
+            scene['choices'][self._choice_index(scene, operation)]['text'] = self._text(operation)
+        elif op == 'set_choice_target':
+            scene = self._scene(scene_id)
+            index = self._choice_index(scene, operation)
+            scene['choices'][index]['next_scene'] = self._text(operation, 'next_scene')
+        elif op == 'add_choice':
+            scene = self._scene(scene_id)
+            if operation.get('index') is None:
+                operation = dict(operation, index=len(scene['choices']))
+            index = self._choice_index(scene, operation, allow_end=True)
+            scene['choices'].insert(index, {
+                'text': self._text(operation),
+                'next_scene': self._text(operation, 'next_scene')
+            })
+        elif op == 'remove_choice':
+            scene = self._scene(scene_id)
+            del scene['choices'][self._choice_index(scene, operation)]
+        elif op == 'add_scene':
+            scene = operation.get('scene')
+            if not isinstance(scene, dict) or not isinstance(scene.get('scene_id'), str):
+                raise PatchError("Поле 'scene' должно быть сценой с 'scene_id'")
+            if self._scene_exists(scene['scene_id']):
+                raise PatchError(f"Сцена '{scene['scene_id']}' уже существует")
+            self.scene_changes[scene['scene_id']] = copy.deepcopy(scene)
+            if 'x' in operation or 'y' in operation:
+                self._set_position(scene['scene_id'], operation)
+        elif op == 'remove_scene':
+            if not self._scene_exists(scene_id):
+                raise PatchError(f"Сцена '{scene_id}' не найдена")
+            self.scene_changes[scene_id] = None
+            if scene_id in self._positions or scene_id in self.position_changes:
+                self.position_changes[scene_id] = None
+        else:
+            raise PatchError(f"Неизвестная операция: {op}")
+
+        if op in GRAPH_OPERATIONS:
+            self.graph_changed = True
+
+    def apply_all(self, operations: List[Dict]) -> None:
+        """Применяет операции по порядку; первая ошибка прерывает весь патч."""
+        for i, operation in enumerate(operations):
+            try:
+                self.apply(operation)
+            except PatchError as e:
+                raise PatchError(f"Операция #{i+1}: {e}") from None
+
+    def validate(self) -> Tuple[bool, str]:
+        """
+        Проверяет только изменённые сцены; граф целиком проверяется,
+        лишь если операции изменили связи между сценами.
+
+        Returns:
+            Tuple[bool, str]: (успех, сообщение)
+        """
+        validator = GameValidator()
+
+        if self.graph_changed:
+            scenes = merge_by_scene_id(self.quest_data.get('scenes', []), self.scene_changes)
+            return validator.validate_data(dict(self.quest_data, scenes=scenes))
+
+        known_scenes = {
+            scene_id for scene_id in set(self._scenes) | set(self.scene_changes)
+            if self._scene_exists(scene_id)
+        }
+        for scene in self.scene_changes.values():
+            success, message = validator.validate_scene(scene, known_scenes)
+            if not success:
+                return False, message
+        return True, "Все проверки пройдены успешно"
@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Скомпилированный двоичный формат квеста: загрузка через mmap без разбора JSON
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import serialization
+from engine import MISSING_SCENE, CompiledQuest
+
+MAGIC = b"QBIN"
+FORMAT_VERSION = 1
+SUFFIX = ".qbin"
+
+# Заголовок: сигнатура, версия формата, размер и время изменения исходного
+# JSON, количество записей в таблицах, дополнительные поля квеста и смещения разделов
+HEADER = struct.Struct("<4sHHQqIIIIIQQQQQ")
+ID_FIELDS = 2      # имя (строка), строка таблицы сцен
+ROW_FIELDS = 6     # scene_id (номер), текст, первый выбор, число выборов, доп. поля, флаги
+CHOICE_FIELDS = 4  # текст, next_scene (строка), номер целевой сцены, доп. поля
+STRING_FIELDS = 2  # смещение в блоке текстов, длина в байтах
+
+# Отсутствующее поле (строка или дополнительные поля)
+NONE = 0xFFFFFFFF
+# Флаги строки таблицы сцен
+HAS_CHOICES = 1
+
+# Поля, хранящиеся в таблицах; остальные поля сцены или выбора сохраняются как JSON
+SCENE_KEYS = ("scene_id", "text", "choices")
+CHOICE_KEYS = ("text", "next_scene")
+
+
+class QuestFormatError(Exception):
+    """Квест нельзя записать в двоичном формате или файл повреждён."""
+
+
+def _string_field(value, what: str):
+    if value is not None and not isinstance(value, str):
+        raise QuestFormatError(f"{what} должно быть строкой")
+    return value
+
+
+def compile_quest(quest_data: Dict, source_size: int = 0, source_mtime_ns: int = 0) -> bytes:
+    """
+    Компилирует квест в двоичный формат.
+
+    Все строки (id сцен, тексты, переходы) хранятся один раз в общем
+    блоке текстов, таблицы ссылаются на них номерами; переходы
+    дополнительно разрешены в номера сцен. Поля, которых нет в таблицах,
+    сохраняются как JSON, поэтому to_dict() возвращает исходный квест.
+
+    Args:
+        quest_data: Данные квеста ({"scenes": [...]})
+        source_size: Размер исходного JSON файла (для проверки актуальности)
+        source_mtime_ns: Время изменения исходного JSON файла
+
+    Returns:
+        bytes: Содержимое .qbin файла
+
+    Raises:
+        QuestFormatError: Если структура квеста не подходит для двоичного формата
+    """
+    if not isinstance(quest_data, dict) or not isinstance(quest_data.get("scenes"), list):
+        raise QuestFormatError("В квесте отсутствует массив 'scenes'")
+
+    strings: Dict[str, int] = {}
+    blob = bytearray()
+    string_table = array("I")
+
+    def intern(value: Optional[str]) -> int:
+        if value is None:
+            return NONE
+        number = strings.get(value)
+        if number is None:
+            data = value.encode("utf-8")
+            number = strings[value] = len(strings)
+            string_table.extend((len(blob), len(data)))
+            blob.extend(data)
+        return number
+
+    def extras(item: Dict, keys: Tuple[str, ...]) -> int:
+        rest = {key: value for key, value in item.items() if key not in keys}
+        return intern(serialization.dumps(rest)) if rest else NONE
+
+    scenes = quest_data["scenes"]
+    id_numbers: Dict[str, int] = {}
+    id_rows: Dict[str, int] = {}
+    for row, scene in enumerate(scenes):
+        if not isinstance(scene, dict) or "scene_id" not in scene:
+            raise QuestFormatError("Найден сценарий без поля 'scene_id'")
+        scene_id = _string_field(scene["scene_id"], "scene_id")
+        if scene_id not in id_numbers:
+            id_numbers[scene_id] = len(id_numbers)
+            # id сцен лежат в начале блока текстов: загрузка квеста читает только их
+            intern(scene_id)
+        # При повторяющихся scene_id побеждает последняя сцена, как в CompiledQuest
+        id_rows[scene_id] = row
+
+    rows = array("I")
+    choices = array("I")
+    for scene in scenes:
+        scene_choices = scene.get("choices")
+        if scene_choices is not None and not isinstance(scene_choices, list):
+            raise QuestFormatError(f"У сцены '{scene['scene_id']}' поле 'choices' должно быть массивом")
+        first_choice = len(choices) // CHOICE_FIELDS
+        for choice in scene_choices or []:
+            if not isinstance(choice, dict):
+                raise QuestFormatError(f"У сцены '{scene['scene_id']}' выбор должен быть объектом")
+            next_scene = _string_field(choice.get("next_scene"), "next_scene")
+            choices.extend((
+                intern(_string_field(choice.get("text"), "text")),
+                intern(next_scene),
+                id_numbers.get(next_scene, MISSING_SCENE),
+                extras(choice, CHOICE_KEYS),
+            ))
+        rows.extend((
+            id_numbers[scene["scene_id"]],
+            intern(_string_field(scene.get("text"), "text")),
+            first_choice,
+            len(scene_choices or []),
+            extras(scene, SCENE_KEYS),
+            HAS_CHOICES if scene_choices is not None else 0,
+        ))
+
+    ids = array("I")
+    for scene_id in id_numbers:
+        ids.extend((intern(scene_id), id_rows[scene_id]))
+    quest_extras = extras(quest_data, ("scenes",))
+
+    sections = [ids, rows, choices, string_table]
+    if sys.byteorder != "little":
+        for section in sections:
+            section.byteswap()
+    offsets = []
+    position = HEADER.size
+    for section in sections:
+        offsets.append(position)
+        position += len(section) * section.itemsize
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, 0, source_size, source_mtime_ns,
+        len(id_numbers), len(scenes), len(choices) // CHOICE_FIELDS, len(strings), quest_extras,
+        *offsets, position,
+    )
+    return b"".join([header] + [section.tobytes() for section in sections] + [bytes(blob)])
+
+
+class _Table:
+    """Таблица беззнаковых 32-битных чисел в отображённом файле (записи по fields чисел)."""
+
+    def __init__(self, buffer: memoryview, offset: int, count: int, fields: int):
+        data = buffer[offset:offset + count * fields * 4]
+        if sys.byteorder == "little":
+            self.values = data.cast("I")
+        else:
+            self.values = array("I", data.tobytes())
+            self.values.byteswap()
+        self.fields = fields
+
+    def row(self, number: int) -> Tuple[int, ...]:
+        start = number * self.fields
+        return tuple(self.values[start:start + self.fields])
+
+    def field(self, number: int, field: int) -> int:
+        return self.values[number * self.fields + field]
+
+    def release(self) -> None:
+        if isinstance(self.values, memoryview):
+            self.values.release()
+
+
+class _TextsView:
+    """Тексты сцен по номерам сцен движка; строки декодируются при обращении."""
+
+    def __init__(self, quest: "BinaryQuest"):
+        self._quest = quest
+
+    def __len__(self) -> int:
+        return self._quest.id_count
+
+    def __getitem__(self, number: int) -> str:
+        if not 0 <= number < len(self):
+            raise IndexError(number)
+        text = self._quest.string(self._quest.rows.field(self._quest.ids.field(number, 1), 1))
+        return "Описание сценария отсутствует." if text is None else text
+
+
+class _ChoicesView:
+    """Выборы сцен по номерам сцен движка в виде ((текст, номер сцены), ...)."""
+
+    def __init__(self, quest: "BinaryQuest"):
+        self._quest = quest
+
+    def __len__(self) -> int:
+        return self._quest.id_count
+
+    def __getitem__(self, number: int) -> Tuple[Tuple[str, int], ...]:
+        if not 0 <= number < len(self):
+            raise IndexError(number)
+        quest = self._quest
+        _, _, first, count, _, _ = quest.rows.row(quest.ids.field(number, 1))
+        result = []
+        for choice in range(first, first + count):
+            text = quest.string(quest.choices.field(choice, 0))
+            result.append(("Неизвестное действие" if text is None else text, quest.choices.field(choice, 2)))
+        return tuple(result)
+
+
+class BinaryQuest:
+    """
+    Квест в двоичном формате, отображённый в память.
+
+    При открытии читается только заголовок: таблицы сцен и выборов
+    доступны напрямую из отображения, строки декодируются при обращении,
+    поэтому загрузка не зависит от объёма текстов.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: Путь к .qbin файлу
+
+        Raises:
+            QuestFormatError: Если файл не является квестом в поддерживаемом формате
+        """
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise QuestFormatError(f"Файл '{path}' пуст")
+        self._buffer = memoryview(self._mmap)
+        try:
+            self._open()
+        except (struct.error, TypeError, ValueError) as e:
+            self.close()
+            raise QuestFormatError(f"Файл '{path}' повреждён: {e}")
+
+    def _open(self) -> None:
+        if len(self._buffer) < HEADER.size:
+            raise ValueError("файл меньше заголовка")
+        (magic, version, _, self.source_size, self.source_mtime_ns,
+         self.id_count, self.row_count, self.choice_count, self.string_count, self._quest_extras,
+         ids_offset, rows_offset, choices_offset, strings_offset, self._blob_offset) = \
+            HEADER.unpack_from(self._buffer)
+        if magic != MAGIC:
+            raise ValueError("неверная сигнатура")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"неподдерживаемая версия формата {version}")
+        if strings_offset + self.string_count * STRING_FIELDS * 4 > len(self._buffer):
+            raise ValueError("файл обрезан")
+        self.ids = _Table(self._buffer, ids_offset, self.id_count, ID_FIELDS)
+        self.rows = _Table(self._buffer, rows_offset, self.row_count, ROW_FIELDS)
+        self.choices = _Table(self._buffer, choices_offset, self.choice_count, CHOICE_FIELDS)
+        self.strings = _Table(self._buffer, strings_offset, self.string_count, STRING_FIELDS)
+
+    def close(self) -> None:
+        for table in ("ids", "rows", "choices", "strings"):
+            if hasattr(self, table):
+                getattr(self, table).release()
+        self._buffer.release()
+        self._mmap.close()
+
+    def __enter__(self) -> "BinaryQuest":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def string(self, number: int) -> Optional[str]:
+        """Строка по номеру (None для отсутствующего поля)."""
+        if number == NONE:
+            return None
+        offset, length = self.strings.row(number)
+        start = self._blob_offset + offset
+        return str(self._buffer[start:start + length], "utf-8")
+
+    @property
+    def scene_ids(self) -> Tuple[str, ...]:
+        """Уникальные id сцен в порядке первого появления (номера сцен движка)."""
+        return tuple(self.string(self.ids.field(number, 0)) for number in range(self.id_count))
+
+    def _strings(self) -> List[str]:
+        """Все строки файла одним проходом (для полного чтения квеста)."""
+        table = self.strings.values.tolist()
+        blob = self._buffer[self._blob_offset:].tobytes()
+        return [blob[offset:offset + length].decode("utf-8")
+                for offset, length in zip(table[0::2], table[1::2])]
+
+    def _scenes(self, row_numbers, string, tables, with_text: bool = True) -> List[Dict]:
+        """
+        Собирает сцены в формате квеста.
+
+        Args:
+            row_numbers: Номера строк таблицы сцен
+            string: Функция номер строки -> строка
+            tables: Таблицы id, сцен и выборов (отображение или списки)
+            with_text: Включать тексты и дополнительные поля
+        """
+        ids, rows, choices = tables
+        scenes = []
+        for row in row_numbers:
+            base = row * ROW_FIELDS
+            id_number, text, first, count, extras, flags = rows[base:base + ROW_FIELDS]
+            scene = {"scene_id": string(ids[id_number * ID_FIELDS])}
+            if with_text and text != NONE:
+                scene["text"] = string(text)
+            if flags & HAS_CHOICES:
+                scene_choices = []
+                for position in range(first * CHOICE_FIELDS, (first + count) * CHOICE_FIELDS, CHOICE_FIELDS):
+                    choice_text, next_scene, _, choice_extras = choices[position:position + CHOICE_FIELDS]
+                    item = {}
+                    if with_text and choice_text != NONE:
+                        item["text"] = string(choice_text)
+                    if next_scene != NONE:
+                        item["next_scene"] = string(next_scene)
+                    if with_text and choice_extras != NONE:
+                        item.update(serialization.loads(string(choice_extras)))
+                    scene_choices.append(item)
+                scene["choices"] = scene_choices
+            if with_text and extras != NONE:
+                scene.update(serialization.loads(string(extras)))
+            scenes.append(scene)
+        return scenes
+
+    def scene(self, scene_id: str) -> Optional[Dict]:
+        """Сцена по id в формате квеста (None, если сцены нет). Просматривает только таблицу id."""
+        for number in range(self.id_count):
+            if self.string(self.ids.field(number, 0)) == scene_id:
+                tables = (self.ids.values, self.rows.values, self.choices.values)
+                return self._scenes([self.ids.field(number, 1)], self.string, tables)[0]
+        return None
+
+    def skeleton(self) -> Dict:
+        """Структура графа без текстов: {"scenes": [{"scene_id", "choices": [{"next_scene"}]}]}."""
+        # Читаются только id сцен и переходы; повторяющиеся строки декодируются один раз
+        cache: Dict[int, str] = {}
+
+        def string(number: int) -> str:
+            value = cache.get(number)
+            if value is None:
+                value = cache[number] = self.string(number)
+            return value
+
+        tables = (self.ids.values.tolist(), self.rows.values.tolist(), self.choices.values.tolist())
+        return {"scenes": self._scenes(range(self.row_count), string, tables, with_text=False)}
+
+    def to_dict(self) -> Dict:
+        """Полные данные квеста, как в исходном JSON."""
+        strings = self._strings()
+        tables = (self.ids.values.tolist(), self.rows.values.tolist(), self.choices.values.tolist())
+        quest_data = {"scenes": self._scenes(range(self.row_count), strings.__getitem__, tables)}
+        if self._quest_extras != NONE:
+            quest_data.update(serialization.loads(strings[self._quest_extras]))
+        return quest_data
+
+    def compiled(self, name: Optional[str] = None, version: Optional[int] = None) -> CompiledQuest:
+        """
+        Квест для игрового движка. Тексты сцен и выборов не копируются, а
+        читаются из отображения при показе сцены.
+        """
+        scene_ids = self.scene_ids
+        return CompiledQuest.from_tables(
+            scene_ids, _TextsView(self), _ChoicesView(self), name=name, version=version
+        )
+
+
+def binary_path(json_path) -> Path:
+    """Путь к скомпилированной копии JSON квеста: .{имя}.qbin в той же папке."""
+    json_path = Path(json_path)
+    return json_path.with_name(f".{json_path.stem}{SUFFIX}")
+
+
+def open_binary(path) -> Optional[BinaryQuest]:
+    """
+    Открывает скомпилированный квест.
+
+    Для .qbin файла открывает его самого; для JSON - его скомпилированную
+    копию, если она есть и соответствует файлу по размеру и времени изменения.
+
+    Returns:
+        Optional[BinaryQuest]: Квест или None, если актуальной копии нет
+    """
+    path = Path(path)
+    if path.suffix == SUFFIX:
+        return BinaryQuest(path)
+    try:
+        stat = path.stat()
+        quest = BinaryQuest(binary_path(path))
+    except (FileNotFoundError, QuestFormatError):
+        return None
+    if quest.source_size != stat.st_size or quest.source_mtime_ns != stat.st_mtime_ns:
+        quest.close()
+        return None
+    return quest
+
+
+def compile_file(json_path, output=None) -> Path:
+    """
+    Компилирует JSON файл квеста в .qbin.
+
+    Args:
+        json_path: Путь к JSON файлу
+        output: Путь к .qbin файлу (по умолчанию - скомпилированная копия рядом с JSON)
+
+    Returns:
+        Path: Путь к записанному файлу
+
+    Raises:
+        QuestFormatError: Если квест не подходит для двоичного формата
+    """
+    # Запись атомарная, как у остальных файлов хранилища
+    from storage import FileQuestStorage
+
+    json_path = Path(json_path)
+    stat = json_path.stat()
+    with open(json_path, "rb") as f:
+        quest_data = serialization.loads(f.read())
+    output = Path(output) if output else binary_path(json_path)
+    FileQuestStorage._atomic_write(output, compile_quest(quest_data, stat.st_size, stat.st_mtime_ns))
+    return output
+
+
+def load_quest_data(path) -> Dict:
+    """
+    Загружает полные данные квеста из JSON или .qbin файла.
+
+    Для JSON скомпилированная копия не используется: полный разбор
+    упирается в создание словарей, и json.load не медленнее to_dict().
+
+    Raises:
+        FileNotFoundError: Если файла нет
+        json.JSONDecodeError: Если JSON некорректен
+        QuestFormatError: Если .qbin файл повреждён
+    """
+    if Path(path).suffix == SUFFIX:
+        with BinaryQuest(path) as quest:
+            return quest.to_dict()
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_skeleton(path) -> Dict:
+    """Структура графа квеста (см. BinaryQuest.skeleton) из скомпилированной копии или JSON."""
+    quest = open_binary(path)
+    if quest is None:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    with quest:
+        return quest.skeleton()
+
+
+def load_compiled_quest(path, name: Optional[str] = None, version: Optional[int] = None) -> CompiledQuest:
+    """
+    Загружает квест для игрового движка: из скомпилированной копии через
+    mmap (тексты читаются лениво), а если её нет - из JSON.
+
+    Raises:
+        FileNotFoundError: Если файла нет
+        json.JSONDecodeError: Если JSON некорректен
+        GameError: Если квест нельзя загрузить
+    """
+    quest = open_binary(path)
+    if quest is not None:
+        # Отображение остаётся открытым, пока жив CompiledQuest
+        return quest.compiled(name, version)
+    with open(path, "r", encoding="utf-8") as f:
+        return CompiledQuest(json.load(f), name=name, version=version)
+
+
+def main():
+    """Главная функция программы."""
+    parser = argparse.ArgumentParser(description='Двоичный формат квестов')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    compile_parser = subparsers.add_parser('compile', help='Скомпилировать JSON квесты')
+    compile_parser.add_argument('paths', nargs='+', help='JSON файлы или папки с квестами')
+    compile_parser.add_argument('-o', '--output', help='Путь к .qbin файлу (для одного квеста)')
+
+    info_parser = subparsers.add_parser('info', help='Показать содержимое скомпилированного квеста')
+    info_parser.add_argument('path', help='.qbin файл или JSON файл со скомпилированной копией')
+
+    args = parser.parse_args()
+
+    if args.command == 'compile':
+        files: List[Path] = []
+        for path in map(Path, args.paths):
+            if path.is_dir():
+                files.extend(f for f in sorted(path.glob("*.json")) if not f.name.startswith("."))
+            else:
+                files.append(path)
+        if args.output and len(files) != 1:
+            print("Ошибка: --output можно указать только для одного квеста")
+            sys.exit(1)
+        failed = 0
+        for path in files:
+            try:
+                output = compile_file(path, args.output)
+                print(f"{path} -> {output} ({os.path.getsize(output)} байт)")
+            except (OSError, ValueError, QuestFormatError) as e:
+                failed += 1
+                print(f"Ошибка: {path}: {e}")
+        if failed:
+            sys.exit(1)
+
+    elif args.command == 'info':
+        try:
+            quest = open_binary(args.path)
+        except QuestFormatError as e:
+            print(f"Ошибка: {e}")
+            sys.exit(1)
+        if quest is None:
+            print(f"Нет актуальной скомпилированной копии для {args.path}")
+            sys.exit(1)
+        with quest:
+            print(f"Файл: {quest.path} ({quest.path.stat().st_size} байт)")
+            print(f"Сцен: {quest.row_count} (уникальных id: {quest.id_count}), "
+                  f"выборов: {quest.choice_count}, строк: {quest.string_count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Полнотекстовый поиск по текстам сцен и выборов всех квестов
+
+import argparse
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from metrics import STAGE_SECONDS
+
+WORD_RE = re.compile(r"[0-9a-zа-яё]+", re.IGNORECASE)
+
+# Частые служебные слова, которые не индексируются
+STOP_WORDS = frozenset("""
+    а без бы в во вот все всё вы да для до его ее её если же за и из или им их
+    к как ко ли мы на над не нет ни но о об от по под при с со так то только
+    у уже что чтобы это я ты он она оно они мне меня тебя себя
+""".split())
+
+# Сколько слов показывать вокруг совпадения в сниппете
+SNIPPET_WORDS = 12
+# Вес совпадений в тексте выборов относительно текста сцены (BM25)
+CHOICE_WEIGHT = 0.5
+
+
+class RussianStemmer:
+    """
+    Стеммер Портера (Snowball) для русского языка.
+
+    Отбрасывает окончания и суффиксы, чтобы "дракона", "драконы" и
+    "драконом" давали одну основу. Слова латиницей и числа не меняются.
+    """
+
+    VOWELS = "аеиоуыэюя"
+
+    PERFECTIVE_GERUND = (("в", "вши", "вшись"), ("ив", "ивши", "ившись", "ыв", "ывши", "ывшись"))
+    REFLEXIVE = ("ся", "сь")
+    ADJECTIVE = ("ее", "ие", "ые", "ое", "ими", "ыми", "ей", "ий", "ый", "ой", "ем", "им", "ым",
+                 "ом", "его", "ого", "ему", "ому", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею")
+    PARTICIPLE = (("ем", "нн", "вш", "ющ", "щ"), ("ивш", "ывш", "ующ"))
+    VERB = (("ла", "на", "ете", "йте", "ли", "й", "л", "ем", "н", "ло", "но", "ет", "ют", "ны",
+             "ть", "ешь", "нно"),
+            ("ила", "ыла", "ена", "ейте", "уйте", "ите", "или", "ыли", "ей", "уй", "ил", "ыл",
+             "им", "ым", "ен", "ило", "ыло", "ено", "ят", "ует", "уют", "ит", "ыт", "ены", "ить",
+             "ыть", "ишь", "ую", "ю"))
+    NOUN = ("а", "ев", "ов", "ие", "ье", "е", "иями", "ями", "ами", "еи", "ии", "и", "ией", "ей",
+            "ой", "ий", "й", "иям", "ям", "ием", "ем", "ам", "ом", "о", "у", "ах", "иях", "ях", "ы",
+            "ь", "ию", "ью", "ю", "ия", "ья", "я")
+    DERIVATIONAL = ("ост", "ость")
+    SUPERLATIVE = ("ейш", "ейше")
+
+    def __init__(self):
+        self._cache: Dict[str, str] = {}
+
+    @staticmethod
+    def _strip(word: str, suffixes, preceded_by: str = "") -> Optional[str]:
+        """Отрезает самый длинный подходящий суффикс или возвращает None."""
+        for suffix in sorted(suffixes, key=len, reverse=True):
+            if word.endswith(suffix):
+                rest = word[:-len(suffix)]
+                if preceded_by and not rest.endswith(tuple(preceded_by)):
+                    continue
+                return rest
+        return None
+
+    def _strip_groups(self, word: str, groups) -> Optional[str]:
+        """Группа 1 удаляется только после 'а' или 'я', группа 2 - всегда."""
+        candidates = [
+            (len(word) - len(rest), rest)
+            for rest in (self._strip(word, groups[0], "ая"), self._strip(word, groups[1]))
+            if rest is not None
+        ]
+        return max(candidates)[1] if candidates else None
+
+    def _regions(self, word: str) -> Tuple[int, int]:
+        """Начала областей RV и R2."""
+        rv = next((i + 1 for i, char in enumerate(word) if char in self.VOWELS), len(word))
+
+        def region(start: int) -> int:
+            # Позиция после первой согласной, следующей за гласной
+            for i in range(start + 1, len(word)):
+                if word[i] not in self.VOWELS and word[i - 1] in self.VOWELS:
+                    return i + 1
+            return len(word)
+
+        return rv, region(region(0))
+
+    def stem(self, word: str) -> str:
+        """Возвращает основу слова (в нижнем регистре)."""
+        word = word.lower().replace("ё", "е")
+        cached = self._cache.get(word)
+        if cached is not None:
+            return cached
+        if not re.fullmatch(r"[а-я]+", word):
+            return word
+
+        rv, r2 = self._regions(word)
+        # Все шаги, кроме третьего, работают внутри области RV
+        prefix, rest = word[:rv], word[rv:]
+
+        # Шаг 1: деепричастие, иначе возвратность и прилагательное/глагол/существительное
+        stripped = self._strip_groups(rest, self.PERFECTIVE_GERUND)
+        if stripped is not None:
+            rest = stripped
+        else:
+            stripped = self._strip(rest, self.REFLEXIVE)
+            if stripped is not None:
+                rest = stripped
+            adjective = self._strip(rest, self.ADJECTIVE)
+            if adjective is not None:
+                participle = self._strip_groups(adjective, self.PARTICIPLE)
+                rest = participle if participle is not None else adjective
+            else:
+                stripped = self._strip_groups(rest, self.VERB)
+                if stripped is None:
+                    stripped = self._strip(rest, self.NOUN)
+                if stripped is not None:
+                    rest = stripped
+
+        # Шаг 2: конечная 'и'
+        if rest.endswith("и"):
+            rest = rest[:-1]
+
+        # Шаг 3: словообразовательный суффикс, если он целиком в R2
+        stripped = self._strip(rest, self.DERIVATIONAL)
+        if stripped is not None and len(prefix) + len(stripped) >= r2:
+            rest = stripped
+
+        # Шаг 4: превосходная степень, удвоенная 'н', мягкий знак
+        stripped = self._strip(rest, self.SUPERLATIVE)
+        if stripped is not None:
+            rest = stripped
+        if rest.endswith("нн"):
+            rest = rest[:-1]
+        elif stripped is None and rest.endswith("ь"):
+            rest = rest[:-1]
+
+        result = prefix + rest
+        if len(self._cache) < 100_000:
+            self._cache[word] = result
+        return result
+
+
+_stemmer = RussianStemmer()
+
+
+def tokenize(text: str) -> List[Tuple[str, int, int]]:
+    """
+    Разбивает текст на слова.
+
+    Returns:
+        List[Tuple[str, int, int]]: (основа слова, начало, конец) для каждого
+        значимого слова текста
+    """
+    tokens = []
+    for match in WORD_RE.finditer(text or ""):
+        word = match.group().lower()
+        if word in STOP_WORDS:
+            continue
+        tokens.append((_stemmer.stem(word), match.start(), match.end()))
+    return tokens
+
+
+def stems_of(text: str) -> str:
+    """Основы слов текста через пробел (то, что попадает в индекс)."""
+    return " ".join(stem for stem, _, _ in tokenize(text))
+
+
+def make_snippet(text: str, stems: set, words: int = SNIPPET_WORDS) -> Tuple[str, List[List[int]]]:
+    """
+    Вырезает из текста фрагмент вокруг первого совпадения.
+
+    Args:
+        text: Исходный текст
+        stems: Основы слов запроса
+        words: Сколько слов показать
+
+    Returns:
+        Tuple[str, List[List[int]]]: Фрагмент и позиции совпадений [начало, конец] в нём
+    """
+    tokens = [(stem, start, end) for stem, start, end in tokenize(text)]
+    hits = [i for i, (stem, _, _) in enumerate(tokens) if stem in stems]
+    if not tokens:
+        return text[:200], []
+    first = hits[0] if hits else 0
+    begin = max(0, first - words // 3)
+    window = tokens[begin:begin + words]
+    start = 0 if begin == 0 else window[0][1]
+    end = len(text) if begin + words >= len(tokens) else window[-1][2]
+    snippet = text[start:end]
+    matches = [[token_start - start, token_end - start]
+               for stem, token_start, token_end in window if stem in stems]
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(text) else ""
+    if prefix:
+        matches = [[a + len(prefix), b + len(prefix)] for a, b in matches]
+    return prefix + snippet + suffix, matches
+
+
+def scene_documents(quest_data: Dict) -> List[Tuple[str, str, str]]:
+    """Тексты сцен квеста для индексации: (scene_id, текст сцены, тексты выборов)."""
+    documents = []
+    scenes = quest_data.get("scenes", []) if isinstance(quest_data, dict) else []
+    for scene in scenes:
+        if not isinstance(scene, dict) or not isinstance(scene.get("scene_id"), str):
+            continue
+        choices = "\n".join(
+            str(choice.get("text", "")) for choice in scene.get("choices") or []
+            if isinstance(choice, dict)
+        )
+        documents.append((scene["scene_id"], str(scene.get("text", "")), choices))
+    return documents
+
+
+class SearchIndex:
+    """
+    Инвертированный индекс текстов сцен и выборов на SQLite FTS5.
+
+    В индекс попадают основы слов (см. RussianStemmer), поэтому поиск
+    находит слово в любой форме. Ранжирование - BM25, совпадения в тексте
+    сцены весят больше, чем в текстах выборов. Исходные тексты хранятся
+    рядом для сниппетов. Индекс обновляется по квестам или отдельным
+    сценам; каждый поток получает собственное соединение.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY,
+            quest_name TEXT NOT NULL,
+            scene_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            choices TEXT NOT NULL,
+            text_stems TEXT NOT NULL,
+            choice_stems TEXT NOT NULL,
+            UNIQUE (quest_name, scene_id)
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+            text_stems, choice_stems,
+            content='documents', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 0'
+        );
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_guard = threading.Lock()
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Возвращает соединение текущего потока, создавая его при необходимости."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_guard:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _delete_rows(conn: sqlite3.Connection, where: str, params: tuple) -> None:
+        """Удаляет документы вместе с их записями в FTS5."""
+        rows = conn.execute(
+            f"SELECT id, text_stems, choice_stems FROM documents WHERE {where}", params
+        ).fetchall()
+        conn.executemany(
+            "INSERT INTO documents_fts (documents_fts, rowid, text_stems, choice_stems) "
+            "VALUES ('delete', ?, ?, ?)",
+            rows,
+        )
+        conn.executemany("DELETE FROM documents WHERE id = ?", [(row[0],) for row in rows])
+
+    @staticmethod
+    def _insert_rows(conn: sqlite3.Connection, quest_name: str,
+                     documents: List[Tuple[str, str, str]]) -> None:
+        for scene_id, text, choices in documents:
+            text_stems, choice_stems = stems_of(text), stems_of(choices)
+            rowid = conn.execute(
+                "INSERT INTO documents (quest_name, scene_id, text, choices, text_stems, choice_stems) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (quest_name, scene_id, text, choices, text_stems, choice_stems),
+            ).lastrowid
+            conn.execute(
+                "INSERT INTO documents_fts (rowid, text_stems, choice_stems) VALUES (?, ?, ?)",
+                (rowid, text_stems, choice_stems),
+            )
+
+    @STAGE_SECONDS.time(stage="search_index")
+    def index_quest(self, quest_name: str, quest_data: Dict) -> None:
+        """Индексирует квест целиком, заменяя его прежние записи."""
+        with self._transaction() as conn:
+            self._delete_rows(conn, "quest_name = ?", (quest_name,))
+            self._insert_rows(conn, quest_name, scene_documents(quest_data))
+
+    @STAGE_SECONDS.time(stage="search_index")
+    def update_scenes(self, quest_name: str, scenes: Dict[str, Optional[Dict]]) -> None:
+        """
+        Переиндексирует только изменённые сцены квеста.
+
+        Args:
+            quest_name: Название квеста
+            scenes: scene_id -> новая сцена (None - сцена удалена)
+        """
+        with self._transaction() as conn:
+            for scene_id, scene in scenes.items():
+                self._delete_rows(conn, "quest_name = ? AND scene_id = ?", (quest_name, scene_id))
+                if scene is not None:
+                    self._insert_rows(conn, quest_name, scene_documents({"scenes": [scene]}))
+
+    def remove_quest(self, quest_name: str) -> None:
+        """Удаляет квест из индекса."""
+        with self._transaction() as conn:
+            self._delete_rows(conn, "quest_name = ?", (quest_name,))
+
+    def is_empty(self) -> bool:
+        """Проверяет, что в индексе нет ни одной сцены."""
+        return self._connect().execute("SELECT 1 FROM documents LIMIT 1").fetchone() is None
+
+    @STAGE_SECONDS.time(stage="search_query")
+    def search(self, query: str, limit: int = 20, offset: int = 0,
+               quest_prefix: Optional[str] = None) -> List[Dict]:
+        """
+        Ищет сцены, содержащие все слова запроса (в любой форме).
+
+        Args:
+            query: Строка запроса
+            limit: Сколько результатов вернуть
+            offset: Сколько лучших результатов пропустить
+            quest_prefix: Искать только в квестах с этим префиксом
+
+        Returns:
+            List[Dict]: Результаты по убыванию релевантности: quest_name, scene_id,
+            score, field ("text" или "choices"), snippet и matches (позиции
+            совпадений в snippet)
+        """
+        stems = {stem for stem, _, _ in tokenize(query)}
+        if not stems:
+            return []
+        # Каждая основа в кавычках: спецсимволы FTS5 в запросе не интерпретируются
+        match = " ".join('"{}"'.format(stem.replace('"', '""')) for stem in sorted(stems))
+
+        rank = f"bm25(documents_fts, 1.0, {CHOICE_WEIGHT})"
+        if quest_prefix:
+            sql = (
+                f"SELECT d.quest_name, d.scene_id, d.text, d.choices, {rank} AS score "
+                "FROM documents_fts JOIN documents AS d ON d.id = documents_fts.rowid "
+                "WHERE documents_fts MATCH ? AND d.quest_name >= ? AND d.quest_name < ? "
+                "ORDER BY score LIMIT ? OFFSET ?"
+            )
+            params = (match, quest_prefix, quest_prefix + "\U0010ffff", limit, offset)
+        else:
+            # Сначала ранжируем в FTS5, а тексты читаем только для попавших в limit
+            sql = (
+                "SELECT d.quest_name, d.scene_id, d.text, d.choices, r.score "
+                f"FROM (SELECT rowid, {rank} AS score FROM documents_fts "
+                "WHERE documents_fts MATCH ? ORDER BY score LIMIT ? OFFSET ?) AS r "
+                "JOIN documents AS d ON d.id = r.rowid ORDER BY r.score"
+            )
+            params = (match, limit, offset)
+
+        results = []
+        for quest_name, scene_id, text, choices, score in self._connect().execute(sql, params):
+            text_hit = any(stem in stems for stem, _, _ in tokenize(text))
+            field = "text" if text_hit else "choices"
+            snippet, matches = make_snippet(text if text_hit else choices, stems)
+            results.append({
+                "quest_name": quest_name,
+                "scene_id": scene_id,
+                # bm25() в FTS5 отрицателен: чем меньше, тем релевантнее
+                "score": round(-score, 4),
+                "field": field,
+                "snippet": snippet,
+                "matches": matches,
+            })
+        return results
+
+    def rebuild(self, storage) -> int:
+        """
+        Перестраивает индекс по всем квестам хранилища.
+
+        Returns:
+            int: Количество проиндексированных квестов
+        """
+        quest_names = storage.list_quests()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM documents")
+            conn.execute("INSERT INTO documents_fts (documents_fts) VALUES ('delete-all')")
+        indexed = 0
+        for quest_name in quest_names:
+            quest_data = storage.load_quest(quest_name)
+            if quest_data is not None:
+                self.index_quest(quest_name, quest_data)
+                indexed += 1
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO documents_fts (documents_fts) VALUES ('optimize')")
+        return indexed
+
+    def close(self) -> None:
+        with self._connections_guard:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def get_search_index(project_root=None) -> SearchIndex:
+    """
+    Открывает поисковый индекс.
+
+    QUEST_SEARCH_DB: путь к базе индекса (по умолчанию search.db в корне проекта).
+    """
+    root = Path(project_root) if project_root else Path(__file__).parent
+    return SearchIndex(os.getenv("QUEST_SEARCH_DB", str(root / "search.db")))
+
+
+def main():
+    """Главная функция программы."""
+    script_dir = Path(__file__).parent
+    parser = argparse.ArgumentParser(description='Полнотекстовый поиск по квестам')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('rebuild', help='Перестроить индекс по всем квестам хранилища')
+
+    query_parser = subparsers.add_parser('query', help='Найти сцены')
+    query_parser.add_argument('query', help='Строка запроса')
+    query_parser.add_argument('-n', '--limit', type=int, default=20, help='Количество результатов')
+    query_parser.add_argument('--prefix', help='Только квесты с этим префиксом')
+
+    args = parser.parse_args()
+    index = get_search_index(script_dir)
+
+    if args.command == 'rebuild':
+        from storage import get_storage
+        storage = get_storage(script_dir)
+        try:
+            indexed = index.rebuild(storage)
+        finally:
+            storage.close()
+        print(f"Проиндексировано квестов: {indexed}")
+
+    elif args.command == 'query':
+        results = index.search(args.query, limit=args.limit, quest_prefix=args.prefix)
+        if not results:
+            print("Ничего не найдено")
+        for result in results:
+            print(f"{result['quest_name']} / {result['scene_id']} ({result['score']:.2f})")
+            print(f"  {result['snippet']}")
+
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Быстрая сериализация JSON: orjson при наличии, иначе стандартный json
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps_bytes(data: Any, pretty: bool = False) -> bytes:
+    """
+    Сериализует данные в UTF-8 JSON.
+
+    По умолчанию вывод компактный (без отступов и пробелов), кириллица
+    не экранируется.
+
+    Args:
+        data: Данные для сериализации
+        pretty: Форматировать с отступами (для экспорта и чтения человеком)
+
+    Returns:
+        bytes: JSON в кодировке UTF-8
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else 0)
+    if pretty:
+        return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(data: Any, pretty: bool = False) -> str:
+    """Сериализует данные в строку JSON (см. dumps_bytes)."""
+    return dumps_bytes(data, pretty).decode("utf-8")
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """
+    Разбирает JSON из строки или байтов.
+
+    Raises:
+        json.JSONDecodeError: Если данные не являются валидным JSON
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
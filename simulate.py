@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Массовая симуляция прохождений квеста и анализ его как поглощающей цепи Маркова
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from engine import MISSING_SCENE, CompiledQuest, GameError
+from questbin import QuestFormatError, load_compiled_quest, load_quest_data
+
+POLICIES = ("uniform", "weighted", "exhaustive")
+# Сколько прохождений симулируется одним пакетом массивов
+BATCH_SIZE = 250_000
+# Полная фундаментальная матрица считается только для квестов до этого размера
+MAX_EXACT_SCENES = 3000
+# Для больших квестов посещаемость считается рядом до этой доли незавершённых прохождений
+SERIES_TOLERANCE = 1e-12
+MAX_SERIES_STEPS = 100_000
+
+
+def choice_weights(quest_data: Dict) -> Dict[str, List[float]]:
+    """Извлекает веса выборов из поля 'weight' (по умолчанию 1)."""
+    weights = {}
+    for scene in quest_data.get("scenes", []):
+        if isinstance(scene, dict) and "scene_id" in scene:
+            weights[scene["scene_id"]] = [
+                float(choice.get("weight", 1)) if isinstance(choice, dict) else 1.0
+                for choice in scene.get("choices") or []
+            ]
+    return weights
+
+
+class QuestSimulator:
+    """
+    Матрица переходов квеста при выбранной стратегии игрока.
+
+    Сцены без выборов (или только с переходами в несуществующие сцены)
+    поглощающие - это концовки. Для uniform и weighted вероятности
+    концовок, ожидаемая длина пути и посещаемость сцен вычисляются точно
+    через фундаментальную матрицу N = (I - Q)^-1 и проверяются пакетной
+    симуляцией; exhaustive перечисляет все пути до max_steps ходов.
+    """
+
+    def __init__(self, quest: CompiledQuest, policy: str = "uniform",
+                 weights: Optional[Dict[str, List[float]]] = None):
+        """
+        Args:
+            quest: Скомпилированный квест
+            policy: Стратегия выбора: uniform, weighted или exhaustive
+            weights: Веса выборов по сценам для weighted (scene_id -> веса по порядку выборов)
+
+        Raises:
+            ValueError: Если стратегия неизвестна или веса некорректны
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Неизвестная стратегия: {policy}")
+        self.quest = quest
+        self.policy = policy
+        n = len(quest)
+        width = max([len(choices) for choices in quest.choices] + [1])
+
+        self.targets = np.zeros((n, width), dtype=np.int64)
+        self.probs = np.zeros((n, width), dtype=np.float64)
+        for i, choices in enumerate(quest.choices):
+            scene_weights = (weights or {}).get(quest.scene_ids[i]) if policy == "weighted" else None
+            if scene_weights is not None and not isinstance(scene_weights, list):
+                raise ValueError(f"Сцена '{quest.scene_ids[i]}': веса должны быть списком")
+            if scene_weights is not None and len(scene_weights) != len(choices):
+                raise ValueError(
+                    f"Сцена '{quest.scene_ids[i]}': {len(scene_weights)} весов для {len(choices)} выборов"
+                )
+            for k, (_, target) in enumerate(choices):
+                weight = 1.0 if scene_weights is None else float(scene_weights[k])
+                if weight < 0:
+                    raise ValueError(f"Сцена '{quest.scene_ids[i]}': отрицательный вес выбора")
+                if target != MISSING_SCENE:
+                    self.targets[i, k] = target
+                    self.probs[i, k] = weight
+
+        totals = self.probs.sum(axis=1)
+        self.absorbing = totals == 0
+        self.probs[~self.absorbing] /= totals[~self.absorbing, None]
+        # Накопленные вероятности; после последнего ненулевого выбора - 1, чтобы
+        # погрешность округления не выбрала пустой столбец
+        self.cdf = np.cumsum(self.probs, axis=1)
+        for i in np.flatnonzero(~self.absorbing):
+            last = np.flatnonzero(self.probs[i])[-1]
+            self.cdf[i, last:] = 1.0
+
+        # Разреженный граф переходов в формате CSR: рёбра с ненулевой вероятностью,
+        # упорядоченные по исходной сцене (ravel идёт по строкам)
+        mask = (self.probs > 0).ravel()
+        self.edge_sources = np.repeat(np.arange(n), width)[mask]
+        self.edge_targets = self.targets.ravel()[mask]
+        self.edge_probs = self.probs.ravel()[mask]
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(self.edge_sources, minlength=n))))
+        # Обратный граф для поиска сцен, из которых достижима концовка
+        order = np.argsort(self.edge_targets, kind="stable")
+        self.reverse_indices = self.edge_sources[order]
+        self.reverse_indptr = np.concatenate(([0], np.cumsum(np.bincount(self.edge_targets, minlength=n))))
+
+    def _reachable(self, indptr: np.ndarray, indices: np.ndarray, starts) -> np.ndarray:
+        """Сцены, достижимые из starts по рёбрам графа в формате CSR (indptr, indices)."""
+        seen = np.zeros(len(indptr) - 1, dtype=bool)
+        seen[starts] = True
+        queue = deque(np.flatnonzero(seen))
+        while queue:
+            scene = queue.popleft()
+            for target in indices[indptr[scene]:indptr[scene + 1]]:
+                if not seen[target]:
+                    seen[target] = True
+                    queue.append(target)
+        return seen
+
+    def _step(self, vector: np.ndarray, edge_values: np.ndarray) -> np.ndarray:
+        """Умножение вектора-строки на разреженную матрицу со значениями edge_values на рёбрах."""
+        return np.bincount(self.edge_targets, weights=vector[self.edge_sources] * edge_values,
+                           minlength=len(vector))
+
+    def structure(self) -> Dict:
+        """Достижимые сцены, недостижимые сцены и ловушки (циклы без выхода к концовке)."""
+        reachable = self._reachable(self.indptr, self.edge_targets, self.quest.start)
+        # Сцены, из которых можно дойти до концовки: обход обратного графа от концовок
+        can_finish = self._reachable(self.reverse_indptr, self.reverse_indices, self.absorbing)
+        ids = self.quest.scene_ids
+        return {
+            "reachable": reachable,
+            "unreachable": [ids[i] for i in np.flatnonzero(~reachable)],
+            "traps": [ids[i] for i in np.flatnonzero(reachable & ~can_finish)],
+            "endings": [ids[i] for i in np.flatnonzero(self.absorbing & reachable)],
+        }
+
+    def exact(self) -> Optional[Dict]:
+        """
+        Точное решение поглощающей цепи Маркова из стартовой сцены.
+
+        Returns:
+            Optional[Dict]: Вероятности концовок, ожидаемая длина пути, ожидаемое
+            число посещений и вероятность посетить каждую сцену; None, если из
+            достижимых сцен есть ловушки (цепь не поглощающая)
+        """
+        structure = self.structure()
+        if structure["traps"]:
+            return None
+        ids = self.quest.scene_ids
+        start = self.quest.start
+        if self.absorbing[start]:
+            return {
+                "ending_probabilities": {ids[start]: 1.0},
+                "expected_length": 0.0,
+                "expected_visits": {ids[start]: 1.0},
+                "visit_probabilities": {ids[start]: 1.0},
+            }
+
+        reachable = structure["reachable"]
+        transient = np.flatnonzero(reachable & ~self.absorbing)
+        endings = np.flatnonzero(reachable & self.absorbing)
+        n = len(self.quest)
+
+        if len(transient) <= MAX_EXACT_SCENES:
+            # Плотная матрица Q только по достижимым непоглощающим сценам
+            position = np.full(n, -1, dtype=np.int64)
+            position[transient] = np.arange(len(transient))
+            inner = (position[self.edge_sources] >= 0) & (position[self.edge_targets] >= 0)
+            q = np.zeros((len(transient), len(transient)), dtype=np.float64)
+            np.add.at(q, (position[self.edge_sources[inner]], position[self.edge_targets[inner]]),
+                      self.edge_probs[inner])
+            identity = np.eye(len(transient))
+            fundamental = np.linalg.solve(identity - q, identity)
+            visits = fundamental[position[start]]
+            # Вероятность хотя бы раз попасть в сцену j: N[s, j] / N[j, j]
+            visit_probability = visits / np.diag(fundamental)
+            residual = 0.0
+        else:
+            # Для очень больших квестов - только строка стартовой сцены как ряд
+            # e_s (I + Q + Q^2 + ...): каждое слагаемое - распределение игроков,
+            # ещё не дошедших до концовки, после k ходов
+            term = np.zeros(n)
+            term[start] = 1.0
+            total = term.copy()
+            residual = 1.0
+            for _ in range(MAX_SERIES_STEPS):
+                term = self._step(term, self.edge_probs)
+                term[self.absorbing] = 0.0
+                residual = float(term.sum())
+                total += term
+                if residual < SERIES_TOLERANCE:
+                    break
+            visits = total[transient]
+            visit_probability = None
+
+        full_visits = np.zeros(n)
+        full_visits[transient] = visits
+        absorption = self._step(full_visits, self.edge_probs)[endings]
+
+        result = {
+            "ending_probabilities": {ids[j]: float(p) for j, p in zip(endings, absorption)},
+            "expected_length": float(visits.sum()),
+            "expected_visits": {ids[j]: float(v) for j, v in zip(transient, visits)},
+        }
+        result["expected_visits"].update(result["ending_probabilities"])
+        if residual:
+            # Доля прохождений, не учтённая рядом (только для больших квестов)
+            result["residual"] = residual
+        if visit_probability is not None:
+            result["visit_probabilities"] = {
+                ids[j]: float(min(p, 1.0)) for j, p in zip(transient, visit_probability)
+            }
+            result["visit_probabilities"].update(result["ending_probabilities"])
+        return result
+
+    def simulate(self, runs: int, seed: Optional[int] = None, max_steps: int = 1000) -> Dict:
+        """
+        Пакетная симуляция прохождений: все игроки пакета делают ход одной операцией над массивами.
+
+        Args:
+            runs: Количество прохождений
+            seed: Зерно генератора случайных чисел
+            max_steps: Прохождения длиннее max_steps ходов прерываются
+
+        Returns:
+            Dict: Доли концовок, длина пути (средняя, p50, p95, максимум),
+            среднее число посещений сцен, прерванные прохождения, скорость
+        """
+        n = len(self.quest)
+        rng = np.random.default_rng(seed)
+        ending_counts = np.zeros(n, dtype=np.int64)
+        visit_counts = np.zeros(n, dtype=np.int64)
+        length_histogram = np.zeros(max_steps + 1, dtype=np.int64)
+        truncated = 0
+        started = time.perf_counter()
+
+        for offset in range(0, runs, BATCH_SIZE):
+            batch = min(BATCH_SIZE, runs - offset)
+            state = np.full(batch, self.quest.start, dtype=np.int64)
+            steps = np.zeros(batch, dtype=np.int64)
+            active = np.flatnonzero(~self.absorbing[state])
+            visit_counts[self.quest.start] += batch
+            for _ in range(max_steps):
+                if active.size == 0:
+                    break
+                current = state[active]
+                roll = rng.random(active.size)
+                choice = (roll[:, None] >= self.cdf[current]).sum(axis=1)
+                nxt = self.targets[current, choice]
+                state[active] = nxt
+                steps[active] += 1
+                visit_counts += np.bincount(nxt, minlength=n)
+                active = active[~self.absorbing[nxt]]
+            truncated += active.size
+            finished = np.ones(batch, dtype=bool)
+            finished[active] = False
+            ending_counts += np.bincount(state[finished], minlength=n)
+            length_histogram += np.bincount(steps[finished], minlength=max_steps + 1)
+
+        elapsed = time.perf_counter() - started
+        completed = int(length_histogram.sum())
+        cumulative = np.cumsum(length_histogram)
+
+        def length_percentile(p: float) -> Optional[int]:
+            if not completed:
+                return None
+            return int(np.searchsorted(cumulative, np.ceil(p / 100 * completed)))
+
+        ids = self.quest.scene_ids
+        return {
+            "runs": runs,
+            "seconds": elapsed,
+            "runs_per_second": runs / elapsed if elapsed else 0.0,
+            "ending_probabilities": {
+                ids[i]: int(count) / runs for i, count in enumerate(ending_counts) if count
+            },
+            "mean_length": float(length_histogram @ np.arange(max_steps + 1) / completed) if completed else None,
+            "length_p50": length_percentile(50),
+            "length_p95": length_percentile(95),
+            "max_length": int(np.flatnonzero(length_histogram)[-1]) if completed else None,
+            "mean_visits": {ids[i]: int(count) / runs for i, count in enumerate(visit_counts) if count},
+            "never_visited": [ids[i] for i in np.flatnonzero(visit_counts == 0)],
+            "truncated": truncated,
+        }
+
+    def enumerate_paths(self, max_steps: int = 100) -> Dict:
+        """
+        Перечисляет все пути от старта до концовок длиной до max_steps ходов.
+
+        Пути считаются по длинам умножением вектора на разреженную матрицу числа
+        переходов, поэтому циклы не приводят к бесконечному обходу.
+
+        Returns:
+            Dict: Количество путей (всего и по концовкам), длины путей и
+            количество путей, не закончившихся за max_steps ходов
+        """
+        n = len(self.quest)
+        counts = np.ones(len(self.edge_targets))
+        transient = ~self.absorbing
+
+        paths = np.zeros(n)
+        paths[self.quest.start] = 1.0
+        ending_paths = paths * self.absorbing
+        total_length = 0.0
+        lengths = [0] if self.absorbing[self.quest.start] else []
+        for length in range(1, max_steps + 1):
+            paths = self._step(paths * transient, counts)
+            finished = paths * self.absorbing
+            if finished.any():
+                ending_paths += finished
+                total_length += length * finished.sum()
+                lengths.append(length)
+            if not (paths * transient).any():
+                break
+        unfinished = float((paths * transient).sum())
+        total = float(ending_paths.sum())
+
+        ids = self.quest.scene_ids
+        return {
+            "paths": total,
+            "ending_paths": {ids[i]: float(c) for i, c in enumerate(ending_paths) if c},
+            "ending_share": {ids[i]: float(c) / total for i, c in enumerate(ending_paths) if c},
+            "mean_length": float(total_length / total) if total else None,
+            "min_length": lengths[0] if lengths else None,
+            "max_length": lengths[-1] if lengths else None,
+            "unfinished_paths": unfinished,
+        }
+
+
+def analyze(quest: CompiledQuest, policy: str = "uniform", runs: int = 100_000,
+            seed: Optional[int] = None, max_steps: int = 1000,
+            weights: Optional[Dict[str, List[float]]] = None) -> Dict:
+    """
+    Полный отчёт по квесту: структура графа, точное решение и симуляция.
+
+    Args:
+        quest: Скомпилированный квест
+        policy: Стратегия выбора (см. POLICIES)
+        runs: Количество симулируемых прохождений (0 - без симуляции)
+        seed: Зерно генератора случайных чисел
+        max_steps: Ограничение длины прохождения (для exhaustive - длины пути)
+        weights: Веса выборов для weighted
+
+    Returns:
+        Dict: Отчёт
+    """
+    simulator = QuestSimulator(quest, policy, weights)
+    structure = simulator.structure()
+    report = {
+        "quest_name": quest.name,
+        "policy": policy,
+        "scenes": len(quest),
+        "reachable_scenes": int(structure["reachable"].sum()),
+        "unreachable": structure["unreachable"],
+        "traps": structure["traps"],
+        "endings": structure["endings"],
+    }
+    if policy == "exhaustive":
+        report["paths"] = simulator.enumerate_paths(max_steps)
+        return report
+    report["exact"] = simulator.exact()
+    report["simulation"] = simulator.simulate(runs, seed, max_steps) if runs > 0 else None
+    return report
+
+
+def load_quest(source: str, project_root: Path) -> CompiledQuest:
+    """Загружает квест из файла (JSON или .qbin) или, если файла нет, из хранилища по названию."""
+    if os.path.exists(source):
+        return load_compiled_quest(source, name=Path(source).stem.lstrip("."))
+
+    from storage import get_storage
+    storage = get_storage(project_root)
+    try:
+        quest = storage.load_compiled(source, storage.get_version(source))
+    finally:
+        storage.close()
+    if quest is None:
+        raise GameError(f"Квест '{source}' не найден")
+    return quest
+
+
+def load_choice_weights(source: str, project_root: Path) -> Dict[str, List[float]]:
+    """Веса выборов из поля 'weight' квеста (файл или квест в хранилище, как в load_quest)."""
+    if os.path.exists(source):
+        return choice_weights(load_quest_data(source))
+
+    from storage import get_storage
+    storage = get_storage(project_root)
+    try:
+        return choice_weights(storage.load_quest(source) or {})
+    finally:
+        storage.close()
+
+
+def print_report(report: Dict) -> None:
+    """Печатает отчёт в читаемом виде."""
+    print(f"Квест {report['quest_name']}: {report['scenes']} сцен, "
+          f"достижимо {report['reachable_scenes']}, стратегия {report['policy']}")
+    if report["unreachable"]:
+        print(f"  Недостижимые сцены: {', '.join(report['unreachable'])}")
+    if report["traps"]:
+        print(f"  Ловушки (нет пути к концовке): {', '.join(report['traps'])}")
+
+    if "paths" in report:
+        paths = report["paths"]
+        print(f"\nПутей до концовок: {paths['paths']:.0f} (длина {paths['min_length']}-{paths['max_length']}, "
+              f"в среднем {paths['mean_length'] or 0:.2f})")
+        for scene_id, share in sorted(paths["ending_share"].items(), key=lambda item: -item[1]):
+            print(f"  {scene_id:<30} {share:7.1%}  ({paths['ending_paths'][scene_id]:.0f} путей)")
+        if paths["unfinished_paths"]:
+            print(f"  Путей длиннее ограничения: {paths['unfinished_paths']:.0f}")
+        return
+
+    exact = report["exact"]
+    simulation = report["simulation"] or {}
+    if exact is None:
+        print("\nТочное решение недоступно: есть ловушки, результаты только по симуляции")
+    else:
+        print(f"\nОжидаемая длина пути: {exact['expected_length']:.2f} ходов")
+    if simulation:
+        print(f"Симуляция: {simulation['runs']} прохождений за {simulation['seconds']:.2f} с "
+              f"({simulation['runs_per_second']:,.0f}/с), средняя длина {simulation['mean_length'] or 0:.2f}, "
+              f"p50 {simulation['length_p50']}, p95 {simulation['length_p95']}, "
+              f"прервано {simulation['truncated']}")
+
+    print(f"\n{'концовка':<30} {'точно':>8} {'симуляция':>10}")
+    endings = set(exact["ending_probabilities"] if exact else []) | set(simulation.get("ending_probabilities", {}))
+    for scene_id in sorted(endings):
+        exact_p = exact["ending_probabilities"].get(scene_id) if exact else None
+        simulated_p = simulation.get("ending_probabilities", {}).get(scene_id)
+        print(f"{scene_id:<30} {'' if exact_p is None else f'{exact_p:.2%}':>8} "
+              f"{'' if simulated_p is None else f'{simulated_p:.2%}':>10}")
+
+    if exact and "visit_probabilities" in exact:
+        rarely = sorted(exact["visit_probabilities"].items(), key=lambda item: item[1])[:10]
+        print("\nРеже всего посещаемые сцены (вероятность посещения):")
+        for scene_id, probability in rarely:
+            print(f"  {scene_id:<30} {probability:7.2%}")
+
+
+def main():
+    """Главная функция программы."""
+    script_dir = Path(__file__).parent
+    parser = argparse.ArgumentParser(description='Симуляция прохождений и анализ квеста')
+    parser.add_argument('quest', help='Название квеста в хранилище или путь к JSON файлу')
+    parser.add_argument('--policy', choices=POLICIES, default='uniform', help='Стратегия выбора')
+    parser.add_argument('--runs', type=int, default=1_000_000, help='Количество прохождений')
+    parser.add_argument('--seed', type=int, help='Зерно генератора случайных чисел')
+    parser.add_argument('--max-steps', type=int, default=1000, help='Максимальная длина прохождения')
+    parser.add_argument('--weights', help="JSON файл с весами выборов {scene_id: [веса]} "
+                                          "(по умолчанию - поле 'weight' выборов)")
+    parser.add_argument('--json', action='store_true', help='Вывести отчёт в JSON')
+    args = parser.parse_args()
+
+    try:
+        quest = load_quest(args.quest, script_dir)
+    except (GameError, QuestFormatError, json.JSONDecodeError) as e:
+        print(f"Ошибка: {e}")
+        sys.exit(1)
+
+    weights = None
+    if args.policy == 'weighted':
+        if args.weights:
+            with open(args.weights, 'r', encoding='utf-8') as f:
+                weights = json.load(f)
+        else:
+            weights = load_choice_weights(args.quest, script_dir)
+
+    try:
+        report = analyze(quest, args.policy, args.runs, args.seed, args.max_steps, weights)
+    except ValueError as e:
+        print(f"Ошибка: {e}")
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
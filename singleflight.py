@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Объединение одинаковых одновременных запросов (single-flight)
+
+import hashlib
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import deadline
+import tracing
+from metrics import Counter
+
+COALESCED_REQUESTS = Counter(
+    "singleflight_coalesced_requests",
+    "Запросы, которые дождались результата уже выполняющейся операции",
+    ["kind"],
+)
+
+
+def request_key(*parts: str) -> str:
+    """Строит ключ запроса из произвольных строк (например, название квеста и промпт)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class _Call:
+    """Выполняющаяся операция и ожидающие её результата."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.subscribers: List[Callable] = []
+        self.lock = threading.Lock()
+        # Исполнитель начал операцию (или отказался от неё, см. SingleFlight.abandon)
+        self.started = False
+        # Работа отменяется, только когда её результат не нужен ни одному вызову
+        self.deadline = deadline.SharedDeadline()
+
+    def broadcast(self, event_type: str, data: Dict) -> None:
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            callback(event_type, data)
+
+
+class SingleFlight:
+    """
+    Выполняет операцию один раз для всех одновременных вызовов с одним ключом.
+
+    Первый вызов выполняет работу, остальные ждут его результата (или
+    исключения). События прогресса, которые отправляет операция,
+    получают все подписавшиеся вызовы. Работа выполняется со сроком
+    deadline.SharedDeadline: отключение одного клиента не отменяет её
+    для остальных, а вызов, чей срок истёк, перестаёт ждать результата.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def join(self, key: str, on_event: Optional[Callable] = None) -> Tuple[_Call, bool]:
+        """
+        Регистрирует вызов: становится исполнителем операции или ждущим её.
+
+        Решение принимается атомарно, поэтому между ним и выполнением
+        операции другой вызов не может стать вторым исполнителем. Исполнитель
+        обязан затем вызвать run или abandon, ждущий - wait.
+
+        Args:
+            key: Ключ операции
+            on_event: Обработчик событий прогресса этого вызова
+
+        Returns:
+            Tuple[_Call, bool]: (операция, является ли вызов её исполнителем)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                reason = call.deadline.reason()
+                if reason is not None:
+                    # Все участники отменены: работа вот-вот прервётся, и новый
+                    # участник получил бы чужой Cancelled. Закрепляем отмену,
+                    # чтобы новый участник её не «оживил», и начинаем заново
+                    call.deadline.cancel(reason)
+                    call = None
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            call.deadline.add(deadline.current())
+            if on_event is not None:
+                with call.lock:
+                    call.subscribers.append(on_event)
+        if not leader:
+            COALESCED_REQUESTS.inc(kind=self.kind)
+        return call, leader
+
+    def run(self, key: str, call: _Call, fn: Callable[[Callable], Any]) -> Any:
+        """
+        Выполняет операцию исполнителя: fn(функция отправки событий).
+
+        Срок выполнения - общий срок всех ждущих (deadline.SharedDeadline).
+        """
+        with self._lock:
+            if call.started:
+                # Исполнитель уже отказался от операции (abandon)
+                raise call.error
+            call.started = True
+        try:
+            with deadline.use(call.deadline):
+                call.result = fn(call.broadcast)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(key, call)
+        return call.result
+
+    def abandon(self, key: str, call: _Call, error: BaseException) -> None:
+        """
+        Завершает операцию, не выполняя её (например, исполнителю отказано в
+        месте в очереди): ждущие получают error. Уже начатую операцию не меняет.
+        """
+        with self._lock:
+            if call.started or call.done.is_set():
+                return
+            call.started = True
+        call.error = error
+        self._finish(key, call)
+
+    def wait(self, call: _Call, on_event: Optional[Callable] = None) -> Any:
+        """
+        Дожидается результата операции, к которой присоединился вызов.
+
+        Raises:
+            deadline.Cancelled: Если срок этого вызова истёк или он отменён
+        """
+        own_deadline = deadline.current()
+        with tracing.span("singleflight_wait", kind=self.kind):
+            try:
+                if own_deadline is None:
+                    call.done.wait()
+                else:
+                    own_deadline.wait(call.done)
+            except deadline.Cancelled:
+                if on_event is not None:
+                    with call.lock:
+                        call.subscribers.remove(on_event)
+                raise
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do(self, key: str, fn: Callable[[Callable], Any],
+           on_event: Optional[Callable] = None) -> Tuple[Any, bool]:
+        """
+        Выполняет fn(on_event) или дожидается уже выполняющегося вызова.
+
+        Args:
+            key: Ключ операции
+            fn: Операция; получает функцию отправки событий прогресса
+            on_event: Обработчик событий прогресса этого вызова
+
+        Returns:
+            Tuple[Any, bool]: (результат, был ли вызов объединён с уже выполняющимся)
+
+        Raises:
+            deadline.Cancelled: Если срок этого вызова истёк или он отменён
+        """
+        call, leader = self.join(key, on_event)
+        if leader:
+            return self.run(key, call, fn), False
+        return self.wait(call, on_event), True
+
+    def _finish(self, key: str, call: _Call) -> None:
+        with self._lock:
+            # Ключ мог уже перейти к новой операции (см. join)
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.done.set()
+
+    def in_flight(self) -> int:
+        """Количество выполняющихся операций."""
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,1382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Хранилище квестов и позиций узлов графа
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import history
+import questbin
+import serialization
+from engine import CompiledQuest
+from metrics import STAGE_SECONDS
+
+# Замеры операций хранилища (используются как декораторы методов)
+timed_read = STAGE_SECONDS.time(stage="storage_read")
+timed_write = STAGE_SECONDS.time(stage="storage_write")
+
+# Межпроцессные блокировки доступны только в Unix/Linux/Mac
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class VersionConflictError(Exception):
+    """Версия квеста в хранилище не совпала с ожидаемой."""
+
+    def __init__(self, quest_name: str, expected: int, actual: Optional[int]):
+        super().__init__(
+            f"Квест '{quest_name}' изменён: ожидалась версия {expected}, текущая {actual}"
+        )
+        self.quest_name = quest_name
+        self.expected = expected
+        self.actual = actual
+
+
+class QuestStorage:
+    """Базовый интерфейс хранилища квестов и позиций узлов."""
+
+    def list_quests(self) -> List[str]:
+        """
+        Возвращает отсортированный список названий квестов.
+
+        Returns:
+            List[str]: Названия квестов
+        """
+        raise NotImplementedError
+
+    def quest_exists(self, quest_name: str) -> bool:
+        """Проверяет, есть ли квест в хранилище."""
+        raise NotImplementedError
+
+    def load_quest(self, quest_name: str) -> Optional[Dict]:
+        """
+        Загружает данные квеста.
+
+        Args:
+            quest_name: Название квеста
+
+        Returns:
+            Optional[Dict]: Данные квеста или None, если квеста нет
+        """
+        raise NotImplementedError
+
+    def load_positions(self, quest_name: str) -> Optional[List]:
+        """
+        Загружает позиции узлов квеста.
+
+        Args:
+            quest_name: Название квеста
+
+        Returns:
+            Optional[List]: Позиции узлов или None, если они ещё не построены
+        """
+        raise NotImplementedError
+
+    def load_skeleton(self, quest_name: str) -> Optional[Dict]:
+        """
+        Загружает только структуру графа квеста: id сцен и переходы без текстов.
+
+        Args:
+            quest_name: Название квеста
+
+        Returns:
+            Optional[Dict]: {"scenes": [{"scene_id", "choices": [{"next_scene"}]}]}
+            или None, если квеста нет
+        """
+        quest_data = self.load_quest(quest_name)
+        if quest_data is None:
+            return None
+        return {"scenes": [skeleton_scene(scene) for scene in quest_data.get("scenes", [])]}
+
+    def load_scenes(self, quest_name: str, scene_ids: List[str]) -> Optional[Dict[str, Dict]]:
+        """
+        Загружает полные данные отдельных сцен квеста.
+
+        Args:
+            quest_name: Название квеста
+            scene_ids: Идентификаторы сцен
+
+        Returns:
+            Optional[Dict[str, Dict]]: scene_id -> сцена (отсутствующих сцен нет в словаре)
+            или None, если квеста нет
+        """
+        quest_data = self.load_quest(quest_name)
+        if quest_data is None:
+            return None
+        wanted = set(scene_ids)
+        return {
+            scene["scene_id"]: scene for scene in quest_data.get("scenes", [])
+            if isinstance(scene, dict) and scene.get("scene_id") in wanted
+        }
+
+    def load_compiled(self, quest_name: str, version: Optional[int] = None) -> Optional[CompiledQuest]:
+        """
+        Загружает квест в виде для игрового движка.
+
+        Args:
+            quest_name: Название квеста
+            version: Версия квеста (записывается в CompiledQuest)
+
+        Returns:
+            Optional[CompiledQuest]: Квест или None, если квеста нет
+
+        Raises:
+            GameError: Если квест нельзя загрузить в движок
+        """
+        quest_data = self.load_quest(quest_name)
+        if quest_data is None:
+            return None
+        return CompiledQuest(quest_data, quest_name, version)
+
+    def get_version(self, quest_name: str) -> Optional[int]:
+        """
+        Возвращает номер текущей версии квеста.
+
+        Версия увеличивается при каждом изменении квеста или его позиций.
+
+        Returns:
+            Optional[int]: Версия или None, если квеста нет
+        """
+        raise NotImplementedError
+
+    def save_quest(self, quest_name: str, quest_data: Dict,
+                   node_positions: Optional[List] = None,
+                   expected_version: Optional[int] = None) -> int:
+        """
+        Сохраняет квест и (если переданы) позиции узлов одной операцией.
+
+        Если позиции не переданы, старые позиции удаляются: они относятся
+        к предыдущей версии графа и будут построены заново.
+
+        Args:
+            quest_name: Название квеста
+            quest_data: Данные квеста
+            node_positions: Позиции узлов
+            expected_version: Если задана, запись выполняется только при совпадении версии
+
+        Returns:
+            int: Новая версия квеста
+
+        Raises:
+            VersionConflictError: Если версия не совпала с expected_version
+        """
+        raise NotImplementedError
+
+    def patch_quest(self, quest_name: str, expected_version: int,
+                    scenes: Dict[str, Optional[Dict]],
+                    positions: Dict[str, Optional[Dict]]) -> int:
+        """
+        Записывает только изменённые сцены и позиции узлов.
+
+        Args:
+            quest_name: Название квеста
+            expected_version: Версия, к которой применяются изменения
+            scenes: scene_id -> новая сцена (None - удалить сцену, новые id добавляются в конец)
+            positions: scene_id -> новая позиция узла (None - удалить позицию)
+
+        Returns:
+            int: Новая версия квеста
+
+        Raises:
+            KeyError: Если квеста нет
+            VersionConflictError: Если версия не совпала с expected_version
+        """
+        raise NotImplementedError
+
+    def save_positions(self, quest_name: str, node_positions: List,
+                       expected_version: Optional[int] = None) -> bool:
+        """
+        Сохраняет построенные позиции узлов существующего квеста.
+
+        Версия квеста не меняется: автоматическая раскладка не является
+        правкой пользователя.
+
+        Args:
+            quest_name: Название квеста
+            node_positions: Позиции узлов
+            expected_version: Версия квеста, для которой построены позиции: если
+                квест успели изменить, позиции устарели и не записываются
+
+        Returns:
+            bool: Записаны ли позиции
+        """
+        raise NotImplementedError
+
+    def locations(self, quest_name: str) -> Dict[str, str]:
+        """
+        Где хранятся квест и его позиции узлов (для ответов API и логов).
+
+        Returns:
+            Dict[str, str]: {"quest_file", "positions_file"} - пути к файлам
+            или к базе, в которой они лежат
+        """
+        raise NotImplementedError
+
+    def delete_quest(self, quest_name: str) -> bool:
+        """
+        Удаляет квест вместе с позициями.
+
+        Returns:
+            bool: True если квест существовал
+        """
+        raise NotImplementedError
+
+    def list_versions(self, quest_name: str) -> Optional[List[Dict]]:
+        """
+        Возвращает сохранённые версии квеста, от новых к старым.
+
+        Каждая версия - манифест из хешей сцен, позиций и полей квеста;
+        сами объекты хранятся один раз для всех версий (см. history.py).
+
+        Args:
+            quest_name: Название квеста
+
+        Returns:
+            Optional[List[Dict]]: {"version", "created_at", "scenes", "has_positions",
+            "added_bytes"} или None, если квеста нет
+        """
+        raise NotImplementedError
+
+    def _read_manifest(self, quest_name: str, version: int) -> Optional[Dict]:
+        """Возвращает манифест версии или None, если версии нет в истории."""
+        raise NotImplementedError
+
+    def _read_objects(self, quest_name: str, keys) -> Dict[str, bytes]:
+        """Читает объекты истории квеста по хешам."""
+        raise NotImplementedError
+
+    def load_version(self, quest_name: str, version: int) -> Optional[Tuple[Dict, Optional[List]]]:
+        """
+        Загружает квест и позиции узлов в состоянии одной из версий.
+
+        Args:
+            quest_name: Название квеста
+            version: Номер версии
+
+        Returns:
+            Optional[Tuple[Dict, Optional[List]]]: Данные квеста и позиции или None,
+            если версии нет в истории
+
+        Raises:
+            HistoryError: Если история версий повреждена
+        """
+        manifest = self._read_manifest(quest_name, version)
+        if manifest is None:
+            return None
+        return history.materialize(manifest, lambda keys: self._read_objects(quest_name, keys))
+
+    def diff_versions(self, quest_name: str, old_version: int, new_version: int) -> Optional[Dict]:
+        """
+        Сравнивает две версии квеста (см. history.diff_manifests).
+
+        Returns:
+            Optional[Dict]: Добавленные, удалённые и изменённые сцены, изменённые
+            поля квеста и перемещённые узлы или None, если одной из версий нет
+
+        Raises:
+            HistoryError: Если история версий повреждена
+        """
+        old = self._read_manifest(quest_name, old_version)
+        new = self._read_manifest(quest_name, new_version)
+        if old is None or new is None:
+            return None
+        return history.diff_manifests(old, new, lambda keys: self._read_objects(quest_name, keys))
+
+    def restore_version(self, quest_name: str, version: int,
+                        expected_version: Optional[int] = None) -> Optional[Tuple[int, Dict]]:
+        """
+        Восстанавливает квест и позиции узлов одной из версий как новую версию.
+
+        Args:
+            quest_name: Название квеста
+            version: Восстанавливаемая версия
+            expected_version: Если задана, запись выполняется только при совпадении текущей версии
+
+        Returns:
+            Optional[Tuple[int, Dict]]: Новая версия и восстановленные данные квеста
+            или None, если версии нет в истории
+
+        Raises:
+            VersionConflictError: Если текущая версия не совпала с expected_version
+            HistoryError: Если история версий повреждена
+        """
+        snapshot = self.load_version(quest_name, version)
+        if snapshot is None:
+            return None
+        quest_data, node_positions = snapshot
+        return self.save_quest(quest_name, quest_data, node_positions, expected_version), quest_data
+
+    def close(self) -> None:
+        """Освобождает ресурсы хранилища."""
+
+
+class FileQuestStorage(QuestStorage):
+    """
+    Хранилище в виде JSON файлов: generated_quests/{name}.json и
+    node_positions/{name}.json.
+
+    Файлы пишутся в компактном JSON (без отступов); читаемая копия
+    квеста доступна через export_quest. Каждый файл пишется атомарно
+    (временный файл + os.replace), а пара квест/позиции защищена
+    блокировкой, общей для потоков и процессов: запись исключительна,
+    чтение разделяемо (flock LOCK_SH), поэтому читатели одного квеста не
+    ждут друг друга.
+
+    Сохранение из нескольких файлов фиксируется последним шагом: сначала
+    в историю записывается манифест новой версии (журнал намерения), затем
+    позиции, квест, индекс и копия, и только потом файл версии. Если запись
+    прервалась (сбой процесса или ошибка записи), версия остаётся прежней, а
+    при следующей записи квеста или открытии хранилища (recover) незавершённая
+    версия дописывается из истории.
+
+    Рядом с квестом хранится индекс .{name}.index со смещениями сцен в
+    файле и переходами между ними: структура графа и отдельные сцены
+    читаются без разбора всего квеста. Там же лежит скомпилированная
+    копия .{name}.qbin (см. questbin.py), из которой движок загружает
+    квест через mmap. Индекс и копия, не совпадающие с файлом по размеру
+    и времени изменения (например, после ручной правки), игнорируются.
+
+    История версий лежит в .history/{name}/: файл объектов objects.pack
+    и манифест {версия}.json на каждую версию.
+    """
+
+    def __init__(self, quests_dir, positions_dir):
+        self.quests_dir = Path(quests_dir)
+        self.positions_dir = Path(positions_dir)
+        self._locks: Dict[str, threading.RLock] = {}
+        self._locks_guard = threading.Lock()
+        self._packs: Dict[str, history.ObjectPack] = {}
+
+    def _quest_path(self, quest_name: str) -> Path:
+        return self.quests_dir / f"{quest_name}.json"
+
+    def _positions_path(self, quest_name: str) -> Path:
+        return self.positions_dir / f"{quest_name}.json"
+
+    def _version_path(self, quest_name: str) -> Path:
+        return self.quests_dir / f".{quest_name}.version"
+
+    def _index_path(self, quest_name: str) -> Path:
+        return self.quests_dir / f".{quest_name}.index"
+
+    def _binary_path(self, quest_name: str) -> Path:
+        return questbin.binary_path(self._quest_path(quest_name))
+
+    def locations(self, quest_name: str) -> Dict[str, str]:
+        return {"quest_file": str(self._quest_path(quest_name)),
+                "positions_file": str(self._positions_path(quest_name))}
+
+    def _history_dir(self, quest_name: str) -> Path:
+        return self.quests_dir / ".history" / quest_name
+
+    def _manifest_path(self, quest_name: str, version: int) -> Path:
+        return self._history_dir(quest_name) / f"{version}.json"
+
+    def _pack(self, quest_name: str) -> history.ObjectPack:
+        with self._locks_guard:
+            pack = self._packs.get(quest_name)
+            if pack is None:
+                pack = self._packs[quest_name] = history.ObjectPack(
+                    self._history_dir(quest_name) / "objects.pack"
+                )
+            return pack
+
+    @contextmanager
+    def _locked(self, quest_name: str, exclusive: bool) -> Iterator[None]:
+        """
+        Блокирует квест: запись - внутри процесса и (если возможно) между
+        процессами, чтение - только разделяемой блокировкой файла. Каждое
+        чтение открывает свой дескриптор, поэтому flock согласует читателей
+        и писателей и между потоками одного процесса.
+        """
+        if not exclusive:
+            with self._file_lock(quest_name, fcntl.LOCK_SH if fcntl else None):
+                yield
+            return
+
+        with self._locks_guard:
+            lock = self._locks.setdefault(quest_name, threading.RLock())
+        with lock:
+            with self._file_lock(quest_name, fcntl.LOCK_EX if fcntl else None):
+                yield
+
+    @contextmanager
+    def _file_lock(self, quest_name: str, mode: Optional[int]) -> Iterator[None]:
+        if mode is None:
+            # Без fcntl читатели полагаются на атомарную подмену файлов
+            yield
+            return
+
+        self.quests_dir.mkdir(parents=True, exist_ok=True)
+        lock_path = self.quests_dir / f".{quest_name}.lock"
+        with open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _atomic_write(path: Path, data: bytes) -> None:
+        """Записывает данные во временный файл и атомарно подменяет им целевой."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def _atomic_write_json(cls, path: Path, data) -> None:
+        cls._atomic_write(path, serialization.dumps_bytes(data))
+
+    def _write_quest(self, quest_name: str, quest_data: Dict) -> None:
+        """Записывает квест, индекс смещений его сцен и скомпилированную копию. Вызывается под блокировкой."""
+        data, entries = serialize_quest(quest_data)
+        quest_path = self._quest_path(quest_name)
+        self._atomic_write(quest_path, data)
+        stat = quest_path.stat()
+        self._atomic_write_json(self._index_path(quest_name), {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "scenes": entries,
+        })
+        try:
+            binary = questbin.compile_quest(quest_data, stat.st_size, stat.st_mtime_ns)
+        except questbin.QuestFormatError:
+            # Квест загружается из JSON; устаревшая копия не совпадёт с файлом по размеру и времени
+            return
+        self._atomic_write(self._binary_path(quest_name), binary)
+
+    def _record_version(self, quest_name: str, version: int,
+                        manifest: Dict, objects: Dict[str, bytes]) -> None:
+        """Дописывает новые объекты и записывает манифест версии. Вызывается под блокировкой."""
+        added_bytes = self._pack(quest_name).write(objects)
+        self._atomic_write_json(self._manifest_path(quest_name, version), {
+            "version": version,
+            "created_at": time.time(),
+            "added_bytes": added_bytes,
+            **manifest,
+        })
+
+    def _read_index(self, quest_name: str) -> Optional[List]:
+        """Возвращает записи индекса [scene_id, начало, длина, переходы] или None, если индекс устарел."""
+        index = self._read_json(self._index_path(quest_name))
+        if not isinstance(index, dict):
+            return None
+        try:
+            stat = self._quest_path(quest_name).stat()
+        except FileNotFoundError:
+            return None
+        if index.get("size") != stat.st_size or index.get("mtime_ns") != stat.st_mtime_ns:
+            return None
+        return index.get("scenes")
+
+    @staticmethod
+    def _read_json(path: Path):
+        try:
+            with open(path, "rb") as f:
+                return serialization.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def list_quests(self) -> List[str]:
+        if not self.quests_dir.exists():
+            return []
+        return sorted(
+            f.stem for f in self.quests_dir.glob("*.json")
+            if not f.name.startswith(".")
+        )
+
+    def quest_exists(self, quest_name: str) -> bool:
+        return self._quest_path(quest_name).exists()
+
+    def _read_version(self, quest_name: str) -> Optional[int]:
+        if not self._quest_path(quest_name).exists():
+            return None
+        try:
+            return int(self._version_path(quest_name).read_text())
+        except (FileNotFoundError, ValueError):
+            # Квесты, сохранённые до появления версий
+            return 0
+
+    def _next_version(self, quest_name: str, expected_version: Optional[int]) -> int:
+        """Проверяет ожидаемую версию и возвращает следующую. Вызывается под блокировкой."""
+        current = self._read_version(quest_name)
+        if expected_version is not None and current != expected_version:
+            raise VersionConflictError(quest_name, expected_version, current)
+        return (current or 0) + 1
+
+    def get_version(self, quest_name: str) -> Optional[int]:
+        with self._locked(quest_name, exclusive=False):
+            return self._read_version(quest_name)
+
+    @timed_read
+    def load_quest(self, quest_name: str) -> Optional[Dict]:
+        with self._locked(quest_name, exclusive=False):
+            return self._read_json(self._quest_path(quest_name))
+
+    @timed_read
+    def load_skeleton(self, quest_name: str) -> Optional[Dict]:
+        with self._locked(quest_name, exclusive=False):
+            entries = self._read_index(quest_name)
+            if entries is None:
+                # Квест без индекса (сохранён старой версией или изменён вручную)
+                return super().load_skeleton(quest_name)
+            return {"scenes": [
+                {"scene_id": scene_id, "choices": [{"next_scene": target} for target in targets]}
+                for scene_id, _, _, targets in entries
+            ]}
+
+    @timed_read
+    def load_scenes(self, quest_name: str, scene_ids: List[str]) -> Optional[Dict[str, Dict]]:
+        with self._locked(quest_name, exclusive=False):
+            entries = self._read_index(quest_name)
+            if entries is None:
+                return super().load_scenes(quest_name, scene_ids)
+            wanted = set(scene_ids)
+            scenes = {}
+            with open(self._quest_path(quest_name), "rb") as f:
+                for scene_id, start, length, _ in entries:
+                    if scene_id in wanted:
+                        f.seek(start)
+                        scenes[scene_id] = serialization.loads(f.read(length))
+            return scenes
+
+    @timed_read
+    def load_compiled(self, quest_name: str, version: Optional[int] = None) -> Optional[CompiledQuest]:
+        with self._locked(quest_name, exclusive=False):
+            binary = questbin.open_binary(self._quest_path(quest_name))
+            if binary is not None:
+                return binary.compiled(quest_name, version)
+            # Квест без скомпилированной копии (сохранён старой версией или изменён вручную)
+            quest_data = self._read_json(self._quest_path(quest_name))
+        if quest_data is None:
+            return None
+        return CompiledQuest(quest_data, quest_name, version)
+
+    @timed_read
+    def load_positions(self, quest_name: str) -> Optional[List]:
+        with self._locked(quest_name, exclusive=False):
+            return self._read_json(self._positions_path(quest_name))
+
+    def _write_files(self, quest_name: str, quest_data: Optional[Dict],
+                     node_positions: Optional[List], drop_positions: bool) -> None:
+        """Записывает позиции и квест. Вызывается под блокировкой."""
+        positions_path = self._positions_path(quest_name)
+        if node_positions is not None:
+            self._atomic_write_json(positions_path, node_positions)
+        elif drop_positions and positions_path.exists():
+            positions_path.unlink()
+        if quest_data is not None:
+            self._write_quest(quest_name, quest_data)
+
+    def _commit(self, quest_name: str, version: int) -> None:
+        """Фиксирует сохранённую версию: последний шаг записи. Вызывается под блокировкой."""
+        self._atomic_write_json(self._version_path(quest_name), version)
+
+    def _roll_forward(self, quest_name: str) -> Optional[int]:
+        """
+        Дописывает запись, прерванную после манифеста новой версии, но до её
+        фиксации: квест и позиции восстанавливаются из истории. Вызывается под
+        блокировкой.
+
+        Returns:
+            Optional[int]: Дописанная версия или None, если дописывать нечего
+        """
+        try:
+            version = int(self._version_path(quest_name).read_text()) + 1
+        except (FileNotFoundError, ValueError):
+            version = 1
+        manifest = self._read_json(self._manifest_path(quest_name, version))
+        if manifest is None:
+            return None
+        quest_data, node_positions = history.materialize(manifest, self._pack(quest_name).read)
+        self._write_files(quest_name, quest_data, node_positions, drop_positions=True)
+        self._commit(quest_name, version)
+        print(f"Дописано прерванное сохранение квеста {quest_name} (версия {version})")
+        return version
+
+    def recover(self) -> int:
+        """
+        Дописывает прерванные сохранения всех квестов (например, после
+        аварийного завершения процесса).
+
+        Returns:
+            int: Сколько квестов дописано
+        """
+        history_dir = self.quests_dir / ".history"
+        if not history_dir.is_dir():
+            return 0
+        recovered = 0
+        for path in history_dir.iterdir():
+            if not path.is_dir():
+                continue
+            with self._locked(path.name, exclusive=True):
+                try:
+                    if self._roll_forward(path.name) is not None:
+                        recovered += 1
+                except history.HistoryError as e:
+                    print(f"Не удалось дописать сохранение квеста {path.name}: {e}")
+        return recovered
+
+    @timed_write
+    def save_quest(self, quest_name: str, quest_data: Dict,
+                   node_positions: Optional[List] = None,
+                   expected_version: Optional[int] = None) -> int:
+        with self._locked(quest_name, exclusive=True):
+            self._roll_forward(quest_name)
+            version = self._next_version(quest_name, expected_version)
+            self._record_version(quest_name, version, *history.snapshot(quest_data, node_positions))
+            self._write_files(quest_name, quest_data, node_positions, drop_positions=True)
+            self._commit(quest_name, version)
+            return version
+
+    @timed_write
+    def patch_quest(self, quest_name: str, expected_version: int,
+                    scenes: Dict[str, Optional[Dict]],
+                    positions: Dict[str, Optional[Dict]]) -> int:
+        with self._locked(quest_name, exclusive=True):
+            self._roll_forward(quest_name)
+            quest_data = self._read_json(self._quest_path(quest_name))
+            if quest_data is None:
+                raise KeyError(quest_name)
+            version = self._next_version(quest_name, expected_version)
+
+            # JSON файл нельзя переписать частично: перезаписываем только изменённые файлы
+            node_positions = None
+            if positions:
+                node_positions = merge_by_scene_id(
+                    self._read_json(self._positions_path(quest_name)) or [], positions
+                )
+            if scenes:
+                quest_data["scenes"] = merge_by_scene_id(quest_data.get("scenes", []), scenes)
+
+            previous = self._read_json(self._manifest_path(quest_name, expected_version))
+            if previous is not None:
+                self._record_version(quest_name, version, *history.patch_snapshot(
+                    previous, scenes, node_positions, self._pack(quest_name).read
+                ))
+            else:
+                # Квест сохранён до появления истории версий
+                self._record_version(quest_name, version, *history.snapshot(
+                    quest_data,
+                    self._read_json(self._positions_path(quest_name)) if node_positions is None
+                    else node_positions
+                ))
+            self._write_files(quest_name, quest_data if scenes else None, node_positions,
+                              drop_positions=False)
+            self._commit(quest_name, version)
+            return version
+
+    @timed_write
+    def save_positions(self, quest_name: str, node_positions: List,
+                       expected_version: Optional[int] = None) -> bool:
+        with self._locked(quest_name, exclusive=True):
+            self._roll_forward(quest_name)
+            if expected_version is not None and self._read_version(quest_name) != expected_version:
+                return False
+            self._atomic_write_json(self._positions_path(quest_name), node_positions)
+            return True
+
+    @timed_write
+    def delete_quest(self, quest_name: str) -> bool:
+        with self._locked(quest_name, exclusive=True):
+            quest_path = self._quest_path(quest_name)
+            existed = quest_path.exists()
+            for path in (quest_path, self._positions_path(quest_name),
+                         self._version_path(quest_name), self._index_path(quest_name),
+                         self._binary_path(quest_name)):
+                if path.exists():
+                    path.unlink()
+            shutil.rmtree(self._history_dir(quest_name), ignore_errors=True)
+            with self._locks_guard:
+                self._packs.pop(quest_name, None)
+        return existed
+
+    def list_versions(self, quest_name: str) -> Optional[List[Dict]]:
+        with self._locked(quest_name, exclusive=False):
+            if not self.quest_exists(quest_name):
+                return None
+            manifests = [self._read_json(path) for path in self._history_dir(quest_name).glob("*.json")]
+        return sorted((
+            {
+                "version": manifest["version"],
+                "created_at": manifest["created_at"],
+                "scenes": manifest["scene_count"],
+                "has_positions": manifest["positions"] is not None,
+                "added_bytes": manifest["added_bytes"],
+            }
+            for manifest in manifests if manifest is not None
+        ), key=lambda item: item["version"], reverse=True)
+
+    def _read_manifest(self, quest_name: str, version: int) -> Optional[Dict]:
+        with self._locked(quest_name, exclusive=False):
+            return self._read_json(self._manifest_path(quest_name, version))
+
+    def _read_objects(self, quest_name: str, keys) -> Dict[str, bytes]:
+        with self._locked(quest_name, exclusive=False):
+            return self._pack(quest_name).read(keys)
+
+
+class SQLiteQuestStorage(QuestStorage):
+    """
+    Хранилище в SQLite в режиме WAL.
+
+    Квест хранится построчно: отдельная строка на каждую сцену и на каждую
+    позицию узла. Квест и позиции записываются в одной транзакции, а
+    читатели не блокируют друг друга и писателя. Каждый поток получает
+    собственное соединение.
+
+    История версий пишется в той же транзакции: объекты (history_objects)
+    и манифест каждой версии (quest_versions).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS quests (
+            name TEXT PRIMARY KEY,
+            extra TEXT NOT NULL DEFAULT '{}',
+            version INTEGER NOT NULL DEFAULT 1,
+            has_positions INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS scenes (
+            quest_name TEXT NOT NULL REFERENCES quests(name) ON DELETE CASCADE,
+            ord INTEGER NOT NULL,
+            scene_id TEXT,
+            body TEXT NOT NULL,
+            PRIMARY KEY (quest_name, ord)
+        );
+        CREATE INDEX IF NOT EXISTS scenes_by_id ON scenes (quest_name, scene_id);
+        CREATE TABLE IF NOT EXISTS node_positions (
+            quest_name TEXT NOT NULL REFERENCES quests(name) ON DELETE CASCADE,
+            ord INTEGER NOT NULL,
+            scene_id TEXT,
+            body TEXT NOT NULL,
+            PRIMARY KEY (quest_name, ord)
+        );
+        CREATE TABLE IF NOT EXISTS history_objects (
+            quest_name TEXT NOT NULL REFERENCES quests(name) ON DELETE CASCADE,
+            hash TEXT NOT NULL,
+            body BLOB NOT NULL,
+            PRIMARY KEY (quest_name, hash)
+        );
+        CREATE TABLE IF NOT EXISTS quest_versions (
+            quest_name TEXT NOT NULL REFERENCES quests(name) ON DELETE CASCADE,
+            version INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            scene_count INTEGER NOT NULL,
+            has_positions INTEGER NOT NULL,
+            added_bytes INTEGER NOT NULL,
+            manifest TEXT NOT NULL,
+            PRIMARY KEY (quest_name, version)
+        );
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_guard = threading.Lock()
+        conn = self._connect()
+        conn.executescript(self.SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(quests)")}
+        if "version" not in columns:
+            # Базы, созданные до появления версий квестов
+            conn.execute("ALTER TABLE quests ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+    def locations(self, quest_name: str) -> Dict[str, str]:
+        return {"quest_file": self.db_path, "positions_file": self.db_path}
+
+    def _connect(self) -> sqlite3.Connection:
+        """Возвращает соединение текущего потока, создавая его при необходимости."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+            with self._connections_guard:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Открывает транзакцию записи (BEGIN IMMEDIATE) и фиксирует её при успехе."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _dumps(data) -> str:
+        return serialization.dumps(data)
+
+    @staticmethod
+    def _replace_positions(conn: sqlite3.Connection, quest_name: str,
+                           node_positions: Optional[List]) -> None:
+        conn.execute("DELETE FROM node_positions WHERE quest_name = ?", (quest_name,))
+        if node_positions is None:
+            return
+        conn.executemany(
+            "INSERT INTO node_positions (quest_name, ord, scene_id, body) VALUES (?, ?, ?, ?)",
+            [
+                (quest_name, i, item.get("scene_id") if isinstance(item, dict) else None,
+                 SQLiteQuestStorage._dumps(item))
+                for i, item in enumerate(node_positions)
+            ],
+        )
+
+    @staticmethod
+    def _check_version(conn: sqlite3.Connection, quest_name: str,
+                       expected_version: Optional[int]) -> Optional[int]:
+        row = conn.execute("SELECT version FROM quests WHERE name = ?", (quest_name,)).fetchone()
+        current = row[0] if row else None
+        if expected_version is not None and current != expected_version:
+            raise VersionConflictError(quest_name, expected_version, current)
+        return current
+
+    def _upsert_rows(self, conn: sqlite3.Connection, table: str, quest_name: str,
+                     changes: Dict[str, Optional[Dict]]) -> None:
+        """Обновляет, удаляет или добавляет отдельные строки сцен/позиций."""
+        next_ord = conn.execute(
+            f"SELECT COALESCE(MAX(ord) + 1, 0) FROM {table} WHERE quest_name = ?", (quest_name,)
+        ).fetchone()[0]
+        for scene_id, item in changes.items():
+            if item is None:
+                conn.execute(f"DELETE FROM {table} WHERE quest_name = ? AND scene_id = ?",
+                             (quest_name, scene_id))
+                continue
+            updated = conn.execute(
+                f"UPDATE {table} SET body = ? WHERE quest_name = ? AND scene_id = ?",
+                (self._dumps(item), quest_name, scene_id),
+            ).rowcount
+            if not updated:
+                conn.execute(
+                    f"INSERT INTO {table} (quest_name, ord, scene_id, body) VALUES (?, ?, ?, ?)",
+                    (quest_name, next_ord, scene_id, self._dumps(item)),
+                )
+                next_ord += 1
+
+    @staticmethod
+    def _record_version(conn: sqlite3.Connection, quest_name: str, version: int,
+                        manifest: Dict, objects: Dict[str, bytes]) -> None:
+        """Добавляет новые объекты и манифест версии в текущей транзакции."""
+        added_bytes = 0
+        for key, data in objects.items():
+            if conn.execute(
+                "INSERT OR IGNORE INTO history_objects (quest_name, hash, body) VALUES (?, ?, ?)",
+                (quest_name, key, data),
+            ).rowcount:
+                added_bytes += len(data)
+        conn.execute(
+            "INSERT OR REPLACE INTO quest_versions (quest_name, version, created_at, scene_count, "
+            "has_positions, added_bytes, manifest) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (quest_name, version, time.time(), manifest["scene_count"],
+             int(manifest["positions"] is not None), added_bytes, SQLiteQuestStorage._dumps(manifest)),
+        )
+
+    @staticmethod
+    def _select_manifest(conn: sqlite3.Connection, quest_name: str, version: int) -> Optional[Dict]:
+        row = conn.execute(
+            "SELECT manifest FROM quest_versions WHERE quest_name = ? AND version = ?",
+            (quest_name, version),
+        ).fetchone()
+        return serialization.loads(row[0]) if row else None
+
+    @staticmethod
+    def _select_quest(conn: sqlite3.Connection, quest_name: str) -> Optional[Dict]:
+        row = conn.execute(
+            "SELECT extra FROM quests WHERE name = ?", (quest_name,)
+        ).fetchone()
+        if row is None:
+            return None
+        scenes = conn.execute(
+            "SELECT body FROM scenes WHERE quest_name = ? ORDER BY ord", (quest_name,)
+        ).fetchall()
+        quest_data = serialization.loads(row[0])
+        quest_data["scenes"] = [serialization.loads(body) for (body,) in scenes]
+        return quest_data
+
+    @staticmethod
+    def _select_positions(conn: sqlite3.Connection, quest_name: str) -> Optional[List]:
+        row = conn.execute(
+            "SELECT has_positions FROM quests WHERE name = ?", (quest_name,)
+        ).fetchone()
+        if row is None or not row[0]:
+            return None
+        positions = conn.execute(
+            "SELECT body FROM node_positions WHERE quest_name = ? ORDER BY ord", (quest_name,)
+        ).fetchall()
+        return [serialization.loads(body) for (body,) in positions]
+
+    def list_quests(self) -> List[str]:
+        rows = self._connect().execute("SELECT name FROM quests ORDER BY name").fetchall()
+        return [row[0] for row in rows]
+
+    def quest_exists(self, quest_name: str) -> bool:
+        row = self._connect().execute(
+            "SELECT 1 FROM quests WHERE name = ?", (quest_name,)
+        ).fetchone()
+        return row is not None
+
+    def get_version(self, quest_name: str) -> Optional[int]:
+        return self._check_version(self._connect(), quest_name, None)
+
+    @timed_read
+    def load_quest(self, quest_name: str) -> Optional[Dict]:
+        conn = self._connect()
+        # Читаем квест и его сцены из одного снимка базы
+        conn.execute("BEGIN")
+        try:
+            return self._select_quest(conn, quest_name)
+        finally:
+            conn.execute("COMMIT")
+
+    @timed_read
+    def load_skeleton(self, quest_name: str) -> Optional[Dict]:
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            if not self.quest_exists(quest_name):
+                return None
+            # Переходы извлекает сам SQLite (JSON1), тексты сцен не передаются в Python
+            rows = conn.execute(
+                "SELECT s.scene_id, (SELECT json_group_array(json_extract(c.value, '$.next_scene')) "
+                "FROM json_each(s.body, '$.choices') AS c) "
+                "FROM scenes AS s WHERE s.quest_name = ? ORDER BY s.ord",
+                (quest_name,),
+            ).fetchall()
+        finally:
+            conn.execute("COMMIT")
+        return {"scenes": [
+            {"scene_id": scene_id,
+             "choices": [{"next_scene": target} for target in serialization.loads(targets)]}
+            for scene_id, targets in rows
+        ]}
+
+    @timed_read
+    def load_scenes(self, quest_name: str, scene_ids: List[str]) -> Optional[Dict[str, Dict]]:
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            if not self.quest_exists(quest_name):
+                return None
+            scene_ids = list(set(scene_ids))
+            rows = []
+            # Ограничение SQLite на число параметров запроса
+            for i in range(0, len(scene_ids), 500):
+                chunk = scene_ids[i:i + 500]
+                rows += conn.execute(
+                    f"SELECT scene_id, body FROM scenes WHERE quest_name = ? "
+                    f"AND scene_id IN ({', '.join('?' * len(chunk))})",
+                    (quest_name, *chunk),
+                ).fetchall()
+        finally:
+            conn.execute("COMMIT")
+        return {scene_id: serialization.loads(body) for scene_id, body in rows}
+
+    @timed_read
+    def load_positions(self, quest_name: str) -> Optional[List]:
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            return self._select_positions(conn, quest_name)
+        finally:
+            conn.execute("COMMIT")
+
+    @timed_write
+    def save_quest(self, quest_name: str, quest_data: Dict,
+                   node_positions: Optional[List] = None,
+                   expected_version: Optional[int] = None) -> int:
+        extra = {key: value for key, value in quest_data.items() if key != "scenes"}
+        scenes = quest_data.get("scenes", [])
+
+        with self._transaction() as conn:
+            version = (self._check_version(conn, quest_name, expected_version) or 0) + 1
+            conn.execute(
+                "INSERT INTO quests (name, extra, version, has_positions, updated_at) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET extra = excluded.extra, version = excluded.version, "
+                "has_positions = excluded.has_positions, updated_at = excluded.updated_at",
+                (quest_name, self._dumps(extra), version, int(node_positions is not None),
+                 time.time()),
+            )
+            conn.execute("DELETE FROM scenes WHERE quest_name = ?", (quest_name,))
+            conn.executemany(
+                "INSERT INTO scenes (quest_name, ord, scene_id, body) VALUES (?, ?, ?, ?)",
+                [
+                    (quest_name, i, scene.get("scene_id") if isinstance(scene, dict) else None,
+                     self._dumps(scene))
+                    for i, scene in enumerate(scenes)
+                ],
+            )
+            self._replace_positions(conn, quest_name, node_positions)
+            self._record_version(conn, quest_name, version,
+                                 *history.snapshot(quest_data, node_positions))
+        return version
+
+    @timed_write
+    def patch_quest(self, quest_name: str, expected_version: int,
+                    scenes: Dict[str, Optional[Dict]],
+                    positions: Dict[str, Optional[Dict]]) -> int:
+        with self._transaction() as conn:
+            current = self._check_version(conn, quest_name, None)
+            if current is None:
+                raise KeyError(quest_name)
+            if current != expected_version:
+                raise VersionConflictError(quest_name, expected_version, current)
+            self._upsert_rows(conn, "scenes", quest_name, scenes)
+            if positions:
+                self._upsert_rows(conn, "node_positions", quest_name, positions)
+            conn.execute(
+                "UPDATE quests SET version = ?, has_positions = has_positions OR ?, "
+                "updated_at = ? WHERE name = ?",
+                (current + 1, int(bool(positions)), time.time(), quest_name),
+            )
+            previous = self._select_manifest(conn, quest_name, current)
+            if previous is not None:
+                node_positions = self._select_positions(conn, quest_name) if positions else None
+                snapshot = history.patch_snapshot(previous, scenes, node_positions,
+                                                  lambda keys: self._read_objects(quest_name, keys))
+            else:
+                # Квест сохранён до появления истории версий
+                snapshot = history.snapshot(self._select_quest(conn, quest_name),
+                                            self._select_positions(conn, quest_name))
+            self._record_version(conn, quest_name, current + 1, *snapshot)
+        return current + 1
+
+    @timed_write
+    def save_positions(self, quest_name: str, node_positions: List,
+                       expected_version: Optional[int] = None) -> bool:
+        with self._transaction() as conn:
+            row = conn.execute("SELECT version FROM quests WHERE name = ?", (quest_name,)).fetchone()
+            if row is None:
+                raise KeyError(quest_name)
+            if expected_version is not None and row[0] != expected_version:
+                return False
+            conn.execute(
+                "UPDATE quests SET has_positions = 1, updated_at = ? WHERE name = ?",
+                (time.time(), quest_name),
+            )
+            self._replace_positions(conn, quest_name, node_positions)
+        return True
+
+    @timed_write
+    def delete_quest(self, quest_name: str) -> bool:
+        with self._transaction() as conn:
+            deleted = conn.execute("DELETE FROM quests WHERE name = ?", (quest_name,)).rowcount
+        return bool(deleted)
+
+    def list_versions(self, quest_name: str) -> Optional[List[Dict]]:
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            if not self.quest_exists(quest_name):
+                return None
+            rows = conn.execute(
+                "SELECT version, created_at, scene_count, has_positions, added_bytes "
+                "FROM quest_versions WHERE quest_name = ? ORDER BY version DESC",
+                (quest_name,),
+            ).fetchall()
+        finally:
+            conn.execute("COMMIT")
+        return [
+            {"version": version, "created_at": created_at, "scenes": scene_count,
+             "has_positions": bool(has_positions), "added_bytes": added_bytes}
+            for version, created_at, scene_count, has_positions, added_bytes in rows
+        ]
+
+    def _read_manifest(self, quest_name: str, version: int) -> Optional[Dict]:
+        return self._select_manifest(self._connect(), quest_name, version)
+
+    def _read_objects(self, quest_name: str, keys) -> Dict[str, bytes]:
+        conn = self._connect()
+        keys = list(set(keys))
+        objects = {}
+        # Ограничение SQLite на число параметров запроса
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            objects.update(conn.execute(
+                f"SELECT hash, body FROM history_objects WHERE quest_name = ? "
+                f"AND hash IN ({', '.join('?' * len(chunk))})",
+                (quest_name, *chunk),
+            ).fetchall())
+        return objects
+
+    def close(self) -> None:
+        with self._connections_guard:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def check_quest_name(quest_name) -> None:
+    """
+    Проверяет название квеста, пришедшее извне (API, импорт библиотеки).
+
+    Название становится именем файла, поэтому разделители пути запрещены,
+    как и ведущая точка: с неё начинаются служебные файлы хранилища
+    (журнал, индекс, блокировка, версия), а ".." вывело бы запись за
+    пределы папки.
+
+    Raises:
+        ValueError: Если название пустое или недопустимое
+    """
+    if not isinstance(quest_name, str) or not quest_name.strip():
+        raise ValueError("Название квеста не задано")
+    if quest_name.startswith(".") or any(char in quest_name for char in ("/", "\\", "\0")):
+        raise ValueError(f"Недопустимое название квеста '{quest_name}': "
+                         f"разделители пути и ведущая точка запрещены")
+
+
+def skeleton_scene(scene) -> Dict:
+    """Оставляет от сцены только id и переходы."""
+    if not isinstance(scene, dict):
+        return {"scene_id": None, "choices": []}
+    return {
+        "scene_id": scene.get("scene_id"),
+        "choices": [
+            {"next_scene": choice.get("next_scene") if isinstance(choice, dict) else None}
+            for choice in scene.get("choices") or []
+        ],
+    }
+
+
+def serialize_quest(quest_data: Dict) -> Tuple[bytes, List]:
+    """
+    Сериализует квест в компактный JSON, запоминая положение каждой сцены.
+
+    Args:
+        quest_data: Данные квеста
+
+    Returns:
+        Tuple[bytes, List]: JSON квеста и записи [scene_id, начало, длина, переходы]
+    """
+    if not isinstance(quest_data, dict):
+        return serialization.dumps_bytes(quest_data), []
+
+    parts = [b"{"]
+    size = 1
+    entries = []
+    for i, (key, value) in enumerate(quest_data.items()):
+        head = (b"," if i else b"") + serialization.dumps_bytes(key) + b":"
+        parts.append(head)
+        size += len(head)
+        if key != "scenes" or not isinstance(value, list):
+            data = serialization.dumps_bytes(value)
+            parts.append(data)
+            size += len(data)
+            continue
+        parts.append(b"[")
+        size += 1
+        for j, scene in enumerate(value):
+            if j:
+                parts.append(b",")
+                size += 1
+            data = serialization.dumps_bytes(scene)
+            skeleton = skeleton_scene(scene)
+            entries.append([skeleton["scene_id"], size, len(data),
+                            [choice["next_scene"] for choice in skeleton["choices"]]])
+            parts.append(data)
+            size += len(data)
+        parts.append(b"]")
+        size += 1
+    parts.append(b"}")
+    return b"".join(parts), entries
+
+
+def merge_by_scene_id(items: List, changes: Dict[str, Optional[Dict]]) -> List:
+    """
+    Применяет изменения вида scene_id -> элемент к списку сцен или позиций.
+
+    Args:
+        items: Исходный список элементов с полем 'scene_id'
+        changes: Новые элементы (None - удалить элемент)
+
+    Returns:
+        List: Новый список; элементы с новыми scene_id добавляются в конец
+    """
+    merged = []
+    seen = set()
+    for item in items:
+        scene_id = item.get("scene_id") if isinstance(item, dict) else None
+        if scene_id in changes:
+            seen.add(scene_id)
+            if changes[scene_id] is None:
+                continue
+            item = changes[scene_id]
+        merged.append(item)
+    merged.extend(
+        item for scene_id, item in changes.items()
+        if scene_id not in seen and item is not None
+    )
+    return merged
+
+
+def get_storage(project_root=None) -> QuestStorage:
+    """
+    Создаёт хранилище по переменным окружения.
+
+    QUEST_STORAGE: "file" (по умолчанию) или "sqlite".
+    QUEST_DB_PATH: путь к базе SQLite (по умолчанию quests.db в корне проекта).
+
+    Args:
+        project_root: Корневая директория проекта
+
+    Returns:
+        QuestStorage: Настроенное хранилище
+    """
+    root = Path(project_root) if project_root else Path(__file__).parent
+    backend = os.getenv("QUEST_STORAGE", "file").lower()
+
+    if backend == "sqlite":
+        return SQLiteQuestStorage(os.getenv("QUEST_DB_PATH", str(root / "quests.db")))
+    if backend == "file":
+        storage = FileQuestStorage(root / "generated_quests", root / "node_positions")
+        storage.recover()
+        return storage
+    raise ValueError(f"Неизвестный тип хранилища: {backend}")
+
+
+def export_quest(storage: QuestStorage, quest_name: str, pretty: bool = True) -> Optional[bytes]:
+    """
+    Выгружает квест в JSON для передачи или чтения человеком.
+
+    Args:
+        storage: Хранилище
+        quest_name: Название квеста
+        pretty: Форматировать с отступами
+
+    Returns:
+        Optional[bytes]: JSON квеста или None, если квеста нет
+    """
+    quest_data = storage.load_quest(quest_name)
+    if quest_data is None:
+        return None
+    return serialization.dumps_bytes(quest_data, pretty=pretty)
+
+
+def migrate(source: QuestStorage, target: QuestStorage, overwrite: bool = False) -> int:
+    """
+    Переносит все квесты и позиции из одного хранилища в другое.
+
+    Args:
+        source: Исходное хранилище
+        target: Целевое хранилище
+        overwrite: Перезаписывать квесты, которые уже есть в целевом хранилище
+
+    Returns:
+        int: Количество перенесённых квестов
+    """
+    migrated = 0
+    for quest_name in source.list_quests():
+        if not overwrite and target.quest_exists(quest_name):
+            print(f"Пропускаем {quest_name}: уже есть в целевом хранилище")
+            continue
+        try:
+            quest_data = source.load_quest(quest_name)
+        except json.JSONDecodeError as e:
+            print(f"Пропускаем {quest_name}: файл не является валидным JSON ({e})")
+            continue
+        if quest_data is None:
+            continue
+        target.save_quest(quest_name, quest_data, source.load_positions(quest_name))
+        migrated += 1
+    return migrated
+
+
+def main():
+    """Главная функция программы."""
+    script_dir = Path(__file__).parent
+    parser = argparse.ArgumentParser(description='Управление хранилищем квестов')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    migrate_parser = subparsers.add_parser(
+        'migrate',
+        help='Перенести квесты из директорий generated_quests/node_positions в SQLite'
+    )
+    migrate_parser.add_argument(
+        '--db', default=str(script_dir / 'quests.db'),
+        help='Путь к базе SQLite (по умолчанию: quests.db)'
+    )
+    migrate_parser.add_argument(
+        '--quests-dir', default=str(script_dir / 'generated_quests'),
+        help='Директория с квестами'
+    )
+    migrate_parser.add_argument(
+        '--positions-dir', default=str(script_dir / 'node_positions'),
+        help='Директория с позициями узлов'
+    )
+    migrate_parser.add_argument(
+        '--overwrite', action='store_true',
+        help='Перезаписывать квесты, уже существующие в базе'
+    )
+
+    export_parser = subparsers.add_parser(
+        'export',
+        help='Выгрузить квест в JSON файл'
+    )
+    export_parser.add_argument('quest_name', help='Название квеста')
+    export_parser.add_argument(
+        '-o', '--output',
+        help='Путь к выходному файлу (по умолчанию: {quest_name}.json в текущей директории)'
+    )
+    export_parser.add_argument(
+        '--compact', action='store_true',
+        help='Не форматировать JSON отступами'
+    )
+
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        data = export_quest(get_storage(script_dir), args.quest_name, pretty=not args.compact)
+        if data is None:
+            print(f"Ошибка: квест '{args.quest_name}' не найден!")
+            sys.exit(1)
+        output_file = args.output or f"{args.quest_name}.json"
+        with open(output_file, 'wb') as f:
+            f.write(data)
+        print(f"Квест сохранён: {output_file}")
+
+    if args.command == 'migrate':
+        if not os.path.isdir(args.quests_dir):
+            print(f"Ошибка: директория '{args.quests_dir}' не найдена!")
+            sys.exit(1)
+        source = FileQuestStorage(args.quests_dir, args.positions_dir)
+        target = SQLiteQuestStorage(args.db)
+        try:
+            migrated = migrate(source, target, overwrite=args.overwrite)
+        finally:
+            target.close()
+        print(f"Перенесено квестов: {migrated} -> {args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,567 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Телеметрия прохождений: компактный журнал выборов игроков и его агрегация
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from engine import ABANDONED, FINISHED, MISSING_SCENE, RESTARTED, CompiledQuest
+
+MAGIC = b"QTEL\x01"
+SUFFIX = ".qtel"
+
+# Типы записей журнала
+RECORD_QUEST = 0
+RECORD_PLAYTHROUGH = 1
+
+OUTCOMES = (FINISHED, ABANDONED, RESTARTED)
+OUTCOME_CODES = {outcome: code for code, outcome in enumerate(OUTCOMES)}
+
+# Размер блока при чтении журнала
+READ_CHUNK = 1 << 20
+
+
+def write_varint(value: int, out: bytearray) -> None:
+    """Дописывает неотрицательное число в формате varint (7 бит на байт)."""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data: bytes, position: int) -> Tuple[int, int]:
+    """
+    Читает varint.
+
+    Returns:
+        Tuple[int, int]: (значение, позиция после числа)
+
+    Raises:
+        IndexError: Если число обрывается в конце данных
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+class TelemetryRecorder:
+    """
+    Журнал прохождений в режиме дозаписи.
+
+    Прохождение записывается одной записью: квест, итог, время окончания,
+    длительность и номера выборов в varint (обычно один байт на ход).
+    Название и версия квеста записываются в файл один раз, записи
+    прохождений ссылаются на них номером. Записи копятся в памяти и
+    дописываются в файл одной операцией записи, когда буфер превышает
+    batch_bytes или с прошлой записи прошло больше flush_interval секунд.
+
+    У каждого процесса свой файл {дата}-{pid}.qtel, поэтому воркеры не
+    перемешивают записи; новый файл начинается каждые сутки.
+    """
+
+    def __init__(self, directory, batch_bytes: int = 64 * 1024, flush_interval: float = 5.0):
+        """
+        Args:
+            directory: Папка журналов
+            batch_bytes: Размер буфера, при превышении которого он записывается в файл
+            flush_interval: Максимальное время хранения записей в буфере, с
+        """
+        self.directory = Path(directory)
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self._buffer = bytearray()
+        self._quests: Dict[Tuple[str, Optional[int]], int] = {}
+        self._path: Optional[Path] = None
+        self._pid = 0
+        self._next_day = 0.0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _switch_file(self) -> None:
+        """Начинает файл текущих суток и процесса. Вызывается под блокировкой."""
+        # Записи прежнего файла сбрасываются в него, таблица квестов начинается заново
+        self._flush_locked()
+        now = datetime.now()
+        self._pid = os.getpid()
+        self._next_day = (now.replace(hour=0, minute=0, second=0, microsecond=0)
+                          + timedelta(days=1)).timestamp()
+        self._path = self.directory / f"{now:%Y%m%d}-{self._pid}{SUFFIX}"
+        self._quests.clear()
+
+    def record(self, session, outcome: str) -> None:
+        """
+        Записывает прохождение игровой сессии.
+
+        Args:
+            session: GameSession
+            outcome: FINISHED, ABANDONED или RESTARTED
+        """
+        self.record_choices(session.quest.name, session.quest.version, session.choices,
+                            outcome, session.started, time.time())
+
+    def record_choices(self, quest_name: str, version: Optional[int], choices,
+                       outcome: str, started: float, ended: float) -> None:
+        """
+        Записывает прохождение по номерам выборов.
+
+        Args:
+            quest_name: Название квеста
+            version: Версия квеста (None для квеста из файла)
+            choices: Номера сделанных выборов (с 0) по порядку
+            outcome: FINISHED, ABANDONED или RESTARTED
+            started: Время начала прохождения (time.time())
+            ended: Время окончания
+        """
+        with self._lock:
+            if ended >= self._next_day or os.getpid() != self._pid:
+                # Новые сутки или новый процесс после fork
+                self._switch_file()
+
+            key = (quest_name or "", version)
+            quest_id = self._quests.get(key)
+            if quest_id is None:
+                quest_id = self._quests[key] = len(self._quests)
+                name = key[0].encode("utf-8")
+                payload = bytearray([RECORD_QUEST])
+                write_varint(quest_id, payload)
+                write_varint(0 if version is None else version + 1, payload)
+                write_varint(len(name), payload)
+                payload += name
+                write_varint(len(payload), self._buffer)
+                self._buffer += payload
+
+            payload = bytearray([RECORD_PLAYTHROUGH])
+            write_varint(quest_id, payload)
+            write_varint(OUTCOME_CODES[outcome], payload)
+            write_varint(int(ended), payload)
+            write_varint(max(0, int(ended - started)), payload)
+            write_varint(len(choices), payload)
+            if not choices or max(choices) < 0x80:
+                # Обычный случай: каждый номер выбора занимает один байт
+                payload += bytes(iter(choices))
+            else:
+                for choice in choices:
+                    write_varint(choice, payload)
+            write_varint(len(payload), self._buffer)
+            self._buffer += payload
+
+            if (len(self._buffer) >= self.batch_bytes
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._buffer or self._path is None:
+            return
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size == 0:
+                    data = MAGIC + data
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            # Телеметрия не должна прерывать игру
+            print(f"Не удалось записать телеметрию в {self._path}: {e}")
+
+    def flush(self) -> None:
+        """Записывает накопленные записи в файл."""
+        with self._lock:
+            self._flush_locked()
+
+    def close(self) -> None:
+        self.flush()
+
+
+def get_telemetry(project_root=None) -> Optional[TelemetryRecorder]:
+    """
+    Создаёт журнал телеметрии.
+
+    QUEST_TELEMETRY: 0 - телеметрия отключена (по умолчанию включена).
+    QUEST_TELEMETRY_DIR: папка журналов (по умолчанию telemetry в корне проекта).
+    """
+    if os.getenv("QUEST_TELEMETRY", "1") == "0":
+        return None
+    root = Path(project_root) if project_root else Path(__file__).parent
+    return TelemetryRecorder(os.getenv("QUEST_TELEMETRY_DIR", str(root / "telemetry")))
+
+
+def read_records(path) -> Iterator[Tuple[Tuple[str, Optional[int]], int, int, int, bytes]]:
+    """
+    Потоково читает прохождения из файла журнала.
+
+    Файл читается блоками по READ_CHUNK байт; оборванная последняя запись
+    (процесс остановлен во время записи) пропускается.
+
+    Yields:
+        ((название, версия), итог, время окончания, длительность, выборы) - выборы
+        в виде bytes, если все номера меньше 128, иначе tuple номеров
+    """
+    quests: Dict[int, Tuple[str, Optional[int]]] = {}
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: не является журналом телеметрии")
+        pending = b""
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                return
+            data = pending + chunk
+            position = 0
+            end = len(data)
+            while position < end:
+                try:
+                    length, start = read_varint(data, position)
+                except IndexError:
+                    break
+                if start + length > end:
+                    break
+                position = start + length
+                kind = data[start]
+                if kind == RECORD_PLAYTHROUGH:
+                    quest_id, cursor = read_varint(data, start + 1)
+                    outcome, cursor = read_varint(data, cursor)
+                    ended, cursor = read_varint(data, cursor)
+                    duration, cursor = read_varint(data, cursor)
+                    count, cursor = read_varint(data, cursor)
+                    choices = data[cursor:position]
+                    if len(choices) != count:
+                        # Есть номера выборов из нескольких байт
+                        values = []
+                        for _ in range(count):
+                            value, cursor = read_varint(data, cursor)
+                            values.append(value)
+                        choices = tuple(values)
+                    yield quests.get(quest_id, ("", None)), outcome, ended, duration, choices
+                elif kind == RECORD_QUEST:
+                    quest_id, cursor = read_varint(data, start + 1)
+                    version, cursor = read_varint(data, cursor)
+                    name_length, cursor = read_varint(data, cursor)
+                    quests[quest_id] = (data[cursor:cursor + name_length].decode("utf-8"),
+                                        None if version == 0 else version - 1)
+            pending = data[position:]
+
+
+class QuestTelemetry:
+    """
+    Таблицы частот выборов и ухода игроков для одного квеста.
+
+    Прохождения складываются в префиксное дерево: узел - уникальное начало
+    пути, в узле считается только число прохождений, закончившихся в нём,
+    поэтому прохождение стоит одного поиска в словаре на ход. Когда узлов
+    становится больше max_nodes, дерево сворачивается в таблицы (суммы по
+    поддеревьям) и начинается заново - память ограничена.
+    """
+
+    def __init__(self, quest: CompiledQuest, max_nodes: int = 50_000):
+        self.quest = quest
+        self.max_nodes = max_nodes
+        self.targets = [tuple(target for _, target in choices) for choices in quest.choices]
+        # Смещение выборов каждой сцены в плоском массиве счётчиков
+        self.offsets: List[int] = []
+        total = 0
+        for targets in self.targets:
+            self.offsets.append(total)
+            total += len(targets)
+        self.choice_counts = [0] * total
+        self.reached = [0] * len(quest)
+        self.dropped = [0] * len(quest)
+        self.sessions = Counter()
+        self.moves = 0
+        self.skipped = Counter()
+        self.has_cycles = self._has_cycles()
+        self._reset_tree()
+
+    def _has_cycles(self) -> bool:
+        """Есть ли в графе квеста циклы (сцену можно посетить повторно)."""
+        state = [0] * len(self.targets)  # 0 - не посещена, 1 - в обходе, 2 - обработана
+        for root in range(len(self.targets)):
+            if state[root]:
+                continue
+            stack = [(root, iter(self.targets[root]))]
+            state[root] = 1
+            while stack:
+                scene, targets = stack[-1]
+                for target in targets:
+                    if target == MISSING_SCENE:
+                        continue
+                    if state[target] == 1:
+                        return True
+                    if state[target] == 0:
+                        state[target] = 1
+                        stack.append((target, iter(self.targets[target])))
+                        break
+                else:
+                    state[scene] = 2
+                    stack.pop()
+        return False
+
+    def _reset_tree(self) -> None:
+        # Корень - стартовая сцена; ребро (узел << 16 | выбор) -> дочерний узел
+        self._edges: Dict[int, int] = {}
+        self._parent = [-1]
+        self._choice = [0]
+        self._scene = [self.quest.start]
+        self._first_visit = [True]
+        self._ended = [0]
+
+    def _extend(self, node: int, choice: int) -> Optional[int]:
+        """Добавляет узел для выбора choice; None, если такого выбора нет в квесте."""
+        targets = self.targets[self._scene[node]]
+        if choice >= len(targets) or targets[choice] == MISSING_SCENE:
+            return None
+        scene = targets[choice]
+        # Первое посещение сцены на этом пути: нет ли её среди предков (в квесте без циклов всегда да)
+        first_visit = True
+        ancestor = node if self.has_cycles else -1
+        while ancestor >= 0:
+            if self._scene[ancestor] == scene:
+                first_visit = False
+                break
+            ancestor = self._parent[ancestor]
+        child = len(self._scene)
+        self._edges[node << 16 | choice] = child
+        self._parent.append(node)
+        self._choice.append(choice)
+        self._scene.append(scene)
+        self._first_visit.append(first_visit)
+        self._ended.append(0)
+        return child
+
+    def add(self, choices, outcome: int, weight: int = 1) -> None:
+        """
+        Добавляет weight одинаковых прохождений.
+
+        Прохождение воспроизводится по квесту; если выбор не существует
+        (квест изменился), прохождение пропускается.
+        """
+        edges = self._edges
+        node = 0
+        for choice in choices:
+            child = edges.get(node << 16 | choice)
+            if child is None:
+                child = self._extend(node, choice)
+                if child is None:
+                    self.skipped["invalid"] += weight
+                    return
+            node = child
+        self._ended[node] += weight
+        if self.targets[self._scene[node]]:
+            self.sessions[OUTCOMES[outcome] if outcome < len(OUTCOMES) else ABANDONED] += weight
+        else:
+            self.sessions[FINISHED] += weight
+        self.moves += len(choices) * weight
+        if len(self._scene) > self.max_nodes:
+            self.fold()
+
+    def fold(self) -> None:
+        """Сворачивает дерево прохождений в таблицы."""
+        passed = list(self._ended)
+        # Дочерние узлы создаются после родителей: обратный порядок - снизу вверх
+        for node in range(len(passed) - 1, 0, -1):
+            parent = self._parent[node]
+            passed[parent] += passed[node]
+            self.choice_counts[self.offsets[self._scene[parent]] + self._choice[node]] += passed[node]
+        for node, count in enumerate(passed):
+            scene = self._scene[node]
+            if self._first_visit[node]:
+                self.reached[scene] += count
+            if self._ended[node] and self.targets[scene]:
+                self.dropped[scene] += self._ended[node]
+        self._reset_tree()
+
+    def report(self, top: Optional[int] = None) -> Dict:
+        """
+        Отчёт по квесту.
+
+        Args:
+            top: Сколько сцен с наибольшим уходом игроков включить (по умолчанию все)
+
+        Returns:
+            Dict: Прохождения по итогам, доля завершённых, средняя длина,
+            частоты выборов по сценам и таблица ухода игроков
+        """
+        self.fold()
+        quest = self.quest
+        total = sum(self.sessions.values())
+        choices = []
+        for scene, scene_choices in enumerate(quest.choices):
+            offset = self.offsets[scene]
+            scene_total = sum(self.choice_counts[offset:offset + len(scene_choices)])
+            if not scene_total:
+                continue
+            choices.append({
+                "scene_id": quest.scene_ids[scene],
+                "choices": [
+                    {"choice": index, "text": text, "count": self.choice_counts[offset + index],
+                     "share": self.choice_counts[offset + index] / scene_total}
+                    for index, (text, _) in enumerate(scene_choices)
+                ],
+            })
+        drop_off = sorted(
+            ({"scene_id": quest.scene_ids[scene], "reached": self.reached[scene],
+              "dropped": self.dropped[scene], "drop_rate": self.dropped[scene] / self.reached[scene]}
+             for scene in range(len(quest)) if self.dropped[scene]),
+            key=lambda row: -row["dropped"]
+        )
+        return {
+            "quest_name": quest.name,
+            "version": quest.version,
+            "sessions": total,
+            "outcomes": dict(self.sessions),
+            "completion_rate": self.sessions[FINISHED] / total if total else 0.0,
+            "mean_moves": self.moves / total if total else 0.0,
+            "skipped": dict(self.skipped),
+            "choices": choices,
+            "drop_off": drop_off[:top] if top else drop_off,
+        }
+
+
+class TelemetryAggregator:
+    """
+    Потоковая агрегация журналов телеметрии.
+
+    Журналы читаются блоками, прохождения сразу добавляются в таблицы
+    квестов (QuestTelemetry). Память ограничена таблицами и деревьями
+    прохождений квестов и не зависит от количества прохождений в журналах.
+    """
+
+    def __init__(self, storage, quest_names: Optional[List[str]] = None, any_version: bool = False):
+        """
+        Args:
+            storage: Хранилище квестов (QuestStorage)
+            quest_names: Учитывать только эти квесты
+            any_version: Учитывать прохождения других версий квеста, если их выборы
+                существуют в текущей версии (по умолчанию они пропускаются)
+        """
+        self.storage = storage
+        self.quest_names = set(quest_names) if quest_names else None
+        self.any_version = any_version
+        self.quests: Dict[str, Optional[QuestTelemetry]] = {}
+        self.skipped = Counter()
+        self.records = 0
+        # (название, версия) -> таблицы квеста или причина пропуска
+        self._targets: Dict[Tuple[str, Optional[int]], object] = {}
+
+    def _target(self, name: str, version: Optional[int]):
+        if name not in self.quests:
+            current = self.storage.get_version(name)
+            quest = self.storage.load_compiled(name, current) if current is not None else None
+            self.quests[name] = QuestTelemetry(quest) if quest is not None else None
+        stats = self.quests[name]
+        if self.quest_names is not None and name not in self.quest_names:
+            return None
+        if stats is None:
+            return "unknown_quest"
+        if version is not None and version != stats.quest.version and not self.any_version:
+            return "other_version"
+        return stats
+
+    def add_file(self, path) -> None:
+        """Добавляет прохождения из файла журнала."""
+        targets = self._targets
+        for key, outcome, _, _, choices in read_records(path):
+            self.records += 1
+            target = targets.get(key)
+            if target is None and key not in targets:
+                target = targets[key] = self._target(*key)
+            if isinstance(target, QuestTelemetry):
+                target.add(choices, outcome)
+            elif target is not None:
+                self.skipped[target] += 1
+
+    def report(self, top: Optional[int] = None) -> Dict:
+        """Отчёт по всем квестам (см. QuestTelemetry.report)."""
+        return {
+            "records": self.records,
+            "skipped": dict(self.skipped),
+            "quests": [stats.report(top) for _, stats in sorted(self.quests.items())
+                       if stats is not None and stats.sessions],
+        }
+
+
+def telemetry_files(directory) -> List[Path]:
+    """Файлы журналов в папке по порядку."""
+    directory = Path(directory)
+    return sorted(directory.glob(f"*{SUFFIX}")) if directory.exists() else []
+
+
+def print_report(report: Dict) -> None:
+    """Печатает отчёт в читаемом виде."""
+    print(f"Прохождений в журналах: {report['records']}")
+    if report["skipped"]:
+        print(f"Пропущено: {report['skipped']}")
+    for quest in report["quests"]:
+        print(f"\nКвест {quest['quest_name']} (версия {quest['version']}): {quest['sessions']} прохождений, "
+              f"завершено {quest['completion_rate']:.1%}, в среднем {quest['mean_moves']:.1f} ходов")
+        if quest["skipped"]:
+            print(f"  Пропущено: {quest['skipped']}")
+        print("  Выборы:")
+        for scene in quest["choices"]:
+            print(f"    {scene['scene_id']}")
+            for choice in scene["choices"]:
+                print(f"      {choice['share']:6.1%} {choice['count']:>9}  {choice['choice'] + 1}. {choice['text'][:60]}")
+        if quest["drop_off"]:
+            print("  Уход игроков:")
+            print(f"    {'сцена':<30} {'дошли':>9} {'ушли':>9} {'доля':>7}")
+            for row in quest["drop_off"]:
+                print(f"    {row['scene_id']:<30} {row['reached']:>9} {row['dropped']:>9} {row['drop_rate']:>7.1%}")
+
+
+def main():
+    """Главная функция программы."""
+    script_dir = Path(__file__).parent
+    parser = argparse.ArgumentParser(description='Агрегация телеметрии прохождений')
+    parser.add_argument('--dir', default=os.getenv("QUEST_TELEMETRY_DIR", str(script_dir / "telemetry")),
+                        help='Папка журналов')
+    parser.add_argument('--quest', action='append', help='Только этот квест (можно несколько раз)')
+    parser.add_argument('--any-version', action='store_true',
+                        help='Учитывать прохождения других версий квеста')
+    parser.add_argument('--top', type=int, help='Сколько сцен с наибольшим уходом показать')
+    parser.add_argument('--json', action='store_true', help='Вывести отчёт в JSON')
+    args = parser.parse_args()
+
+    from storage import get_storage
+    storage = get_storage(script_dir)
+    aggregator = TelemetryAggregator(storage, args.quest, args.any_version)
+    files = telemetry_files(args.dir)
+    if not files:
+        print(f"В папке {args.dir} нет журналов телеметрии")
+        sys.exit(1)
+    try:
+        for path in files:
+            try:
+                aggregator.add_file(path)
+            except ValueError as e:
+                print(f"Пропущен файл: {e}", file=sys.stderr)
+        report = aggregator.report(args.top)
+    finally:
+        storage.close()
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
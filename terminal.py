@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Отрисовка сцен в терминале через ANSI-последовательности без перерисовки всего экрана
+
+import os
+import select
+import shutil
+import sys
+import textwrap
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, TextIO, Tuple
+
+# Для работы с клавишами в Unix/Linux/Mac
+try:
+    import termios
+    import tty
+except ImportError:
+    termios = None
+    tty = None
+
+CLEAR = "\x1b[H\x1b[2J"
+CLEAR_LINE = "\x1b[2K"
+HIDE_CURSOR = "\x1b[?25l"
+SHOW_CURSOR = "\x1b[?25h"
+
+KEYS = {
+    b"\x1b[A": "up",
+    b"\x1bOA": "up",
+    b"\x1b[B": "down",
+    b"\x1bOB": "down",
+    b"\x1b[5~": "page_up",
+    b"\x1b[6~": "page_down",
+    b"\r": "enter",
+    b"\n": "enter",
+}
+
+# Сколько ждать продолжения escape-последовательности, прежде чем считать Esc отдельной клавишей
+ESCAPE_TIMEOUT = 0.05
+
+HELP_LINE = "Управление: ↑/↓ - навигация, Enter - выбор, PgUp/PgDn - прокрутка, q - выход, h - история"
+
+
+def move_to(row: int) -> str:
+    """ANSI-последовательность перехода в начало строки row (с 1)."""
+    return f"\x1b[{row};1H"
+
+
+@contextmanager
+def cbreak_mode(stream: TextIO = sys.stdin) -> Iterator[None]:
+    """Переводит терминал в посимвольный ввод на всё время игры, а не на каждую клавишу."""
+    if termios is None or not stream.isatty():
+        yield
+        return
+    fd = stream.fileno()
+    old_settings = termios.tcgetattr(fd)
+    try:
+        tty.setcbreak(fd)
+        yield
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
+
+
+@contextmanager
+def cooked_mode(stream: TextIO = sys.stdin) -> Iterator[None]:
+    """
+    Временно возвращает построчный ввод с эхом внутри cbreak_mode,
+    например для input() при переходе в обычный режим.
+    """
+    if termios is None or not stream.isatty():
+        yield
+        return
+    fd = stream.fileno()
+    old_settings = termios.tcgetattr(fd)
+    settings = list(old_settings)
+    settings[3] |= termios.ICANON | termios.ECHO
+    try:
+        termios.tcsetattr(fd, termios.TCSADRAIN, settings)
+        yield
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
+
+
+# Байты, прочитанные из терминала, но ещё не разобранные на клавиши:
+# одно чтение может вернуть несколько нажатий или часть последовательности
+_pending = bytearray()
+
+
+def parse_key(data: bytes) -> Tuple[Optional[str], int]:
+    """
+    Разбирает первую клавишу в начале буфера.
+
+    Args:
+        data: Непрочитанные байты ввода
+
+    Returns:
+        Tuple[Optional[str], int]: Клавиша и число её байтов или (None, 0),
+        если последовательность ещё не дочитана
+    """
+    for sequence, key in KEYS.items():
+        if data.startswith(sequence):
+            return key, len(sequence)
+
+    if data[:1] == b"\x1b":
+        if any(sequence.startswith(data) for sequence in KEYS):
+            return None, 0
+        if data[1:2] in (b"[", b"O"):
+            # Неизвестная последовательность (например, стрелка вправо) - пропускаем её целиком
+            for i in range(2, len(data)):
+                if 0x40 <= data[i] <= 0x7e:
+                    return "\x1b", i + 1
+            return None, 0
+        return "\x1b", 1
+
+    # Символ UTF-8: длина по первому байту
+    lead = data[0]
+    length = 1 if lead < 0xc0 else 2 if lead < 0xe0 else 3 if lead < 0xf0 else 4
+    if len(data) < length:
+        return None, 0
+    return data[:length].decode("utf-8", errors="ignore"), length
+
+
+def read_key(stream: TextIO = sys.stdin) -> str:
+    """
+    Читает одну клавишу в посимвольном режиме.
+
+    Returns:
+        str: "up", "down", "page_up", "page_down", "enter" или введённый символ
+
+    Raises:
+        EOFError: Если ввод закрыт
+    """
+    fd = stream.fileno()
+    while True:
+        if _pending:
+            key, length = parse_key(bytes(_pending))
+            if key is not None:
+                del _pending[:length]
+                return key
+            if not select.select([fd], [], [], ESCAPE_TIMEOUT)[0]:
+                # Одиночный Esc или оборванная последовательность
+                key = _pending[:1].decode("utf-8", errors="ignore")
+                del _pending[:1]
+                return key
+        data = os.read(fd, 64)
+        if not data:
+            raise EOFError
+        _pending.extend(data)
+
+
+class TerminalRenderer:
+    """
+    Рисует сцену один раз, а при навигации перерисовывает только изменившиеся строки.
+
+    Экран: окно текста сцены (прокручивается, если текст не помещается),
+    разделитель, список выборов и строка состояния. Переход между выборами
+    меняет две строки выборов и строку состояния, прокрутка - только окно
+    текста. Весь вывод кадра отправляется одной записью.
+    """
+
+    def __init__(self, out: TextIO = sys.stdout, size: Optional[os.terminal_size] = None):
+        """
+        Args:
+            out: Поток вывода (терминал)
+            size: Размер экрана; по умолчанию определяется по терминалу
+        """
+        self.out = out
+        self.size = size
+        self.text_lines: List[str] = []
+        self.choices: List[str] = []
+        self.selected = 0
+        self.offset = 0
+        self.viewport = 0
+        self.width = 80
+        # Номера строк экрана (с 1), которые перерисовываются точечно
+        self.separator_row = 0
+        self.choice_rows: List[int] = []
+        self.status_row = 0
+
+    def _write(self, data: str) -> None:
+        self.out.write(data)
+        self.out.flush()
+
+    def _screen_size(self) -> os.terminal_size:
+        return self.size or shutil.get_terminal_size((80, 24))
+
+    def _choice_line(self, index: int) -> str:
+        marker = "→" if index == self.selected else " "
+        return f"{marker} {index + 1}. {self.choices[index]}"
+
+    def _separator(self) -> str:
+        if len(self.text_lines) <= self.viewport:
+            return "-" * self.width
+        last = min(self.offset + self.viewport, len(self.text_lines))
+        label = f" строки {self.offset + 1}-{last} из {len(self.text_lines)}, PgUp/PgDn "
+        return label.center(self.width, "-")
+
+    def _status(self) -> str:
+        return f"Текущий выбор: {self.selected + 1}"
+
+    def render_scene(self, text: str, choices: List[str], selected: int = 0,
+                     header: str = "Доступные действия (используйте ↑↓ для выбора, Enter для подтверждения):"
+                     ) -> None:
+        """
+        Полностью рисует сцену (один раз при переходе на сцену).
+
+        Args:
+            text: Текст сцены
+            choices: Тексты выборов
+            selected: Индекс выделенного выбора
+            header: Заголовок списка выборов
+        """
+        size = self._screen_size()
+        self.width = max(20, min(size.columns, 100))
+        self.choices = choices
+        self.selected = selected
+        self.offset = 0
+        self.text_lines = []
+        for paragraph in text.splitlines() or [""]:
+            self.text_lines.extend(textwrap.wrap(paragraph, self.width) or [""])
+
+        # Выборы переносятся так, чтобы метка "→" была только в первой строке каждого
+        choice_blocks = []
+        for i in range(len(choices)):
+            block = textwrap.wrap(self._choice_line(i), self.width, subsequent_indent="     ")
+            choice_blocks.append(block or [""])
+        bottom = 2 + sum(len(block) for block in choice_blocks) + 3
+        self.viewport = max(3, min(len(self.text_lines), size.lines - bottom - 1))
+
+        lines = self.text_lines[:self.viewport]
+        self.separator_row = len(lines) + 1
+        lines += [self._separator(), "", header[:self.width]]
+        self.choice_rows = []
+        for block in choice_blocks:
+            self.choice_rows.append(len(lines) + 1)
+            lines.extend(block)
+        self.status_row = len(lines) + 2
+        lines += ["", self._status(), HELP_LINE[:self.width]]
+        self._write(CLEAR + "\n".join(lines))
+
+    def select(self, index: int) -> None:
+        """Переносит выделение на выбор index, перерисовывая только две строки и статус."""
+        if index == self.selected or not self.choices:
+            return
+        previous, self.selected = self.selected, index
+        frame = []
+        for i in (previous, index):
+            line = textwrap.wrap(self._choice_line(i), self.width)[0]
+            frame.append(move_to(self.choice_rows[i]) + CLEAR_LINE + line)
+        frame.append(move_to(self.status_row) + CLEAR_LINE + self._status())
+        self._write("".join(frame))
+
+    def scroll(self, delta: int) -> None:
+        """Прокручивает текст сцены на delta строк, перерисовывая только окно текста."""
+        max_offset = max(0, len(self.text_lines) - self.viewport)
+        offset = min(max(0, self.offset + delta), max_offset)
+        if offset == self.offset:
+            return
+        self.offset = offset
+        visible = self.text_lines[offset:offset + self.viewport]
+        frame = [
+            move_to(row) + CLEAR_LINE + line
+            for row, line in enumerate(visible, start=1)
+        ]
+        frame.append(move_to(self.separator_row) + CLEAR_LINE + self._separator())
+        self._write("".join(frame))
+
+    def page(self, direction: int) -> None:
+        """Прокручивает текст на страницу вверх (-1) или вниз (1)."""
+        self.scroll(direction * max(1, self.viewport - 1))
+
+    def clear(self) -> None:
+        """Очищает экран."""
+        self._write(CLEAR)
+
+    @contextmanager
+    def session(self) -> Iterator[None]:
+        """Скрывает курсор на время игры и возвращает его при выходе."""
+        self._write(HIDE_CURSOR)
+        try:
+            yield
+        finally:
+            self._write(SHOW_CURSOR)
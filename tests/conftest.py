@@ -0,0 +1,44 @@
+# Общие фикстуры тестов: модули проекта из корня репозитория и backend
+# с изолированным хранилищем во временной папке
+
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(PROJECT_ROOT / "ui-backend"))
+
+SAMPLE_QUEST = PROJECT_ROOT / "generated_quests" / "cyberpunk_quest.json"
+
+
+@pytest.fixture(scope="session")
+def backend(tmp_path_factory):
+    """Модуль ui-backend/backend.py с хранилищем и поисковым индексом во временной папке."""
+    pytest.importorskip("fastapi")
+    tmp_dir = tmp_path_factory.mktemp("backend")
+    os.environ.update(
+        QUEST_STORAGE="sqlite",
+        QUEST_DB_PATH=str(tmp_dir / "quests.db"),
+        QUEST_SEARCH_DB=str(tmp_dir / "search.db"),
+        QUEST_TELEMETRY_DIR=str(tmp_dir / "telemetry"),
+        QUEST_TRACE_DIR=str(tmp_dir / "traces"),
+        QUEST_PROMPT_CACHE_DB=str(tmp_dir / "prompt_cache.db"),
+        QUEST_CHECKPOINT_DIR=str(tmp_dir / "checkpoints"),
+        QUEST_PRELOAD="0",
+    )
+    spec = importlib.util.spec_from_file_location("backend", PROJECT_ROOT / "ui-backend" / "backend.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def client(backend):
+    from fastapi.testclient import TestClient
+
+    with TestClient(backend.app) as test_client:
+        yield test_client
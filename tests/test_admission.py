@@ -0,0 +1,119 @@
+# Очередь генераций: клиент по адресу подключения, место занимает только исполнитель single-flight
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, Rejected
+
+
+def test_client_header_ignored_from_untrusted_peer(backend, client, monkeypatch):
+    monkeypatch.setattr(backend.admission, "max_per_client", 1)
+    monkeypatch.setattr(backend.admission, "max_in_flight", 1)
+    release = threading.Event()
+
+    def fake_generate(quest_name, user_prompt, on_event=None, scene_count=None):
+        release.wait(5)
+        return {"quest_name": quest_name}
+
+    monkeypatch.setattr(backend, "generate_and_save_quest", fake_generate)
+    first = threading.Thread(target=client.post, args=("/generate_quest",),
+                             kwargs={"json": {"quest_name": "client_a", "user_prompt": "p"}})
+    first.start()
+    try:
+        while backend.admission.in_flight == 0:
+            time.sleep(0.01)
+        # Подменённый заголовок не делает запрос другим клиентом
+        response = client.post("/generate_quest", json={"quest_name": "client_b", "user_prompt": "p"},
+                               headers={"X-Forwarded-For": "10.0.0.1"})
+        assert response.status_code == 429
+        assert "Retry-After" in response.headers
+    finally:
+        release.set()
+        first.join()
+
+
+def test_client_header_trusted_from_proxy(backend, monkeypatch):
+    class FakeRequest:
+        def __init__(self, host, headers):
+            self.client = type("Address", (), {"host": host})()
+            self.headers = headers
+
+    monkeypatch.setattr(backend, "TRUSTED_PROXIES", {"10.0.0.2"})
+    forwarded = {backend.CLIENT_ID_HEADER: "1.1.1.1, 2.2.2.2"}
+    assert backend.client_id(FakeRequest("10.0.0.2", forwarded)) == "2.2.2.2"
+    assert backend.client_id(FakeRequest("10.0.0.3", forwarded)) == "10.0.0.3"
+    assert backend.client_id(FakeRequest("10.0.0.2", {})) == "10.0.0.2"
+
+
+def test_coalesced_requests_take_one_slot(backend, client, monkeypatch):
+    monkeypatch.setattr(backend.admission, "max_per_client", 1)
+    release = threading.Event()
+    calls = []
+
+    def fake_generate(quest_name, user_prompt, on_event=None, scene_count=None):
+        calls.append(quest_name)
+        release.wait(5)
+        return {"quest_name": quest_name}
+
+    monkeypatch.setattr(backend, "generate_and_save_quest", fake_generate)
+    body = {"quest_name": "coalesced_test", "user_prompt": "p"}
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(client.post("/generate_quest", json=body)))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.1)
+    try:
+        assert backend.admission.in_flight == 1
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join()
+
+    assert calls == ["coalesced_test"]
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert sorted(response.json()["coalesced"] for response in responses) == [False, True, True]
+    assert backend.admission.in_flight == 0
+
+
+
+def test_free_slot_goes_to_least_recently_served_client():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=3, initial_estimate=10)
+        running = controller.enter("a")
+        queued = [controller.enter("a"), controller.enter("a"), controller.enter("b")]
+        assert [controller.position(ticket) for ticket in queued] == [2, 3, 1]
+
+        with pytest.raises(Rejected) as error:
+            controller.enter("c")
+        assert error.value.reason == "queue_full"
+        assert 1 <= error.value.retry_after <= 10
+
+        controller.leave(running)
+        assert queued[2].admitted.done() and not queued[0].admitted.done()
+        controller.leave(queued[2])
+        assert queued[0].admitted.done()
+        assert controller.in_flight == 1 and controller.queued == 1
+
+    asyncio.run(scenario())
+
+
+def test_client_limit_counts_queued_requests():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=10, max_per_client=2)
+        first, second = controller.enter("a"), controller.enter("a")
+        with pytest.raises(Rejected) as error:
+            controller.enter("a")
+        assert error.value.reason == "client_limit"
+        controller.enter("b")
+
+        # Ушедший из очереди запрос освобождает место клиента
+        controller.leave(second)
+        controller.enter("a")
+        controller.leave(first)
+        assert controller.in_flight == 1
+
+    asyncio.run(scenario())
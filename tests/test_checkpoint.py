@@ -0,0 +1,140 @@
+# Контрольные точки генерации: журнал запуска и возобновление повторов без повторных запросов к LLM
+
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from checkpoint import CheckpointStore, Run
+
+generate = pytest.importorskip("generate")
+main = pytest.importorskip("main")
+
+SKELETON = [
+    {"scene_id": "start", "beat": "Завязка", "next": ["gate", "forest"]},
+    {"scene_id": "gate", "beat": "Ворота", "next": ["end"]},
+    {"scene_id": "forest", "beat": "Лес", "next": ["end", "lost"]},
+    {"scene_id": "end", "beat": "Финал", "next": []},
+    {"scene_id": "lost", "beat": "Герой заблудился", "next": []},
+]
+
+
+def written_scene(scene):
+    return {"scene_id": scene["scene_id"], "text": f"Текст: {scene['beat']}",
+            "choices": [{"text": f"Выбор {i}", "next_scene": n} for i, n in enumerate(scene["next"])]}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CheckpointStore(tmp_path / "checkpoints")
+
+
+@pytest.fixture
+def prompts(monkeypatch):
+    """Запросы текстов сцен к модели: список замыслов запрошенных сцен."""
+    requested = []
+
+    class FakeClient:
+        def invoke(self, prompt):
+            beat = prompt.split("Эта сцена: ", 1)[1].split("\n", 1)[0]
+            requested.append(beat)
+            scene = next(scene for scene in SKELETON if scene["beat"] == beat)
+            answer = written_scene(scene)
+            answer["choices"] = [choice["text"] for choice in answer["choices"]]
+            return SimpleNamespace(content=json.dumps(answer, ensure_ascii=False), response_metadata={})
+
+    monkeypatch.setattr(generate, "make_client", lambda credentials, timeout=360: FakeClient())
+    monkeypatch.setattr(main, "generate_quest_skeleton", pytest.fail)
+    return requested
+
+
+def test_run_journal_survives_reopen_and_truncated_tail(store):
+    run = store.open("q", "prompt", 5)
+    assert not run.resumed
+    run.record_attempt("skeleton", "ответ", {"scenes": SKELETON}, True, "ok")
+    run.save_skeleton(SKELETON)
+    run.save_scene(written_scene(SKELETON[0]))
+    with open(run.path, "a", encoding="utf-8") as f:
+        f.write('{"type": "scene", "scene": {"scene_')  # Сбой посреди записи
+
+    reopened = store.open("q", "prompt", 5)
+    assert reopened.resumed
+    assert reopened.skeleton == SKELETON
+    assert list(reopened.scenes) == ["start"]
+    assert len(reopened.attempts) == 1
+    # Другие параметры - другой запуск
+    assert not store.open("q", "prompt", 6).resumed
+
+    reopened.finish()
+    assert not store.open("q", "prompt", 5).resumed
+
+
+def test_two_phase_resume_requests_only_missing_scenes(store, prompts):
+    run = store.open("q", "prompt", 5)
+    run.save_skeleton(SKELETON)
+    for scene in SKELETON[:3]:
+        run.save_scene(written_scene(scene))
+
+    events = []
+    quest, errors = main.generate_quest_two_phase(
+        "q", "prompt", None, scene_count=5, checkpoint=Run(run.path, run.run_id),
+        on_event=lambda event_type, data: events.append((event_type, data))
+    )
+
+    assert errors == ""
+    assert [scene["scene_id"] for scene in quest["scenes"]] == [scene["scene_id"] for scene in SKELETON]
+    assert sorted(prompts) == ["Герой заблудился", "Финал"]
+    assert events[0] == ("resumed", {"run_id": run.run_id, "attempts": 0, "scenes": 3, "scenes_total": 5})
+    assert [event_type for event_type, _ in events].count("scene_parsed") == 5
+    # Новые сцены тоже попали в контрольную точку
+    assert set(Run(run.path, run.run_id).scenes) == {scene["scene_id"] for scene in SKELETON}
+
+
+def test_invalid_resumed_quest_discards_checkpoint(store, prompts):
+    run = store.open("q", "prompt", 5)
+    run.save_skeleton(SKELETON)
+    broken = written_scene(SKELETON[0])
+    broken["choices"][0]["next_scene"] = "missing"
+    run.save_scene(broken)
+
+    quest, errors = main.generate_quest_two_phase("q", "prompt", None, scene_count=5, checkpoint=run)
+
+    assert quest is None
+    assert "missing" in errors
+    # Повтор генерирует квест заново, а не собирает тот же невалидный квест
+    assert not run.path.exists()
+    assert not store.open("q", "prompt", 5).resumed
+
+
+def test_valid_quest_reused_without_llm_call(store, monkeypatch):
+    quest = {"scenes": [written_scene(scene) for scene in SKELETON]}
+    run = store.open("q", "prompt")
+    run.record_attempt("quest", "ответ", quest, True, "ok")
+    monkeypatch.setattr(main, "generate_rpg_quest", pytest.fail)
+
+    events = []
+    result, errors = main.generate_quest_with_validation(
+        "q", "prompt", "system", None, checkpoint=store.open("q", "prompt"),
+        on_event=lambda event_type, data: events.append(event_type)
+    )
+
+    assert (result, errors) == (quest, "")
+    assert events == ["resumed"]
+
+
+def test_runs_listing_and_purge(store):
+    run = store.open("q", "prompt", 5)
+    run.save_skeleton(SKELETON)
+    assert [(info["quest_name"], info["skeleton_scenes"]) for info in store.runs()] == [("q", 5)]
+
+    assert store.purge() == 0
+    old = time.time() - store.ttl - 60
+    os.utime(run.path, (old, old))
+    assert store.purge() == 1
+    assert store.runs() == []
+
+
+def test_backend_checkpoints_in_configured_dir(backend):
+    assert str(backend.checkpoints.directory) == os.environ["QUEST_CHECKPOINT_DIR"]
@@ -0,0 +1,88 @@
+# Сжатие ответов: выбор алгоритма по Accept-Encoding и порог minimum_size,
+# который соблюдается и для тела, отправленного частями
+
+import asyncio
+import gzip
+
+import pytest
+
+from compression import CompressionMiddleware, choose_encoding
+
+
+def make_app(body, content_type=b"application/json"):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", content_type),
+                                (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+    return app
+
+
+def make_chunked_app(chunks):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json")]})
+        for i, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+    return app
+
+
+def run(app, accept_encoding=b"gzip"):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", accept_encoding)]}
+    asyncio.run(CompressionMiddleware(app, minimum_size=1024)(scope, receive, send))
+    headers = dict(messages[0]["headers"])
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return headers, body
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("gzip, deflate", "gzip"),
+    ("gzip;q=0, identity", None),
+    ("", None),
+    ("identity", None),
+])
+def test_choose_encoding(accept_encoding, expected):
+    assert choose_encoding(accept_encoding) == expected
+
+
+def test_small_body_is_not_compressed():
+    headers, body = run(make_app(b'{"quests": []}'))
+    assert b"content-encoding" not in headers
+    assert body == b'{"quests": []}'
+
+
+def test_large_body_is_compressed():
+    payload = b'{"scenes": "' + b"x" * 4000 + b'"}'
+    headers, body = run(make_app(payload))
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"vary"] == b"Accept-Encoding"
+    assert int(headers[b"content-length"]) == len(body)
+    assert gzip.decompress(body) == payload
+
+
+def test_event_stream_is_passed_through():
+    payload = b"data: " + b"x" * 4000 + b"\n\n"
+    headers, body = run(make_app(payload, content_type=b"text/event-stream"))
+    assert b"content-encoding" not in headers
+    assert body == payload
+
+
+def test_small_chunked_body_is_not_compressed():
+    headers, body = run(make_chunked_app([b'{"quests": ', b'["a", "b"]}']))
+    assert b"content-encoding" not in headers
+    assert body == b'{"quests": ["a", "b"]}'
+
+
+def test_large_chunked_body_is_compressed():
+    chunks = [b"x" * 600, b"y" * 600, b"z" * 600]
+    headers, body = run(make_chunked_app(chunks))
+    assert headers[b"content-encoding"] == b"gzip"
+    assert gzip.decompress(body) == b"".join(chunks)
@@ -0,0 +1,119 @@
+# Срок выполнения запроса и отмена: Deadline, общий срок объединённых запросов, /generate_quest
+
+import threading
+import time
+
+import pytest
+
+import deadline
+from singleflight import SingleFlight
+
+
+def test_deadline_check_and_timeout():
+    unlimited = deadline.Deadline()
+    assert unlimited.remaining() is None
+    assert unlimited.timeout(360) == 360
+
+    short = deadline.Deadline(10)
+    assert short.timeout(360) <= 10
+    with pytest.raises(deadline.Cancelled) as error:
+        short.check(min_remaining=30)
+    assert error.value.reason == "deadline"
+
+    short.cancel()
+    with pytest.raises(deadline.Cancelled) as error:
+        short.check()
+    assert error.value.reason == "disconnected"
+
+
+def test_sleep_interrupted_by_cancel():
+    waiting = deadline.Deadline()
+    threading.Timer(0.1, waiting.cancel).start()
+    started = time.monotonic()
+    with deadline.use(waiting), pytest.raises(deadline.Cancelled):
+        deadline.sleep(10)
+    assert time.monotonic() - started < 2
+
+
+def test_shared_deadline_lasts_while_any_member_needs_it():
+    first, second = deadline.Deadline(30), deadline.Deadline(60)
+    shared = deadline.SharedDeadline()
+    shared.add(first)
+    shared.add(second)
+
+    first.cancel()
+    assert shared.reason() is None
+    assert 30 < shared.remaining() <= 60
+
+    second.cancel()
+    assert shared.reason() == "disconnected"
+    shared.add(None)
+    assert shared.reason() is None
+
+
+def test_cancelled_call_is_not_joined():
+    flight = SingleFlight("test")
+    first = deadline.Deadline()
+    started, release = threading.Event(), threading.Event()
+    outcome = {}
+
+    def cancelled_work(broadcast):
+        started.set()
+        release.wait(5)
+        deadline.check()
+        return "stale"
+
+    def leader():
+        with deadline.use(first):
+            try:
+                flight.do("k", cancelled_work)
+            except deadline.Cancelled as e:
+                outcome["first"] = e.reason
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    started.wait(5)
+    first.cancel()
+
+    # Операция ещё выполняется, но нужна только отменённому вызову:
+    # новый вызов начинает её заново, а не получает чужую отмену
+    with deadline.use(deadline.Deadline(30)):
+        result = flight.do("k", lambda broadcast: "fresh")
+    release.set()
+    thread.join(5)
+
+    assert result == ("fresh", False)
+    assert outcome["first"] == "disconnected"
+    assert flight.in_flight() == 0
+
+
+def test_deadline_visible_in_worker(backend, client, monkeypatch):
+    seen = {}
+
+    def fake_generate(quest_name, user_prompt, on_event=None, scene_count=None):
+        seen["deadline"] = deadline.current()
+        return {"message": "Quest generated successfully", "quest_name": quest_name}
+
+    monkeypatch.setattr(backend, "generate_and_save_quest", fake_generate)
+    response = client.post("/generate_quest", json={"quest_name": "deadline_test", "user_prompt": "p",
+                                                    "deadline_seconds": 30})
+    assert response.status_code == 200
+    assert seen["deadline"] is not None
+    assert 0 < seen["deadline"].remaining() <= 30
+
+
+def test_expired_deadline_returns_504(backend, client, monkeypatch):
+    def fake_generate(quest_name, user_prompt, on_event=None, scene_count=None):
+        deadline.sleep(5)
+        return {"quest_name": quest_name}
+
+    monkeypatch.setattr(backend, "generate_and_save_quest", fake_generate)
+    response = client.post("/generate_quest", json={"quest_name": "deadline_test", "user_prompt": "p",
+                                                    "deadline_seconds": 0.2})
+    assert response.status_code == 504
+
+
+def test_non_positive_deadline_rejected(backend, client):
+    response = client.post("/generate_quest", json={"quest_name": "deadline_test", "user_prompt": "p",
+                                                    "deadline_seconds": 0})
+    assert response.status_code == 400
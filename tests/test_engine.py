@@ -0,0 +1,128 @@
+# Игровой движок: скомпилированный квест, сессии и менеджер сессий
+
+import pytest
+
+from engine import CompiledQuest, GameError, GameSession, SessionManager
+from storage import FileQuestStorage
+
+QUEST = {"scenes": [
+    {"scene_id": "start", "text": "Развилка", "choices": [
+        {"text": "Налево", "next_scene": "left"},
+        {"text": "Направо", "next_scene": "right"},
+        {"text": "В пропасть", "next_scene": "nowhere"},
+    ]},
+    {"scene_id": "left", "text": "Тупик", "choices": [{"text": "Назад", "next_scene": "start"}]},
+    {"scene_id": "right", "text": "Финал", "choices": []},
+]}
+
+
+@pytest.fixture
+def quest():
+    return CompiledQuest(QUEST, "q", 1)
+
+
+def test_compile_rejects_quest_without_start():
+    with pytest.raises(GameError):
+        CompiledQuest({"scenes": [{"scene_id": "a"}]})
+    with pytest.raises(GameError):
+        CompiledQuest({"title": "нет сцен"})
+
+
+def test_play_through(quest):
+    session = GameSession(quest)
+    assert session.scene()["scene_id"] == "start"
+    assert session.choose(0)["scene_id"] == "left"
+    assert session.choose(0)["scene_id"] == "start"
+    assert session.choose(1)["text"] == "Финал"
+    assert session.is_finished()
+    assert session.history_ids() == ["start", "left", "start", "right"]
+    assert session.stats() == {"total_scenes": 3, "visited_scenes": 3,
+                               "completion_rate": 100.0, "moves": 4}
+
+    with pytest.raises(GameError, match="Игра окончена"):
+        session.choose(0)
+    session.restart()
+    assert session.history_ids() == ["start"]
+
+
+def test_invalid_choices(quest):
+    session = GameSession(quest)
+    with pytest.raises(GameError):
+        session.choose(3)
+    with pytest.raises(GameError, match="несуществующий"):
+        session.choose(2)
+    assert session.history_ids() == ["start"]
+
+
+def test_save_and_restore(quest):
+    session = GameSession(quest)
+    session.choose(0)
+    state = session.save()
+    assert state == {"quest_name": "q", "quest_version": 1, "history": ["start", "left"]}
+
+    restored = GameSession.restore(quest, state)
+    assert restored.history_ids() == ["start", "left"]
+    with pytest.raises(GameError):
+        GameSession.restore(quest, {"history": ["start", "gone"]})
+    with pytest.raises(GameError):
+        GameSession.restore(quest, {"history": []})
+
+
+def test_manager_shares_compiled_quest_per_version(tmp_path):
+    storage = FileQuestStorage(tmp_path / "quests", tmp_path / "positions")
+    storage.save_quest("q", QUEST)
+    manager = SessionManager(storage)
+
+    first_id, first = manager.create("q")
+    _, second = manager.create("q")
+    assert first.quest is second.quest
+
+    storage.save_quest("q", QUEST)
+    _, third = manager.create("q")
+    assert third.quest is not first.quest
+    assert third.quest.version == 2
+    # Сессия, начатая раньше, доигрывает свою версию
+    assert manager.get(first_id).quest.version == 1
+
+    with pytest.raises(KeyError):
+        manager.create("missing")
+
+
+def test_manager_evicts_expired_and_least_recently_used(tmp_path):
+    storage = FileQuestStorage(tmp_path / "quests", tmp_path / "positions")
+    storage.save_quest("q", QUEST)
+
+    manager = SessionManager(storage, max_sessions=2)
+    a, _ = manager.create("q")
+    b, _ = manager.create("q")
+    manager.get(a)
+    c, _ = manager.create("q")
+    assert manager.get(b) is None
+    assert manager.get(a) is not None and manager.get(c) is not None
+
+    expiring = SessionManager(storage, ttl=0)
+    session_id, session = expiring.create("q")
+    session.last_access -= 1
+    assert expiring.get(session_id) is None
+    assert len(expiring) == 0
+
+
+def test_session_endpoints(backend, client):
+    backend.storage.save_quest("session_q", QUEST)
+    created = client.post("/sessions", json={"quest_name": "session_q"})
+    assert created.status_code == 200
+    session_id = created.json()["session_id"]
+
+    moved = client.post(f"/sessions/{session_id}/choose", json={"choice": 1}).json()
+    assert moved["scene"]["scene_id"] == "right"
+    assert moved["finished"] is True
+    assert client.post(f"/sessions/{session_id}/choose", json={"choice": 0}).status_code == 422
+
+    state = client.get(f"/sessions/{session_id}/save").json()
+    restored = client.post("/sessions/restore", json={"state": state}).json()
+    assert restored["session_id"] != session_id
+    assert client.get(f"/sessions/{restored['session_id']}/history").json()["history"] == ["start", "right"]
+
+    assert client.delete(f"/sessions/{session_id}").status_code == 200
+    assert client.get(f"/sessions/{session_id}").status_code == 404
+    assert client.post("/sessions", json={"quest_name": "missing"}).status_code == 404
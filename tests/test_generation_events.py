@@ -0,0 +1,65 @@
+# События прогресса генерации: разбор сцен по мере получения ответа и порядок событий
+
+import json
+
+import pytest
+
+from conftest import SAMPLE_QUEST
+
+generate = pytest.importorskip("generate")
+main = pytest.importorskip("main")
+
+
+def test_partial_parser_returns_each_scene_once_complete():
+    response = 'Вот квест: {"scenes": [{"scene_id": "a", "text": "{x}"}, {"scene_id": "b"}]}'
+    parser = generate.PartialSceneParser()
+    parsed = []
+    for i in range(0, len(response), 7):
+        parsed.extend(scene["scene_id"] for scene in parser.feed(response[i:i + 7]))
+    assert parsed == ["a", "b"]
+    assert parser.buffer == response
+
+
+def test_events_follow_attempts_and_validation(monkeypatch):
+    valid_quest = json.loads(SAMPLE_QUEST.read_text(encoding="utf-8"))
+    responses = iter([{"scenes": []}, valid_quest])
+    monkeypatch.setattr(main, "generate_rpg_quest", lambda **kwargs: next(responses))
+    monkeypatch.setattr(main.deadline, "sleep", lambda seconds: None)
+
+    events = []
+    quest, errors = main.generate_quest_with_validation(
+        "q", "prompt", "system", None, max_retries=3,
+        on_event=lambda event_type, data: events.append((event_type, data))
+    )
+
+    assert errors == ""
+    assert quest == valid_quest
+    assert [event_type for event_type, _ in events] == [
+        "attempt_started", "validation", "retry", "attempt_started", "validation"
+    ]
+    assert events[1][1]["success"] is False
+    assert events[2][1]["attempt"] == 2
+    assert events[4][1]["success"] is True
+
+
+def test_stream_endpoint_emits_events_in_order(backend, client, monkeypatch):
+    valid_quest = json.loads(SAMPLE_QUEST.read_text(encoding="utf-8"))
+
+    def fake_generate_rpg_quest(user_prompt, system_prompt, credentials, on_event=None, on_response=None):
+        on_event("scene_parsed", {"scene": valid_quest["scenes"][0], "scenes_parsed": 1})
+        return valid_quest
+
+    monkeypatch.setattr(backend.main_module, "generate_rpg_quest", fake_generate_rpg_quest)
+    monkeypatch.setattr(backend, "build_node_positions", lambda quest_name: True)
+
+    response = client.post("/generate_quest/stream", json={"quest_name": "stream_q", "user_prompt": "p"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = [
+        line[len("event: "):] for line in response.text.splitlines() if line.startswith("event: ")
+    ]
+    assert events == ["attempt_started", "scene_parsed", "validation", "saved", "layout_done", "done"]
+    done = json.loads(response.text.rstrip().splitlines()[-1][len("data: "):])
+    assert done["quest_name"] == "stream_q"
+    assert done["coalesced"] is False
@@ -0,0 +1,104 @@
+# История версий квеста: объекты по хешу содержимого, манифесты, сравнение и восстановление
+
+import pytest
+
+import history
+from storage import FileQuestStorage, SQLiteQuestStorage
+
+
+def scene(scene_id, text="текст"):
+    return {"scene_id": scene_id, "text": text, "choices": []}
+
+
+def quest(count=50, title="Квест"):
+    return {"title": title, "scenes": [scene(f"s{i}") for i in range(count)]}
+
+
+def positions(count=50, x=0):
+    return [{"scene_id": f"s{i}", "x": x, "y": i} for i in range(count)]
+
+
+@pytest.fixture(params=["file", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "file":
+        yield FileQuestStorage(tmp_path / "quests", tmp_path / "positions")
+    else:
+        store = SQLiteQuestStorage(tmp_path / "quests.db")
+        yield store
+        store.close()
+
+
+def test_snapshot_round_trip():
+    manifest, objects = history.snapshot(quest(), positions())
+    assert history.materialize(manifest, lambda keys: {key: objects[key] for key in keys}) == (
+        quest(), positions()
+    )
+
+
+def test_patch_snapshot_stores_only_changed_chunks():
+    manifest, objects = history.snapshot(quest(200), positions(200))
+    read = lambda keys: {key: objects[key] for key in keys}  # noqa: E731
+    patched, new_objects = history.patch_snapshot(
+        manifest, {"s100": scene("s100", "новый текст")}, None, read
+    )
+    # Новая сцена и её блок, остальные блоки и позиции - прежние объекты
+    assert 0 < len(new_objects) < len(objects) / 4
+    assert patched["positions"] == manifest["positions"]
+    data, _ = history.materialize(patched, lambda keys: {key: {**objects, **new_objects}[key] for key in keys})
+    assert data["scenes"][100]["text"] == "новый текст"
+
+
+def test_versions_diff_and_restore(store):
+    store.save_quest("q", quest(), positions())
+    store.patch_quest("q", 1, {"s3": scene("s3", "изменена"), "s50": scene("s50"), "s7": None},
+                      {"s1": {"scene_id": "s1", "x": 10, "y": 1}})
+    store.save_quest("q", quest(title="Новое название"), positions(), expected_version=2)
+
+    versions = store.list_versions("q")
+    assert [item["version"] for item in versions] == [3, 2, 1]
+    assert versions[1]["added_bytes"] < versions[2]["added_bytes"]
+    assert store.list_versions("missing") is None
+
+    data, node_positions = store.load_version("q", 2)
+    assert [s["scene_id"] for s in data["scenes"]][-1] == "s50"
+    assert "s7" not in {s["scene_id"] for s in data["scenes"]}
+    assert node_positions[1]["x"] == 10
+
+    diff = store.diff_versions("q", 1, 2)
+    assert [item["scene_id"] for item in diff["added"]] == ["s50"]
+    assert [item["scene_id"] for item in diff["removed"]] == ["s7"]
+    assert diff["changed"] == [{"scene_id": "s3", "before": scene("s3"), "after": scene("s3", "изменена")}]
+    assert diff["moved_nodes"] == ["s1"]
+    assert store.diff_versions("q", 2, 3)["extra"] == {"title": {"before": "Квест", "after": "Новое название"}}
+    assert store.diff_versions("q", 1, 9) is None
+
+    new_version, restored = store.restore_version("q", 1)
+    assert new_version == 4 and restored == quest()
+    assert store.load_quest("q") == quest() and store.load_positions("q") == positions()
+    assert store.restore_version("q", 9) is None
+
+
+def test_delete_removes_history(store):
+    store.save_quest("q", quest())
+    store.delete_quest("q")
+    store.save_quest("q", quest(3))
+    assert [item["version"] for item in store.list_versions("q")] == [1]
+
+
+def test_version_endpoints(client, backend):
+    backend.storage.save_quest("history_api", quest(5), positions(5))
+    backend.storage.save_quest("history_api", quest(6), positions(6), expected_version=1)
+
+    listing = client.get("/quest_versions/history_api").json()
+    assert listing["current_version"] == 2
+    assert [item["version"] for item in listing["versions"]] == [2, 1]
+    assert client.get("/quest_versions/history_api/1").json()["quest_data"] == quest(5)
+    diff = client.get("/quest_versions/history_api/diff", params={"from_version": 1}).json()
+    assert [item["scene_id"] for item in diff["added"]] == ["s5"]
+
+    response = client.post("/quest_versions/history_api/1/restore", json={"base_version": 1})
+    assert response.status_code == 409
+    response = client.post("/quest_versions/history_api/1/restore", json={"base_version": 2})
+    assert response.json()["version"] == 3
+    assert client.get("/quest_versions/history_api/7").status_code == 404
+    assert client.get("/quest_versions/missing").status_code == 404
@@ -0,0 +1,96 @@
+# Импорт и экспорт библиотеки: круговой перенос, проверка названий и счётчик экспорта
+
+import io
+import json
+
+import pytest
+
+from conftest import SAMPLE_QUEST
+from library import LibraryImporter, iter_export, write_export
+from storage import FileQuestStorage
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FileQuestStorage(tmp_path / "quests", tmp_path / "positions")
+
+
+@pytest.fixture
+def quest_data():
+    return json.loads(SAMPLE_QUEST.read_text(encoding="utf-8"))
+
+
+@pytest.mark.parametrize("fmt", ["ndjson", "tar", "tar.gz"])
+def test_export_import_round_trip(store, tmp_path, quest_data, fmt):
+    positions = [{"scene_id": quest_data["scenes"][0]["scene_id"], "position": {"x": 1, "y": 2}}]
+    store.save_quest("a", quest_data, positions)
+    store.save_quest("b", quest_data)
+    data = b"".join(iter_export(store, ["a", "b"], fmt))
+
+    target = FileQuestStorage(tmp_path / "copy", tmp_path / "copy_positions")
+    importer = LibraryImporter(target)
+    if fmt == "ndjson":
+        importer.import_ndjson(data.split(b"\n"))
+    else:
+        importer.import_tar(io.BytesIO(data))
+
+    assert importer.report()["imported"] == 2
+    assert target.load_quest("a") == quest_data
+    assert target.load_positions("a") == positions
+    assert target.load_positions("b") is None
+
+
+def test_existing_quests_are_skipped_unless_overwrite(store, quest_data):
+    store.save_quest("a", quest_data)
+    line = json.dumps({"quest_name": "a", "quest_data": quest_data}).encode()
+
+    importer = LibraryImporter(store)
+    importer.add_record(line)
+    assert (importer.imported, importer.skipped) == (0, 1)
+
+    importer = LibraryImporter(store, overwrite=True)
+    importer.add_record(line)
+    assert importer.imported == 1
+    assert store.get_version("a") == 2
+
+
+@pytest.mark.parametrize("quest_name", ["../../escaped", "a/b", "a\\b", ".pending", "..", " "])
+def test_import_rejects_unsafe_names(store, tmp_path, quest_name):
+    importer = LibraryImporter(store)
+    importer.add_record(json.dumps({"quest_name": quest_name, "quest_data": {"scenes": []}}).encode())
+    assert importer.report()["invalid"] == 1
+    assert importer.imported == 0
+    assert not (tmp_path / "escaped.json").exists()
+
+
+def test_write_export_counts_written_quests(store):
+    quest_data = {"scenes": [{"scene_id": "start", "text": "t", "choices": []}]}
+    store.save_quest("a", quest_data)
+    store.save_quest("b", quest_data)
+    for fmt in ("ndjson", "tar"):
+        # Квест c отсутствует в хранилище и не выгружается
+        assert write_export(store, ["a", "b", "c"], fmt, io.BytesIO()) == 2
+
+
+def test_import_endpoint_reassembles_lines_split_across_chunks(client, quest_data):
+    records = [
+        json.dumps({"quest_name": f"lib_{i}", "quest_data": quest_data}, ensure_ascii=False).encode()
+        for i in range(3)
+    ]
+    body = b"\n".join(records) + b"\n" + b"{broken"
+
+    def chunks():
+        for i in range(0, len(body), 100):
+            yield body[i:i + 100]
+
+    response = client.post("/import_library?format=ndjson&overwrite=true", content=chunks())
+    assert response.status_code == 200
+    report = response.json()
+    assert report["imported"] == 3
+    assert report["invalid"] == 1
+
+
+def test_update_rejects_unsafe_name(client):
+    response = client.put("/update_quest", json={"quest_name": "../escaped", "quest_data": {"scenes": []},
+                                                 "node_positions": []})
+    assert response.status_code == 400
@@ -0,0 +1,30 @@
+# Нагрузочный тест: разбор смеси запросов и перцентили
+
+import sys
+
+import pytest
+
+from conftest import PROJECT_ROOT
+
+sys.path.insert(0, str(PROJECT_ROOT / "benchmarks"))
+pytest.importorskip("httpx")
+import loadtest  # noqa: E402
+
+
+def test_parse_mix_drops_zero_weights():
+    assert loadtest.parse_mix("list_quests=5, get_quest_data=0,update_quest") == {
+        "list_quests": 5.0, "update_quest": 1.0,
+    }
+
+
+def test_parse_mix_rejects_unknown_endpoint():
+    with pytest.raises(ValueError, match="delete_everything"):
+        loadtest.parse_mix("list_quests=1,delete_everything=1")
+
+
+def test_percentile_nearest_rank():
+    values = [float(i) for i in range(1, 101)]
+    assert loadtest.percentile(values, 50) == 50.0
+    assert loadtest.percentile(values, 99) == 99.0
+    assert loadtest.percentile(values, 100) == 100.0
+    assert loadtest.percentile([], 95) == 0.0
@@ -0,0 +1,67 @@
+# Метрики: текстовый формат Prometheus, таймеры и учёт HTTP запросов
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import metrics
+
+
+def test_counter_and_histogram_render():
+    registry = metrics.MetricsRegistry()
+    requests = metrics.Counter("requests", "Запросы", ["path"], registry=registry)
+    latency = metrics.Histogram("latency_seconds", "Время", buckets=(0.1, 1), registry=registry)
+
+    requests.inc(path="/a")
+    requests.inc(2, path="/a")
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    text = registry.render()
+    assert "# TYPE requests counter" in text
+    assert 'requests_total{path="/a"} 3' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1"} 2' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+    assert "latency_seconds_count 3" in text
+    assert "latency_seconds_sum 5.55" in text
+
+
+def test_duplicate_metric_name_is_rejected():
+    registry = metrics.MetricsRegistry()
+    metrics.Gauge("value", "Значение", registry=registry)
+    with pytest.raises(ValueError):
+        metrics.Gauge("value", "Значение", registry=registry)
+
+
+def test_timer_records_nested_blocks():
+    registry = metrics.MetricsRegistry()
+    stage = metrics.Histogram("stage_seconds", "Этапы", ["stage"], registry=registry)
+    timer = stage.time(stage="outer")
+    with timer:
+        with timer:
+            pass
+    assert stage.count(stage="outer") == 2
+
+
+def test_http_middleware_counts_by_route_template_and_passes_body():
+    async def app(scope, receive, send):
+        scope["route"] = SimpleNamespace(path="/get_quest_data/{quest_name}")
+        await send({"type": "http.response.start", "status": 404, "headers": []})
+        await send({"type": "http.response.body", "body": b"a", "more_body": True})
+        await send({"type": "http.response.body", "body": b"b"})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    labels = {"method": "GET", "path": "/get_quest_data/{quest_name}", "status": 404}
+    before = metrics.HTTP_REQUESTS.get(**labels)
+    scope = {"type": "http", "method": "GET", "path": "/get_quest_data/q"}
+    asyncio.run(metrics.HTTPMetricsMiddleware(app)(scope, None, send))
+
+    assert metrics.HTTP_REQUESTS.get(**labels) == before + 1
+    assert [message.get("more_body", False) for message in sent[1:]] == [True, False]
@@ -0,0 +1,97 @@
+# Валидатор квестов: глубина веток и статистика путей без перебора всех путей
+
+import random
+import time
+
+import pytest
+
+from process import GameValidator
+
+
+def validator_for(edges, scenes=None):
+    """GameValidator с графом сцен {scene_id: [next_scene, ...]}."""
+    validator = GameValidator()
+    for scene_id in scenes or edges:
+        validator.scenes[scene_id] = {"scene_id": scene_id}
+        validator.graph[scene_id] = list(edges.get(scene_id, []))
+    return validator
+
+
+def brute_force_paths(edges, start="start"):
+    """Все пути без повторов сцен от старта до конечных сцен (перебором)."""
+    paths = []
+
+    def walk(path):
+        next_scenes = edges.get(path[-1], [])
+        if not next_scenes:
+            paths.append(path)
+        for next_scene in next_scenes:
+            if next_scene in edges and next_scene not in path:
+                walk(path + [next_scene])
+
+    walk([start])
+    return paths
+
+
+def random_graph(rng, size):
+    names = ["start"] + [f"s{i}" for i in range(1, size)]
+    return {name: rng.sample(names, min(len(names), rng.choice([0, 0, 1, 2, 2, 3]))) for name in names}
+
+
+@pytest.mark.parametrize("edges, expected", [
+    ({"start": ["a"], "a": ["b"], "b": []}, True),
+    ({"start": ["a", "b"], "a": [], "b": []}, False),
+    ({"start": []}, False),
+    # Конечная сцена рядом со стартом, но до неё есть и обходной путь
+    ({"start": ["end", "a"], "a": ["end"], "end": []}, True),
+    # Обходной путь к соседней конечной сцене возможен только через неё саму
+    ({"start": ["end", "a"], "a": ["start"], "end": []}, False),
+    # Цикл без выхода к конечной сцене
+    ({"start": ["a"], "a": ["start"]}, False),
+])
+def test_branch_depth(edges, expected):
+    assert validator_for(edges)._check_branch_depth() is expected
+
+
+def test_branch_depth_and_stats_match_brute_force():
+    rng = random.Random(7)
+    for _ in range(300):
+        edges = random_graph(rng, rng.randint(1, 8))
+        validator = validator_for(edges)
+        paths = brute_force_paths(edges)
+
+        assert validator._check_branch_depth() is any(len(path) >= 3 for path in paths)
+        assert sorted(validator.find_all_paths()) == sorted(paths)
+
+        stats = validator.path_stats()
+        assert stats["min_length"] == min((len(path) for path in paths), default=None)
+        if not stats["has_cycles"]:
+            assert stats["paths"] == len(paths)
+            assert stats["max_length"] == max((len(path) for path in paths), default=None)
+
+
+def test_large_graph_is_fast():
+    # Лестница из 2000 развилок: 2^1000 путей, перебор не закончился бы никогда
+    size = 2000
+    edges = {f"s{i}": [f"s{i + 1}", f"s{i + 2}"] for i in range(size)}
+    edges["start"] = ["s0"]
+    edges[f"s{size}"] = []
+    edges[f"s{size + 1}"] = []
+
+    validator = validator_for(edges)
+    started = time.perf_counter()
+    assert validator._check_branch_depth() is True
+    stats = validator.path_stats()
+    paths = validator.find_all_paths(limit=10)
+    assert time.perf_counter() - started < 5
+
+    assert stats["has_cycles"] is False
+    assert stats["paths"] > 2 ** 1000
+    assert stats["min_length"] == size // 2 + 2
+    assert stats["max_length"] == size + 2
+    assert len(paths) == 10
+
+
+def test_stats_with_cycle_report_shortest_path_only():
+    validator = validator_for({"start": ["a"], "a": ["start", "end"], "end": []})
+    assert validator.path_stats() == {"paths": None, "min_length": 3, "max_length": None, "has_cycles": True}
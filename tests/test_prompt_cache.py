@@ -0,0 +1,91 @@
+# Кэш похожих промптов: MinHash/LSH поиск и режимы offer/reuse генерации
+
+import pytest
+
+import prompt_cache
+from prompt_cache import PromptCache
+
+PROMPT = "Жанр: киберпанк. Герой: хакер-одиночка. Цель: проникнуть в башню корпорации."
+REWORDED = "жанр - Киберпанк; герой - хакер-одиночка; цель - проникнуть в башню корпорации!"
+OTHER = "Жанр: сказка. Герой: кот учёный. Цель: найти дорогу домой через волшебный лес."
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = PromptCache(tmp_path / "prompts.db")
+    yield cache
+    cache.close()
+
+
+def test_normalize_strips_template_labels_and_punctuation():
+    assert prompt_cache.normalize(PROMPT) == prompt_cache.normalize(REWORDED)
+
+
+def test_signature_estimates_jaccard():
+    a, b = prompt_cache.shingles(PROMPT), prompt_cache.shingles(OTHER)
+    estimate = prompt_cache.estimate(prompt_cache.signature(a), prompt_cache.signature(b))
+    assert estimate == pytest.approx(prompt_cache.jaccard(a, b), abs=0.15)
+    assert prompt_cache.estimate(prompt_cache.signature(a), prompt_cache.signature(a)) == 1.0
+
+
+def test_find_similar(cache):
+    cache.add(PROMPT, "cyber", 1)
+    cache.add(OTHER, "tale", 1)
+    cache.add(PROMPT + " Ночь.", "cyber", 2)
+    [match] = cache.find_similar(REWORDED)
+    assert match["quest_name"] == "cyber"
+    assert match["version"] == 1 and match["similarity"] == 1.0
+    assert cache.find_similar("совсем другой запрос про космос и звёзды") == []
+    assert cache.find_similar("") == []
+
+    cache.remove_quest("cyber")
+    assert cache.count() == 1
+    cache.discard(cache.find_similar(OTHER)[0]["id"])
+    assert cache.count() == 0
+
+
+def test_cache_mode(monkeypatch):
+    monkeypatch.delenv("QUEST_PROMPT_CACHE", raising=False)
+    assert prompt_cache.cache_mode() == "generate"
+    assert prompt_cache.cache_mode("reuse") == "reuse"
+    monkeypatch.setenv("QUEST_PROMPT_CACHE", "offer")
+    assert prompt_cache.cache_mode() == "offer"
+    with pytest.raises(ValueError):
+        prompt_cache.cache_mode("always")
+
+
+@pytest.fixture
+def cached_backend(backend, cache, monkeypatch):
+    monkeypatch.setattr(backend, "prompt_cache", cache)
+    quest = {"title": "Башня", "scenes": [{"scene_id": "start", "text": "Вход", "choices": []}]}
+    version = backend.storage.save_quest("cached_source", quest)
+    cache.add(PROMPT, "cached_source", version)
+    return backend
+
+
+def test_similar_prompts_endpoint(client, cached_backend, cache):
+    cache.add(OTHER, "deleted_quest", 1)
+    response = client.get("/similar_prompts", params={"prompt": REWORDED})
+    assert [item["quest_name"] for item in response.json()["results"]] == ["cached_source"]
+    # Квесты, которых нет в хранилище, не возвращаются
+    assert client.get("/similar_prompts", params={"prompt": OTHER}).json()["results"] == []
+
+
+def test_similar_prompts_disabled(client, backend):
+    assert backend.prompt_cache is None
+    assert client.get("/similar_prompts", params={"prompt": PROMPT}).status_code == 400
+    response = client.post("/generate_quest", json={"quest_name": "x", "user_prompt": PROMPT, "similar": "reuse"})
+    assert response.status_code == 400
+
+
+def test_offer_and_reuse(client, cached_backend):
+    offer = client.post("/generate_quest", json={"quest_name": "offered", "user_prompt": REWORDED,
+                                                 "similar": "offer"}).json()
+    assert offer["generated"] is False
+    assert offer["similar"][0]["quest_name"] == "cached_source"
+    assert not cached_backend.storage.quest_exists("offered")
+
+    reused = client.post("/generate_quest", json={"quest_name": "reused", "user_prompt": REWORDED,
+                                                  "similar": "reuse"}).json()
+    assert reused["reused_from"]["quest_name"] == "cached_source"
+    assert cached_backend.storage.load_quest("reused")["title"] == "Башня"
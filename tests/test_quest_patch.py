@@ -0,0 +1,72 @@
+# Точечные изменения квеста: операции редактора и конфликты версий
+
+import json
+
+import pytest
+
+from conftest import SAMPLE_QUEST
+from quest_patch import PatchError, QuestPatch
+
+
+@pytest.fixture
+def quest():
+    return json.loads(SAMPLE_QUEST.read_text(encoding="utf-8"))
+
+
+@pytest.fixture
+def positions(quest):
+    return [{"scene_id": scene["scene_id"], "position": {"x": i, "y": 0}}
+            for i, scene in enumerate(quest["scenes"])]
+
+
+def test_text_and_move_touch_only_changed_scenes(quest, positions):
+    original = json.dumps(quest, ensure_ascii=False)
+    patch = QuestPatch(quest, positions)
+    patch.apply_all([
+        {"op": "set_scene_text", "scene_id": "start", "text": "Новый текст"},
+        {"op": "set_choice_text", "scene_id": "start", "index": 0, "text": "Новый выбор"},
+        {"op": "move_node", "scene_id": "start", "x": 10.6, "y": -3},
+    ])
+    assert set(patch.scene_changes) == {"start"}
+    assert patch.scene_changes["start"]["text"] == "Новый текст"
+    assert patch.scene_changes["start"]["choices"][0]["text"] == "Новый выбор"
+    assert patch.position_changes == {"start": {"scene_id": "start", "position": {"x": 10, "y": -3}}}
+    assert not patch.graph_changed
+    assert patch.validate() == (True, "Все проверки пройдены успешно")
+    # Исходный квест не меняется: изменённые сцены копируются
+    assert json.dumps(quest, ensure_ascii=False) == original
+
+
+def test_graph_operations_validate_whole_graph(quest, positions):
+    patch = QuestPatch(quest, positions)
+    patch.apply({"op": "add_choice", "scene_id": "start", "text": "В никуда", "next_scene": "missing"})
+    assert patch.graph_changed
+    success, message = patch.validate()
+    assert not success
+    assert "missing" in message
+
+
+def test_remove_scene_drops_its_position(quest, positions):
+    leaf = next(scene["scene_id"] for scene in quest["scenes"] if not scene["choices"])
+    patch = QuestPatch(quest, positions)
+    patch.apply({"op": "remove_scene", "scene_id": leaf})
+    assert patch.scene_changes == {leaf: None}
+    assert patch.position_changes == {leaf: None}
+
+
+@pytest.mark.parametrize("operation, error", [
+    ({"op": "explode"}, "Неизвестная операция"),
+    ({"op": "set_scene_text", "scene_id": "nope", "text": "x"}, "не найдена"),
+    ({"op": "remove_choice", "scene_id": "start", "index": 99}, "индексом 99"),
+    ({"op": "move_node", "scene_id": "start", "x": "a", "y": 0}, "числами"),
+])
+def test_invalid_operations(quest, positions, operation, error):
+    patch = QuestPatch(quest, positions)
+    with pytest.raises(PatchError, match=error) as info:
+        patch.apply_all([{"op": "set_scene_text", "scene_id": "start", "text": "ok"}, operation])
+    assert str(info.value).startswith("Операция #2")
+
+
+def test_move_without_positions(quest):
+    with pytest.raises(PatchError, match="не построены"):
+        QuestPatch(quest, None).apply({"op": "move_node", "scene_id": "start", "x": 1, "y": 1})
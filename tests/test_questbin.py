@@ -0,0 +1,87 @@
+# Двоичный формат квестов questbin и его использование хранилищем
+
+import os
+
+import pytest
+
+import questbin
+from engine import GameSession
+from storage import FileQuestStorage
+
+QUEST = {
+    "title": "Двоичный квест",
+    "scenes": [
+        {"scene_id": "start", "text": "Начало", "mood": "тихо", "choices": [
+            {"text": "Вперёд", "next_scene": "end", "weight": 3},
+            {"text": "В никуда", "next_scene": "nowhere"},
+        ]},
+        {"scene_id": "end", "text": "Конец", "choices": []},
+    ],
+}
+
+
+@pytest.fixture
+def quest_file(tmp_path):
+    path = tmp_path / "bin_quest.json"
+    path.write_text(questbin.json.dumps(QUEST, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def test_compile_round_trips_quest_data(quest_file):
+    output = questbin.compile_file(quest_file)
+    assert output == questbin.binary_path(quest_file)
+    with questbin.open_binary(quest_file) as quest:
+        assert quest.to_dict() == QUEST
+        assert quest.scene_ids == ("start", "end")
+        assert quest.scene("start") == QUEST["scenes"][0]
+        assert quest.skeleton() == {"scenes": [
+            {"scene_id": "start", "choices": [{"next_scene": "end"}, {"next_scene": "nowhere"}]},
+            {"scene_id": "end", "choices": []},
+        ]}
+    assert questbin.load_quest_data(output) == QUEST
+
+
+def test_compiled_quest_plays_from_binary(quest_file):
+    questbin.compile_file(quest_file)
+    quest = questbin.load_compiled_quest(quest_file, name="bin_quest")
+    session = GameSession(quest)
+    assert session.scene()["text"] == "Начало"
+    assert session.choose(0)["scene_id"] == "end"
+    assert session.is_finished()
+
+
+def test_stale_copy_falls_back_to_json(quest_file):
+    questbin.compile_file(quest_file)
+    changed = dict(QUEST, scenes=[dict(QUEST["scenes"][0], text="Новое начало"), QUEST["scenes"][1]])
+    quest_file.write_text(questbin.json.dumps(changed, ensure_ascii=False), encoding="utf-8")
+    assert questbin.open_binary(quest_file) is None
+    quest = questbin.load_compiled_quest(quest_file)
+    assert GameSession(quest).scene()["text"] == "Новое начало"
+
+
+def test_corrupted_binary_is_rejected(tmp_path):
+    path = tmp_path / "broken.qbin"
+    path.write_bytes(b"not a quest")
+    with pytest.raises(questbin.QuestFormatError):
+        questbin.BinaryQuest(path)
+
+
+def test_storage_writes_and_removes_binary_copy(tmp_path):
+    storage = FileQuestStorage(tmp_path / "quests", tmp_path / "positions")
+    storage.save_quest("bin_quest", QUEST)
+    binary = tmp_path / "quests" / ".bin_quest.qbin"
+    assert binary.exists()
+    quest = storage.load_compiled("bin_quest", 1)
+    assert isinstance(quest.texts, questbin._TextsView)
+    assert quest.version == 1 and quest.scene_at(quest.start)["text"] == "Начало"
+
+    storage.delete_quest("bin_quest")
+    assert not binary.exists()
+
+
+def test_storage_loads_json_without_binary_copy(tmp_path):
+    storage = FileQuestStorage(tmp_path / "quests", tmp_path / "positions")
+    storage.save_quest("bin_quest", QUEST)
+    os.unlink(tmp_path / "quests" / ".bin_quest.qbin")
+    quest = storage.load_compiled("bin_quest")
+    assert GameSession(quest).choose(0)["text"] == "Конец"
@@ -0,0 +1,118 @@
+# Полнотекстовый поиск: стемминг, ранжирование, инкрементальное обновление
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import PROJECT_ROOT, SAMPLE_QUEST
+from search import RussianStemmer, SearchIndex, make_snippet, tokenize
+
+
+@pytest.fixture
+def index(tmp_path):
+    search_index = SearchIndex(str(tmp_path / "search.db"))
+    yield search_index
+    search_index.close()
+
+
+def scene(scene_id, text, *choices):
+    return {"scene_id": scene_id, "text": text,
+            "choices": [{"text": choice, "next_scene": None} for choice in choices]}
+
+
+@pytest.mark.parametrize("forms", [
+    ("дракон", "дракона", "драконы", "драконом", "драконами"),
+    ("башня", "башни", "башней", "башню"),
+    ("бежать", "бежала"),
+])
+def test_word_forms_share_a_stem(forms):
+    stemmer = RussianStemmer()
+    assert len({stemmer.stem(word) for word in forms}) == 1
+
+
+def test_tokenize_skips_stop_words_and_keeps_offsets():
+    text = "Он увидел Дракона и замок"
+    tokens = tokenize(text)
+    assert [text[start:end] for _, start, end in tokens] == ["увидел", "Дракона", "замок"]
+
+
+def test_search_finds_any_form_and_ranks_scene_text_first(index):
+    index.index_quest("q", {"scenes": [
+        scene("choice_only", "Тихая деревня у реки.", "Спросить о драконе"),
+        scene("text", "Над деревней кружат драконы.", "Уйти"),
+        scene("other", "Пустая дорога.", "Идти дальше"),
+    ]})
+
+    results = index.search("дракон")
+    assert [result["scene_id"] for result in results] == ["text", "choice_only"]
+    assert results[0]["field"] == "text"
+    assert results[1]["field"] == "choices"
+
+    snippet = results[0]["snippet"]
+    start, end = results[0]["matches"][0]
+    assert snippet[start:end] == "драконы"
+
+
+def test_all_query_words_must_match(index):
+    index.index_quest("q", {"scenes": [
+        scene("a", "Дракон спит в пещере."),
+        scene("b", "Дракон летит над башней."),
+    ]})
+    assert [result["scene_id"] for result in index.search("дракон башня")] == ["b"]
+    assert index.search("и в на") == []
+
+
+def test_update_scenes_reindexes_only_changed_scenes(index):
+    index.index_quest("q", {"scenes": [scene("a", "Старый маяк."), scene("b", "Старый мост.")]})
+    index.update_scenes("q", {"a": scene("a", "Новый маяк."), "b": None})
+
+    assert [result["scene_id"] for result in index.search("новый маяк")] == ["a"]
+    assert index.search("мост") == []
+    index.remove_quest("q")
+    assert index.is_empty()
+
+
+def test_prefix_limits_quests(index):
+    index.index_quest("alpha_1", {"scenes": [scene("a", "Лес.")]})
+    index.index_quest("beta_1", {"scenes": [scene("a", "Лес.")]})
+    assert [result["quest_name"] for result in index.search("лес", quest_prefix="beta")] == ["beta_1"]
+
+
+def test_snippet_marks_matches_after_ellipsis():
+    text = " ".join(["слово"] * 30 + ["дракон"] + ["слово"] * 30)
+    snippet, matches = make_snippet(text, {RussianStemmer().stem("дракон")}, words=6)
+    assert snippet.startswith("…") and snippet.endswith("…")
+    assert [snippet[start:end] for start, end in matches] == ["дракон"]
+
+
+def test_search_endpoint_sees_updated_quest(client):
+    quest_data = {"scenes": [scene("start", "Вход в заброшенную обсерваторию.")]}
+    assert client.put("/update_quest", json={"quest_name": "search_q", "quest_data": quest_data,
+                                             "node_positions": []}).status_code == 200
+    response = client.get("/search", params={"q": "обсерватория"})
+    assert response.status_code == 200
+    assert [(r["quest_name"], r["scene_id"]) for r in response.json()["results"]] == [("search_q", "start")]
+    assert client.get("/search", params={"q": "x", "limit": 0}).status_code == 400
+
+
+def test_cli_import_updates_search_index(tmp_path):
+    record = {"quest_name": "imported", "quest_data": json.loads(SAMPLE_QUEST.read_text(encoding="utf-8"))}
+    archive = tmp_path / "library.ndjson"
+    archive.write_text(json.dumps(record, ensure_ascii=False) + "\n", encoding="utf-8")
+    env = dict(os.environ, QUEST_STORAGE="sqlite", QUEST_DB_PATH=str(tmp_path / "quests.db"),
+               QUEST_SEARCH_DB=str(tmp_path / "search.db"))
+    result = subprocess.run([sys.executable, str(PROJECT_ROOT / "library.py"), "import", str(archive)],
+                            env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert "Импортировано: 1" in result.stdout
+
+    scene_text = record["quest_data"]["scenes"][0]["text"]
+    word = next(word for word in scene_text.split() if len(word) > 4 and word.isalpha())
+    search_index = SearchIndex(str(tmp_path / "search.db"))
+    try:
+        assert any(hit["quest_name"] == "imported" for hit in search_index.search(word))
+    finally:
+        search_index.close()
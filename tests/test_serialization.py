@@ -0,0 +1,35 @@
+# Сериализация JSON: компактный формат хранилища и выгрузка квеста
+
+import json
+
+import serialization
+from storage import FileQuestStorage, export_quest
+
+
+def test_dumps_is_compact_and_keeps_cyrillic():
+    data = {"title": "Квест", "scenes": [{"id": 1}]}
+    raw = serialization.dumps_bytes(data)
+    assert raw == '{"title":"Квест","scenes":[{"id":1}]}'.encode("utf-8")
+    assert serialization.loads(raw) == data
+    assert serialization.loads(raw.decode("utf-8")) == data
+
+
+def test_pretty_output_is_indented():
+    raw = serialization.dumps_bytes({"a": [1]}, pretty=True)
+    assert b"\n" in raw
+    assert json.loads(raw) == {"a": [1]}
+
+
+def test_file_storage_writes_compact_json_and_exports_pretty(tmp_path):
+    storage = FileQuestStorage(tmp_path / "quests", tmp_path / "positions")
+    quest = {"title": "Квест", "scenes": [{"scene_id": "s1", "text": "Текст"}]}
+    storage.save_quest("q", quest)
+
+    stored = (tmp_path / "quests" / "q.json").read_bytes()
+    assert b"\n" not in stored
+    assert serialization.loads(stored) == quest
+
+    exported = export_quest(storage, "q")
+    assert b"\n" in exported
+    assert json.loads(exported) == quest
+    assert export_quest(storage, "missing") is None
@@ -0,0 +1,123 @@
+# Симуляция прохождений и точный анализ квеста как цепи Маркова
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import simulate
+from engine import CompiledQuest
+from simulate import QuestSimulator, analyze, choice_weights, load_choice_weights
+
+# Развилка с весами 9:1, петля через "loop" и недостижимая сцена
+QUEST = {"scenes": [
+    {"scene_id": "start", "text": "Развилка", "choices": [
+        {"text": "К свету", "next_scene": "good", "weight": 9},
+        {"text": "Во тьму", "next_scene": "loop", "weight": 1},
+    ]},
+    {"scene_id": "loop", "text": "Петля", "choices": [
+        {"text": "Назад", "next_scene": "start"},
+        {"text": "Вниз", "next_scene": "bad"},
+    ]},
+    {"scene_id": "good", "text": "Хорошая концовка", "choices": []},
+    {"scene_id": "bad", "text": "Плохая концовка", "choices": []},
+    {"scene_id": "lost", "text": "Забытая сцена", "choices": [{"text": "Вперёд", "next_scene": "good"}]},
+]}
+
+
+@pytest.fixture
+def quest():
+    return CompiledQuest(QUEST, "q")
+
+
+def test_structure(quest):
+    structure = QuestSimulator(quest).structure()
+    assert structure["unreachable"] == ["lost"]
+    assert structure["traps"] == []
+    assert sorted(structure["endings"]) == ["bad", "good"]
+
+
+def test_traps_disable_exact_solution():
+    quest = CompiledQuest({"scenes": [
+        {"scene_id": "start", "choices": [{"text": "a", "next_scene": "end"}, {"text": "b", "next_scene": "pit"}]},
+        {"scene_id": "pit", "choices": [{"text": "снова", "next_scene": "pit"}]},
+        {"scene_id": "end", "choices": []},
+    ]})
+    report = analyze(quest, runs=1000, seed=1, max_steps=50)
+    assert report["traps"] == ["pit"]
+    assert report["exact"] is None
+    assert report["simulation"]["truncated"] > 0
+
+
+def test_uniform_exact(quest):
+    exact = QuestSimulator(quest).exact()
+    # P(good) = 1/2 + 1/4 * P(good) -> 2/3
+    assert exact["ending_probabilities"]["good"] == pytest.approx(2 / 3)
+    assert exact["ending_probabilities"]["bad"] == pytest.approx(1 / 3)
+    assert exact["expected_visits"]["start"] == pytest.approx(4 / 3)
+    assert exact["visit_probabilities"]["loop"] == pytest.approx(1 / 2)
+
+
+def test_weighted_uses_choice_weights_from_quest_data(quest):
+    exact = QuestSimulator(quest, "weighted", choice_weights(QUEST)).exact()
+    # P(good) = 0.9 + 0.1 * 0.5 * P(good)
+    assert exact["ending_probabilities"]["good"] == pytest.approx(0.9 / 0.95)
+
+
+def test_load_choice_weights_reads_weight_field(tmp_path):
+    path = tmp_path / "q.json"
+    path.write_text(simulate.json.dumps(QUEST), encoding="utf-8")
+    assert load_choice_weights(str(path), tmp_path)["start"] == [9.0, 1.0]
+
+
+def test_weighted_rejects_bad_weights(quest):
+    with pytest.raises(ValueError):
+        QuestSimulator(quest, "weighted", {"start": [1]})
+    with pytest.raises(ValueError):
+        QuestSimulator(quest, "weighted", {"start": [1, -1]})
+    with pytest.raises(ValueError):
+        QuestSimulator(quest, "greedy")
+
+
+def test_series_matches_fundamental_matrix(quest, monkeypatch):
+    dense = QuestSimulator(quest).exact()
+    monkeypatch.setattr(simulate, "MAX_EXACT_SCENES", 1)
+    series = QuestSimulator(quest).exact()
+    assert "visit_probabilities" not in series
+    assert series["residual"] < simulate.SERIES_TOLERANCE
+    for scene_id, probability in dense["ending_probabilities"].items():
+        assert series["ending_probabilities"][scene_id] == pytest.approx(probability)
+    assert series["expected_length"] == pytest.approx(dense["expected_length"])
+
+
+def test_large_chain_does_not_need_dense_matrix():
+    n = 20_000
+    scenes = [{"scene_id": "start", "choices": [{"text": "дальше", "next_scene": "s1"}]}]
+    scenes += [{"scene_id": f"s{i}", "choices": [{"text": "дальше", "next_scene": f"s{i + 1}"}]}
+               for i in range(1, n)]
+    scenes.append({"scene_id": f"s{n}", "choices": []})
+    exact = QuestSimulator(CompiledQuest({"scenes": scenes})).exact()
+    assert exact["expected_length"] == pytest.approx(n)
+    assert exact["ending_probabilities"] == {f"s{n}": pytest.approx(1.0)}
+
+
+def test_simulation_agrees_with_exact(quest):
+    report = analyze(quest, runs=200_000, seed=7)
+    simulated = report["simulation"]["ending_probabilities"]
+    assert simulated["good"] == pytest.approx(report["exact"]["ending_probabilities"]["good"], abs=0.01)
+    assert report["simulation"]["never_visited"] == ["lost"]
+
+
+def test_exhaustive_counts_paths_through_cycles(quest):
+    paths = analyze(quest, "exhaustive", max_steps=6)["paths"]
+    # good - пути длины 1, 3, 5; bad - 2, 4, 6; один путь ещё идёт по петле
+    assert paths["ending_paths"] == {"good": 3.0, "bad": 3.0}
+    assert paths["min_length"] == 1 and paths["max_length"] == 6
+    assert paths["unfinished_paths"] == 1.0
+
+
+def test_simulate_endpoint_weighted(client, backend):
+    backend.storage.save_quest("sim_quest", QUEST)
+    response = client.post("/simulate_quest/sim_quest", json={"policy": "weighted", "runs": 0})
+    assert response.status_code == 200
+    assert response.json()["exact"]["ending_probabilities"]["good"] == pytest.approx(0.9 / 0.95)
+    assert client.post("/simulate_quest/missing", json={}).status_code == 404
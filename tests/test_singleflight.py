@@ -0,0 +1,73 @@
+# Объединение одинаковых одновременных вызовов
+
+import threading
+import time
+
+from singleflight import SingleFlight, request_key
+
+
+def run_concurrently(flight, key, fn, callers):
+    """Запускает callers вызовов flight.do в потоках, пока первый выполняет fn."""
+    results, errors, events = [], [], []
+    started = threading.Event()
+    release = threading.Event()
+
+    def leader_fn(broadcast):
+        started.set()
+        release.wait(5)
+        broadcast("progress", {"step": 1})
+        return fn()
+
+    def call(index):
+        try:
+            results.append(flight.do(key, leader_fn, lambda t, d: events.append((index, t))))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call, args=(0,))]
+    threads[0].start()
+    started.wait(5)
+    for index in range(1, callers):
+        threads.append(threading.Thread(target=call, args=(index,)))
+        threads[-1].start()
+    # Ждём, пока все вызовы подпишутся на выполняющуюся операцию
+    while len(flight._calls[key].subscribers) < callers:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return results, errors, events
+
+
+def test_concurrent_calls_share_one_execution_and_events():
+    flight = SingleFlight("test")
+    runs = []
+    results, errors, events = run_concurrently(flight, "k", lambda: runs.append(1) or "quest", 3)
+
+    assert errors == []
+    assert runs == [1]
+    assert sorted(results) == [("quest", False), ("quest", True), ("quest", True)]
+    assert sorted(index for index, _ in events) == [0, 1, 2]
+    assert flight.in_flight() == 0
+
+
+def test_error_is_raised_in_every_caller():
+    flight = SingleFlight("test")
+
+    def fail():
+        raise RuntimeError("LLM недоступна")
+
+    results, errors, _ = run_concurrently(flight, "k", fail, 2)
+    assert results == []
+    assert [str(e) for e in errors] == ["LLM недоступна", "LLM недоступна"]
+
+
+def test_finished_call_is_not_reused():
+    flight = SingleFlight("test")
+    assert flight.do("k", lambda broadcast: 1) == (1, False)
+    assert flight.do("k", lambda broadcast: 2) == (2, False)
+
+
+def test_request_key_separates_parts():
+    assert request_key("ab", "c") != request_key("a", "bc")
+    assert request_key("quest", "промпт") == request_key("quest", "промпт")
@@ -0,0 +1,68 @@
+# Структура графа и ленивая загрузка сцен: индекс смещений и SQLite
+
+import json
+import os
+
+import pytest
+
+from conftest import SAMPLE_QUEST
+from storage import FileQuestStorage, SQLiteQuestStorage, skeleton_scene
+
+
+@pytest.fixture(params=["file", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "file":
+        yield FileQuestStorage(tmp_path / "quests", tmp_path / "positions")
+    else:
+        sqlite_store = SQLiteQuestStorage(str(tmp_path / "quests.db"))
+        yield sqlite_store
+        sqlite_store.close()
+
+
+@pytest.fixture
+def quest_data():
+    return json.loads(SAMPLE_QUEST.read_text(encoding="utf-8"))
+
+
+def test_skeleton_matches_full_quest(store, quest_data):
+    store.save_quest("q", quest_data)
+    assert store.load_skeleton("q") == {"scenes": [skeleton_scene(scene) for scene in quest_data["scenes"]]}
+    assert store.load_skeleton("missing") is None
+
+
+def test_load_scenes_by_id(store, quest_data):
+    store.save_quest("q", quest_data)
+    first, last = quest_data["scenes"][0], quest_data["scenes"][-1]
+    scenes = store.load_scenes("q", [last["scene_id"], first["scene_id"], "nope"])
+    assert scenes == {first["scene_id"]: first, last["scene_id"]: last}
+    assert store.load_scenes("missing", ["a"]) is None
+
+
+def test_stale_index_falls_back_to_full_parse(tmp_path, quest_data):
+    store = FileQuestStorage(tmp_path / "quests", tmp_path / "positions")
+    store.save_quest("q", quest_data)
+
+    # Ручная правка файла: смещения в индексе больше не совпадают
+    quest_data["scenes"][0]["text"] = "Новый текст " * 20
+    quest_path = tmp_path / "quests" / "q.json"
+    quest_path.write_text(json.dumps(quest_data, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.utime(quest_path, ns=(1, 1))
+
+    first = quest_data["scenes"][0]
+    assert store.load_scenes("q", [first["scene_id"]]) == {first["scene_id"]: first}
+    assert store.load_skeleton("q")["scenes"][0] == skeleton_scene(first)
+
+
+def test_get_scenes_endpoint(backend, client, quest_data):
+    backend.storage.save_quest("lazy_q", quest_data)
+    scene_id = quest_data["scenes"][1]["scene_id"]
+    response = client.get(f"/get_scenes/lazy_q?ids={scene_id},nope,{scene_id}")
+    assert response.status_code == 200
+    body = response.json()
+    assert [scene["scene_id"] for scene in body["scenes"]] == [scene_id]
+    assert body["missing"] == ["nope"]
+    assert body["version"] == backend.storage.get_version("lazy_q")
+
+    too_many = ",".join(f"s{i}" for i in range(backend.MAX_SCENES_PER_REQUEST + 1))
+    assert client.get(f"/get_scenes/lazy_q?ids={too_many}").status_code == 400
+    assert client.get("/get_scenes/missing?ids=a").status_code == 404
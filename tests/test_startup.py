@@ -0,0 +1,34 @@
+# Холодный старт backend: тяжёлые зависимости LLM не загружаются при импорте
+
+import subprocess
+import sys
+
+import pytest
+
+from conftest import PROJECT_ROOT
+
+sys.path.insert(0, str(PROJECT_ROOT / "benchmarks"))
+import bench_startup  # noqa: E402
+
+
+def test_backend_import_does_not_load_llm_client(tmp_path):
+    pytest.importorskip("fastapi")
+    script = (
+        "import sys; sys.path[:0] = [sys.argv[1], sys.argv[2]]; import backend; "
+        "print(','.join(sorted({name.split('.')[0] for name in sys.modules})))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script, str(PROJECT_ROOT), str(PROJECT_ROOT / "ui-backend")],
+        cwd=tmp_path, capture_output=True, text=True, env=bench_startup.isolated_env(str(tmp_path)),
+    )
+    assert result.returncode == 0, result.stderr
+    loaded = set(result.stdout.strip().splitlines()[-1].split(","))
+    assert not loaded & {"langchain_community", "langchain_core", "gigachat", "networkx"}
+    # Данные backend создаются только во временной папке
+    assert (tmp_path / "quests.db").exists()
+
+
+def test_list_quests_responds(client):
+    response = client.get("/list_quests")
+    assert response.status_code == 200
+    assert isinstance(response.json()["quests"], list)
@@ -0,0 +1,164 @@
+# Хранилища квестов: атомарная запись файлов, разделяемое чтение, SQLite и перенос между ними
+
+import threading
+
+import pytest
+
+from storage import FileQuestStorage, SQLiteQuestStorage, VersionConflictError, migrate
+
+
+def quest(text):
+    return {"title": text, "scenes": [{"scene_id": "start", "text": text, "choices": []}]}
+
+
+def positions(x):
+    return [{"scene_id": "start", "x": x, "y": 0}]
+
+
+@pytest.fixture
+def file_store(tmp_path):
+    return FileQuestStorage(tmp_path / "quests", tmp_path / "positions")
+
+
+@pytest.fixture(params=["file", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "file":
+        yield FileQuestStorage(tmp_path / "quests", tmp_path / "positions")
+    else:
+        store = SQLiteQuestStorage(tmp_path / "quests.db")
+        yield store
+        store.close()
+
+
+def test_round_trip(store):
+    store.save_quest("q", quest("a"), positions(1))
+    assert store.list_quests() == ["q"]
+    assert store.load_quest("q") == quest("a")
+    assert store.load_positions("q") == positions(1)
+
+    # Новый граф без позиций сбрасывает устаревшие позиции
+    store.save_quest("q", quest("b"))
+    assert store.load_positions("q") is None
+    store.save_positions("q", positions(2))
+    assert store.load_positions("q") == positions(2)
+
+    assert store.delete_quest("q")
+    assert store.load_quest("q") is None
+    assert not store.delete_quest("q")
+
+
+@pytest.mark.parametrize("failing", ["_write_files", "_commit"])
+def test_interrupted_save_rolls_forward(file_store, tmp_path, monkeypatch, failing):
+    file_store.save_quest("q", quest("old"), positions(1))
+
+    def crash(*args, **kwargs):
+        raise OSError("crash")
+
+    # Сбой после манифеста новой версии: до записи файлов или до фиксации версии
+    monkeypatch.setattr(FileQuestStorage, failing, crash)
+    with pytest.raises(OSError):
+        file_store.save_quest("q", quest("new"), positions(2), expected_version=1)
+    monkeypatch.undo()
+    # Версия фиксируется последним шагом
+    assert file_store.get_version("q") == 1
+
+    reopened = FileQuestStorage(tmp_path / "quests", tmp_path / "positions")
+    assert reopened.recover() == 1
+    assert reopened.get_version("q") == 2
+    assert reopened.load_quest("q") == quest("new")
+    assert reopened.load_positions("q") == positions(2)
+    assert reopened.load_scenes("q", ["start"])["start"]["text"] == "new"
+    assert reopened.recover() == 0
+
+
+def test_interrupted_patch_completed_by_next_write(file_store, monkeypatch):
+    file_store.save_quest("q", quest("old"), positions(1))
+
+    def crash(*args, **kwargs):
+        raise OSError("crash")
+
+    monkeypatch.setattr(FileQuestStorage, "_write_files", crash)
+    with pytest.raises(OSError):
+        file_store.patch_quest("q", 1, {"start": quest("new")["scenes"][0]}, {})
+    monkeypatch.undo()
+
+    assert file_store.patch_quest("q", 2, {}, {"start": positions(3)[0]}) == 3
+    assert file_store.load_quest("q")["scenes"] == quest("new")["scenes"]
+    assert file_store.load_positions("q") == positions(3)
+
+
+def test_versions_and_conflicts(store):
+    assert store.get_version("q") is None
+    assert store.save_quest("q", quest("a"), positions(1)) == 1
+    assert store.save_quest("q", quest("b"), positions(1), expected_version=1) == 2
+    with pytest.raises(VersionConflictError) as info:
+        store.save_quest("q", quest("c"), expected_version=1)
+    assert info.value.actual == 2
+
+    scene = dict(quest("x")["scenes"][0], text="patched")
+    assert store.patch_quest("q", 2, {"start": scene, "extra": {"scene_id": "extra", "text": "e",
+                                                                "choices": []}}, {}) == 3
+    assert [s["text"] for s in store.load_quest("q")["scenes"]] == ["patched", "e"]
+    with pytest.raises(VersionConflictError):
+        store.patch_quest("q", 2, {"start": None}, {})
+    with pytest.raises(KeyError):
+        store.patch_quest("missing", 1, {}, {})
+    # Позиции не меняют версию
+    store.save_positions("q", positions(5))
+    assert store.get_version("q") == 3
+
+
+def test_stale_layout_is_not_saved(store):
+    store.save_quest("q", quest("a"), positions(1))
+    # Раскладка построена для версии 1, а квест уже изменили
+    store.save_quest("q", quest("b"), positions(2), expected_version=1)
+    assert not store.save_positions("q", positions(9), expected_version=1)
+    assert store.load_positions("q") == positions(2)
+    assert store.save_positions("q", positions(3), expected_version=2)
+    assert store.load_positions("q") == positions(3)
+
+
+def test_readers_do_not_wait_for_each_other(file_store):
+    file_store.save_quest("q", quest("a"))
+    holding = threading.Event()
+    release = threading.Event()
+
+    def slow_reader():
+        with file_store._locked("q", exclusive=False):
+            holding.set()
+            release.wait(5)
+
+    reader = threading.Thread(target=slow_reader)
+    reader.start()
+    try:
+        holding.wait(5)
+        loaded = []
+        other = threading.Thread(target=lambda: loaded.append(file_store.load_quest("q")))
+        other.start()
+        other.join(2)
+        assert loaded == [quest("a")]
+
+        # Писатель ждёт, пока читатель не отпустит квест
+        writer = threading.Thread(target=file_store.save_quest, args=("q", quest("b")))
+        writer.start()
+        writer.join(0.3)
+        assert writer.is_alive()
+    finally:
+        release.set()
+        reader.join()
+    writer.join(5)
+    assert file_store.load_quest("q") == quest("b")
+
+
+def test_migrate_to_sqlite(file_store, tmp_path):
+    file_store.save_quest("a", quest("a"), positions(1))
+    file_store.save_quest("b", quest("b"))
+    target = SQLiteQuestStorage(tmp_path / "migrated.db")
+    try:
+        assert migrate(file_store, target) == 2
+        assert migrate(file_store, target) == 0
+        assert target.load_quest("a") == quest("a")
+        assert target.load_positions("a") == positions(1)
+        assert target.load_positions("b") is None
+    finally:
+        target.close()
@@ -0,0 +1,121 @@
+# Журнал телеметрии прохождений и его агрегация
+
+import pytest
+
+import telemetry
+from engine import ABANDONED, FINISHED, RESTARTED, CompiledQuest, SessionManager
+from storage import FileQuestStorage
+from telemetry import QuestTelemetry, TelemetryAggregator, TelemetryRecorder, read_records
+
+QUEST = {"scenes": [
+    {"scene_id": "start", "text": "Развилка", "choices": [
+        {"text": "Налево", "next_scene": "left"},
+        {"text": "Направо", "next_scene": "end"},
+    ]},
+    {"scene_id": "left", "text": "Коридор", "choices": [
+        {"text": "Назад", "next_scene": "start"},
+        {"text": "Вперёд", "next_scene": "end"},
+    ]},
+    {"scene_id": "end", "text": "Финал", "choices": []},
+]}
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = FileQuestStorage(tmp_path / "quests", tmp_path / "positions")
+    storage.save_quest("tq", QUEST)
+    return storage
+
+
+def test_varint_round_trip():
+    out = bytearray()
+    values = [0, 1, 127, 128, 300, 2 ** 32 + 5]
+    for value in values:
+        telemetry.write_varint(value, out)
+    position = 0
+    for value in values:
+        decoded, position = telemetry.read_varint(bytes(out), position)
+        assert decoded == value
+    assert position == len(out)
+
+
+def test_recorder_writes_batched_records(tmp_path):
+    recorder = TelemetryRecorder(tmp_path, batch_bytes=1 << 20, flush_interval=3600)
+    recorder.record_choices("tq", 1, [1], FINISHED, 100.0, 130.0)
+    recorder.record_choices("tq", 1, [0, 300, 1], ABANDONED, 100.0, 101.0)
+    recorder.record_choices("other", None, [], RESTARTED, 100.0, 100.0)
+    assert telemetry.telemetry_files(tmp_path) == []
+    recorder.flush()
+
+    [path] = telemetry.telemetry_files(tmp_path)
+    records = [(key, outcome, duration, tuple(choices)) for key, outcome, _, duration, choices
+               in read_records(path)]
+    assert records == [
+        (("tq", 1), 0, 30, (1,)),
+        (("tq", 1), 1, 1, (0, 300, 1)),
+        (("other", None), 2, 0, ()),
+    ]
+
+
+def test_truncated_tail_is_skipped(tmp_path):
+    recorder = TelemetryRecorder(tmp_path)
+    recorder.record_choices("tq", 1, [1], FINISHED, 0, 1)
+    recorder.record_choices("tq", 1, [0, 1], FINISHED, 0, 1)
+    recorder.flush()
+    [path] = telemetry.telemetry_files(tmp_path)
+    path.write_bytes(path.read_bytes()[:-2])
+    assert len(list(read_records(path))) == 1
+
+
+def test_quest_telemetry_drop_off_and_choices():
+    stats = QuestTelemetry(CompiledQuest(QUEST, "tq", 1), max_nodes=3)
+    stats.add(b"\x01", 0)
+    stats.add(b"\x00\x01", 0)
+    stats.add(b"\x00", 1)
+    stats.add(b"\x00\x00", 1)
+    stats.add(b"\x05", 0)
+    report = stats.report()
+    assert report["sessions"] == 4
+    assert report["outcomes"] == {FINISHED: 2, ABANDONED: 2}
+    assert report["skipped"] == {"invalid": 1}
+    start = report["choices"][0]
+    assert [choice["count"] for choice in start["choices"]] == [3, 1]
+    drop_off = {row["scene_id"]: (row["reached"], row["dropped"]) for row in report["drop_off"]}
+    # Возврат в start не считается повторным достижением сцены
+    assert drop_off == {"left": (3, 1), "start": (4, 1)}
+
+
+def test_sessions_record_each_playthrough_once(tmp_path, storage):
+    recorder = TelemetryRecorder(tmp_path / "telemetry")
+    manager = SessionManager(storage, telemetry=recorder)
+    finished_id, session = manager.create("tq")
+    session.choose(1)
+    manager.restart(finished_id)
+    abandoned_id, session = manager.create("tq")
+    session.choose(0)
+    manager.delete(abandoned_id)
+    manager.create("tq")
+    manager.close()
+
+    aggregator = TelemetryAggregator(storage)
+    for path in telemetry.telemetry_files(tmp_path / "telemetry"):
+        aggregator.add_file(path)
+    report = aggregator.report()
+    # Завершённое, удалённое и два незавершённых при close (включая начатое заново)
+    assert aggregator.records == 4
+    [quest] = report["quests"]
+    assert quest["outcomes"] == {FINISHED: 1, ABANDONED: 3}
+    assert quest["completion_rate"] == pytest.approx(1 / 4)
+
+
+def test_aggregator_skips_other_versions(tmp_path, storage):
+    recorder = TelemetryRecorder(tmp_path / "telemetry")
+    recorder.record_choices("tq", 1, [1], FINISHED, 0, 1)
+    recorder.record_choices("tq", 7, [1], FINISHED, 0, 1)
+    recorder.record_choices("missing", 1, [1], FINISHED, 0, 1)
+    recorder.flush()
+    aggregator = TelemetryAggregator(storage)
+    for path in telemetry.telemetry_files(tmp_path / "telemetry"):
+        aggregator.add_file(path)
+    assert aggregator.skipped == {"other_version": 1, "unknown_quest": 1}
+    assert aggregator.report()["quests"][0]["sessions"] == 1
@@ -0,0 +1,87 @@
+# Терминальный интерфейс: разбор клавиш и точечная перерисовка
+
+import io
+import os
+
+import pytest
+
+import terminal
+from terminal import TerminalRenderer, cooked_mode, parse_key, read_key
+
+
+@pytest.fixture
+def keyboard():
+    """Канал, из которого read_key читает как из терминала."""
+    read_fd, write_fd = os.pipe()
+    terminal._pending.clear()
+    with os.fdopen(read_fd, "rb", buffering=0) as stream:
+        yield stream, write_fd
+    os.close(write_fd)
+    terminal._pending.clear()
+
+
+@pytest.mark.parametrize("data, expected", [
+    (b"\x1b[A", ("up", 3)),
+    (b"\x1bOB", ("down", 3)),
+    (b"\x1b[6~rest", ("page_down", 4)),
+    (b"\r", ("enter", 1)),
+    (b"q\x1b[A", ("q", 1)),
+    ("ж".encode("utf-8"), ("ж", 2)),
+    (b"\x1b[C", ("\x1b", 3)),
+    (b"\x1b[", (None, 0)),
+    ("ж".encode("utf-8")[:1], (None, 0)),
+])
+def test_parse_key(data, expected):
+    assert parse_key(data) == expected
+
+
+def test_several_keys_from_one_read_are_not_lost(keyboard):
+    stream, write_fd = keyboard
+    os.write(write_fd, b"\x1b[B\x1b[Bq")
+    assert [read_key(stream) for _ in range(3)] == ["down", "down", "q"]
+
+
+def test_sequence_split_across_reads(keyboard):
+    stream, write_fd = keyboard
+    os.write(write_fd, b"\x1b[")
+    os.write(write_fd, b"A")
+    assert read_key(stream) == "up"
+
+
+def test_lone_escape_is_returned_after_timeout(keyboard):
+    stream, write_fd = keyboard
+    os.write(write_fd, b"\x1b")
+    assert read_key(stream) == "\x1b"
+
+
+def test_cooked_mode_is_noop_without_terminal():
+    with cooked_mode(io.StringIO()):
+        pass
+
+
+def test_select_rewrites_only_two_choice_lines_and_status():
+    out = io.StringIO()
+    renderer = TerminalRenderer(out, size=os.terminal_size((80, 24)))
+    renderer.render_scene("Текст сцены", ["Налево", "Направо", "Назад"])
+    out.seek(0)
+    out.truncate()
+
+    renderer.select(2)
+    frame = out.getvalue()
+    assert frame.count("\x1b[2K") == 3
+    assert "→ 3. Назад" in frame
+    assert "  1. Налево" in frame
+    assert "Направо" not in frame
+
+
+def test_long_text_scrolls_within_viewport():
+    out = io.StringIO()
+    renderer = TerminalRenderer(out, size=os.terminal_size((40, 12)))
+    renderer.render_scene("\n".join(f"строка {i}" for i in range(30)), ["Дальше"])
+    assert renderer.viewport < 30
+    out.seek(0)
+    out.truncate()
+
+    renderer.page(1)
+    assert renderer.offset == renderer.viewport - 1
+    assert f"строка {renderer.offset}" in out.getvalue()
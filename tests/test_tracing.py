@@ -0,0 +1,116 @@
+# Трассировка запросов: интервалы этапов, профилирование и middleware backend
+
+import contextvars
+import json
+import threading
+
+import pytest
+
+import tracing
+
+
+def test_spans_nest_and_follow_context_into_threads():
+    assert tracing.begin("без трассировки") is None
+    trace = tracing.start_trace("запрос")
+    with tracing.span("validate", scenes=3):
+        tracing.annotate(ok=True)
+        context = contextvars.copy_context()
+        worker = threading.Thread(target=context.run, args=(lambda: tracing.end(tracing.begin("worker")),))
+        worker.start()
+        worker.join()
+    trace.finish()
+    assert tracing.current_trace() is None
+
+    spans = {span.name: span for span in trace.spans}
+    assert spans["validate"].parent_id == trace.root.span_id
+    assert spans["worker"].parent_id == spans["validate"].span_id
+    assert spans["worker"].thread_id != spans["validate"].thread_id
+    assert spans["validate"].attrs == {"scenes": 3, "ok": True}
+
+
+def test_error_is_recorded():
+    trace = tracing.start_trace("запрос")
+    with pytest.raises(KeyError):
+        with tracing.span("storage_write"):
+            raise KeyError("q")
+    trace.finish()
+    assert trace.spans[0].attrs["error"] == "KeyError: 'q'"
+
+
+def test_only_one_stage_is_profiled_at_a_time():
+    started = threading.Barrier(3)
+    release = threading.Event()
+    spans = []
+
+    def stage():
+        trace = tracing.start_trace("запрос", profile=True, profile_stages=("validate",))
+        span = tracing.begin("validate")
+        started.wait()
+        release.wait()
+        tracing.end(span)
+        trace.finish()
+        spans.append(span)
+
+    workers = [threading.Thread(target=stage) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    started.wait()
+    release.set()
+    for worker in workers:
+        worker.join()
+    assert sorted(span.profiler is not None for span in spans) == [False, True]
+    # После окончания профилируемого этапа профилировщик снова доступен
+    assert tracing._profiler_lock.acquire(blocking=False)
+    tracing._profiler_lock.release()
+
+
+def test_foreign_profiler_leaves_stage_unprofiled(monkeypatch):
+    class ActiveProfiler:
+        def enable(self):
+            raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr(tracing.cProfile, "Profile", ActiveProfiler)
+    trace = tracing.start_trace("запрос", profile=True, profile_stages=None)
+    with tracing.span("validate") as span:
+        pass
+    trace.finish()
+    assert span.profiler is None
+    assert not tracing._profiler_lock.locked()
+
+
+def test_profile_and_export(tmp_path):
+    trace = tracing.start_trace("GET /q", profile=True)
+    with tracing.span("json_extract"):
+        sum(range(1000))
+    trace.finish()
+    chrome = json.loads(trace.save(tmp_path).read_text())
+    events = {event["name"]: event for event in chrome["traceEvents"] if event["ph"] == "X"}
+    assert events["json_extract"]["args"]["profile.top"]
+    assert list(tmp_path.glob("*.prof"))
+    otlp = json.loads(trace.save(tmp_path, "otlp").read_text())
+    assert {span["name"] for span in otlp["resourceSpans"][0]["scopeSpans"][0]["spans"]} == {"GET /q", "json_extract"}
+
+
+def test_trace_mode(monkeypatch):
+    monkeypatch.setenv("QUEST_TRACE", "0")
+    assert tracing.trace_mode() is None
+    assert tracing.trace_mode("1") == "trace"
+    assert tracing.trace_mode("profile") == "profile"
+    monkeypatch.setenv("QUEST_TRACE", "1")
+    assert tracing.trace_mode() == "trace"
+    assert tracing.trace_mode("0") is None
+
+
+def test_middleware_traces_requests(client, backend):
+    trace_dir = tracing.trace_dir(backend.PROJECT_ROOT)
+    before = set(trace_dir.glob("*.json")) if trace_dir.exists() else set()
+    response = client.get("/list_quests", headers={"X-Quest-Trace": "1"})
+    assert response.status_code == 200
+    trace_id = response.headers["X-Quest-Trace-Id"]
+    [path] = set(trace_dir.glob("*.json")) - before
+    data = json.loads(path.read_text())
+    assert data["otherData"]["trace_id"] == trace_id
+    root = [event for event in data["traceEvents"] if event["name"] == "GET /list_quests"]
+    assert root[0]["args"]["status"] == 200
+
+    assert "X-Quest-Trace-Id" not in client.get("/list_quests").headers
@@ -0,0 +1,98 @@
+# Двухфазная генерация: скелет квеста, затем тексты сцен параллельными запросами
+
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+generate = pytest.importorskip("generate")
+main = pytest.importorskip("main")
+
+SKELETON = {"scenes": [
+    {"scene_id": "start", "beat": "Завязка", "next": ["gate", "forest"]},
+    {"scene_id": "gate", "beat": "Ворота", "next": ["end"]},
+    {"scene_id": "forest", "beat": "Лес", "next": ["end", "lost"]},
+    {"scene_id": "end", "beat": "Финал", "next": []},
+    {"scene_id": "lost", "beat": "Герой заблудился", "next": []},
+]}
+
+
+class FakeClient:
+    """Клиент модели: отвечает текстом сцены по её замыслу из промпта."""
+
+    def __init__(self, failures=None):
+        self.failures = failures if failures is not None else {}
+        self.lock = threading.Lock()
+
+    def invoke(self, prompt):
+        beat = prompt.split("Эта сцена: ", 1)[1].split("\n", 1)[0]
+        scene = next(scene for scene in SKELETON["scenes"] if scene["beat"] == beat)
+        with self.lock:
+            if self.failures.get(beat, 0) > 0:
+                self.failures[beat] -= 1
+                return SimpleNamespace(content="не JSON", response_metadata={})
+        answer = {"text": f"Текст: {beat}", "choices": [f"Выбор {i}" for i, _ in enumerate(scene["next"])]}
+        return SimpleNamespace(content=json.dumps(answer, ensure_ascii=False), response_metadata={})
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    fake = FakeClient()
+    monkeypatch.setattr(generate, "make_client", lambda credentials, timeout=360: fake)
+    monkeypatch.setattr(main.deadline, "sleep", lambda seconds: None)
+    return fake
+
+
+def test_parse_scene_text_checks_choice_count():
+    scene = SKELETON["scenes"][0]
+    quest_scene = generate.parse_scene_text('Ответ: {"text": " T ", "choices": ["a", {"text": "b"}]}', scene)
+    assert quest_scene == {"scene_id": "start", "text": "T", "choices": [
+        {"text": "a", "next_scene": "gate"}, {"text": "b", "next_scene": "forest"}]}
+    with pytest.raises(ValueError):
+        generate.parse_scene_text('{"text": "T", "choices": ["a"]}', scene)
+
+
+def test_skeleton_quest_rejects_bad_format():
+    assert main.skeleton_quest({"scenes": [{"scene_id": "a", "next": []}]}, 2)[0] is None
+    assert main.skeleton_quest(SKELETON, 20)[0] is None
+    quest, message = main.skeleton_quest(SKELETON, 5)
+    assert message == ""
+    assert quest["scenes"][0]["choices"] == [{"text": "", "next_scene": "gate"}, {"text": "", "next_scene": "forest"}]
+
+
+def test_two_phase_retries_skeleton_and_writes_scenes(llm, monkeypatch):
+    skeletons = iter([{"scenes": []}, SKELETON])
+    monkeypatch.setattr(main, "generate_quest_skeleton", lambda *args, **kwargs: next(skeletons))
+    llm.failures["Лес"] = 1  # Сцена повторяется отдельно, скелет не перегенерируется
+
+    events = []
+    quest, errors = main.generate_quest_two_phase(
+        "q", "prompt", None, scene_count=5, max_workers=2,
+        on_event=lambda event_type, data: events.append((event_type, data))
+    )
+
+    assert errors == ""
+    assert [scene["scene_id"] for scene in quest["scenes"]] == ["start", "gate", "forest", "end", "lost"]
+    assert quest["scenes"][2]["text"] == "Текст: Лес"
+    event_types = [event_type for event_type, _ in events]
+    assert event_types[:5] == ["attempt_started", "validation", "retry", "attempt_started", "validation"]
+    assert event_types[5] == "skeleton_ready"
+    assert event_types.count("scene_parsed") == 5
+    assert event_types[-1] == "validation" and events[-1][1]["success"] is True
+
+
+def test_two_phase_fails_when_scene_text_fails(llm, monkeypatch):
+    monkeypatch.setattr(main, "generate_quest_skeleton", lambda *args, **kwargs: SKELETON)
+    llm.failures["Ворота"] = generate.SCENE_ATTEMPTS
+
+    quest, errors = main.generate_quest_two_phase("q", "prompt", None, scene_count=5)
+
+    assert quest is None
+    assert "gate" in errors
+
+
+def test_backend_rejects_scene_count_out_of_range(backend, client):
+    response = client.post("/generate_quest", json={
+        "quest_name": "big", "user_prompt": "p", "scene_count": backend.MAX_SCENE_COUNT + 1})
+    assert response.status_code == 400
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Трассировка запросов: вложенные интервалы этапов конвейера, профилирование cProfile
+
+import argparse
+import contextvars
+import cProfile
+import os
+import pstats
+import re
+import secrets
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import serialization
+
+# Этапы, которые в режиме profile выполняются под cProfile: работа процессора,
+# а не ожидание LLM, диска или подпроцесса раскладки
+PROFILE_STAGES = ("validate", "json_extract", "storage_write", "search_index")
+FORMATS = ("chrome", "otlp")
+
+# Сколько самых долгих функций cProfile записывается в атрибуты интервала
+PROFILE_TOP = 10
+
+# Текущая трассировка и открытый в ней интервал; копируется в потоки вместе с контекстом
+_current: contextvars.ContextVar = contextvars.ContextVar("quest_trace", default=None)
+
+# Профилировщик один на процесс: с Python 3.12 cProfile использует общий для
+# всех потоков sys.monitoring, и второй включённый профилировщик падает с ValueError
+_profiler_lock = threading.Lock()
+
+
+class Span:
+    """Интервал времени этапа внутри трассировки."""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attrs", "start_ns", "end_ns",
+                 "thread_id", "thread_name", "profiler", "_token")
+
+    def __init__(self, trace: "Trace", parent: Optional["Span"], name: str, attrs: Dict):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.name = name
+        self.attrs = attrs
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+        thread = threading.current_thread()
+        self.thread_id = thread.ident
+        self.thread_name = thread.name
+        self.profiler = None
+        self._token = None
+
+
+class Trace:
+    """
+    Трассировка одного запроса: интервалы всех этапов во всех потоках.
+
+    Интервалы открываются функциями begin/end (или span) и попадают в
+    трассировку, активную в текущем контексте; пул потоков FastAPI
+    копирует контекст, поэтому этапы в рабочих потоках тоже записываются.
+    """
+
+    def __init__(self, name: str, profile: bool = False,
+                 profile_stages=PROFILE_STAGES):
+        self.trace_id = secrets.token_hex(16)
+        self.name = name
+        self.profile = profile
+        self.profile_stages = None if profile_stages is None else set(profile_stages)
+        self.spans: List[Span] = []
+        self.root: Optional[Span] = None
+        self._wall_ns = time.time_ns()
+        self._perf_ns = time.perf_counter_ns()
+        self._token = None
+
+    def _unix_ns(self, perf_ns: int) -> int:
+        return self._wall_ns + perf_ns - self._perf_ns
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """Закрывает корневой интервал и отключает трассировку в текущем контексте."""
+        end(self.root, error)
+        if self._token is not None:
+            try:
+                _current.reset(self._token)
+            except ValueError:
+                # Трассировка завершается в другом контексте (после отправки потокового ответа)
+                pass
+            self._token = None
+
+    def duration(self) -> float:
+        """Длительность корневого интервала в секундах."""
+        root = self.root
+        if root is None or root.end_ns is None:
+            return 0.0
+        return (root.end_ns - root.start_ns) / 1e9
+
+    def _profile_attrs(self, span: Span, prof_path: Optional[Path]) -> Dict:
+        stats = pstats.Stats(span.profiler)
+        if prof_path is not None:
+            stats.dump_stats(str(prof_path))
+        top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP]
+        attrs = {"profile.top": [
+            f"{Path(filename).name}:{line}({function}) {cumulative * 1000:.1f} мс"
+            for (filename, line, function), (_, _, _, cumulative, _) in top
+        ]}
+        if prof_path is not None:
+            attrs["profile.file"] = prof_path.name
+        return attrs
+
+    def to_chrome(self, profile_dir: Optional[Path] = None, prefix: str = "") -> Dict:
+        """
+        Возвращает трассировку в формате Chrome Trace Event (chrome://tracing, Perfetto).
+
+        Args:
+            profile_dir: Куда сохранить профили cProfile (.prof); None - только сводка в атрибутах
+            prefix: Начало имени файлов профилей
+        """
+        pid = os.getpid()
+        events = []
+        threads = {}
+        for span in sorted(self.spans, key=lambda item: item.start_ns):
+            threads[span.thread_id] = span.thread_name
+            args = dict(span.attrs, span_id=span.span_id, parent_id=span.parent_id)
+            if span.profiler is not None:
+                prof_path = None if profile_dir is None else profile_dir / f"{prefix}-{span.span_id}.prof"
+                args.update(self._profile_attrs(span, prof_path))
+            events.append({
+                "name": span.name,
+                "cat": "quest",
+                "ph": "X",
+                "ts": self._unix_ns(span.start_ns) / 1000,
+                "dur": (span.end_ns - span.start_ns) / 1000,
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": args,
+            })
+        events += [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in threads.items()
+        ]
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"trace_id": self.trace_id, "name": self.name},
+        }
+
+    def to_otlp(self, profile_dir: Optional[Path] = None, prefix: str = "") -> Dict:
+        """Возвращает трассировку в формате OTLP JSON (OpenTelemetry, ExportTraceServiceRequest)."""
+        spans = []
+        for span in sorted(self.spans, key=lambda item: item.start_ns):
+            attrs = dict(span.attrs, **{"thread.id": span.thread_id, "thread.name": span.thread_name})
+            if span.profiler is not None:
+                prof_path = None if profile_dir is None else profile_dir / f"{prefix}-{span.span_id}.prof"
+                attrs.update(self._profile_attrs(span, prof_path))
+            error = attrs.pop("error", None)
+            item = {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(self._unix_ns(span.start_ns)),
+                "endTimeUnixNano": str(self._unix_ns(span.end_ns)),
+                "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in attrs.items()],
+                "status": {"code": 2, "message": error} if error else {"code": 1},
+            }
+            if span.parent_id is not None:
+                item["parentSpanId"] = span.parent_id
+            spans.append(item)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": "quest-backend"}},
+                {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+            ]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+        }]}
+
+    def save(self, directory, fmt: str = "chrome") -> Path:
+        """
+        Сохраняет завершённые интервалы трассировки в файл.
+
+        Args:
+            directory: Каталог трассировок
+            fmt: "chrome" или "otlp"
+
+        Returns:
+            Path: Путь к файлу трассировки
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", self.name).strip("_")[:60]
+        prefix = f"{datetime.now():%Y%m%d-%H%M%S}-{slug}-{self.trace_id[:8]}"
+        if fmt == "otlp":
+            data, path = self.to_otlp(directory, prefix), directory / f"{prefix}.otlp.json"
+        else:
+            data, path = self.to_chrome(directory, prefix), directory / f"{prefix}.json"
+        path.write_bytes(serialization.dumps_bytes(data))
+        return path
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(item) for item in value]}}
+    return {"stringValue": "" if value is None else str(value)}
+
+
+def _from_otlp_value(value: Dict):
+    if "arrayValue" in value:
+        return [_from_otlp_value(item) for item in value["arrayValue"].get("values", [])]
+    return next(iter(value.values()), None)
+
+
+def begin(name: str, attrs: Optional[Dict] = None) -> Optional[Span]:
+    """
+    Открывает интервал в текущей трассировке.
+
+    Без активной трассировки ничего не делает и возвращает None, поэтому
+    вызов можно оставлять в коде постоянно.
+
+    Args:
+        name: Название этапа
+        attrs: Атрибуты интервала
+
+    Returns:
+        Optional[Span]: Интервал для передачи в end
+    """
+    state = _current.get()
+    if state is None:
+        return None
+    trace, parent = state
+    span = Span(trace, parent, name, dict(attrs) if attrs else {})
+    span._token = _current.set((trace, span))
+    if (trace.profile and (trace.profile_stages is None or name in trace.profile_stages)
+            and _profiler_lock.acquire(blocking=False)):
+        # Этап, начатый пока профилируется другой, выполняется без профилировщика
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Профилировщик уже включён не через tracing (например, python -m cProfile)
+            _profiler_lock.release()
+        else:
+            span.profiler = profiler
+    return span
+
+
+def end(span: Optional[Span], error: Optional[BaseException] = None) -> None:
+    """Закрывает интервал, открытый begin (None пропускается)."""
+    if span is None:
+        return
+    span.end_ns = time.perf_counter_ns()
+    if span.profiler is not None:
+        span.profiler.disable()
+        _profiler_lock.release()
+    if error is not None:
+        span.attrs["error"] = f"{type(error).__name__}: {error}"
+    try:
+        _current.reset(span._token)
+    except ValueError:
+        # Интервал закрывается в другом контексте: просто не восстанавливаем родителя
+        pass
+    span.trace.spans.append(span)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Optional[Span]]:
+    """Интервал для блока кода или функции (можно использовать как декоратор)."""
+    current = begin(name, attrs)
+    try:
+        yield current
+    except BaseException as e:
+        end(current, e)
+        raise
+    end(current)
+
+
+def annotate(**attrs) -> None:
+    """Добавляет атрибуты к текущему открытому интервалу."""
+    state = _current.get()
+    if state is not None and state[1] is not None:
+        state[1].attrs.update(attrs)
+
+
+def start_trace(name: str, profile: bool = False, profile_stages=PROFILE_STAGES, **attrs) -> Trace:
+    """
+    Начинает трассировку в текущем контексте и открывает корневой интервал.
+
+    Args:
+        name: Название трассировки (например, метод и путь запроса)
+        profile: Выполнять этапы profile_stages под cProfile
+        profile_stages: Профилируемые этапы (None - все)
+        **attrs: Атрибуты корневого интервала
+
+    Returns:
+        Trace: Трассировка; завершается вызовом finish()
+    """
+    trace = Trace(name, profile, profile_stages)
+    trace._token = _current.set((trace, None))
+    trace.root = begin(name, attrs)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    """Трассировка, активная в текущем контексте."""
+    state = _current.get()
+    return state[0] if state else None
+
+
+def trace_mode(value: Optional[str] = None) -> Optional[str]:
+    """
+    Определяет режим трассировки по значению заголовка или QUEST_TRACE.
+
+    Значения: "1"/"trace" - интервалы этапов, "profile" - ещё и cProfile,
+    "0" или пусто - выключено. Заголовок запроса имеет приоритет над
+    переменной окружения.
+
+    Returns:
+        Optional[str]: None, "trace" или "profile"
+    """
+    if value is None:
+        value = os.getenv("QUEST_TRACE", "0")
+    value = value.strip().lower()
+    if value in ("", "0", "off", "false", "no"):
+        return None
+    return "profile" if value == "profile" else "trace"
+
+
+def profile_stages():
+    """Профилируемые этапы из QUEST_TRACE_PROFILE (через запятую, "all" - все)."""
+    value = os.getenv("QUEST_TRACE_PROFILE", "")
+    if not value:
+        return PROFILE_STAGES
+    if value.strip().lower() == "all":
+        return None
+    return tuple(stage.strip() for stage in value.split(",") if stage.strip())
+
+
+def trace_dir(project_root=None) -> Path:
+    """Каталог трассировок: QUEST_TRACE_DIR или traces/ в корне проекта."""
+    root = Path(project_root) if project_root else Path(__file__).parent
+    return Path(os.getenv("QUEST_TRACE_DIR", str(root / "traces")))
+
+
+def trace_format() -> str:
+    """Формат файлов трассировки из QUEST_TRACE_FORMAT: chrome (по умолчанию) или otlp."""
+    fmt = os.getenv("QUEST_TRACE_FORMAT", "chrome").lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат трассировки: {fmt}")
+    return fmt
+
+
+@contextmanager
+def trace(name: str, mode: Optional[str], directory, fmt: str = "chrome", **attrs) -> Iterator[Optional[Trace]]:
+    """
+    Трассирует блок кода и сохраняет результат (для скриптов, не для backend).
+
+    Args:
+        name: Название трассировки
+        mode: Режим из trace_mode(); None - без трассировки
+        directory: Каталог трассировок
+        fmt: Формат файла
+    """
+    if mode is None:
+        yield None
+        return
+    current = start_trace(name, profile=mode == "profile", profile_stages=profile_stages(), **attrs)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        current.finish(error)
+        path = current.save(directory, fmt)
+        print(f"Трассировка {name}: {current.duration():.2f} с -> {path}")
+
+
+def load_spans(path) -> List[Dict]:
+    """
+    Читает трассировку в формате chrome или otlp.
+
+    Returns:
+        List[Dict]: Интервалы {"span_id", "parent_id", "name", "start", "duration", "attrs"}
+        (время в секундах)
+    """
+    with open(path, "rb") as f:
+        data = serialization.loads(f.read())
+    spans = []
+    if "traceEvents" in data:
+        for event in data["traceEvents"]:
+            if event.get("ph") != "X":
+                continue
+            attrs = dict(event.get("args", {}))
+            spans.append({
+                "span_id": attrs.pop("span_id", None),
+                "parent_id": attrs.pop("parent_id", None),
+                "name": event["name"],
+                "start": event["ts"] / 1e6,
+                "duration": event["dur"] / 1e6,
+                "attrs": attrs,
+            })
+        return spans
+    for resource in data.get("resourceSpans", []):
+        for scope in resource.get("scopeSpans", []):
+            for item in scope.get("spans", []):
+                start = int(item["startTimeUnixNano"])
+                spans.append({
+                    "span_id": item["spanId"],
+                    "parent_id": item.get("parentSpanId"),
+                    "name": item["name"],
+                    "start": start / 1e9,
+                    "duration": (int(item["endTimeUnixNano"]) - start) / 1e9,
+                    "attrs": {attr["key"]: _from_otlp_value(attr["value"])
+                              for attr in item.get("attributes", [])},
+                })
+    return spans
+
+
+def print_tree(spans: List[Dict], min_ms: float = 0.0) -> None:
+    """Печатает дерево интервалов: длительность, доля от корня и собственное время."""
+    children: Dict[Optional[str], List[Dict]] = {}
+    ids = {item["span_id"] for item in spans}
+    for item in sorted(spans, key=lambda item: item["start"]):
+        parent = item["parent_id"] if item["parent_id"] in ids else None
+        children.setdefault(parent, []).append(item)
+
+    def walk(item: Dict, depth: int, total: float) -> None:
+        own = children.get(item["span_id"], [])
+        self_time = item["duration"] - sum(child["duration"] for child in own)
+        share = item["duration"] / total if total else 1.0
+        print(f"{'  ' * depth}{item['name']:<{40 - 2 * depth}} {item['duration'] * 1000:10.1f} мс "
+              f"{share:7.1%}  собственное {max(self_time, 0) * 1000:9.1f} мс")
+        top = item["attrs"].get("profile.top")
+        for line in top if isinstance(top, list) else []:
+            print(f"{'  ' * (depth + 2)}{line}")
+        for child in own:
+            if child["duration"] * 1000 >= min_ms:
+                walk(child, depth + 1, total)
+
+    for root in children.get(None, []):
+        walk(root, 0, root["duration"])
+
+
+def main():
+    """Главная функция программы."""
+    parser = argparse.ArgumentParser(description='Просмотр трассировок запросов')
+    parser.add_argument('paths', nargs='*', help='Файлы трассировок (по умолчанию последняя в QUEST_TRACE_DIR)')
+    parser.add_argument('--min-ms', type=float, default=0.0, help='Скрывать интервалы короче')
+    args = parser.parse_args()
+
+    paths = args.paths
+    if not paths:
+        files = sorted(trace_dir().glob("*.json"), key=lambda path: path.stat().st_mtime)
+        if not files:
+            print(f"Трассировок нет в {trace_dir()}")
+            sys.exit(1)
+        paths = [str(files[-1])]
+    for path in paths:
+        print(f"\n{path}")
+        print_tree(load_spans(path), args.min_ms)
+
+
+if __name__ == "__main__":
+    main()
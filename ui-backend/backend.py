@@ -1,11 +1,22 @@
+import asyncio
+import contextvars
 import json
 import os
 import sys
 import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
 from pydantic import BaseModel
+from typing import List, Optional
 from dotenv import load_dotenv
 
 # Добавляем корневую папку в sys.path для импорта модулей
@@ -19,19 +30,112 @@ spec = importlib.util.spec_from_file_location("main_module", Path(__file__).pare
 main_module = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(main_module)
 generate_quest_with_validation = main_module.generate_quest_with_validation
+generate_quest_two_phase = main_module.generate_quest_two_phase
+emit = main_module.emit
 
-app = FastAPI(title="Game Quest Backend", version="1.0.0")
+import serialization
+from generate import preload as preload_llm_client
+from storage import get_storage, export_quest, VersionConflictError, check_quest_name
+from quest_patch import QuestPatch, PatchError
+from library import FORMATS, MEDIA_TYPES, LibraryImporter, iter_export, select_quests
+from search import get_search_index
+from prompt_cache import cache_mode, get_prompt_cache
+from checkpoint import get_checkpoint_store
+from engine import GameError, GameSession, SessionManager
+from telemetry import get_telemetry
+from compression import CompressionMiddleware
+from admission import Rejected, Ticket, get_admission_controller
+import deadline
+import metrics
+import tracing
+from singleflight import SingleFlight, request_key
+
+
+class DefaultResponse(JSONResponse):
+    """JSON ответ, сериализуемый через serialization (orjson, если установлен)."""
+
+    def render(self, content) -> bytes:
+        return serialization.dumps_bytes(content)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Загружает тяжёлые зависимости LLM в фоне, не задерживая старт сервера"""
+    if os.getenv("QUEST_PRELOAD", "1") == "1":
+        threading.Thread(target=preload_heavy_modules, name="preload", daemon=True).start()
+    threading.Thread(target=build_search_index_if_empty, name="search-index", daemon=True).start()
+    yield
+    # Незавершённые прохождения попадают в телеметрию при остановке сервера
+    sessions.close()
+
+def preload_heavy_modules():
+    """Импортирует клиент LLM заранее, чтобы первая генерация не ждала загрузки"""
+    start = time.perf_counter()
+    try:
+        preload_llm_client()
+        print(f"Зависимости LLM загружены за {time.perf_counter() - start:.1f} с")
+    except Exception as e:
+        print(f"Не удалось заранее загрузить зависимости LLM: {e}")
+
+def build_search_index_if_empty():
+    """Строит поисковый индекс при первом запуске, если в хранилище уже есть квесты"""
+    try:
+        if search_index.is_empty() and storage.list_quests():
+            print(f"Поисковый индекс построен, квестов: {search_index.rebuild(storage)}")
+    except Exception as e:
+        print(f"Не удалось построить поисковый индекс: {e}")
+
+app = FastAPI(
+    title="Game Quest Backend",
+    version="1.0.0",
+    default_response_class=DefaultResponse,
+    lifespan=lifespan
+)
 
 # Модель для запроса генерации квеста
 class GenerateQuestRequest(BaseModel):
     quest_name: str
     user_prompt: str
+    # Что делать с похожим промптом: generate, offer или reuse (см. prompt_cache.py)
+    similar: Optional[str] = None
+    # Количество сцен: квест генерируется в две фазы, скелет и тексты сцен (см. main.py)
+    scene_count: Optional[int] = None
+    # Срок генерации в секундах, включая повторные попытки (см. deadline.py)
+    deadline_seconds: Optional[float] = None
 
 # Модель для обновления квеста
 class UpdateQuestRequest(BaseModel):
     quest_name: str
     quest_data: dict
     node_positions: list
+    base_version: Optional[int] = None
+
+# Модель для точечного изменения квеста (см. QuestPatch в quest_patch.py)
+class PatchQuestRequest(BaseModel):
+    base_version: int
+    operations: List[dict]
+
+# Модель восстановления версии квеста (см. history.py)
+class RestoreVersionRequest(BaseModel):
+    base_version: Optional[int] = None
+
+# Модели игровых сессий (см. engine.py)
+class CreateSessionRequest(BaseModel):
+    quest_name: str
+
+class ChooseRequest(BaseModel):
+    choice: int
+
+class RestoreSessionRequest(BaseModel):
+    state: dict
+
+# Модель симуляции прохождений (см. simulate.py)
+class SimulateQuestRequest(BaseModel):
+    policy: str = "uniform"
+    runs: int = 100_000
+    seed: Optional[int] = None
+    max_steps: int = 1000
+    weights: Optional[dict] = None
 
 # Настройка CORS для работы с фронтендом
 app.add_middleware(
@@ -40,38 +144,191 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Quest-Trace-Id"],
 )
 
+# Счётчики и время обработки запросов по шаблонам путей (см. metrics.py)
+app.add_middleware(metrics.HTTPMetricsMiddleware)
+
+# Сжатие ответов (brotli/gzip) начиная с COMPRESSION_MIN_SIZE байт
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")),
+)
+
+def save_trace(trace: tracing.Trace):
+    """Сохраняет трассировку запроса; ошибка записи не влияет на ответ"""
+    try:
+        path = trace.save(tracing.trace_dir(PROJECT_ROOT), tracing.trace_format())
+        print(f"Трассировка {trace.name}: {trace.duration():.2f} с -> {path}")
+    except (OSError, ValueError) as e:
+        print(f"Ошибка при сохранении трассировки: {e}")
+
+class TraceMiddleware:
+    """
+    ASGI middleware: трассирует запрос, если включено QUEST_TRACE или передан
+    заголовок X-Quest-Trace: 1 (profile - ещё и cProfile для этапов обработки).
+
+    Трассировка закрывается после отправки тела ответа (в том числе потока SSE)
+    и сохраняется в QUEST_TRACE_DIR в пуле потоков, не занимая цикл событий;
+    её id возвращается в X-Quest-Trace-Id. Сообщения ответа передаются без
+    изменений, кроме этого заголовка (как в metrics.HTTPMetricsMiddleware).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        mode = tracing.trace_mode(Headers(scope=scope).get("x-quest-trace"))
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        trace = tracing.start_trace(
+            f"{scope['method']} {scope['path']}",
+            profile=mode == "profile",
+            profile_stages=tracing.profile_stages(),
+            method=scope["method"],
+            path=scope["path"]
+        )
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                trace.root.attrs["status"] = message["status"]
+                MutableHeaders(scope=message).append("X-Quest-Trace-Id", trace.trace_id)
+            await send(message)
+
+        error = None
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            trace.finish(error)
+            await run_in_threadpool(save_trace, trace)
+
+app.add_middleware(TraceMiddleware)
+
 # Путь к корневой директории проекта
 PROJECT_ROOT = Path(__file__).parent.parent
-GENERATED_QUESTS_DIR = PROJECT_ROOT / "generated_quests"
-NODE_POSITIONS_DIR = PROJECT_ROOT / "node_positions"
 GET_NODE_POSITIONS_SCRIPT = PROJECT_ROOT / "get_node_positions.py"
 
+# Сколько сцен можно запросить одним запросом /get_scenes
+MAX_SCENES_PER_REQUEST = 500
+
+# Максимум прохождений в одном запросе /simulate_quest
+MAX_SIMULATION_RUNS = 10_000_000
+
+# Размер квеста при двухфазной генерации и число одновременных запросов текстов сцен
+MIN_SCENE_COUNT = 5
+MAX_SCENE_COUNT = 200
+SCENE_CONCURRENCY = int(os.getenv("QUEST_SCENE_CONCURRENCY", "8"))
+
+# Срок генерации по умолчанию (секунды); без переменной срок не ограничен
+DEFAULT_GENERATION_DEADLINE = os.getenv("QUEST_GENERATION_DEADLINE")
+
+# Клиент для лимитов очереди генераций - адрес подключения. Заголовку с адресом
+# клиента (QUEST_CLIENT_ID_HEADER) доверяем, только если подключение пришло от
+# прокси из QUEST_TRUSTED_PROXIES (адреса через запятую): иначе клиент может
+# подменять его и обходить лимиты
+CLIENT_ID_HEADER = os.getenv("QUEST_CLIENT_ID_HEADER", "X-Forwarded-For")
+TRUSTED_PROXIES = {address.strip() for address in os.getenv("QUEST_TRUSTED_PROXIES", "").split(",")
+                   if address.strip()}
+
+# Хранилище квестов: JSON файлы или SQLite (см. QUEST_STORAGE в storage.py)
+storage = get_storage(PROJECT_ROOT)
+
+# Полнотекстовый индекс сцен (см. search.py), обновляется при каждом сохранении квеста
+search_index = get_search_index(PROJECT_ROOT)
+
+# Кэш похожих промптов (см. prompt_cache.py); None, если не включён QUEST_PROMPT_CACHE
+prompt_cache = get_prompt_cache(PROJECT_ROOT)
+
+# Контрольные точки генерации (см. checkpoint.py): повтор запроса после ошибки
+# или перезапуска продолжает генерацию с уже полученных результатов
+checkpoints = get_checkpoint_store(PROJECT_ROOT)
+
+# Игровые сессии: квест загружается один раз и разделяется всеми игроками;
+# завершённые прохождения записываются в журнал телеметрии (см. telemetry.py)
+sessions = SessionManager(
+    storage,
+    max_sessions=int(os.getenv("GAME_MAX_SESSIONS", "100000")),
+    ttl=float(os.getenv("GAME_SESSION_TTL", "3600")),
+    telemetry=get_telemetry(PROJECT_ROOT)
+)
+
+def update_search_index(method, *args):
+    """Обновляет поисковый индекс; ошибка индекса не отменяет сохранение квеста"""
+    try:
+        method(*args)
+    except Exception as e:
+        print(f"Ошибка при обновлении поискового индекса: {e}")
+
+def version_conflict(e: VersionConflictError) -> HTTPException:
+    """Ответ 409 с текущей версией, чтобы клиент мог перечитать квест"""
+    return HTTPException(
+        status_code=409,
+        detail={"message": str(e), "current_version": e.actual}
+    )
+
+# Одновременные одинаковые генерации и раскладки выполняются один раз
+generation_flight = SingleFlight("generate_quest")
+layout_flight = SingleFlight("layout")
+
+# Очередь генераций: одновременные генерации и запросы одного клиента ограничены
+# (QUEST_MAX_GENERATIONS, QUEST_GENERATION_QUEUE, QUEST_GENERATIONS_PER_CLIENT)
+admission = get_admission_controller()
+# Фоновые задачи исполнителей генераций (ссылки, чтобы задачи не собрал GC)
+generation_tasks = set()
+
 def ensure_node_positions_exist(quest_name: str) -> bool:
-    """Проверяет существование файла позиций узлов и создаёт его при необходимости"""
-    positions_file = NODE_POSITIONS_DIR / f"{quest_name}.json"
+    """
+    Проверяет наличие позиций узлов и создаёт их при необходимости.
+    Одновременные запросы одной версии квеста ждут одну раскладку.
+    """
+    if storage.load_positions(quest_name) is not None:
+        return True
     
-    if positions_file.exists():
+    version = storage.get_version(quest_name)
+    success, _ = layout_flight.do(
+        f"{quest_name}:{version}",
+        lambda broadcast: build_node_positions(quest_name)
+    )
+    return success
+
+def build_node_positions(quest_name: str) -> bool:
+    """Строит позиции узлов в отдельном процессе и сохраняет их"""
+    if storage.load_positions(quest_name) is not None:
         return True
     
-    # Создаём директорию для позиций если её нет
-    NODE_POSITIONS_DIR.mkdir(exist_ok=True)
+    # Версию читаем до квеста: позиции не запишутся поверх более новой версии
+    version = storage.get_version(quest_name)
+    quest_data = storage.load_quest(quest_name)
+    if quest_data is None:
+        return False
     
     try:
-        # Запускаем скрипт генерации позиций
-        result = subprocess.run([
-            sys.executable, 
-            str(GET_NODE_POSITIONS_SCRIPT), 
-            f"{quest_name}.json"
-        ], 
-        cwd=PROJECT_ROOT,
-        capture_output=True, 
-        text=True
-        )
+        # Запускаем скрипт генерации позиций, передавая квест через stdin
+        with metrics.STAGE_SECONDS.time(stage="layout"):
+            result = subprocess.run(
+                [sys.executable, str(GET_NODE_POSITIONS_SCRIPT), "--stdin"],
+                cwd=PROJECT_ROOT,
+                input=json.dumps(quest_data, ensure_ascii=False),
+                capture_output=True, 
+                text=True
+            )
         
         if result.returncode == 0:
-            print(f"Успешно создан файл позиций для {quest_name}")
+            if not storage.save_positions(quest_name, json.loads(result.stdout), expected_version=version):
+                # Квест изменили во время раскладки: строим позиции для новой версии
+                print(f"Квест {quest_name} изменён во время построения позиций, повторяем")
+                return ensure_node_positions_exist(quest_name)
+            print(f"Успешно созданы позиции для {quest_name}")
             return True
         else:
             print(f"Ошибка при создании позиций: {result.stderr}")
@@ -86,43 +343,44 @@ async def root():
     """Проверка работоспособности API"""
     return {"message": "Game Quest Backend is running"}
 
+@app.get("/metrics")
+async def get_metrics():
+    """Метрики процесса в формате Prometheus"""
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/get_quest_data/{quest_name}")
 async def get_quest_data(quest_name: str):
     """
     Получает данные квеста и позиции узлов.
     Если позиции не существуют, создаёт их автоматически.
+    Хранилище и построение позиций работают в пуле потоков, не блокируя цикл событий.
     """
-    # Проверяем существование файла квеста
-    quest_file = GENERATED_QUESTS_DIR / f"{quest_name}.json"
-    
-    if not quest_file.exists():
-        raise HTTPException(
-            status_code=404, 
-            detail=f"Quest file '{quest_name}.json' not found in generated_quests directory"
-        )
-    
-    # Загружаем данные квеста
+    # Загружаем данные квеста (версию читаем первой: при гонке клиент получит 409 при записи)
     try:
-        with open(quest_file, 'r', encoding='utf-8') as f:
-            quest_data = json.load(f)
+        version = await run_in_threadpool(storage.get_version, quest_name)
+        quest_data = await run_in_threadpool(storage.load_quest, quest_name)
     except Exception as e:
         raise HTTPException(
             status_code=500, 
             detail=f"Error reading quest file: {str(e)}"
         )
     
+    if quest_data is None:
+        raise HTTPException(
+            status_code=404, 
+            detail=f"Quest '{quest_name}' not found"
+        )
+    
     # Проверяем/создаём позиции узлов
-    if not ensure_node_positions_exist(quest_name):
+    if not await run_in_threadpool(ensure_node_positions_exist, quest_name):
         raise HTTPException(
             status_code=500, 
             detail=f"Failed to generate node positions for quest '{quest_name}'"
         )
     
     # Загружаем позиции узлов
-    positions_file = NODE_POSITIONS_DIR / f"{quest_name}.json"
     try:
-        with open(positions_file, 'r', encoding='utf-8') as f:
-            node_positions = json.load(f)
+        node_positions = await run_in_threadpool(storage.load_positions, quest_name)
     except Exception as e:
         raise HTTPException(
             status_code=500, 
@@ -131,124 +389,613 @@ async def get_quest_data(quest_name: str):
     
     return {
         "quest_name": quest_name,
+        "version": version,
         "quest_data": quest_data,
         "node_positions": node_positions
     }
 
+@app.get("/get_quest_skeleton/{quest_name}")
+async def get_quest_skeleton(quest_name: str):
+    """
+    Получает только структуру графа квеста (id сцен и переходы) и позиции узлов,
+    без текстов сцен и выборов. Тексты загружаются через /get_scenes.
+    """
+    version = await run_in_threadpool(storage.get_version, quest_name)
+    skeleton = await run_in_threadpool(storage.load_skeleton, quest_name)
+    if skeleton is None:
+        raise HTTPException(status_code=404, detail=f"Quest '{quest_name}' not found")
+
+    if not await run_in_threadpool(ensure_node_positions_exist, quest_name):
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to generate node positions for quest '{quest_name}'"
+        )
+
+    return {
+        "quest_name": quest_name,
+        "version": version,
+        "scenes": skeleton["scenes"],
+        "node_positions": await run_in_threadpool(storage.load_positions, quest_name)
+    }
+
+@app.get("/get_scenes/{quest_name}")
+async def get_scenes(quest_name: str, ids: str):
+    """
+    Получает полные данные сцен квеста по списку id через запятую.
+    Ненайденные id возвращаются в поле missing.
+    """
+    scene_ids = [scene_id for scene_id in ids.split(",") if scene_id]
+    if len(scene_ids) > MAX_SCENES_PER_REQUEST:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many scenes requested, maximum is {MAX_SCENES_PER_REQUEST}"
+        )
+
+    version = await run_in_threadpool(storage.get_version, quest_name)
+    scenes = await run_in_threadpool(storage.load_scenes, quest_name, scene_ids)
+    if scenes is None:
+        raise HTTPException(status_code=404, detail=f"Quest '{quest_name}' not found")
+
+    return {
+        "quest_name": quest_name,
+        "version": version,
+        "scenes": [scenes[scene_id] for scene_id in dict.fromkeys(scene_ids) if scene_id in scenes],
+        "missing": [scene_id for scene_id in dict.fromkeys(scene_ids) if scene_id not in scenes]
+    }
+
+@app.get("/export_quest/{quest_name}")
+async def export_quest_file(quest_name: str, pretty: bool = False):
+    """
+    Отдаёт квест JSON файлом для скачивания.
+    С параметром pretty=true JSON форматируется отступами.
+    """
+    data = export_quest(storage, quest_name, pretty=pretty)
+    if data is None:
+        raise HTTPException(status_code=404, detail=f"Quest '{quest_name}' not found")
+    
+    return Response(
+        content=data,
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{quest_name}.json"'}
+    )
+
+@app.get("/export_library")
+async def export_library(format: str = "ndjson", prefix: Optional[str] = None):
+    """
+    Выгружает библиотеку квестов (или квесты с префиксом prefix) потоком:
+    NDJSON или tar/tar.gz архив. Квесты читаются из хранилища по одному.
+    """
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format '{format}', expected one of {FORMATS}")
+    
+    quest_names = await run_in_threadpool(select_quests, storage, prefix)
+    return StreamingResponse(
+        iter_export(storage, quest_names, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="quests.{format}"'}
+    )
+
+@app.post("/import_library")
+async def import_library(request: Request, format: str = "ndjson", overwrite: bool = False):
+    """
+    Загружает квесты из NDJSON или tar/tar.gz архива в теле запроса.
+    Каждый квест проверяется GameValidator; существующие квесты
+    пропускаются, если не указан overwrite=true.
+    """
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format '{format}', expected one of {FORMATS}")
+    
+    importer = LibraryImporter(
+        storage,
+        overwrite=overwrite,
+        on_import=lambda name, data: update_search_index(search_index.index_quest, name, data)
+    )
+    
+    if format == "ndjson":
+        # Импортируем по мере получения строк, храня в памяти только незавершённую
+        # строку; перевод строки ищется только в новом фрагменте, поэтому длинная
+        # запись, пришедшая многими фрагментами, не копируется заново на каждом
+        pending = bytearray()
+        async for chunk in request.stream():
+            end = chunk.rfind(b"\n")
+            if end < 0:
+                pending += chunk
+                continue
+            pending += chunk[:end]
+            lines = pending.split(b"\n")
+            pending = bytearray(chunk[end + 1:])
+            await run_in_threadpool(importer.import_ndjson, lines)
+        if pending:
+            await run_in_threadpool(importer.import_ndjson, [bytes(pending)])
+    else:
+        # tarfile читает синхронно, поэтому архив буферизуется (большой - на диске)
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as spool:
+            async for chunk in request.stream():
+                spool.write(chunk)
+            spool.seek(0)
+            try:
+                await run_in_threadpool(importer.import_tar, spool)
+            except tarfile.TarError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid archive: {e}")
+    
+    return importer.report()
+
+@app.get("/search")
+async def search_quests(q: str, limit: int = 20, offset: int = 0, prefix: Optional[str] = None):
+    """
+    Полнотекстовый поиск по текстам сцен и выборов всех квестов.
+    Слова запроса ищутся в любой форме; результаты упорядочены по
+    релевантности и содержат фрагмент текста с позициями совпадений.
+    """
+    if not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+    
+    results = await run_in_threadpool(search_index.search, q, limit, max(offset, 0), prefix)
+    return {"query": q, "results": results}
+
+def find_similar_prompts(prompt: str, limit: int, threshold: Optional[float]) -> List[dict]:
+    """Похожие промпты, квесты которых есть в хранилище (выполняется в пуле потоков)"""
+    return [match for match in prompt_cache.find_similar(prompt, limit, threshold)
+            if storage.quest_exists(match["quest_name"])]
+
+@app.get("/similar_prompts")
+async def similar_prompts(prompt: str, limit: int = 5, threshold: Optional[float] = None):
+    """
+    Квесты, сгенерированные по похожим промптам (кэш промптов, см. prompt_cache.py).
+    Позволяет предложить готовый квест до запуска генерации.
+    """
+    if prompt_cache is None:
+        raise HTTPException(status_code=400, detail="Prompt cache is disabled (QUEST_PROMPT_CACHE)")
+    if not 1 <= limit <= 20:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 20")
+    
+    matches = await run_in_threadpool(find_similar_prompts, prompt, limit, threshold)
+    return {
+        "prompt": prompt,
+        "results": [{key: match[key] for key in ("quest_name", "version", "prompt", "similarity")}
+                    for match in matches]
+    }
+
 @app.get("/list_quests")
 async def list_quests():
     """Возвращает список доступных квестов"""
     try:
-        quest_files = list(GENERATED_QUESTS_DIR.glob("*.json"))
-        quest_names = [f.stem for f in quest_files]
-        return {"quests": quest_names}
+        return {"quests": await run_in_threadpool(storage.list_quests)}
     except Exception as e:
         raise HTTPException(
             status_code=500, 
             detail=f"Error listing quests: {str(e)}"
         )
 
-@app.post("/generate_quest")
-async def generate_quest(request: GenerateQuestRequest):
+@tracing.span("generate_and_save_quest")
+def generate_and_save_quest(quest_name: str, user_prompt: str, on_event=None,
+                            scene_count: Optional[int] = None) -> dict:
     """
-    Генерирует новый квест на основе пользовательского промпта.
-    Сохраняет его в generated_quests и возвращает название файла.
+    Генерирует квест, валидирует и сохраняет его в хранилище.
+    Если задан scene_count, квест генерируется в две фазы: скелет, затем тексты сцен.
+    Повтор того же запроса продолжает незавершённый запуск с контрольной точки.
+    Блокирующая функция: вызывается из пула потоков.
     """
-    try:
-        # Читаем системный промпт
-        system_prompt_path = PROJECT_ROOT / "system_prompt.txt"
-        if not system_prompt_path.exists():
-            raise HTTPException(
-                status_code=500,
-                detail="System prompt file not found"
-            )
-        
-        with open(system_prompt_path, "r", encoding="utf-8") as f:
-            system_prompt = f.read()
-        
-        # Учетные данные для GigaChat (из main.py)
-        credentials = os.getenv("GIGACHAT_CREDENTIALS")
-        
-        # Создаём директорию для квестов если её нет
-        GENERATED_QUESTS_DIR.mkdir(exist_ok=True)
-        
-        print(f"Начинаем генерацию квеста: {request.quest_name}")
-        
-        # Генерируем квест с валидацией
+    # Читаем системный промпт
+    system_prompt_path = PROJECT_ROOT / "system_prompt.txt"
+    if not system_prompt_path.exists():
+        raise HTTPException(
+            status_code=500,
+            detail="System prompt file not found"
+        )
+    
+    with open(system_prompt_path, "r", encoding="utf-8") as f:
+        system_prompt = f.read()
+    
+    # Учетные данные для GigaChat (из main.py)
+    credentials = os.getenv("GIGACHAT_CREDENTIALS")
+    
+    print(f"Начинаем генерацию квеста: {quest_name}")
+    run = checkpoints.open(quest_name, user_prompt, scene_count) if checkpoints is not None else None
+    
+    # Генерируем квест с валидацией
+    if scene_count is not None:
+        quest_data, errors = generate_quest_two_phase(
+            quest_name=quest_name,
+            user_prompt=user_prompt,
+            credentials=credentials,
+            scene_count=scene_count,
+            max_retries=3,
+            max_workers=SCENE_CONCURRENCY,
+            on_event=on_event,
+            checkpoint=run
+        )
+    else:
         quest_data, errors = generate_quest_with_validation(
-            quest_name=request.quest_name,
-            user_prompt=request.user_prompt,
+            quest_name=quest_name,
+            user_prompt=user_prompt,
             system_prompt=system_prompt,
             credentials=credentials,
-            max_retries=3
+            max_retries=3,
+            on_event=on_event,
+            checkpoint=run
         )
+    
+    if errors and errors != "":
+        raise HTTPException(
+            status_code=400,
+            detail=f"Quest generation failed: {errors}"
+        )
+    
+    if quest_data is None:
+        raise HTTPException(
+            status_code=500,
+            detail="Quest generation failed: No data returned"
+        )
+    
+    # Сохраняем квест; устаревшие позиции узлов сбрасываются
+    version = storage.save_quest(quest_name, quest_data)
+    update_search_index(search_index.index_quest, quest_name, quest_data)
+    if prompt_cache is not None:
+        try:
+            prompt_cache.add(user_prompt, quest_name, version)
+        except Exception as e:
+            print(f"Ошибка при обновлении кэша промптов: {e}")
+    if run is not None:
+        run.finish()
+    emit(on_event, "saved", quest_name=quest_name, version=version)
+    
+    print(f"Квест {quest_name} успешно сохранён")
+    
+    return {
+        "message": "Quest generated successfully",
+        "quest_name": quest_name,
+        "filename": f"{quest_name}.json",
+        "file_path": storage.locations(quest_name)["quest_file"],
+        "version": version
+    }
+
+def check_new_quest_name(quest_name: str) -> None:
+    """400, если название квеста нельзя использовать как имя файла (см. storage.check_quest_name)"""
+    try:
+        check_quest_name(quest_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def check_scene_count(scene_count: Optional[int]) -> None:
+    """400, если запрошенный размер квеста вне допустимого диапазона"""
+    if scene_count is not None and not MIN_SCENE_COUNT <= scene_count <= MAX_SCENE_COUNT:
+        raise HTTPException(
+            status_code=400,
+            detail=f"scene_count must be between {MIN_SCENE_COUNT} and {MAX_SCENE_COUNT}"
+        )
+
+def generation_deadline(seconds: Optional[float]) -> deadline.Deadline:
+    """Срок генерации из запроса или QUEST_GENERATION_DEADLINE; 400, если срок не положителен"""
+    if seconds is None and DEFAULT_GENERATION_DEADLINE:
+        seconds = float(DEFAULT_GENERATION_DEADLINE)
+    if seconds is not None and seconds <= 0:
+        raise HTTPException(status_code=400, detail="deadline_seconds must be positive")
+    return deadline.Deadline(seconds)
+
+async def wait_for_disconnect(http_request: Request) -> None:
+    """
+    Завершается, когда клиент отключается. Тело запроса к этому моменту
+    уже прочитано, поэтому следующее сообщение ASGI - http.disconnect
+    (Request.is_disconnected за BaseHTTPMiddleware отключения не видит).
+    """
+    while (await http_request.receive())["type"] != "http.disconnect":
+        pass
+
+async def until_disconnected(aw, disconnected: asyncio.Future, generation: deadline.Deadline):
+    """
+    Ждёт aw. Если клиент отключился раньше, отменяет генерацию и дожидается,
+    пока aw заметит отмену (deadline.Cancelled).
+    """
+    task = asyncio.ensure_future(aw)
+    await asyncio.wait({task, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+    if not task.done():
+        generation.cancel("disconnected")
+    return await task
+
+def client_id(http_request: Request) -> str:
+    """
+    Клиент для лимитов очереди генераций: адрес подключения, а за доверенным
+    прокси - последний адрес из CLIENT_ID_HEADER (его добавил сам прокси)
+    """
+    peer = http_request.client.host if http_request.client else "unknown"
+    if peer in TRUSTED_PROXIES:
+        forwarded = http_request.headers.get(CLIENT_ID_HEADER, "").split(",")[-1].strip()
+        if forwarded:
+            return forwarded
+    return peer
+
+def generation_key(quest_name: str, user_prompt: str, scene_count: Optional[int], mode: str) -> str:
+    """Ключ объединения одинаковых генераций (single-flight)"""
+    return request_key(quest_name, user_prompt, str(scene_count), mode)
+
+def generation_work(request: GenerateQuestRequest, mode: str):
+    """
+    Работа исполнителя генерации: в режимах offer и reuse сначала ищется
+    квест с похожим промптом, иначе квест генерируется и сохраняется.
+    """
+    def work(broadcast):
+        if mode != "generate":
+            similar = find_similar_quest(request.quest_name, request.user_prompt, mode, broadcast)
+            if similar is not None:
+                return similar
+        return generate_and_save_quest(request.quest_name, request.user_prompt, broadcast,
+                                       request.scene_count)
+    return work
+
+async def lead_generation(key: str, call, ticket: Ticket, work) -> None:
+    """
+    Фоновая задача исполнителя: ждёт места в очереди и выполняет генерацию в
+    пуле потоков, затем освобождает место. Не привязана к HTTP запросу, поэтому
+    отключение первого клиента не отменяет генерацию для присоединившихся;
+    срок ожидания и работы - общий срок всех ждущих (SingleFlight).
+    """
+    error = deadline.Cancelled("disconnected")
+    try:
+        if not ticket.admitted.done():
+            call.broadcast("queued", {"position": admission.position(ticket),
+                                      "expected_wait": round(admission.expected_wait(ticket), 1)})
+        await admission.wait(ticket, call.deadline)
+        await run_in_threadpool(generation_flight.run, key, call, work)
+    except Exception as e:
+        # Ошибку выполненной работы ждущие получают из call.error
+        error = e
+    finally:
+        # Работа не началась (срок истёк в очереди): ждущие получают ошибку
+        generation_flight.abandon(key, call, error)
+        admission.leave(ticket)
+
+def join_generation(request: GenerateQuestRequest, http_request: Request, mode: str, on_event=None):
+    """
+    Присоединяет запрос к генерации квеста (single-flight).
+
+    Первый запрос становится исполнителем: занимает место в очереди генераций
+    и запускает lead_generation; одновременные такие же запросы ждут его
+    результата и места не занимают. Решение и регистрация атомарны
+    (SingleFlight.join), поэтому ограничение QUEST_MAX_GENERATIONS не обходится.
+    Вызывается в цикле событий внутри deadline.use со сроком запроса.
+
+    Returns:
+        Tuple[_Call, bool]: (генерация, является ли запрос её исполнителем)
+
+    Raises:
+        HTTPException: 429 с Retry-After, если очередь заполнена или превышен лимит клиента
+    """
+    key = generation_key(request.quest_name, request.user_prompt, request.scene_count, mode)
+    call, leader = generation_flight.join(key, on_event)
+    if not leader:
+        return call, False
+    try:
+        ticket = admission.enter(client_id(http_request))
+    except Rejected as e:
+        error = HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+        generation_flight.abandon(key, call, error)
+        raise error
+    task = asyncio.ensure_future(lead_generation(key, call, ticket, generation_work(request, mode)))
+    generation_tasks.add(task)
+    task.add_done_callback(generation_tasks.discard)
+    return call, True
+
+def wait_generation(call, leader: bool, on_event=None) -> dict:
+    """Ждёт результата генерации со сроком текущего запроса (блокирующая, из пула потоков)"""
+    return dict(generation_flight.wait(call, on_event), coalesced=not leader)
+
+def cancelled_error(e: deadline.Cancelled) -> HTTPException:
+    """504, если истёк срок генерации; 499, если клиент отключился (ответ никто не получит)"""
+    if e.reason == "deadline":
+        return HTTPException(status_code=504, detail=f"Generation deadline exceeded: {e}")
+    return HTTPException(status_code=499, detail=str(e))
+
+def generation_mode(similar: Optional[str]) -> str:
+    """Режим кэша похожих промптов для запроса; 400, если режим неизвестен или кэш выключен"""
+    try:
+        mode = cache_mode(similar)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if mode != "generate" and prompt_cache is None:
+        raise HTTPException(status_code=400, detail="Prompt cache is disabled (QUEST_PROMPT_CACHE)")
+    return mode
+
+def find_similar_quest(quest_name: str, user_prompt: str, mode: str, on_event=None) -> Optional[dict]:
+    """
+    Ищет квест, сгенерированный по похожему промпту.
+
+    offer - возвращает список похожих квестов, ничего не генерируя;
+    reuse - сохраняет версию самого похожего квеста, прошедшую валидацию
+    при генерации, под запрошенным названием. None - похожих нет.
+    """
+    matches = []
+    for match in prompt_cache.find_similar(user_prompt):
+        if mode == "offer":
+            if storage.quest_exists(match["quest_name"]):
+                matches.append(match)
+            else:
+                prompt_cache.discard(match["id"])
+            continue
         
-        if errors and errors != "":
-            raise HTTPException(
-                status_code=400,
-                detail=f"Quest generation failed: {errors}"
-            )
-        
-        if quest_data is None:
-            raise HTTPException(
-                status_code=500,
-                detail="Quest generation failed: No data returned"
-            )
-        
-        # Сохраняем квест в файл
-        quest_file_path = GENERATED_QUESTS_DIR / f"{request.quest_name}.json"
-        with open(quest_file_path, "w", encoding="utf-8") as f:
-            json.dump(quest_data, f, ensure_ascii=False, indent=4)
-        
-        print(f"Квест {request.quest_name} успешно сохранён в {quest_file_path}")
-        
+        loaded = storage.load_version(match["quest_name"], match["version"])
+        if loaded is None:
+            # Квест удалён: запись кэша больше не нужна
+            prompt_cache.discard(match["id"])
+            continue
+        quest_data, node_positions = loaded
+        reused_from = {key: match[key] for key in ("quest_name", "version", "similarity")}
+        if match["quest_name"] == quest_name and storage.get_version(quest_name) == match["version"]:
+            version = match["version"]
+        else:
+            version = storage.save_quest(quest_name, quest_data, node_positions)
+            update_search_index(search_index.index_quest, quest_name, quest_data)
+        emit(on_event, "saved", quest_name=quest_name, version=version, reused_from=reused_from)
+        print(f"Квест {quest_name} взят из {match['quest_name']} (сходство промптов {match['similarity']})")
         return {
-            "message": "Quest generated successfully",
-            "quest_name": request.quest_name,
-            "filename": f"{request.quest_name}.json",
-            "file_path": str(quest_file_path)
+            "message": "Similar quest reused",
+            "quest_name": quest_name,
+            "filename": f"{quest_name}.json",
+            "file_path": storage.locations(quest_name)["quest_file"],
+            "version": version,
+            "reused_from": reused_from
         }
+    
+    if not matches:
+        return None
+    return {
+        "message": "Similar quests found",
+        "quest_name": quest_name,
+        "generated": False,
+        "similar": [{key: match[key] for key in ("quest_name", "version", "prompt", "similarity")}
+                    for match in matches]
+    }
+
+@app.post("/generate_quest")
+async def generate_quest(request: GenerateQuestRequest, http_request: Request):
+    """
+    Генерирует новый квест на основе пользовательского промпта.
+    Сохраняет его в generated_quests и возвращает название файла.
+    Если включён кэш промптов, похожий промпт может вернуть уже
+    сгенерированный квест (поле similar запроса, см. prompt_cache.py).
+    
+    Генерация прекращается, если истёк deadline_seconds (504) или клиент
+    отключился: незавершённые вызовы LLM и повторные попытки отменяются.
+    Если одновременных генераций слишком много, запрос ждёт в очереди, а при
+    заполненной очереди получает 429 с Retry-After (см. admission.py).
+    """
+    check_new_quest_name(request.quest_name)
+    mode = generation_mode(request.similar)
+    check_scene_count(request.scene_count)
+    generation = generation_deadline(request.deadline_seconds)
+    # Задача пула потоков получает срок через контекст: он копируется при
+    # создании задачи, поэтому она создаётся внутри блока
+    with deadline.use(generation):
+        call, leader = join_generation(request, http_request, mode)
+        task = asyncio.ensure_future(run_in_threadpool(wait_generation, call, leader))
+    disconnected = asyncio.ensure_future(wait_for_disconnect(http_request))
+    try:
+        return await until_disconnected(task, disconnected, generation)
         
     except HTTPException:
         # Перебрасываем HTTP исключения как есть
         raise
+    except deadline.Cancelled as e:
+        raise cancelled_error(e)
+    except asyncio.CancelledError:
+        # Обработчик отменён сервером (например, при остановке): генерация тоже
+        generation.cancel("disconnected")
+        raise
     except Exception as e:
         print(f"Ошибка при генерации квеста: {e}")
         raise HTTPException(
             status_code=500,
             detail=f"Internal server error: {str(e)}"
         )
+    finally:
+        disconnected.cancel()
+
+def format_sse(event_type: str, data: dict) -> bytes:
+    """Форматирует событие Server-Sent Events"""
+    return f"event: {event_type}\ndata: {serialization.dumps(data)}\n\n".encode("utf-8")
+
+@app.post("/generate_quest/stream")
+async def generate_quest_stream(request: GenerateQuestRequest, http_request: Request):
+    """
+    Генерирует квест, передавая прогресс потоком Server-Sent Events.
+    
+    События: attempt_started, tokens, scene_parsed (готовые сцены для
+    предпросмотра), validation, retry, saved, layout_done, а в конце
+    done (как ответ /generate_quest) или error (status_code, detail).
+    При двухфазной генерации (scene_count) перед текстами сцен приходит
+    skeleton_ready со скелетом квеста, а scene_parsed - по мере готовности сцен.
+    Отключение клиента отменяет генерацию, как и истечение deadline_seconds,
+    если её не ждут другие такие же запросы.
+    Запрос, ожидающий в очереди генераций, сначала получает queued
+    (позиция и оценка ожидания в секундах).
+    """
+    check_new_quest_name(request.quest_name)
+    mode = generation_mode(request.similar)
+    check_scene_count(request.scene_count)
+    generation = generation_deadline(request.deadline_seconds)
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    
+    def on_event(event_type, data):
+        # Вызывается из рабочего потока генерации
+        loop.call_soon_threadsafe(queue.put_nowait, (event_type, data))
+    
+    # Рабочий поток получает контекст запроса: трассировку и срок генерации
+    with deadline.use(generation):
+        call, leader = join_generation(request, http_request, mode, on_event)
+        context = contextvars.copy_context()
+    
+    def worker():
+        try:
+            result = wait_generation(call, leader, on_event)
+            if result.get("generated", True):
+                emit(on_event, "layout_done", success=ensure_node_positions_exist(request.quest_name))
+            on_event("done", result)
+        except HTTPException as e:
+            emit(on_event, "error", status_code=e.status_code, detail=e.detail)
+        except deadline.Cancelled as e:
+            error = cancelled_error(e)
+            emit(on_event, "error", status_code=error.status_code, detail=error.detail)
+        except Exception as e:
+            print(f"Ошибка при генерации квеста: {e}")
+            emit(on_event, "error", status_code=500, detail=f"Internal server error: {str(e)}")
+        finally:
+            on_event(None, None)
+    
+    async def events():
+        task = loop.run_in_executor(None, context.run, worker)
+        try:
+            while True:
+                event_type, data = await queue.get()
+                if event_type is None:
+                    break
+                yield format_sse(event_type, data)
+            await task
+        finally:
+            # Клиент закрыл поток: запрос перестаёт ждать, генерация отменяется,
+            # если её не ждут другие запросы
+            if not task.done():
+                generation.cancel("disconnected")
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.put("/update_quest")
 async def update_quest(request: UpdateQuestRequest):
     """
     Обновляет данные квеста и позиции узлов.
-    Перезаписывает JSON файлы в соответствующих папках.
+    Квест и позиции записываются в хранилище одной операцией.
     """
+    check_new_quest_name(request.quest_name)
     try:
-        # Создаём директории если их нет
-        GENERATED_QUESTS_DIR.mkdir(exist_ok=True)
-        NODE_POSITIONS_DIR.mkdir(exist_ok=True)
-        
-        # Сохраняем данные квеста
-        quest_file_path = GENERATED_QUESTS_DIR / f"{request.quest_name}.json"
-        with open(quest_file_path, "w", encoding="utf-8") as f:
-            json.dump(request.quest_data, f, ensure_ascii=False, indent=4)
-        
-        # Сохраняем позиции узлов
-        positions_file_path = NODE_POSITIONS_DIR / f"{request.quest_name}.json"
-        with open(positions_file_path, "w", encoding="utf-8") as f:
-            json.dump(request.node_positions, f, ensure_ascii=False, indent=4)
+        version = await run_in_threadpool(
+            storage.save_quest,
+            request.quest_name,
+            request.quest_data,
+            request.node_positions,
+            expected_version=request.base_version
+        )
+        await run_in_threadpool(update_search_index, search_index.index_quest,
+                                request.quest_name, request.quest_data)
         
         print(f"Квест {request.quest_name} успешно обновлён")
         
         return {
             "message": "Quest updated successfully",
             "quest_name": request.quest_name,
-            "quest_file": str(quest_file_path),
-            "positions_file": str(positions_file_path)
+            **storage.locations(request.quest_name),
+            "version": version
         }
         
+    except VersionConflictError as e:
+        raise version_conflict(e)
     except Exception as e:
         print(f"Ошибка при обновлении квеста: {e}")
         raise HTTPException(
@@ -256,6 +1003,236 @@ async def update_quest(request: UpdateQuestRequest):
             detail=f"Failed to update quest: {str(e)}"
         )
 
+@app.patch("/patch_quest/{quest_name}")
+async def patch_quest(quest_name: str, request: PatchQuestRequest):
+    """
+    Применяет к квесту список точечных операций (перемещение узла,
+    правка текста, добавление/удаление выбора или сцены).
+    Записываются и валидируются только изменённые сцены и позиции.
+    """
+    return await run_in_threadpool(apply_quest_patch, quest_name, request)
+
+def apply_quest_patch(quest_name: str, request: PatchQuestRequest) -> dict:
+    """Чтение, проверка и запись изменений квеста (блокирующая, из пула потоков)"""
+    current_version = storage.get_version(quest_name)
+    if current_version is None:
+        raise HTTPException(status_code=404, detail=f"Quest '{quest_name}' not found")
+    if current_version != request.base_version:
+        raise version_conflict(VersionConflictError(quest_name, request.base_version, current_version))
+    
+    quest_data = storage.load_quest(quest_name)
+    if quest_data is None:
+        raise HTTPException(status_code=404, detail=f"Quest '{quest_name}' not found")
+    
+    patch = QuestPatch(quest_data, storage.load_positions(quest_name))
+    try:
+        patch.apply_all(request.operations)
+    except PatchError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    success, message = patch.validate()
+    if not success:
+        raise HTTPException(status_code=422, detail=f"Quest validation failed: {message}")
+    
+    try:
+        version = storage.patch_quest(
+            quest_name,
+            request.base_version,
+            patch.scene_changes,
+            patch.position_changes
+        )
+    except VersionConflictError as e:
+        raise version_conflict(e)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Quest '{quest_name}' not found")
+    
+    if patch.scene_changes:
+        update_search_index(search_index.update_scenes, quest_name, patch.scene_changes)
+    
+    return {
+        "message": "Quest patched successfully",
+        "quest_name": quest_name,
+        "version": version,
+        "changed_scenes": sorted(patch.scene_changes),
+        "changed_positions": sorted(patch.position_changes)
+    }
+
+@app.get("/quest_versions/{quest_name}")
+async def list_quest_versions(quest_name: str):
+    """
+    Список сохранённых версий квеста, от новых к старым.
+    added_bytes - сколько новых данных записала версия в историю.
+    """
+    versions = await run_in_threadpool(storage.list_versions, quest_name)
+    if versions is None:
+        raise HTTPException(status_code=404, detail=f"Quest '{quest_name}' not found")
+    return {
+        "quest_name": quest_name,
+        "current_version": await run_in_threadpool(storage.get_version, quest_name),
+        "versions": versions
+    }
+
+@app.get("/quest_versions/{quest_name}/diff")
+async def diff_quest_versions(quest_name: str, from_version: int, to_version: Optional[int] = None):
+    """
+    Сравнивает две версии квеста (по умолчанию с текущей): добавленные,
+    удалённые и изменённые сцены, изменённые поля квеста и перемещённые узлы.
+    """
+    if to_version is None:
+        to_version = await run_in_threadpool(storage.get_version, quest_name)
+    diff = await run_in_threadpool(storage.diff_versions, quest_name, from_version, to_version)
+    if diff is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Version {from_version} or {to_version} of quest '{quest_name}' not found"
+        )
+    return {"quest_name": quest_name, "from_version": from_version, "to_version": to_version, **diff}
+
+@app.get("/quest_versions/{quest_name}/{version}")
+async def get_quest_version(quest_name: str, version: int):
+    """Данные квеста и позиции узлов в состоянии одной из версий"""
+    snapshot = await run_in_threadpool(storage.load_version, quest_name, version)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail=f"Version {version} of quest '{quest_name}' not found")
+    quest_data, node_positions = snapshot
+    return {
+        "quest_name": quest_name,
+        "version": version,
+        "quest_data": quest_data,
+        "node_positions": node_positions
+    }
+
+@app.post("/quest_versions/{quest_name}/{version}/restore")
+async def restore_quest_version(quest_name: str, version: int, request: RestoreVersionRequest):
+    """
+    Восстанавливает квест и позиции узлов одной из версий как новую версию;
+    история при этом не теряется. Если передана base_version, квест
+    восстанавливается только если его не изменили (иначе 409).
+    """
+    try:
+        restored = await run_in_threadpool(
+            storage.restore_version, quest_name, version, request.base_version
+        )
+    except VersionConflictError as e:
+        raise version_conflict(e)
+    if restored is None:
+        raise HTTPException(status_code=404, detail=f"Version {version} of quest '{quest_name}' not found")
+
+    new_version, quest_data = restored
+    await run_in_threadpool(update_search_index, search_index.index_quest, quest_name, quest_data)
+    return {
+        "message": "Quest version restored successfully",
+        "quest_name": quest_name,
+        "version": new_version,
+        "restored_from": version
+    }
+
+def session_view(session_id: str, session: GameSession) -> dict:
+    """Ответ с текущим состоянием игровой сессии"""
+    return {
+        "session_id": session_id,
+        "quest_name": session.quest.name,
+        "quest_version": session.quest.version,
+        "scene": session.scene(),
+        "finished": session.is_finished(),
+        "stats": session.stats()
+    }
+
+def get_session_or_404(session_id: str) -> GameSession:
+    session = sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found")
+    return session
+
+@app.post("/sessions")
+async def create_session(request: CreateSessionRequest):
+    """Начинает новую игру в квесте и возвращает id сессии и стартовую сцену"""
+    try:
+        session_id, session = await run_in_threadpool(sessions.create, request.quest_name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Quest '{request.quest_name}' not found")
+    except GameError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return session_view(session_id, session)
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    """Текущая сцена и статистика игры"""
+    return session_view(session_id, get_session_or_404(session_id))
+
+@app.post("/sessions/{session_id}/choose")
+async def choose(session_id: str, request: ChooseRequest):
+    """Делает выбор (номер с 0) в текущей сцене"""
+    session = get_session_or_404(session_id)
+    try:
+        session.choose(request.choice)
+    except GameError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return session_view(session_id, session)
+
+@app.get("/sessions/{session_id}/history")
+async def get_session_history(session_id: str):
+    """История посещённых сцен"""
+    return {"session_id": session_id, "history": get_session_or_404(session_id).history_ids()}
+
+@app.post("/sessions/{session_id}/restart")
+async def restart_session(session_id: str):
+    """Начинает игру заново в той же сессии"""
+    session = sessions.restart(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found")
+    return session_view(session_id, session)
+
+@app.get("/sessions/{session_id}/save")
+async def save_session(session_id: str):
+    """Состояние сессии для последующего восстановления через /sessions/restore"""
+    return get_session_or_404(session_id).save()
+
+@app.post("/sessions/restore")
+async def restore_session(request: RestoreSessionRequest):
+    """Восстанавливает игру из сохранения в новую сессию"""
+    try:
+        session_id, session = await run_in_threadpool(sessions.restore, request.state)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Quest from saved state not found")
+    except GameError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return session_view(session_id, session)
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """Завершает сессию"""
+    if not sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found")
+    return {"message": "Session deleted", "session_id": session_id}
+
+def run_simulation(quest_name: str, request: SimulateQuestRequest) -> dict:
+    """Загружает квест и строит отчёт simulate.analyze (выполняется в пуле потоков)"""
+    # numpy импортируется только при первой симуляции, не при старте сервера
+    from simulate import analyze, choice_weights
+
+    quest = sessions.load_quest(quest_name)
+    if quest is None:
+        raise KeyError(quest_name)
+    weights = request.weights
+    if request.policy == "weighted" and weights is None:
+        weights = choice_weights(storage.load_quest(quest_name) or {})
+    return analyze(quest, request.policy, request.runs, request.seed, request.max_steps, weights)
+
+@app.post("/simulate_quest/{quest_name}")
+async def simulate_quest(quest_name: str, request: SimulateQuestRequest):
+    """Симулирует прохождения квеста и считает вероятности концовок, длину пути и посещаемость сцен"""
+    if not 0 <= request.runs <= MAX_SIMULATION_RUNS:
+        raise HTTPException(status_code=422, detail=f"runs must be between 0 and {MAX_SIMULATION_RUNS}")
+    if not 1 <= request.max_steps <= 100_000:
+        raise HTTPException(status_code=422, detail="max_steps must be between 1 and 100000")
+    try:
+        return await run_in_threadpool(run_simulation, quest_name, request)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Quest '{quest_name}' not found")
+    except (GameError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
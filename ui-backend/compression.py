@@ -0,0 +1,153 @@
+# Сжатие ответов backend: brotli (если установлен) или gzip по Accept-Encoding
+
+import zlib
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Потоковые ответы, которые нельзя буферизовать компрессором
+UNCOMPRESSED_TYPES = ("text/event-stream", "application/zip", "application/gzip",
+                      "application/x-tar", "image/")
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Выбирает алгоритм сжатия по заголовку Accept-Encoding.
+
+    Args:
+        accept_encoding: Значение заголовка Accept-Encoding
+
+    Returns:
+        Optional[str]: "br", "gzip" или None
+    """
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(name.strip().lower())
+
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    """Потоковый компрессор с общим интерфейсом для gzip и brotli."""
+
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._impl = brotli.Compressor(quality=min(level, 11))
+        else:
+            self._impl = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._impl.process(data)
+        return self._impl.compress(data)
+
+    def flush(self) -> bytes:
+        if self.encoding == "br":
+            return self._impl.finish()
+        return self._impl.flush()
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware, сжимающее ответы не меньше minimum_size байт.
+
+    Алгоритм выбирается по Accept-Encoding клиента: brotli предпочтительнее
+    gzip. Небольшие ответы, SSE и уже сжатые форматы передаются как есть.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.levels = {"gzip": gzip_level, "br": brotli_quality}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressingSender(send, encoding, self.levels[encoding], self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressingSender:
+    """Перехватывает сообщения ответа и сжимает тело, если это имеет смысл."""
+
+    def __init__(self, send, encoding: str, level: int, minimum_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.level = level
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.compressor: Optional[_Compressor] = None
+        self.passthrough = False
+        # Начало тела, пока не ясно, дорастёт ли ответ до minimum_size
+        self.pending = bytearray()
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            headers = dict(message.get("headers") or [])
+            content_type = headers.get(b"content-type", b"").decode("latin-1")
+            if b"content-encoding" in headers or content_type.startswith(UNCOMPRESSED_TYPES):
+                self.passthrough = True
+                await self._send(message)
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None:
+            # Тело, пришедшее частями, копится до minimum_size: маленький ответ
+            # не сжимается, даже если приложение отправило его по частям
+            self.pending += body
+            if more_body and len(self.pending) < self.minimum_size:
+                return
+            body = bytes(self.pending)
+            self.pending = bytearray()
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self._send(self.start_message)
+                await self._send({"type": "http.response.body", "body": body})
+                return
+
+            self.compressor = _Compressor(self.encoding, self.level)
+            headers = [
+                (name, value) for name, value in self.start_message.get("headers", [])
+                if name.lower() != b"content-length"
+            ]
+            if not more_body:
+                compressed = self.compressor.compress(body) + self.compressor.flush()
+                headers.append((b"content-length", str(len(compressed)).encode()))
+            headers.append((b"content-encoding", self.encoding.encode()))
+            headers.append((b"vary", b"Accept-Encoding"))
+            await self._send(dict(self.start_message, headers=headers))
+            if not more_body:
+                await self._send({"type": "http.response.body", "body": compressed})
+                return
+
+        chunk = self.compressor.compress(body)
+        if not more_body:
+            chunk += self.compressor.flush()
+        await self._send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+